@@ -0,0 +1,131 @@
+"""
+Активация чеков и промокодов
+
+Активация - одна транзакция на соединении записи (Database._activate):
+запись активации через INSERT ... ON CONFLICT DO NOTHING, уменьшение счетчика
+условным UPDATE ... WHERE remaining_activations > 0 RETURNING и зачисление
+суммы. Повторная активация и активация сверх лимита ничего не меняют, счетчик
+не уходит в минус при любом числе одновременных запросов.
+
+Перед базой стоит шлюз кода: одновременно в транзакции идут не больше
+активаций, чем у кода осталось по последнему ответу базы, остальные ждут в
+памяти. Когда код исчерпан, ждущие и все следующие активации отклоняются
+без обращения к базе и без очереди на соединение записи. Если администратор
+добавил активаций, шлюз промокода сбрасывается (reopen_promo).
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Итоги активации
+ACTIVATED = "activated"
+ALREADY_ACTIVATED = "already_activated"
+SOLD_OUT = "sold_out"
+FAILED = "failed"
+
+db = Database()
+
+
+class _Gate:
+    """Остаток активаций кода по последнему ответу базы и активации в транзакции"""
+
+    __slots__ = ("remaining", "in_flight", "changed")
+
+    def __init__(self):
+        self.remaining: Optional[int] = None  # None - еще не известен, в базу идет одна активация
+        self.in_flight = 0
+        self.changed = asyncio.Condition()
+
+    @property
+    def sold_out(self) -> bool:
+        return self.remaining is not None and self.remaining <= 0
+
+    @property
+    def free(self) -> int:
+        """Сколько активаций еще можно пустить в базу"""
+        return (self.remaining if self.remaining is not None else 1) - self.in_flight
+
+    def admits(self) -> bool:
+        return self.sold_out or self.free > 0
+
+
+class ActivationEngine:
+    """Активации чеков и промокодов со шлюзом и отсечкой исчерпанных кодов"""
+
+    def __init__(self):
+        self._check_gates: Dict[int, _Gate] = {}
+        self._promo_gates: Dict[int, _Gate] = {}
+        self.short_circuited = 0
+
+    async def activate_check(self, check_id: int, user_id: int) -> Tuple[str, Optional[Dict]]:
+        """(итог, данные активации из Database.activate_check)"""
+        return await self._activate(
+            self._check_gates, check_id, user_id,
+            db.activate_check, db.get_check_by_id, db.has_user_activated_check,
+        )
+
+    async def activate_promo(self, promo_id: int, user_id: int) -> Tuple[str, Optional[Dict]]:
+        """(итог, данные активации из Database.activate_promo_code)"""
+        return await self._activate(
+            self._promo_gates, promo_id, user_id,
+            db.activate_promo_code, db.get_promo_code_by_id, db.has_user_activated_promo,
+        )
+
+    async def _activate(self, gates: Dict[int, _Gate], code_id: int, user_id: int,
+                        activate: Callable[[int, int], Awaitable[Optional[Dict]]],
+                        get_code: Callable[[int], Awaitable[Optional[Dict]]],
+                        has_activated: Callable[[int, int], Awaitable[bool]]) -> Tuple[str, Optional[Dict]]:
+        gate = gates.get(code_id)
+        if gate is None:
+            gate = gates[code_id] = _Gate()
+        if not gate.admits():
+            async with gate.changed:
+                await gate.changed.wait_for(gate.admits)
+        if gate.sold_out:
+            self.short_circuited += 1
+            return SOLD_OUT, None
+
+        gate.in_flight += 1
+        status = FAILED
+        try:
+            activation = await activate(code_id, user_id)
+            if activation is not None:
+                status = ACTIVATED
+                gate.remaining = activation["remaining_activations"]
+            else:
+                # Транзакция ничего не изменила - узнаем причину (только при отказе)
+                code = await get_code(code_id)
+                gate.remaining = code["remaining_activations"] if code else 0
+                if gate.sold_out:
+                    status = SOLD_OUT
+                elif await has_activated(code_id, user_id):
+                    status = ALREADY_ACTIVATED
+            return status, activation
+        finally:
+            gate.in_flight -= 1
+            if gate.sold_out and status == ACTIVATED:
+                logger.info(f"🎫 Код #{code_id} исчерпан, следующие активации отклоняются без обращения к базе")
+            # Будим столько ждущих, сколько освободилось мест (всех - если код исчерпан)
+            async with gate.changed:
+                if gate.sold_out:
+                    gate.changed.notify_all()
+                elif gate.free > 0:
+                    gate.changed.notify(gate.free)
+
+    def reopen_promo(self, promo_id: int):
+        """Сбросить шлюз промокода (после изменения числа активаций)"""
+        self._promo_gates.pop(promo_id, None)
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "sold_out_checks": sum(gate.sold_out for gate in self._check_gates.values()),
+            "sold_out_promos": sum(gate.sold_out for gate in self._promo_gates.values()),
+            "short_circuited": self.short_circuited,
+        }
+
+
+activation_engine = ActivationEngine()
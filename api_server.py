@@ -4,10 +4,6 @@ API сервер для мини-приложения Telegram
 """
 import asyncio
 import logging
-import json
-import hmac
-import hashlib
-from urllib.parse import parse_qs, unquote
 from aiohttp import web
 from aiohttp.web import Request, Response
 from typing import Optional, Dict
@@ -19,77 +15,38 @@ from handlers.mini_app import get_sticker_file_url
 from handlers.games import process_game_result, GAME_STATES, ACTIVE_GAMES
 from aiogram import Bot
 from ton_price import get_ton_to_usd_rate, ton_to_usd, usd_to_ton
+from avatars import AvatarResolver
+from game_events import game_results
+from session_store import SessionStore
+from webapp_auth import InitDataVerifier, auth_middleware
+from roulette import RouletteEngine
 import secrets
-import aiosqlite
 
 logger = logging.getLogger(__name__)
 
 db = Database()
 bot = Bot(token=BOT_TOKEN)
+avatars = AvatarResolver(bot, db, BOT_TOKEN)
+# Проверка initData мини-аппа (секретный ключ из BOT_TOKEN считается один раз)
+init_data_verifier = InitDataVerifier(BOT_TOKEN)
 
-# Активные игры для мини-аппа
-MINI_APP_GAMES = {}  # {game_id: {"user_id": int, "game_type": str, "bet": float, "status": str}}
-
+# Сколько хранить игру мини-аппа после создания (сек)
+MINI_APP_GAME_TTL = 60 * 60
 
+# Активные игры для мини-аппа
+MINI_APP_GAMES = SessionStore("mini_app_games", MINI_APP_GAME_TTL, persistent=True)  # {game_id: {"user_id": int, "game_type": str, "bet": float, "status": str}}
 
-def verify_telegram_init_data(init_data: str) -> Optional[Dict]:
-    """Проверка подписи initData от Telegram"""
-    try:
-        # Парсим initData
-        data_dict = {}
-        for pair in init_data.split('&'):
-            if '=' in pair:
-                key, value = pair.split('=', 1)
-                data_dict[key] = unquote(value)
-        
-        # Проверяем подпись
-        if 'hash' not in data_dict:
-            return None
-        
-        hash_value = data_dict.pop('hash')
-        data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(data_dict.items()))
-        
-        # Создаем секретный ключ
-        secret_key = hmac.new(
-            "WebAppData".encode(),
-            BOT_TOKEN.encode(),
-            hashlib.sha256
-        ).digest()
-        
-        # Вычисляем хеш
-        calculated_hash = hmac.new(
-            secret_key,
-            data_check_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        if calculated_hash != hash_value:
-            logger.warning("Неверная подпись initData")
-            return None
-        
-        # Парсим user данные
-        if 'user' in data_dict:
-            user_data = json.loads(data_dict['user'])
-            return user_data
-        
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка проверки initData: {e}")
-        return None
-
-
-async def get_user_from_request(request: Request) -> Optional[Dict]:
-    """Получить данные пользователя из запроса"""
-    init_data = request.headers.get('X-Telegram-Init-Data', '')
-    if not init_data:
-        return None
-    
-    return verify_telegram_init_data(init_data)
+# Сколько ждать результата игры до пометки timeout (сек)
+GAME_RESULT_TIMEOUT = 10
+# Максимальное ожидание long-poll запроса результата (сек)
+GAME_RESULT_MAX_WAIT = 25
+# Через сколько (сек) после завершения игры забывать ее событие
+GAME_EVENT_TTL = 60
 
 
 async def handle_user(request: Request) -> Response:
     """GET /api/user - Получить данные пользователя"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -239,7 +196,7 @@ async def handle_stickers(request: Request) -> Response:
 
 async def handle_game_start(request: Request) -> Response:
     """POST /api/game/start - Запустить игру"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -277,8 +234,10 @@ async def handle_game_start(request: Request) -> Response:
             "status": "started",
             "created_at": time.time()
         }
+        game_results.register(game_id)
         
         # Запускаем игру через бота (отправляем dice в чат)
+        bet_debited = False
         try:
             # Для игр кроме слотов отправляем dice в чат с ботом
             if game_type != 'slots':
@@ -300,6 +259,7 @@ async def handle_game_start(request: Request) -> Response:
                 )
                 
                 if success:
+                    MINI_APP_GAMES[game_id]['bet_debited'] = True
                     # Сохраняем game_id в состояние игры для связи с мини-аппом
                     if user_id in GAME_STATES:
                         GAME_STATES[user_id]["game_id"] = game_id
@@ -311,12 +271,18 @@ async def handle_game_start(request: Request) -> Response:
                     asyncio.create_task(check_mini_app_game_result(game_id, user_id))
                 else:
                     logger.error(f"Не удалось запустить игру для пользователя {user_id}")
+                    MINI_APP_GAMES.pop(game_id, None)
+                    game_results.discard(game_id)
                     return web.json_response({"error": "Failed to start game"}, status=500)
             else:
                 # Для слотов обрабатываем отдельно
-                # Списываем баланс
-                await db.decrease_rollover(user_id, bet)
-                await db.update_balance(user_id, -bet)
+                # Списываем баланс и уменьшаем отыгрыш одной транзакцией
+                if await db.place_bet(user_id, bet) is None:
+                    MINI_APP_GAMES.pop(game_id, None)
+                    game_results.discard(game_id)
+                    return web.json_response({"error": "Insufficient balance"}, status=400)
+                bet_debited = True
+                MINI_APP_GAMES[game_id]['bet_debited'] = True
                 logger.info(f"💰 Списан баланс для слотов из мини-аппа: ${bet:.2f}, user_id={user_id}")
                 
                 # Отправляем слот в личный чат пользователя
@@ -332,6 +298,12 @@ async def handle_game_start(request: Request) -> Response:
                 asyncio.create_task(process_mini_app_slots_result(game_id, user_id, bet, slot_message))
         except Exception as e:
             logger.error(f"Ошибка запуска игры: {e}", exc_info=True)
+            # Слот не отправлен - возвращаем уже списанную ставку
+            if bet_debited:
+                await db.update_balance(user_id, bet)
+                logger.info(f"↩️ Ставка слотов возвращена: ${bet:.2f}, user_id={user_id}, game_id={game_id}")
+            MINI_APP_GAMES.pop(game_id, None)
+            game_results.discard(game_id)
             return web.json_response({"error": "Internal server error"}, status=500)
         
         return web.json_response({
@@ -346,52 +318,21 @@ async def handle_game_start(request: Request) -> Response:
 async def process_mini_app_slots_result(game_id: int, user_id: int, bet: float, slot_message):
     """Обработать результат слота из мини-аппа"""
     try:
-        # Ждем завершения анимации слота (Telegram dice анимация длится ~2-3 секунды)
-        await asyncio.sleep(3)
-        
-        # Получаем значение слота из сообщения
-        # После завершения анимации (3 секунды) dice.value будет содержать финальное значение
+        # Значение слота известно сразу из ответа send_dice - анимацию мини-апп проигрывает сам
         slot_value = None
         if hasattr(slot_message, 'dice') and slot_message.dice:
             slot_value = slot_message.dice.value
         
-        # Если значение еще не готово (анимация не завершена), получаем обновленное сообщение
-        if slot_value is None or slot_value == 0:
-            try:
-                # Получаем обновленное сообщение через get_chat_member и затем через get_updates
-                # Или просто ждем еще немного - после 3 секунд значение должно быть готово
-                await asyncio.sleep(0.5)
-                # Пробуем получить сообщение заново через bot.get_chat
-                # Но проще всего - использовать значение из исходного сообщения после ожидания
-                # В aiogram dice.value обновляется автоматически в объекте сообщения
-                if hasattr(slot_message, 'dice') and slot_message.dice:
-                    slot_value = slot_message.dice.value
-            except Exception as e:
-                logger.warning(f"⚠️ Не удалось получить значение слота: {e}")
-        
-        # Если все еще нет значения, используем случайное (для тестирования)
-        # В продакшене это не должно происходить, так как анимация завершится за 3 секунды
+        # Если значения нет, используем случайное (для тестирования)
+        # В продакшене это не должно происходить: Telegram возвращает значение в ответе
         if slot_value is None or slot_value == 0:
             import random
             slot_value = random.randint(1, 64)
             logger.warning(f"⚠️ Не удалось получить значение слота, используем случайное: {slot_value}")
         
-        # Декодируем символы
-        from utils.checks import decode_slot_symbols
-        symbols = decode_slot_symbols(slot_value)
-        
-        # Проверяем выигрыш (используя множители из config.py)
-        multiplier = 0
-        if symbols[0] == symbols[1] == symbols[2]:
-            # 3 одинаковых символа
-            if symbols[0] == "7":
-                multiplier = 20  # 777 - 20x
-            elif symbols[0] == "🍇":
-                multiplier = 10  # 🍇🍇🍇 - 10x
-            elif symbols[0] == "🍋":
-                multiplier = 7   # 🍋🍋🍋 - 7x
-            elif symbols[0] == "Bar":
-                multiplier = 5   # BAR BAR BAR - 5x
+        # Символы барабанов и множитель (из config.py) по таблице всех 64 значений слота
+        from outcomes import outcome_table
+        symbols, multiplier = outcome_table.slot(slot_value)
         
         win = bet * multiplier
         
@@ -417,6 +358,7 @@ async def process_mini_app_slots_result(game_id: int, user_id: int, bet: float,
             MINI_APP_GAMES[game_id]['game_type'] = 'slots'
             MINI_APP_GAMES[game_id]['throws'] = symbols  # Для совместимости с другими играми
             logger.info(f"✅ Слот из мини-аппа обработан: game_id={game_id}, symbols={symbols}, win={win}")
+            game_results.resolve(game_id, MINI_APP_GAMES[game_id])
         else:
             logger.error(f"❌ game_id {game_id} не найден в MINI_APP_GAMES!")
             
@@ -424,132 +366,93 @@ async def process_mini_app_slots_result(game_id: int, user_id: int, bet: float,
         logger.error(f"Ошибка обработки слота из мини-аппа: {e}", exc_info=True)
         if game_id in MINI_APP_GAMES:
             MINI_APP_GAMES[game_id]['status'] = 'error'
+            game_results.resolve(game_id, MINI_APP_GAMES[game_id])
+    finally:
+        # Как и для остальных игр: long-poll запросы успеют забрать событие
+        asyncio.get_running_loop().call_later(GAME_EVENT_TTL, game_results.discard, game_id)
 
 
 async def check_mini_app_game_result(game_id: int, user_id: int):
-    """Проверить результат игры из мини-аппа"""
-    max_attempts = 20  # Увеличиваем для слотов (нужно больше времени)
-    attempts = 0
+    """Дождаться результата игры из мини-аппа; без результата за GAME_RESULT_TIMEOUT - пометить timeout
     
+    Результат сохраняет в MINI_APP_GAMES и публикует в game_results сам process_game_result.
+    """
     try:
-        from handlers.games import GAME_STATES
-        
-        # Проверяем тип игры
-        game_info = MINI_APP_GAMES.get(game_id, {})
-        game_type = game_info.get('game_type', 'unknown')
-        
-        # Для слотов проверяем MINI_APP_GAMES напрямую
-        if game_type == 'slots':
-            while attempts < max_attempts:
-                await asyncio.sleep(0.5)
-                attempts += 1
-                
-                if game_id in MINI_APP_GAMES and MINI_APP_GAMES[game_id].get('status') == 'completed':
-                    logger.info(f"✅ Слот завершен: game_id={game_id}")
-                    break
-                elif game_id in MINI_APP_GAMES and MINI_APP_GAMES[game_id].get('status') in ['error', 'timeout']:
-                    logger.warning(f"⚠️ Слот завершен с ошибкой: game_id={game_id}, status={MINI_APP_GAMES[game_id].get('status')}")
-                    break
-            
-            return  # Для слотов не используем GAME_STATES
-        
-        # Для остальных игр используем стандартную логику
-        while attempts < max_attempts:
-            await asyncio.sleep(0.5)  # Проверяем каждые 0.5 секунды для быстрого отклика
-            attempts += 1
-            
-            # Проверяем состояние игры
-            state = GAME_STATES.get(user_id)
-            if not state:
-                # Если состояние удалено, возможно игра завершена
-                # Проверяем MINI_APP_GAMES напрямую
-                if game_id in MINI_APP_GAMES and MINI_APP_GAMES[game_id].get('status') == 'completed':
-                    break
-                # Если прошло больше 2 секунд, проверяем еще раз
-                if attempts >= 4:
-                    # Возможно игра уже обработана, но состояние удалено
-                    # Проверяем MINI_APP_GAMES еще раз
-                    if game_id in MINI_APP_GAMES and MINI_APP_GAMES[game_id].get('status') == 'completed':
-                        break
-                continue
-            
-            # Проверяем, обработан ли результат
-            if state.get("result_processed", False) and state.get("game_id") == game_id:
-                # Игра обработана, получаем результат
-                throws = state.get("throws", [])
-                logger.info(f"🔍 check_mini_app_game_result: throws из состояния={throws}, тип={type(throws)}, is_list={isinstance(throws, list)}")
-                
-                if throws:
-                    # ВАЖНО: result - это сумма для отображения, но throws - это массив каждого броска
-                    result = throws[0] if len(throws) == 1 else sum(throws)
-                    game_type = state.get("game_type", "dice")
-                    
-                    # Получаем информацию о выигрыше из состояния игры
-                    # (process_game_result уже обработал результат и сохранил в БД)
-                    win = state.get("win", 0.0)
-                    
-                    # Получаем новый баланс
-                    user = await db.get_user(user_id)
-                    new_balance = user.get('balance', 0.0) if user else 0.0
-                    
-                    # Обновляем статус игры в MINI_APP_GAMES
-                    # ВАЖНО: Сохраняем throws как список, даже если он уже был сохранен в process_game_result
-                    if game_id in MINI_APP_GAMES:
-                        MINI_APP_GAMES[game_id]['status'] = 'completed'
-                        MINI_APP_GAMES[game_id]['result'] = result  # Сумма для отображения
-                        # ВАЖНО: Всегда сохраняем throws из состояния, так как это самый актуальный источник
-                        # НИКОГДА не используем result (сумму) как fallback для throws!
-                        if isinstance(throws, list) and len(throws) > 0:
-                            MINI_APP_GAMES[game_id]['throws'] = throws.copy()  # ВАЖНО: Массив каждого броска для стикеров
-                            logger.info(f"💾 Сохранен throws в check_mini_app_game_result: {throws} → {MINI_APP_GAMES[game_id]['throws']}")
-                        elif 'throws' not in MINI_APP_GAMES[game_id] or not MINI_APP_GAMES[game_id].get('throws'):
-                            # Если throws не список или пустой - это ошибка, НЕ создаем из result!
-                            logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА: throws не является списком в check_mini_app_game_result! throws={throws}, тип: {type(throws)}")
-                            # НЕ используем result, так как это сумма! Оставляем пустой список
-                            MINI_APP_GAMES[game_id]['throws'] = []
-                        MINI_APP_GAMES[game_id]['win'] = win
-                        MINI_APP_GAMES[game_id]['new_balance'] = new_balance
-                        MINI_APP_GAMES[game_id]['game_type'] = game_type
-                        logger.info(f"📋 MINI_APP_GAMES после сохранения: throws={MINI_APP_GAMES[game_id].get('throws')}")
-                    else:
-                        logger.error(f"❌ game_id {game_id} не найден в MINI_APP_GAMES!")
-                    
-                    logger.info(f"✅ Игра из мини-аппа завершена: game_id={game_id}, result={result}, throws={throws}, win={win}")
-                    break
-                else:
-                    logger.error(f"❌ throws пустой в check_mini_app_game_result! state={state}")
-            
-            # Дополнительная проверка: если состояние уже удалено, но игра завершена в MINI_APP_GAMES
-            if game_id in MINI_APP_GAMES and MINI_APP_GAMES[game_id].get('status') == 'completed':
-                # Игра уже завершена, throws должен быть сохранен в process_game_result
-                if MINI_APP_GAMES[game_id].get('throws'):
-                    logger.info(f"✅ Игра уже завершена в MINI_APP_GAMES: game_id={game_id}, throws={MINI_APP_GAMES[game_id].get('throws')}")
-                    break
-            
-            # Проверяем, не истекло ли время ожидания
-            if attempts >= max_attempts:
-                logger.warning(f"⏱ Таймаут ожидания результата игры: game_id={game_id}")
-                if game_id in MINI_APP_GAMES:
-                    MINI_APP_GAMES[game_id]['status'] = 'timeout'
-                break
-        
+        game = await game_results.wait(game_id, GAME_RESULT_TIMEOUT)
+        if game is not None:
+            logger.info(f"✅ Игра из мини-аппа завершена: game_id={game_id}, status={game.get('status')}, "
+                        f"throws={game.get('throws')}, win={game.get('win')}")
+        elif game_id in MINI_APP_GAMES and MINI_APP_GAMES[game_id].get('status') == 'started':
+            logger.warning(f"⏱ Таймаут ожидания результата игры: game_id={game_id}, user_id={user_id}")
+            MINI_APP_GAMES[game_id]['status'] = 'timeout'
+            game_results.resolve(game_id, MINI_APP_GAMES[game_id])
     except Exception as e:
         logger.error(f"Ошибка проверки результата игры: {e}", exc_info=True)
         if game_id in MINI_APP_GAMES:
             MINI_APP_GAMES[game_id]['status'] = 'error'
+            game_results.resolve(game_id, MINI_APP_GAMES[game_id])
+    finally:
+        # Long-poll запросы успеют забрать событие, дальше результат отдается из MINI_APP_GAMES
+        asyncio.get_running_loop().call_later(GAME_EVENT_TTL, game_results.discard, game_id)
+
+
+async def refund_interrupted_mini_app_games() -> int:
+    """Завершить игры мини-аппа, восстановленные из снимка в статусе started (вызывается при запуске)
+
+    Результата такой игры никто не ждет: отправленные до перезапуска броски не
+    будут обработаны. Игра помечается timeout, списанная ставка возвращается,
+    а состояние игры в боте удаляется, чтобы она не была доиграна и оплачена
+    повторно.
+    """
+    from handlers.games import GAME_STATES
+
+    refunded = 0
+    for game_id in list(MINI_APP_GAMES):
+        game = MINI_APP_GAMES.get(game_id)
+        if not game or game.get('status') != 'started':
+            continue
+        game['status'] = 'timeout'
+        user_id = game['user_id']
+        state = GAME_STATES.get(user_id)
+        if state and state.get('game_id') == game_id:
+            GAME_STATES.pop(user_id, None)
+        if game.pop('bet_debited', False):
+            await db.update_balance(user_id, game['bet'])
+            game['refunded'] = True
+            refunded += 1
+            logger.warning(f"↩️ Игра мини-аппа game_id={game_id} прервана перезапуском, "
+                           f"ставка ${game['bet']:.2f} возвращена пользователю {user_id}")
+    return refunded
 
 
 async def handle_game_result(request: Request) -> Response:
-    """GET /api/game/result/{game_id} - Получить результат игры"""
+    """GET /api/game/result/{game_id}[?wait=секунды] - Получить результат игры
+    
+    С параметром wait запрос ждет завершения игры (long-poll) и отвечает сразу,
+    как только результат готов, либо по истечении wait с completed=False.
+    """
     game_id = int(request.match_info.get('game_id', 0))
     if not game_id:
         return web.json_response({"error": "game_id required"}, status=400)
     
+    try:
+        wait = min(max(float(request.query.get('wait', 0)), 0.0), GAME_RESULT_MAX_WAIT)
+    except ValueError:
+        wait = 0.0
+    
     try:
         game_data = MINI_APP_GAMES.get(game_id)
         if not game_data:
             return web.json_response({"error": "Game not found"}, status=404)
         
+        if game_data['status'] == 'started' and not game_results.is_registered(game_id):
+            # Результата ждать некому (игра пережила перезапуск) - отдаем окончательный статус,
+            # иначе мини-апп опрашивает без паузы
+            game_data['status'] = 'timeout'
+        
+        if wait and game_data['status'] == 'started':
+            await game_results.wait(game_id, wait)
+        
         if game_data['status'] == 'completed':
             game_type = game_data.get('game_type', 'unknown')
             
@@ -611,7 +514,7 @@ async def handle_game_result(request: Request) -> Response:
 
 async def handle_settings_base_bet(request: Request) -> Response:
     """POST /api/settings/base-bet - Сохранить базовую ставку"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -635,7 +538,7 @@ async def handle_settings_base_bet(request: Request) -> Response:
 
 async def handle_check_create(request: Request) -> Response:
     """POST /api/check/create - Создать чек"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -680,7 +583,7 @@ async def handle_check_create(request: Request) -> Response:
 
 async def handle_lotteries(request: Request) -> Response:
     """GET /api/lotteries - Получить список лотерей"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     user_id = user_data.get('id') if user_data else None
     
     try:
@@ -720,7 +623,7 @@ async def handle_lotteries(request: Request) -> Response:
 
 async def handle_lottery_participate(request: Request) -> Response:
     """POST /api/lottery/participate - Участвовать в лотерее"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -772,13 +675,13 @@ async def handle_gifts(request: Request) -> Response:
     """GET /api/gifts - Получить список подарков"""
     try:
         # Получаем конфигурацию подарков для цен
-        from gifts import GIFTS_CONFIG
+        from gifts import gift_catalog
         
         # Возвращаем ВСЕ подарки из конфига, а не только из БД релеера
         # Это позволяет показывать все доступные подарки даже если они еще не синхронизированы
         gifts_list = []
         
-        for emoji, config_info in GIFTS_CONFIG.items():
+        for config_info in gift_catalog.gifts:
             gift_name = config_info.get('name', '')
             price_ton = config_info.get('price_ton', 0.0)
             price_ton_black = config_info.get('price_ton_black', 0.0)
@@ -799,18 +702,8 @@ async def handle_gifts(request: Request) -> Response:
 
 
 async def get_user_photo_url(user_id: int) -> Optional[str]:
-    """Получить URL аватара пользователя через Telegram Bot API"""
-    try:
-        # Пытаемся получить фото профиля пользователя
-        photos = await bot.get_user_profile_photos(user_id, limit=1)
-        if photos and photos.photos and len(photos.photos) > 0:
-            # Берем самое большое фото
-            photo = photos.photos[0][-1]
-            file = await bot.get_file(photo.file_id)
-            return f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file.file_path}"
-    except Exception as e:
-        logger.debug(f"Не удалось получить аватар для пользователя {user_id}: {e}")
-    return None
+    """Получить URL аватара пользователя (через кэш аватаров)"""
+    return await avatars.get(user_id)
 
 
 async def handle_top(request: Request) -> Response:
@@ -820,7 +713,7 @@ async def handle_top(request: Request) -> Response:
     
     try:
         # Получаем данные текущего пользователя
-        user_data = await get_user_from_request(request)
+        user_data = request["user"]
         user_id = user_data.get('id') if user_data else None
         
         if category == 'chats':
@@ -852,16 +745,17 @@ async def handle_top(request: Request) -> Response:
             # Топ игроков
             top_players = await db.get_top_by_turnover(period=period, limit=100)
             
-            # Получаем аватарки для всех пользователей в топе
-            top_with_avatars = []
-            for p in top_players:
-                photo_url = await get_user_photo_url(p['user_id'])
-                top_with_avatars.append({
+            # Получаем аватарки для всех пользователей в топе одним пакетом
+            photo_urls = await avatars.get_many([p['user_id'] for p in top_players])
+            top_with_avatars = [
+                {
                     "user_id": p['user_id'],
                     "username": p.get('username', f"ID{p['user_id']}"),
                     "turnover": p.get('turnover', 0.0),
-                    "photo_url": photo_url
-                })
+                    "photo_url": photo_urls.get(p['user_id'])
+                }
+                for p in top_players
+            ]
             
             # Получаем позицию и оборот текущего пользователя
             user_position = None
@@ -887,7 +781,7 @@ async def handle_top(request: Request) -> Response:
 
 async def handle_profile(request: Request) -> Response:
     """GET /api/profile - Получить данные профиля"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -924,7 +818,7 @@ async def handle_profile(request: Request) -> Response:
 
 async def handle_wallet_deposit_methods(request: Request) -> Response:
     """GET /api/wallet/deposit-methods - Получить список методов пополнения"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -965,7 +859,7 @@ async def handle_wallet_deposit_methods(request: Request) -> Response:
 
 async def handle_wallet_deposit_address(request: Request) -> Response:
     """POST /api/wallet/deposit-address - Получить адрес для пополнения через TON"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -1012,7 +906,7 @@ async def handle_wallet_deposit_address(request: Request) -> Response:
 
 async def handle_wallet_deposit_status(request: Request) -> Response:
     """GET /api/wallet/deposit-status/{deposit_id} - Проверить статус депозита"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -1062,7 +956,7 @@ async def handle_wallet_deposit_status(request: Request) -> Response:
                     await db.save_chain_payment(tx_hash, user_id, amount_usd)
                     
                     # Обновляем статус депозита
-                    async with aiosqlite.connect(db.db_path) as conn:
+                    async with db.writer() as conn:
                         await conn.execute(
                             "UPDATE deposits SET status = 'completed' WHERE id = ?",
                             (deposit_id,)
@@ -1085,18 +979,13 @@ async def handle_wallet_deposit_status(request: Request) -> Response:
 
 # ========== РУЛЕТКА API ==========
 
-# Глобальное состояние рулетки (в реальном приложении лучше использовать Redis или БД)
-ROULETTE_STATE = {
-    'current_round': 1,
-    'game_id': 1,  # Номер текущей игры
-    'countdown': 15,
-    'bets': {},  # {sector: [{user_id, bet, avatar, username}]}
-    'round_start_time': None
-}
+# Раунды рулетки ведет сервер (таймер, суммы по секторам и игрокам, запись пачками)
+roulette = RouletteEngine(db)
+
 
 async def handle_roulette_data(request: Request) -> Response:
-    """GET /api/roulette/data - Получить данные рулетки"""
-    user_data = await get_user_from_request(request)
+    """GET /api/roulette/data - Получить данные рулетки (готовый снимок текущего раунда)"""
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -1105,213 +994,12 @@ async def handle_roulette_data(request: Request) -> Response:
         return web.json_response({"error": "Invalid user data"}, status=400)
     
     try:
-        # Получаем все ставки текущего раунда
-        bets = ROULETTE_STATE.get('bets', {})
-        
-        # Подсчитываем статистику
-        total_bets = 0.0
-        participants = set()
-        user_bet = 0.0
-        
-        # Нормализуем user_id для сравнения
-        try:
-            user_id_int = int(user_id)
-        except (ValueError, TypeError):
-            user_id_int = user_id
-        
-        for sector, sector_bets in bets.items():
-            for bet_data in sector_bets:
-                bet_amount = bet_data.get('bet', 0.0)
-                total_bets += bet_amount
-                
-                # Нормализуем user_id участника
-                participant_id = bet_data.get('user_id')
-                if participant_id is not None:
-                    try:
-                        participant_id = int(participant_id)
-                    except (ValueError, TypeError):
-                        pass
-                    participants.add(participant_id)
-                    
-                    # Сравниваем нормализованные ID
-                    if participant_id == user_id_int:
-                        user_bet += bet_amount
-        
-        # Получаем список игроков с аватарами, ставками и шансами на победу
-        players = []
-        # Вычисляем общую сумму ставок по секторам для расчета шансов
-        sector_totals = {}
-        for sector, sector_bets in bets.items():
-            sector_total = sum(bet_data.get('bet', 0.0) for bet_data in sector_bets)
-            sector_totals[int(sector)] = sector_total
-        
-        # Вычисляем общую сумму всех ставок
-        total_all_bets = sum(sector_totals.values())
-        
-        # Собираем данные по каждому игроку
-        player_data = {}  # {user_id: {total_bet, sectors, name, avatar}}
-        for sector, sector_bets in bets.items():
-            for bet_data in sector_bets:
-                # Нормализуем user_id (может быть строкой или числом)
-                user_id_participant = bet_data.get('user_id')
-                if user_id_participant is None:
-                    continue
-                # Преобразуем в int для консистентности
-                try:
-                    user_id_participant = int(user_id_participant)
-                except (ValueError, TypeError):
-                    continue
-                
-                bet_amount = bet_data.get('bet', 0.0)
-                
-                if user_id_participant not in player_data:
-                    user = await db.get_user(user_id_participant)
-                    player_data[user_id_participant] = {
-                        'user_id': user_id_participant,
-                        'total_bet': 0.0,
-                        'sectors': [],
-                        'name': user.get('username', f'User {user_id_participant}') if user else f'User {user_id_participant}',
-                        'avatar': None  # Будет получен позже через get_user_photo_url
-                    }
-                
-                player_data[user_id_participant]['total_bet'] += bet_amount
-                sector_num = int(sector) if isinstance(sector, (str, int)) else sector
-                if sector_num not in player_data[user_id_participant]['sectors']:
-                    player_data[user_id_participant]['sectors'].append(sector_num)
-        
-        # Получаем аватарки для всех игроков через Telegram Bot API
-        for user_id_participant, data in player_data.items():
-            # Получаем реальный аватар через Telegram Bot API
-            photo_url = await get_user_photo_url(user_id_participant)
-            if photo_url:
-                data['avatar'] = photo_url
-            else:
-                # Если не удалось получить аватар, пробуем из базы данных
-                user = await db.get_user(user_id_participant)
-                if user and user.get('photo_url'):
-                    data['avatar'] = user.get('photo_url')
-        
-        # Вычисляем шансы на победу для каждого игрока
-        for user_id_participant, data in player_data.items():
-            # Шанс = сумма ставок игрока на его секторах / общая сумма всех ставок
-            player_sector_total = sum(sector_totals.get(s, 0) for s in data['sectors'])
-            win_chance = (player_sector_total / total_all_bets * 100) if total_all_bets > 0 else 0
-            
-            players.append({
-                'user_id': data['user_id'],
-                'name': data['name'],
-                'avatar': data['avatar'],
-                'photo_url': data['avatar'],  # Добавляем photo_url для совместимости
-                'total_bet': data['total_bet'],
-                'win_chance': round(win_chance, 1),
-                'sectors': data['sectors']
-            })
-        
-        # Убеждаемся, что текущий пользователь всегда в списке (даже если его ставка еще не обработана)
-        current_user_in_list = any(p.get('user_id') == user_id_int for p in players)
-        if not current_user_in_list and user_bet > 0:
-            # Если пользователь сделал ставку, но его нет в списке, добавляем его
-            user = await db.get_user(user_id)
-            # Получаем реальный аватар через Telegram Bot API
-            user_avatar = await get_user_photo_url(user_id_int)
-            if not user_avatar:
-                # Если не удалось получить через API, пробуем из user_data или базы данных
-                user_avatar = user_data.get('photo_url') or (user.get('photo_url') if user else None)
-            user_name = user_data.get('first_name', '') + (' ' + user_data.get('last_name', '') if user_data.get('last_name') else '')
-            if not user_name:
-                user_name = (user.get('username') if user else None) or f'User {user_id}'
-            
-            # Вычисляем шанс для текущего пользователя
-            user_sectors = []
-            user_sector_total = 0.0
-            for sector, sector_bets in bets.items():
-                for bet_data in sector_bets:
-                    bet_user_id = bet_data.get('user_id')
-                    try:
-                        bet_user_id = int(bet_user_id) if bet_user_id is not None else None
-                    except (ValueError, TypeError):
-                        pass
-                    if bet_user_id == user_id_int:
-                        sector_num = int(sector) if isinstance(sector, (str, int)) else sector
-                        if sector_num not in user_sectors:
-                            user_sectors.append(sector_num)
-                        user_sector_total += sector_totals.get(sector_num, 0)
-            
-            user_win_chance = (user_sector_total / total_all_bets * 100) if total_all_bets > 0 else 0
-            
-            players.append({
-                'user_id': user_id_int,
-                'name': user_name,
-                'avatar': user_avatar,
-                'photo_url': user_avatar,  # Добавляем photo_url для совместимости
-                'total_bet': user_bet,
-                'win_chance': round(user_win_chance, 1),
-                'sectors': user_sectors
-            })
-            logger.info(f"✅ Добавлен текущий пользователь {user_id_int} в список игроков (ставка: ${user_bet:.2f})")
-        
-        # Сортируем игроков по сумме ставки (от большего к меньшему)
-        players.sort(key=lambda x: x['total_bet'], reverse=True)
-        
-        logger.info(f"📊 Список игроков: {len(players)} игроков, текущий user_id={user_id_int}, в списке={any(p.get('user_id') == user_id_int for p in players)}")
-        
-        # Вычисляем счетчик - начинается только при 2+ игроках
-        import time
-        participants_count = len(participants)
-        min_players = 2
-        
-        logger.info(f"⏱️ Счетчик: участников={participants_count}, min_players={min_players}, round_start_time={ROULETTE_STATE.get('round_start_time')}")
-        
-        if participants_count >= min_players:
-            # Если есть минимум 2 игрока, начинаем/продолжаем отсчет
-            if not ROULETTE_STATE.get('round_start_time'):
-                ROULETTE_STATE['round_start_time'] = time.time()
-                countdown = 15
-                logger.info(f"🚀 Начинаем новый раунд, устанавливаем round_start_time={ROULETTE_STATE['round_start_time']}, countdown={countdown}")
-            else:
-                elapsed = int(time.time() - ROULETTE_STATE['round_start_time'])
-                countdown = max(0, 15 - elapsed)
-                logger.info(f"⏱️ Продолжаем отсчет: elapsed={elapsed}, countdown={countdown}")
-                # Если счетчик уже дошел до 0, но игра еще не завершена, оставляем 0
-                if countdown == 0 and not ROULETTE_STATE.get('round_finished', False):
-                    countdown = 0
-                    logger.info("⏱️ Счетчик дошел до 0, но игра еще не завершена")
-        else:
-            # Если игроков меньше 2, не начинаем отсчет и сбрасываем таймер
-            countdown = 15
-            ROULETTE_STATE['round_start_time'] = None
-            ROULETTE_STATE['round_finished'] = False
-            logger.info(f"⏸️ Недостаточно игроков ({participants_count} < {min_players}), сбрасываем таймер")
-        
-        # Находим сектор пользователя
-        user_sector = None
-        user_avatar = None
-        for sector, sector_bets in bets.items():
-            for bet_data in sector_bets:
-                if bet_data.get('user_id') == user_id:
-                    user_sector = sector
-                    user_avatar = bet_data.get('avatar')
-                    break
-            if user_sector is not None:
-                break
-        
-        # Если не нашли, пробуем получить из user_data или через Telegram Bot API
-        if not user_avatar:
-            user_avatar = await get_user_photo_url(user_id_int)
-            if not user_avatar:
-                user_avatar = user_data.get('photo_url')
-        
-        return web.json_response({
-            'participants': len(participants),
-            'total_bets': total_bets,
-            'user_bet': user_bet,
-            'bets': bets,
-            'players': players,
-            'countdown': countdown,
-            'game_id': ROULETTE_STATE.get('game_id', 1),
-            'user_sector': user_sector,
-            'user_avatar': user_avatar
-        })
+        user_id_int = int(user_id)
+        data = roulette.snapshot(user_id_int)
+        if not data['user_avatar']:
+            # Игрок еще не ставил в этом раунде - аватар из кэша аватаров или initData
+            data['user_avatar'] = await get_user_photo_url(user_id_int) or user_data.get('photo_url')
+        return web.json_response(data)
     except Exception as e:
         logger.error(f"Ошибка получения данных рулетки: {e}", exc_info=True)
         return web.json_response({"error": "Internal server error"}, status=500)
@@ -1319,7 +1007,7 @@ async def handle_roulette_data(request: Request) -> Response:
 
 async def handle_roulette_bet(request: Request) -> Response:
     """POST /api/roulette/bet - Разместить ставку"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
@@ -1335,58 +1023,32 @@ async def handle_roulette_bet(request: Request) -> Response:
         if bet < 0.1:
             return web.json_response({"error": "Минимальная ставка: $0.10"}, status=400)
         
-        # Проверяем баланс
-        user = await db.get_user(user_id)
+        user_id_int = int(user_id)
+        user = await db.get_user(user_id_int)
         if not user:
             return web.json_response({"error": "User not found"}, status=404)
         
-        balance = user.get('balance', 0.0)
-        if balance < bet:
+        if user.get('balance', 0.0) < bet:
             return web.json_response({"error": "Недостаточно средств"}, status=400)
         
-        # Списываем баланс
-        await db.update_balance(user_id, -bet)
-        await db.decrease_rollover(user_id, bet)
-        
         # Если сектор не указан, выбираем случайный
         if sector == 0:
             import random
             sector = random.randint(1, 12)
         
-        # Добавляем ставку
-        if 'bets' not in ROULETTE_STATE:
-            ROULETTE_STATE['bets'] = {}
-        
-        if sector not in ROULETTE_STATE['bets']:
-            ROULETTE_STATE['bets'][sector] = []
-        
-        # Получаем аватар пользователя
-        avatar = user_data.get('photo_url') or f'https://api.telegram.org/file/bot{BOT_TOKEN}/photos/{user_id}.jpg'
         username = user_data.get('first_name', '') + (' ' + user_data.get('last_name', '') if user_data.get('last_name') else '')
         if not username:
             username = user.get('username', f'User {user_id}')
+        # Имя и аватар игрока запоминаются в раунде один раз, а не ищутся на каждом опросе
+        name = user.get('username') or f'User {user_id_int}'
+        avatar = await get_user_photo_url(user_id_int) or user.get('photo_url') or user_data.get('photo_url')
         
-        # Убеждаемся, что user_id - это число
-        user_id_int = int(user_id) if user_id is not None else None
-        
-        ROULETTE_STATE['bets'][sector].append({
-            'user_id': user_id_int,  # Сохраняем как int для консистентности
-            'bet': bet,
-            'avatar': avatar,
-            'username': username
-        })
-        
-        logger.info(f"📝 Ставка добавлена в ROULETTE_STATE: user_id={user_id_int}, bet=${bet:.2f}, sector={sector}, bets={ROULETTE_STATE.get('bets', {})}")
-        
-        # Сохраняем игру в БД
-        async with aiosqlite.connect(db.db_path) as conn:
-            await conn.execute(
-                "INSERT INTO games (user_id, game_type, bet, result, win) VALUES (?, ?, ?, ?, ?)",
-                (user_id_int, 'roulette', bet, sector, 0.0)  # win будет обновлен после завершения раунда
-            )
-            await conn.commit()
+        # Списываем баланс и добавляем ставку в текущий раунд
+        round_id = await roulette.place_bet(user_id_int, bet, sector, username, name, avatar)
+        if round_id is None:
+            return web.json_response({"error": "Недостаточно средств"}, status=400)
         
-        logger.info(f"✅ Ставка размещена: user_id={user_id_int}, bet=${bet:.2f}, sector={sector}")
+        logger.info(f"✅ Ставка размещена: user_id={user_id_int}, bet=${bet:.2f}, sector={sector}, раунд #{round_id}")
         
         # Возвращаем также аватар пользователя
         user_avatar = user_data.get('photo_url') or f'https://api.telegram.org/file/bot{BOT_TOKEN}/photos/{user_id}.jpg'
@@ -1395,6 +1057,7 @@ async def handle_roulette_bet(request: Request) -> Response:
             'success': True,
             'sector': sector,
             'bet': bet,
+            'game_id': round_id,
             'user_avatar': user_avatar
         })
     except Exception as e:
@@ -1404,13 +1067,12 @@ async def handle_roulette_bet(request: Request) -> Response:
 
 async def handle_roulette_top_games(request: Request) -> Response:
     """GET /api/roulette/top/games - Топ игр в рулетке"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            conn.row_factory = aiosqlite.Row
+        async with db.reader() as conn:
             cursor = await conn.execute("""
                 SELECT 
                     g.id as game_id,
@@ -1445,78 +1107,43 @@ async def handle_roulette_top_games(request: Request) -> Response:
 
 
 async def handle_roulette_finish(request: Request) -> Response:
-    """POST /api/roulette/finish - Завершить раунд рулетки"""
-    user_data = await get_user_from_request(request)
+    """POST /api/roulette/finish - Итог раунда рулетки
+
+    Раунд завершает таймер сервера; сектор, присланный клиентом, не учитывается.
+    Клиент присылает game_id раунда, который показывает: если отсчет только что
+    закончился, запрос ждет итога именно этого раунда до ROULETTE_RESULT_WAIT секунд.
+    """
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
     try:
-        data = await request.json()
-        winning_sector = int(data.get('winning_sector', 0))
-        
-        # Получаем все ставки на выигрышный сектор
-        winning_bets = ROULETTE_STATE.get('bets', {}).get(winning_sector, [])
-        
-        if not winning_bets:
-            # Если нет ставок на выигрышный сектор, возвращаем банк в пул
+        try:
+            data = await request.json()
+        except Exception:
+            data = {}
+        round_id = data.get('game_id') if isinstance(data, dict) else None
+        result = await roulette.wait_result(int(round_id) if round_id else None)
+        if not result:
             return web.json_response({
                 'winner': None,
                 'win_amount': 0,
                 'message': 'Нет победителей'
             })
-        
-        # Вычисляем общий банк
-        total_pot = 0.0
-        for sector, bets in ROULETTE_STATE.get('bets', {}).items():
-            for bet_data in bets:
-                total_pot += bet_data.get('bet', 0.0)
-        
-        # Победитель - первый игрок на выигрышном секторе (или случайный, если несколько)
-        import random
-        winner = random.choice(winning_bets) if len(winning_bets) > 1 else winning_bets[0]
-        win_amount = total_pot
-        
-        # Начисляем выигрыш
-        await db.update_balance(winner['user_id'], win_amount)
-        
-        # Сохраняем результат игры
-        async with aiosqlite.connect(db.db_path) as conn:
-            await conn.execute(
-                "UPDATE games SET win = ?, result = ? WHERE user_id = ? AND game_type = 'roulette' AND win = 0 ORDER BY created_at DESC LIMIT 1",
-                (win_amount, winning_sector, winner['user_id'])
-            )
-            await conn.commit()
-        
-        # Очищаем ставки для нового раунда и увеличиваем номер игры
-        ROULETTE_STATE['bets'] = {}
-        ROULETTE_STATE['round_start_time'] = None
-        ROULETTE_STATE['round_finished'] = False
-        ROULETTE_STATE['game_id'] = ROULETTE_STATE.get('game_id', 1) + 1
-        
-        logger.info(f"Раунд рулетки завершен: победитель user_id={winner['user_id']}, выигрыш=${win_amount:.2f}")
-        
-        return web.json_response({
-            'winner': {
-                'user_id': winner['user_id'],
-                'username': winner.get('username', f"User {winner['user_id']}")
-            },
-            'win_amount': win_amount,
-            'winning_sector': winning_sector
-        })
+        return web.json_response(result)
     except Exception as e:
-        logger.error(f"Ошибка завершения раунда рулетки: {e}", exc_info=True)
+        logger.error(f"Ошибка получения итога раунда рулетки: {e}", exc_info=True)
         return web.json_response({"error": "Internal server error"}, status=500)
 
 
 async def handle_roulette_top_users(request: Request) -> Response:
     """GET /api/roulette/top/users - Топ пользователей в рулетке"""
-    user_data = await get_user_from_request(request)
+    user_data = request["user"]
     if not user_data:
         return web.json_response({"error": "Unauthorized"}, status=401)
     
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            conn.row_factory = aiosqlite.Row
+        async with db.reader() as conn:
             cursor = await conn.execute("""
                 SELECT 
                     u.user_id,
@@ -1574,6 +1201,8 @@ def create_app() -> web.Application:
         return middleware_handler
     
     app.middlewares.append(cors_middleware)
+    # Пользователь Telegram из initData -> request["user"]
+    app.middlewares.append(auth_middleware(init_data_verifier))
     
     # Routes
     app.router.add_get('/api/user', handle_user)
@@ -1608,6 +1237,7 @@ async def start_api_server(port: int = 8080):
     app = create_app()
     runner = web.AppRunner(app)
     await runner.setup()
+    await roulette.start()
     site = web.TCPSite(runner, '0.0.0.0', port)
     await site.start()
     logger.info(f"🌐 API сервер запущен на порту {port}")
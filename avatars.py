@@ -0,0 +1,158 @@
+"""
+Кэш аватаров пользователей для мини-приложения
+
+Получение аватара через Bot API стоит двух запросов (get_user_profile_photos
+и get_file). Результаты кэшируются в памяти (LRU с TTL) и в таблице
+avatar_cache, промахи разрешаются параллельно под семафором, а устаревшие
+записи отдаются сразу и обновляются в фоне (stale-while-revalidate).
+Кэшируется file_path, а ссылка по нему живет около часа, поэтому запись
+старше AVATAR_LINK_LIFETIME не отдается и запрашивается заново.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько (сек) Telegram гарантирует работу ссылки на файл из getFile
+AVATAR_LINK_LIFETIME = 3600.0
+# Время (сек), в течение которого запись считается свежей
+AVATAR_TTL = float(os.getenv("AVATAR_TTL", "1800"))
+# Время (сек), в течение которого устаревшую запись еще можно отдать, пока она обновляется.
+# Не больше AVATAR_LINK_LIFETIME: после него кэшированный file_path дает мертвую ссылку
+AVATAR_STALE_TTL = float(os.getenv("AVATAR_STALE_TTL", "3600"))
+# Максимум записей в памяти
+AVATAR_CACHE_SIZE = int(os.getenv("AVATAR_CACHE_SIZE", "5000"))
+# Максимум одновременных запросов к Bot API
+AVATAR_CONCURRENCY = int(os.getenv("AVATAR_CONCURRENCY", "10"))
+# Сколько (сек) ждать разрешения промахов перед ответом; неуспевшие вернутся как None
+AVATAR_WAIT = float(os.getenv("AVATAR_WAIT", "1.5"))
+
+
+class AvatarResolver:
+    """Разрешение user_id -> URL аватара с кэшем в памяти и в SQLite"""
+
+    def __init__(self, bot, db, token: str, ttl: float = AVATAR_TTL, stale_ttl: float = AVATAR_STALE_TTL,
+                 max_entries: int = AVATAR_CACHE_SIZE, concurrency: int = AVATAR_CONCURRENCY):
+        self.bot = bot
+        self.db = db
+        self.token = token
+        self.stale_ttl = min(stale_ttl, AVATAR_LINK_LIFETIME)
+        self.ttl = min(ttl, self.stale_ttl)
+        self.max_entries = max_entries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # user_id -> (file_path или None, время получения)
+        self._cache: "OrderedDict[int, Tuple[Optional[str], float]]" = OrderedDict()
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _url(self, file_path: Optional[str]) -> Optional[str]:
+        if not file_path:
+            return None
+        return f"https://api.telegram.org/file/bot{self.token}/{file_path}"
+
+    def _store(self, user_id: int, file_path: Optional[str], fetched_at: float):
+        self._cache[user_id] = (file_path, fetched_at)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                rows = await self.db.get_cached_avatars(time.time() - self.stale_ttl, self.max_entries)
+                # Строки отсортированы от новых к старым: самые свежие окажутся в конце LRU
+                for user_id, file_path, fetched_at in reversed(rows):
+                    self._store(user_id, file_path, fetched_at)
+                logger.info(f"🖼 Загружено аватаров из кэша: {len(rows)}")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось загрузить кэш аватаров: {e}")
+            self._loaded = True
+
+    async def _fetch(self, user_id: int) -> Tuple[bool, Optional[str]]:
+        """Запросить file_path аватара в Bot API. Возвращает (успех, file_path)"""
+        async with self._semaphore:
+            try:
+                photos = await self.bot.get_user_profile_photos(user_id, limit=1)
+                if not photos or not photos.photos:
+                    return True, None
+                # Берем самое большое фото
+                file = await self.bot.get_file(photos.photos[0][-1].file_id)
+                return True, file.file_path
+            except Exception as e:
+                logger.debug(f"Не удалось получить аватар для пользователя {user_id}: {e}")
+                return False, None
+
+    async def _refresh(self, user_ids: list):
+        """Обновить аватары пачки пользователей и сохранить их одной транзакцией"""
+        try:
+            results = await asyncio.gather(*(self._fetch(user_id) for user_id in user_ids))
+            now = time.time()
+            rows = []
+            for user_id, (ok, file_path) in zip(user_ids, results):
+                if ok:
+                    self._store(user_id, file_path, now)
+                    rows.append((user_id, file_path, now))
+            if rows:
+                await self.db.save_cached_avatars(rows)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка обновления аватаров: {e}")
+        finally:
+            for user_id in user_ids:
+                self._inflight.pop(user_id, None)
+
+    def _schedule(self, user_ids: Iterable[int]) -> set:
+        """Запустить обновление (без дублей с уже идущими) и вернуть задачи, которые его выполняют"""
+        new = [user_id for user_id in user_ids if user_id not in self._inflight]
+        if new:
+            task = asyncio.create_task(self._refresh(new))
+            for user_id in new:
+                self._inflight[user_id] = task
+        return {self._inflight[user_id] for user_id in user_ids if user_id in self._inflight}
+
+    async def get_many(self, user_ids: Iterable[int], wait: float = AVATAR_WAIT) -> Dict[int, Optional[str]]:
+        """Получить URL аватаров для списка пользователей
+
+        Свежие и устаревшие записи отдаются сразу (устаревшие обновляются в фоне),
+        промахи разрешаются параллельно, но не дольше wait секунд.
+        """
+        await self._ensure_loaded()
+        now = time.time()
+        result: Dict[int, Optional[str]] = {}
+        stale, missing = [], []
+        for user_id in dict.fromkeys(user_ids):
+            entry = self._cache.get(user_id)
+            if entry is None or now - entry[1] > self.stale_ttl:
+                missing.append(user_id)
+                continue
+            self._cache.move_to_end(user_id)
+            result[user_id] = self._url(entry[0])
+            if now - entry[1] > self.ttl:
+                stale.append(user_id)
+        self.hits += len(result)
+        self.misses += len(missing)
+
+        if stale:
+            self._schedule(stale)
+        if missing:
+            tasks = self._schedule(missing)
+            if tasks and wait > 0:
+                await asyncio.wait(tasks, timeout=wait)
+            for user_id in missing:
+                entry = self._cache.get(user_id)
+                result[user_id] = self._url(entry[0]) if entry else None
+        return result
+
+    async def get(self, user_id: int, wait: float = AVATAR_WAIT) -> Optional[str]:
+        """Получить URL аватара одного пользователя"""
+        return (await self.get_many([user_id], wait=wait)).get(user_id)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк индексов базы данных: планы запросов и время выполнения
+до и после миграции со вторичными индексами на таблице games из 1М строк
+
+Запуск: python benchmark_db_indexes.py [количество_игр]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from database import Database, SECONDARY_INDEXES, run_migrations
+
+USERS_COUNT = 20000
+GAME_TYPES = ["dice", "dart", "bowling", "football", "basketball", "slots"]
+
+# Горячие запросы: (название, SQL, параметры)
+QUERIES = [
+    ("Оборот пользователя за все время",
+     "SELECT COALESCE(SUM(bet), 0) FROM games WHERE user_id = ? AND (currency IS NULL OR currency != 'arbuzz')",
+     (42,)),
+    ("Оборот пользователя за неделю",
+     "SELECT COALESCE(SUM(bet), 0) FROM games WHERE user_id = ? AND created_at >= datetime('now', '-7 days', 'localtime') "
+     "AND (currency IS NULL OR currency != 'arbuzz')",
+     (42,)),
+    ("Топ по обороту за неделю",
+     "SELECT user_id, SUM(bet) AS turnover FROM games WHERE created_at >= datetime('now', '-7 days', 'localtime') "
+     "AND (currency IS NULL OR currency != 'arbuzz') GROUP BY user_id ORDER BY turnover DESC LIMIT 10",
+     ()),
+    ("Игры за сегодня",
+     "SELECT COUNT(*) FROM games WHERE created_at >= date('now')",
+     ()),
+    ("Количество рефералов",
+     "SELECT COUNT(*) FROM users WHERE referred_by = ?",
+     (42,)),
+    ("Билеты пользователя в лотерее",
+     "SELECT COUNT(*) FROM lottery_tickets WHERE lottery_id = ? AND user_id = ?",
+     (1, 42)),
+    ("Доступный подарок по эмодзи",
+     "SELECT * FROM relay_gifts WHERE emoji = ? AND is_available = 1 ORDER BY created_at ASC LIMIT 1",
+     ("🧸",)),
+]
+
+
+def fill_database(path: str, games_count: int):
+    """Заполнить базу тестовыми данными"""
+    conn = sqlite3.connect(path)
+    now = datetime.now()
+    conn.executemany(
+        "INSERT INTO users (user_id, username, referral_code, referred_by, balance) VALUES (?, ?, ?, ?, 0)",
+        ((user_id, f"user{user_id}", f"ref_{user_id}", random.randint(1, USERS_COUNT) if user_id % 3 else None)
+         for user_id in range(1, USERS_COUNT + 1)),
+    )
+
+    def games():
+        for _ in range(games_count):
+            created_at = now - timedelta(seconds=random.randint(0, 180 * 24 * 3600))
+            yield (
+                random.randint(1, USERS_COUNT),
+                random.choice(GAME_TYPES),
+                round(random.uniform(0.1, 50), 2),
+                random.randint(1, 6),
+                0.0,
+                "arbuzz" if random.random() < 0.1 else "dollar",
+                created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+
+    conn.executemany(
+        "INSERT INTO games (user_id, game_type, bet, result, win, currency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        games(),
+    )
+    conn.execute("INSERT INTO lotteries (title, ticket_price, max_tickets_per_user, finish_type, created_by) "
+                 "VALUES ('bench', 1, 100, 'participants', 1)")
+    conn.executemany(
+        "INSERT INTO lottery_tickets (lottery_id, user_id, ticket_number) VALUES (1, ?, ?)",
+        ((random.randint(1, USERS_COUNT), number) for number in range(1, 50001)),
+    )
+    conn.executemany(
+        "INSERT INTO relay_gifts (message_id, emoji, gift_name, is_available) VALUES (?, ?, ?, ?)",
+        ((message_id, random.choice("🧸💎🐸🎁🌹"), f"Gift {message_id % 100}", message_id % 4 == 0)
+         for message_id in range(1, 20001)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_queries(path: str, title: str, repeats: int = 5):
+    """Вывести планы запросов и среднее время выполнения"""
+    conn = sqlite3.connect(path)
+    print(f"\n===== {title} =====")
+    for name, sql, params in QUERIES:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        started = time.perf_counter()
+        for _ in range(repeats):
+            conn.execute(sql, params).fetchall()
+        elapsed_ms = (time.perf_counter() - started) / repeats * 1000
+        print(f"\n{name}: {elapsed_ms:.2f} мс")
+        for step in plan:
+            print(f"    {step}")
+    conn.close()
+
+
+async def main(games_count: int):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = Database()
+    db.db_path = path
+    await db.init_db()
+
+    # Состояние «до»: схема без вторичных индексов
+    conn = sqlite3.connect(path)
+    for statement in SECONDARY_INDEXES:
+        index_name = statement.split("IF NOT EXISTS ")[1].split()[0]
+        conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+    print(f"Заполнение базы: {games_count} игр, {USERS_COUNT} пользователей...")
+    fill_database(path, games_count)
+    run_queries(path, "ДО: без вторичных индексов")
+
+    started = time.perf_counter()
+    async with db.writer() as conn:
+        version = await run_migrations(conn)
+    print(f"\nМиграции применены (версия схемы {version}) за {time.perf_counter() - started:.1f} с")
+    await db.close()
+
+    run_queries(path, "ПОСЛЕ: со вторичными индексами")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Сверка скомпилированных правил выигрыша (outcomes.py) с прежней цепочкой
+if/elif из process_game_result и бенчмарк проверки одного результата
+
+Для ставок до 6 бросков перебираются все последовательности граней 1-6 всех
+длин от 1 до нужного числа бросков; для 10 голов - все последовательности из
+граней 1 (мимо) и 3, 4, 5 (гол), которые различает правило, плюс случайная выборка.
+Слоты сверяются по всем 64 значениям.
+
+Запуск: python benchmark_outcomes.py [повторов_бенчмарка]
+"""
+import itertools
+import random
+import sys
+import time
+
+from config import GAME_CONFIGS
+from outcomes import RULES, outcome_table
+from utils.checks import decode_slot_symbols
+
+EXHAUSTIVE_MAX_THROWS = 6
+RANDOM_SAMPLES = 200_000
+
+
+def legacy_multiplier(config: dict, bet_type: str) -> float:
+    multipliers = config.get("multipliers", {})
+    if bet_type.startswith("exact_"):
+        return multipliers.get("exact", 1.0)
+    return multipliers.get(bet_type, 1.0)
+
+
+def legacy_is_win(game_type: str, bet_type: str, throws: list) -> bool:
+    """Цепочка проверки выигрыша из process_game_result до перехода на outcomes.py"""
+    is_win = False
+    first_result = throws[0] if throws else 0
+    if game_type == "dice":
+        if bet_type == "even":
+            is_win = first_result % 2 == 0
+        elif bet_type == "odd":
+            is_win = first_result % 2 == 1
+        elif bet_type.startswith("exact_"):
+            target_num = int(bet_type.split("_")[1])
+            is_win = first_result == target_num
+        elif bet_type == "pair":
+            is_win = len(throws) >= 2 and throws[0] == throws[1]
+        elif bet_type == "3_even":
+            is_win = len(throws) >= 3 and all(t % 2 == 0 for t in throws[:3])
+        elif bet_type == "3_odd":
+            is_win = len(throws) >= 3 and all(t % 2 == 1 for t in throws[:3])
+        elif bet_type == "18":
+            is_win = len(throws) >= 5 and sum(throws[:5]) == 18
+        elif bet_type == "21":
+            is_win = len(throws) >= 5 and sum(throws[:5]) == 21
+        elif bet_type == "111":
+            is_win = len(throws) >= 3 and all(t == 1 for t in throws[:3])
+        elif bet_type == "333":
+            is_win = len(throws) >= 3 and all(t == 3 for t in throws[:3])
+        elif bet_type == "666":
+            is_win = len(throws) >= 3 and all(t == 6 for t in throws[:3])
+    elif game_type == "dart":
+        if bet_type == "red":
+            is_win = first_result in [2, 4, 6]
+        elif bet_type == "white":
+            is_win = first_result in [3, 5]
+        elif bet_type == "center":
+            is_win = first_result == 6
+        elif bet_type == "miss":
+            is_win = first_result == 1
+        elif bet_type == "3_red":
+            is_win = len(throws) >= 3 and all(t in [2, 4, 6] for t in throws[:3])
+        elif bet_type == "3_white":
+            is_win = len(throws) >= 3 and all(t in [3, 5] for t in throws[:3])
+        elif bet_type == "3_center":
+            is_win = len(throws) >= 3 and all(t == 6 for t in throws[:3])
+        elif bet_type == "3_miss":
+            is_win = len(throws) >= 3 and all(t == 1 for t in throws[:3])
+    elif game_type == "bowling":
+        if bet_type == "0-3":
+            is_win = first_result <= 3
+        elif bet_type == "4-6":
+            is_win = 4 <= first_result <= 6
+        elif bet_type == "strike":
+            is_win = first_result == 6
+        elif bet_type == "miss":
+            is_win = first_result in [0, 1]
+        elif bet_type == "2_strike":
+            is_win = len(throws) >= 2 and all(t == 6 for t in throws[:2])
+        elif bet_type == "3_strike":
+            is_win = len(throws) >= 3 and all(t == 6 for t in throws[:3])
+        elif bet_type == "2_miss":
+            is_win = len(throws) >= 2 and all(t in [0, 1] for t in throws[:2])
+        elif bet_type == "3_miss":
+            is_win = len(throws) >= 3 and all(t in [0, 1] for t in throws[:3])
+    elif game_type == "football":
+        if bet_type == "goal":
+            is_win = first_result in [3, 4, 5]
+        elif bet_type == "miss":
+            is_win = first_result in [1, 2]
+        elif bet_type == "center":
+            is_win = first_result == 3
+        elif bet_type == "hattrick":
+            is_win = len(throws) >= 3 and all(t in [3, 4, 5] for t in throws[:3])
+        elif bet_type == "5_goals":
+            is_win = len(throws) >= 5 and all(t in [3, 4, 5] for t in throws[:5])
+        elif bet_type == "10_goals":
+            is_win = len(throws) >= 10 and all(t in [3, 4, 5] for t in throws[:10])
+        elif bet_type == "6_miss":
+            is_win = len(throws) >= 6 and all(t in [1, 2, 3] for t in throws[:6])
+    elif game_type == "basketball":
+        if bet_type == "hit":
+            is_win = first_result in [4, 5]
+        elif bet_type == "miss":
+            is_win = first_result in [1, 2]
+        elif bet_type == "clean":
+            is_win = first_result == 5
+        elif bet_type == "stuck":
+            is_win = first_result == 3
+        elif bet_type == "2_hit":
+            is_win = len(throws) >= 2 and all(t in [4, 5] for t in throws[:2])
+        elif bet_type == "3_hit":
+            is_win = len(throws) >= 3 and all(t in [4, 5] for t in throws[:3])
+        elif bet_type == "2_clean":
+            is_win = len(throws) >= 2 and all(t == 5 for t in throws[:2])
+        elif bet_type == "3_clean":
+            is_win = len(throws) >= 3 and all(t == 5 for t in throws[:3])
+        elif bet_type == "6_hit":
+            is_win = len(throws) >= 6 and all(t in [4, 5] for t in throws[:6])
+    elif game_type == "dice_7":
+        dice_sum = sum(throws[:2])
+        if bet_type == "less_7":
+            is_win = dice_sum < 7
+        elif bet_type == "equal_7":
+            is_win = dice_sum == 7
+        elif bet_type == "more_7":
+            is_win = dice_sum > 7
+    return is_win
+
+
+def legacy_slot_multiplier(value: int) -> float:
+    symbols = decode_slot_symbols(value)
+    multiplier = 0
+    if symbols[0] == symbols[1] == symbols[2]:
+        multiplier = {"7": 20, "🍇": 10, "🍋": 7, "Bar": 5}[symbols[0]]
+    return multiplier
+
+
+def sequences(rule_throws: int):
+    """Последовательности бросков для сверки правила"""
+    if rule_throws <= EXHAUSTIVE_MAX_THROWS:
+        for length in range(1, rule_throws + 1):
+            yield from itertools.product(range(1, 7), repeat=length)
+        return
+    # Длинные серии: перебор по классам граней, которые различает правило, и случайная выборка
+    yield from itertools.product((1, 3, 4, 5), repeat=rule_throws)
+    for _ in range(RANDOM_SAMPLES):
+        yield tuple(random.randint(1, 6) for _ in range(random.randint(1, rule_throws)))
+
+
+def check_consistency() -> int:
+    mismatches = 0
+    checked = 0
+    for game_type, bets in RULES.items():
+        config = GAME_CONFIGS[game_type]
+        for bet_type, rule in bets.items():
+            if outcome_table.evaluate(game_type, bet_type, [])[1] != legacy_multiplier(config, bet_type):
+                print(f"❌ {game_type}/{bet_type}: множитель не совпадает")
+                mismatches += 1
+            for throws in sequences(rule.throws):
+                throws = list(throws)
+                # dice_7 с одним броском process_game_result не оценивает
+                if game_type == "dice_7" and len(throws) < 2:
+                    continue
+                checked += 1
+                expected = legacy_is_win(game_type, bet_type, throws)
+                actual, _multiplier = outcome_table.evaluate(game_type, bet_type, throws)
+                if expected != actual:
+                    mismatches += 1
+                    if mismatches <= 20:
+                        print(f"❌ {game_type}/{bet_type} {throws}: было {expected}, стало {actual}")
+    for value in range(1, 65):
+        checked += 1
+        if outcome_table.slot(value)[1] != legacy_slot_multiplier(value):
+            mismatches += 1
+            print(f"❌ слоты {value}: множитель не совпадает")
+    print(f"Проверено результатов: {checked}, расхождений: {mismatches}")
+    return mismatches
+
+
+def benchmark(repeats: int):
+    cases = []
+    for game_type, bets in RULES.items():
+        for bet_type, rule in bets.items():
+            cases.append((game_type, bet_type, [random.randint(1, 6) for _ in range(rule.throws)]))
+
+    print(f"\nБенчмарк: {len(cases)} ставок x {repeats} повторов")
+    for title, evaluate in (
+        ("if/elif (было)", legacy_is_win),
+        ("таблица (стало)", outcome_table.evaluate),
+    ):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for game_type, bet_type, throws in cases:
+                evaluate(game_type, bet_type, throws)
+        elapsed = time.perf_counter() - started
+        print(f"  {title:<18} {elapsed * 1e9 / (repeats * len(cases)):8.0f} нс на результат")
+
+
+if __name__ == "__main__":
+    random.seed(1)
+    failed = check_consistency()
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,251 @@
+"""
+Фоновые рассылки пользователям
+
+Получатели читаются из SQLite порциями (keyset-пагинация по user_id),
+сообщения отправляются параллельно через общий token bucket под глобальный
+лимит Telegram (~30 сообщений/сек). Каждому получателю уходит одно сообщение,
+поэтому лимит на отдельный чат (1 сообщение/сек) соблюдается сам собой.
+Прогресс сохраняется после каждой порции: после перезапуска бота рассылка
+продолжается с последнего user_id. Пользователи, заблокировавшие бота,
+помечаются и исключаются из следующих рассылок.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит отправки (сообщений/сек) и одновременных запросов
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+# Размер порции получателей, после которой сохраняется прогресс
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+# Как часто (сек) обновлять сообщение с прогрессом у админа
+PROGRESS_UPDATE_INTERVAL = 5
+MAX_SEND_ATTEMPTS = 3
+
+# Ошибки Bad Request, означающие, что получатель недоступен навсегда
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid", "bot was blocked")
+
+db = Database()
+
+
+class TokenBucket:
+    """Token bucket: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (Telegram вернул 429 с retry_after)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _markup_to_json(reply_markup: Optional[InlineKeyboardMarkup]) -> Optional[list]:
+    if not isinstance(reply_markup, InlineKeyboardMarkup):
+        return None
+    return [[button.model_dump(exclude_none=True) for button in row] for row in reply_markup.inline_keyboard]
+
+
+def _markup_from_json(rows: Optional[list]) -> Optional[InlineKeyboardMarkup]:
+    if not rows:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(**button) for button in row] for row in rows])
+
+
+class BroadcastEngine:
+    """Запуск, продолжение и остановка фоновых рассылок"""
+
+    def __init__(self, bot: Bot, rate: float = BROADCAST_RATE, concurrency: int = BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stopped: set = set()
+
+    async def start(self, kind: str, text: str, photo_id: Optional[str] = None,
+                    reply_markup: Optional[InlineKeyboardMarkup] = None,
+                    admin_chat_id: Optional[int] = None) -> int:
+        """Создать рассылку и запустить ее в фоне. Возвращает ID рассылки"""
+        payload = json.dumps({
+            "text": text,
+            "photo_id": photo_id,
+            "reply_markup": _markup_to_json(reply_markup),
+        }, ensure_ascii=False)
+        total = await db.count_broadcast_recipients()
+        broadcast_id = await db.create_broadcast(kind, payload, total, admin_chat_id)
+        logger.info(f"📢 Рассылка #{broadcast_id} ({kind}) создана: {total} получателей")
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    async def resume_all(self):
+        """Продолжить рассылки, прерванные перезапуском бота"""
+        for broadcast in await db.get_running_broadcasts():
+            if broadcast["id"] not in self._tasks:
+                logger.info(f"📢 Продолжаю рассылку #{broadcast['id']} с user_id > {broadcast['last_user_id']}")
+                self._spawn(broadcast["id"])
+
+    def stop(self, broadcast_id: int) -> bool:
+        """Остановить рассылку после текущей порции"""
+        if broadcast_id not in self._tasks:
+            return False
+        self._stopped.add(broadcast_id)
+        return True
+
+    def _spawn(self, broadcast_id: int):
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _send(self, user_id: int, payload: Dict, reply_markup) -> str:
+        """Отправить одно сообщение. Возвращает sent / blocked / failed"""
+        for attempt in range(MAX_SEND_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                if payload.get("photo_id"):
+                    await self.bot.send_photo(
+                        chat_id=user_id,
+                        photo=payload["photo_id"],
+                        caption=payload["text"],
+                        reply_markup=reply_markup,
+                        parse_mode="HTML"
+                    )
+                else:
+                    await self.bot.send_message(
+                        chat_id=user_id,
+                        text=payload["text"],
+                        reply_markup=reply_markup,
+                        parse_mode="HTML"
+                    )
+                return "sent"
+            except TelegramRetryAfter as e:
+                # Превысили лимит - останавливаем всю рассылку на retry_after и повторяем
+                logger.warning(f"⏳ Рассылка: лимит Telegram, пауза {e.retry_after} с")
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except TelegramBadRequest as e:
+                if any(phrase in str(e).lower() for phrase in UNREACHABLE_ERRORS):
+                    return "blocked"
+                logger.warning(f"⚠️ Ошибка отправки пользователю {user_id}: {e}")
+                return "failed"
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка отправки пользователю {user_id}: {e}")
+                return "failed"
+        return "failed"
+
+    async def _run(self, broadcast_id: int):
+        broadcast = await db.get_broadcast(broadcast_id)
+        if not broadcast:
+            return
+        payload = json.loads(broadcast["payload"])
+        reply_markup = _markup_from_json(payload.get("reply_markup"))
+        last_user_id = broadcast["last_user_id"]
+        counters = {"sent": broadcast["sent"], "failed": broadcast["failed"], "blocked": broadcast["blocked"]}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_report = 0.0
+
+        async def deliver(user_id: int):
+            async with semaphore:
+                return await self._send(user_id, payload, reply_markup)
+
+        try:
+            await self._report(broadcast_id, counters, broadcast["total"], finished=False)
+            while broadcast_id not in self._stopped:
+                user_ids = await db.get_broadcast_recipients(last_user_id, BROADCAST_CHUNK_SIZE)
+                if not user_ids:
+                    break
+                results = await asyncio.gather(*(deliver(user_id) for user_id in user_ids))
+                blocked_ids = [user_id for user_id, result in zip(user_ids, results) if result == "blocked"]
+                for result in results:
+                    counters[result] += 1
+                last_user_id = user_ids[-1]
+                await db.save_broadcast_progress(broadcast_id, last_user_id, counters["sent"],
+                                                 counters["failed"], counters["blocked"], blocked_ids)
+                if time.monotonic() - last_report >= PROGRESS_UPDATE_INTERVAL:
+                    last_report = time.monotonic()
+                    await self._report(broadcast_id, counters, broadcast["total"], finished=False)
+            status = "cancelled" if broadcast_id in self._stopped else "completed"
+            await db.finish_broadcast(broadcast_id, status)
+            await self._report(broadcast_id, counters, broadcast["total"], finished=True, status=status)
+            logger.info(f"✅ Рассылка #{broadcast_id} {status}: отправлено {counters['sent']}, "
+                        f"ошибок {counters['failed']}, заблокировано {counters['blocked']}")
+        except Exception as e:
+            # Статус остается running - рассылка продолжится после перезапуска
+            logger.error(f"❌ Рассылка #{broadcast_id} прервана: {e}", exc_info=True)
+        finally:
+            self._stopped.discard(broadcast_id)
+
+    async def _report(self, broadcast_id: int, counters: Dict, total: int, finished: bool, status: str = "running"):
+        """Показать админу прогресс: одно сообщение, которое редактируется по ходу рассылки"""
+        broadcast = await db.get_broadcast(broadcast_id)
+        admin_chat_id = broadcast.get("admin_chat_id") if broadcast else None
+        if not admin_chat_id:
+            return
+        done = counters["sent"] + counters["failed"] + counters["blocked"]
+        if finished:
+            title = "✅ <b>Рассылка завершена!</b>" if status == "completed" else "⏹ <b>Рассылка остановлена</b>"
+        else:
+            title = f"📤 <b>Рассылка #{broadcast_id}</b>: {done}/{total}"
+        text = (
+            f"{title}\n\n"
+            f"📊 Всего пользователей: {total}\n"
+            f"✅ Отправлено: {counters['sent']}\n"
+            f"❌ Ошибок: {counters['failed']}\n"
+            f"🚫 Заблокировали бота: {counters['blocked']}"
+        )
+        keyboard = None if finished else InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⏹ Остановить", callback_data=f"broadcast_stop_{broadcast_id}")]
+        ])
+        try:
+            if broadcast.get("progress_message_id"):
+                await self.bot.edit_message_text(text, chat_id=admin_chat_id, message_id=broadcast["progress_message_id"],
+                                                 reply_markup=keyboard, parse_mode="HTML")
+            else:
+                message = await self.bot.send_message(admin_chat_id, text, reply_markup=keyboard, parse_mode="HTML")
+                await db.set_broadcast_progress_message(broadcast_id, message.message_id)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                logger.debug(f"Не удалось обновить прогресс рассылки #{broadcast_id}: {e}")
+        except Exception as e:
+            logger.debug(f"Не удалось обновить прогресс рассылки #{broadcast_id}: {e}")
+
+
+_engine: Optional[BroadcastEngine] = None
+
+
+def get_broadcast_engine(bot: Bot) -> BroadcastEngine:
+    """Общий для процесса движок рассылок"""
+    global _engine
+    if _engine is None:
+        _engine = BroadcastEngine(bot)
+    return _engine
@@ -0,0 +1,203 @@
+"""
+Графики для админки
+
+Данные берутся из дневных агрегатов в SQLite (daily_stats, game_type_daily)
+и передаются в виде компактных массивов NumPy. Отрисовка matplotlib
+выполняется в отдельном процессе (ProcessPoolExecutor), поэтому
+растеризация не блокирует event loop бота.
+"""
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')  # Используем backend без GUI
+    MATPLOTLIB_AVAILABLE = True
+except ImportError:
+    MATPLOTLIB_AVAILABLE = False
+    logger.warning("matplotlib не установлен, графики будут недоступны")
+
+# Количество процессов отрисовки
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "1"))
+# Период дневных графиков (дней, включая сегодня)
+CHART_DAYS = 30
+
+CHART_TYPES = ("profit", "deposits", "withdrawals", "games", "users", "overview")
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _daily_series(rows: List[tuple], days: int):
+    """[(YYYY-MM-DD, значение)] -> (даты datetime64[D], значения float64) без пропусков дней"""
+    # Дни в агрегатах - локальные даты (как в daily_stats)
+    start = np.datetime64(date.today() - timedelta(days=days - 1), "D")
+    dates = start + np.arange(days)
+    values = np.zeros(days, dtype=np.float64)
+    for day, value in rows:
+        index = (np.datetime64(day, "D") - start).astype(int)
+        if 0 <= index < days:
+            values[index] = value or 0
+    return dates, values
+
+
+async def load_chart_data(db, chart_type: str) -> Dict:
+    """Получить агрегированные данные графика из базы"""
+    if chart_type in ("profit", "deposits", "withdrawals"):
+        data = {}
+        if chart_type in ("profit", "deposits"):
+            data["dates"], data["deposits"] = _daily_series(await db.get_daily_amounts("deposits", CHART_DAYS), CHART_DAYS)
+        if chart_type in ("profit", "withdrawals"):
+            data["dates"], data["withdrawals"] = _daily_series(await db.get_daily_amounts("withdrawals", CHART_DAYS), CHART_DAYS)
+        return data
+    if chart_type == "users":
+        dates, values = _daily_series(await db.get_daily_registrations(CHART_DAYS), CHART_DAYS)
+        return {"dates": dates, "registrations": values}
+    if chart_type == "games":
+        rows = await db.get_game_type_counts()
+        return {
+            "types": np.array([row[0] for row in rows], dtype=object),
+            "counts": np.array([row[1] for row in rows], dtype=np.int64),
+        }
+    if chart_type == "overview":
+        return await db.get_overview_totals()
+    raise ValueError(f"Неизвестный тип графика: {chart_type}")
+
+
+def _format_dates(ax):
+    import matplotlib.dates as mdates
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+
+
+def render_chart(chart_type: str, data: Dict) -> bytes:
+    """Отрисовать график в PNG (выполняется в процессе отрисовки)"""
+    from matplotlib.figure import Figure
+
+    # Настройка русского шрифта для matplotlib
+    matplotlib.rcParams['font.family'] = 'DejaVu Sans'
+    matplotlib.rcParams['axes.unicode_minus'] = False
+
+    if chart_type == "overview":
+        fig = Figure(figsize=(14, 10))
+        axes = fig.subplots(2, 2)
+        total_deposits = data["total_deposits"]
+        total_withdrawals = data["total_withdrawals"]
+
+        # График 1: Доходы vs Расходы
+        if total_deposits or total_withdrawals:
+            axes[0, 0].pie([total_deposits, total_withdrawals],
+                           labels=['Депозиты', 'Выводы'],
+                           autopct='%1.1f%%',
+                           colors=['green', 'red'])
+        axes[0, 0].set_title('Депозиты vs Выводы', fontweight='bold')
+
+        # График 2: Прибыль
+        profit = total_deposits - total_withdrawals
+        axes[0, 1].bar(['Прибыль'], [profit], color='blue' if profit > 0 else 'red')
+        axes[0, 1].set_title(f'Общая прибыль: ${profit:.2f}', fontweight='bold')
+        axes[0, 1].set_ylabel('USD')
+
+        # График 3: Пользователи
+        axes[1, 0].bar(['Пользователи'], [data["total_users"]], color='purple')
+        axes[1, 0].set_title(f'Всего пользователей: {data["total_users"]}', fontweight='bold')
+        axes[1, 0].set_ylabel('Количество')
+
+        # График 4: Игры
+        axes[1, 1].bar(['Игры'], [data["total_games"]], color='orange')
+        axes[1, 1].set_title(f'Всего игр: {data["total_games"]}', fontweight='bold')
+        axes[1, 1].set_ylabel('Количество')
+    else:
+        fig = Figure(figsize=(12, 6))
+        ax = fig.subplots()
+
+        if chart_type == "profit":
+            deposits, withdrawals = data["deposits"], data["withdrawals"]
+            ax.plot(data["dates"], deposits, label='Депозиты', marker='o', linewidth=2)
+            ax.plot(data["dates"], withdrawals, label='Выводы', marker='s', linewidth=2)
+            ax.plot(data["dates"], deposits - withdrawals, label='Прибыль', marker='^', linewidth=2, linestyle='--')
+            ax.set_title('Доходы и расходы за последние 30 дней', fontsize=14, fontweight='bold')
+            ax.set_xlabel('Дата')
+            ax.set_ylabel('Сумма (USD)')
+            ax.legend()
+            ax.grid(True, alpha=0.3)
+            _format_dates(ax)
+
+        elif chart_type in ("deposits", "withdrawals"):
+            title = 'Депозиты' if chart_type == "deposits" else 'Выводы'
+            ax.bar(data["dates"], data[chart_type], color='green' if chart_type == "deposits" else 'red', alpha=0.7)
+            ax.set_title(f'{title} за последние 30 дней', fontsize=14, fontweight='bold')
+            ax.set_xlabel('Дата')
+            ax.set_ylabel('Сумма (USD)')
+            ax.grid(True, alpha=0.3, axis='y')
+            _format_dates(ax)
+
+        elif chart_type == "games":
+            if data["counts"].size:
+                ax.bar(data["types"].astype(str), data["counts"], color='blue', alpha=0.7)
+                ax.set_xlabel('Тип игры')
+                ax.set_ylabel('Количество')
+                ax.grid(True, alpha=0.3, axis='y')
+                for label in ax.get_xticklabels():
+                    label.set_rotation(45)
+            else:
+                ax.text(0.5, 0.5, 'Нет данных', ha='center', va='center', fontsize=16)
+            ax.set_title('Распределение игр по типам', fontsize=14, fontweight='bold')
+
+        elif chart_type == "users":
+            if data["registrations"].any():
+                ax.bar(data["dates"], data["registrations"], color='purple', alpha=0.7)
+                ax.set_title('Регистрации пользователей за последние 30 дней', fontsize=14, fontweight='bold')
+                ax.set_xlabel('Дата')
+                ax.set_ylabel('Количество')
+                ax.grid(True, alpha=0.3, axis='y')
+                _format_dates(ax)
+            else:
+                ax.text(0.5, 0.5, 'Нет данных', ha='center', va='center', fontsize=16)
+                ax.set_title('Регистрации пользователей', fontsize=14, fontweight='bold')
+
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: дочерний процесс не наследует потоки aiosqlite и event loop бота
+        _executor = ProcessPoolExecutor(max_workers=CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def build_chart(db, chart_type: str) -> bytes:
+    """Собрать данные графика в SQLite и отрисовать его в процессе отрисовки"""
+    global _executor
+    data = await load_chart_data(db, chart_type)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_executor(), render_chart, chart_type, data)
+    except BrokenProcessPool:
+        # Процесс отрисовки упал - пересоздаем пул и пробуем еще раз
+        logger.warning("⚠️ Пул отрисовки графиков сломан, пересоздаю")
+        _executor = None
+        return await loop.run_in_executor(_get_executor(), render_chart, chart_type, data)
+
+
+def shutdown_chart_pool():
+    """Остановить процессы отрисовки (при остановке бота)"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -1,7 +1,7 @@
-import aiohttp
 import logging
 from typing import Optional, Dict
 from config import CRYPTO_PAY_TOKEN
+from http_client import http_request
 
 logger = logging.getLogger(__name__)
 
@@ -41,14 +41,13 @@ class CryptoPay:
             data["offset"] = offset
         
         logger.info(f"📤 Запрос getInvoices: {data}")
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (getInvoices): статус {response.status}, результат: {result}")
-                if response.status == 200 and result.get("ok"):
-                    return result.get("result")
-                logger.error(f"❌ Ошибка getInvoices: HTTP {response.status}, ответ: {result}")
-                return None
+        async with http_request("POST", url, headers=headers, json=data) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (getInvoices): статус {response.status}, результат: {result}")
+            if response.status == 200 and result.get("ok"):
+                return result.get("result")
+            logger.error(f"❌ Ошибка getInvoices: HTTP {response.status}, ответ: {result}")
+            return None
     
     async def create_invoice(
         self,
@@ -88,24 +87,23 @@ class CryptoPay:
         
         logger.info(f"📤 Отправка запроса на создание инвойса: {data}")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (createInvoice): статус {response.status}, результат: {result}")
-                if response.status == 200:
-                    if result.get("ok"):
-                        return result.get("result")
-                    else:
-                        # Логируем ошибку от API
-                        error_code = result.get("error", {}).get("code", "unknown")
-                        error_name = result.get("error", {}).get("name", "unknown")
-                        error_message = result.get("error", {}).get("message", "unknown")
-                        logger.error(f"❌ Crypto Pay API ошибка (createInvoice): {error_name} (код: {error_code}), сообщение: {error_message}, данные: {data}")
-                        return None
+        async with http_request("POST", url, headers=headers, json=data) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (createInvoice): статус {response.status}, результат: {result}")
+            if response.status == 200:
+                if result.get("ok"):
+                    return result.get("result")
                 else:
-                    # Логируем HTTP ошибку
-                    logger.error(f"❌ Crypto Pay API HTTP ошибка (createInvoice): статус {response.status}, ответ: {result}")
+                    # Логируем ошибку от API
+                    error_code = result.get("error", {}).get("code", "unknown")
+                    error_name = result.get("error", {}).get("name", "unknown")
+                    error_message = result.get("error", {}).get("message", "unknown")
+                    logger.error(f"❌ Crypto Pay API ошибка (createInvoice): {error_name} (код: {error_code}), сообщение: {error_message}, данные: {data}")
                     return None
+            else:
+                # Логируем HTTP ошибку
+                logger.error(f"❌ Crypto Pay API HTTP ошибка (createInvoice): статус {response.status}, ответ: {result}")
+                return None
     
     async def create_check(
         self,
@@ -128,38 +126,37 @@ class CryptoPay:
         
         logger.info(f"📤 Отправка запроса на создание чека: {data}")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (createCheck): статус {response.status}, результат: {result}")
-                if response.status == 200:
-                    if result.get("ok"):
-                        return result.get("result")
-                    else:
-                        # Логируем ошибку от API
-                        error_code = result.get("error", {}).get("code", "unknown")
-                        error_name = result.get("error", {}).get("name", "unknown")
-                        error_message = result.get("error", {}).get("message", "unknown")
-                        error_description = result.get("error", {}).get("description", "")
-                        logger.error(f"❌ Crypto Pay API ошибка (createCheck): {error_name} (код: {error_code}), сообщение: {error_message}, описание: {error_description}, данные: {data}")
-                        # Возвращаем словарь с ошибкой для обработки
-                        return {"error": True, "code": error_code, "name": error_name, "message": error_message, "description": error_description}
+        async with http_request("POST", url, headers=headers, json=data) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (createCheck): статус {response.status}, результат: {result}")
+            if response.status == 200:
+                if result.get("ok"):
+                    return result.get("result")
                 else:
-                    # Логируем HTTP ошибку
-                    logger.error(f"❌ Crypto Pay API HTTP ошибка (createCheck): статус {response.status}, ответ: {result}")
-                    # Извлекаем информацию об ошибке из ответа, если она есть
-                    error_info = result.get("error", {})
-                    error_code = error_info.get("code", response.status)
-                    error_name = error_info.get("name", "HTTP_ERROR")
-                    error_message = error_info.get("message", "HTTP error")
-                    error_description = error_info.get("description", "")
-                    return {
-                        "error": True,
-                        "code": error_code,
-                        "name": error_name,
-                        "message": error_message,
-                        "description": error_description
-                    }
+                    # Логируем ошибку от API
+                    error_code = result.get("error", {}).get("code", "unknown")
+                    error_name = result.get("error", {}).get("name", "unknown")
+                    error_message = result.get("error", {}).get("message", "unknown")
+                    error_description = result.get("error", {}).get("description", "")
+                    logger.error(f"❌ Crypto Pay API ошибка (createCheck): {error_name} (код: {error_code}), сообщение: {error_message}, описание: {error_description}, данные: {data}")
+                    # Возвращаем словарь с ошибкой для обработки
+                    return {"error": True, "code": error_code, "name": error_name, "message": error_message, "description": error_description}
+            else:
+                # Логируем HTTP ошибку
+                logger.error(f"❌ Crypto Pay API HTTP ошибка (createCheck): статус {response.status}, ответ: {result}")
+                # Извлекаем информацию об ошибке из ответа, если она есть
+                error_info = result.get("error", {})
+                error_code = error_info.get("code", response.status)
+                error_name = error_info.get("name", "HTTP_ERROR")
+                error_message = error_info.get("message", "HTTP error")
+                error_description = error_info.get("description", "")
+                return {
+                    "error": True,
+                    "code": error_code,
+                    "name": error_name,
+                    "message": error_message,
+                    "description": error_description
+                }
     
     async def delete_check(self, check_id: int) -> Optional[Dict]:
         """Удалить чек"""
@@ -170,33 +167,18 @@ class CryptoPay:
         
         logger.info(f"📤 Отправка запроса на удаление чека: {data}")
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (deleteCheck): статус {response.status}, результат: {result}")
-                if response.status == 200:
-                    if result.get("ok"):
-                        return result.get("result")
-                    else:
-                        error_code = result.get("error", {}).get("code", "unknown")
-                        error_name = result.get("error", {}).get("name", "unknown")
-                        error_message = result.get("error", {}).get("message", "unknown")
-                        error_description = result.get("error", {}).get("description", "")
-                        logger.error(f"❌ Crypto Pay API ошибка (deleteCheck): {error_name} (код: {error_code}), сообщение: {error_message}, описание: {error_description}, данные: {data}")
-                        return {
-                            "error": True,
-                            "code": error_code,
-                            "name": error_name,
-                            "message": error_message,
-                            "description": error_description
-                        }
+        async with http_request("POST", url, headers=headers, json=data) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (deleteCheck): статус {response.status}, результат: {result}")
+            if response.status == 200:
+                if result.get("ok"):
+                    return result.get("result")
                 else:
-                    logger.error(f"❌ Crypto Pay API HTTP ошибка (deleteCheck): статус {response.status}, ответ: {result}")
-                    error_info = result.get("error", {})
-                    error_code = error_info.get("code", response.status)
-                    error_name = error_info.get("name", "HTTP_ERROR")
-                    error_message = error_info.get("message", "HTTP error")
-                    error_description = error_info.get("description", "")
+                    error_code = result.get("error", {}).get("code", "unknown")
+                    error_name = result.get("error", {}).get("name", "unknown")
+                    error_message = result.get("error", {}).get("message", "unknown")
+                    error_description = result.get("error", {}).get("description", "")
+                    logger.error(f"❌ Crypto Pay API ошибка (deleteCheck): {error_name} (код: {error_code}), сообщение: {error_message}, описание: {error_description}, данные: {data}")
                     return {
                         "error": True,
                         "code": error_code,
@@ -204,6 +186,20 @@ class CryptoPay:
                         "message": error_message,
                         "description": error_description
                     }
+            else:
+                logger.error(f"❌ Crypto Pay API HTTP ошибка (deleteCheck): статус {response.status}, ответ: {result}")
+                error_info = result.get("error", {})
+                error_code = error_info.get("code", response.status)
+                error_name = error_info.get("name", "HTTP_ERROR")
+                error_message = error_info.get("message", "HTTP error")
+                error_description = error_info.get("description", "")
+                return {
+                    "error": True,
+                    "code": error_code,
+                    "name": error_name,
+                    "message": error_message,
+                    "description": error_description
+                }
     
     async def get_checks(
         self,
@@ -221,35 +217,33 @@ class CryptoPay:
             params["asset"] = asset
         
         logger.info(f"📤 Запрос getChecks: {params}")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (getChecks): статус {response.status}, результат: {result}")
-                if response.status == 200:
-                    if result.get("ok"):
-                        return result.get("result")
-                    else:
-                        error_code = result.get("error", {}).get("code", "unknown")
-                        error_name = result.get("error", {}).get("name", "unknown")
-                        error_message = result.get("error", {}).get("message", "unknown")
-                        logger.error(f"❌ Crypto Pay API ошибка (getChecks): {error_name} (код: {error_code}), сообщение: {error_message}")
-                        return None
+        async with http_request("GET", url, headers=headers, params=params) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (getChecks): статус {response.status}, результат: {result}")
+            if response.status == 200:
+                if result.get("ok"):
+                    return result.get("result")
                 else:
-                    logger.error(f"❌ Crypto Pay API HTTP ошибка (getChecks): статус {response.status}, ответ: {result}")
+                    error_code = result.get("error", {}).get("code", "unknown")
+                    error_name = result.get("error", {}).get("name", "unknown")
+                    error_message = result.get("error", {}).get("message", "unknown")
+                    logger.error(f"❌ Crypto Pay API ошибка (getChecks): {error_name} (код: {error_code}), сообщение: {error_message}")
                     return None
+            else:
+                logger.error(f"❌ Crypto Pay API HTTP ошибка (getChecks): статус {response.status}, ответ: {result}")
+                return None
     
     async def get_me(self) -> Optional[Dict]:
         """Получить информацию о боте"""
         url = f"{self.base_url}/getMe"
         headers = {"Crypto-Pay-API-Token": self.token}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    if result.get("ok"):
-                        return result.get("result")
-                return None
+        async with http_request("GET", url, headers=headers) as response:
+            if response.status == 200:
+                result = await response.json()
+                if result.get("ok"):
+                    return result.get("result")
+            return None
     
     async def get_balance(self) -> Optional[Dict]:
         """Получить баланс бота"""
@@ -257,22 +251,21 @@ class CryptoPay:
         headers = {"Crypto-Pay-API-Token": self.token}
         
         logger.info(f"📤 Запрос getBalance")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (getBalance): статус {response.status}, результат: {result}")
-                if response.status == 200:
-                    if result.get("ok"):
-                        return result.get("result")
-                    else:
-                        error_code = result.get("error", {}).get("code", "unknown")
-                        error_name = result.get("error", {}).get("name", "unknown")
-                        error_message = result.get("error", {}).get("message", "unknown")
-                        logger.error(f"❌ Crypto Pay API ошибка (getBalance): {error_name} (код: {error_code}), сообщение: {error_message}")
-                        return None
+        async with http_request("GET", url, headers=headers) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (getBalance): статус {response.status}, результат: {result}")
+            if response.status == 200:
+                if result.get("ok"):
+                    return result.get("result")
                 else:
-                    logger.error(f"❌ Crypto Pay API HTTP ошибка (getBalance): статус {response.status}, ответ: {result}")
+                    error_code = result.get("error", {}).get("code", "unknown")
+                    error_name = result.get("error", {}).get("name", "unknown")
+                    error_message = result.get("error", {}).get("message", "unknown")
+                    logger.error(f"❌ Crypto Pay API ошибка (getBalance): {error_name} (код: {error_code}), сообщение: {error_message}")
                     return None
+            else:
+                logger.error(f"❌ Crypto Pay API HTTP ошибка (getBalance): статус {response.status}, ответ: {result}")
+                return None
     
     async def transfer(
         self,
@@ -299,34 +292,20 @@ class CryptoPay:
         data["disable_send_notification"] = disable_send_notification
         
         logger.info(f"📤 Отправка запроса на перевод средств: {data}")
+        # spend_id делает перевод идемпотентным, поэтому его можно безопасно повторять
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (transfer): статус {response.status}, результат: {result}")
-                if response.status == 200:
-                    if result.get("ok"):
-                        return result.get("result")
-                    else:
-                        error_code = result.get("error", {}).get("code", "unknown")
-                        error_name = result.get("error", {}).get("name", "unknown")
-                        error_message = result.get("error", {}).get("message", "unknown")
-                        error_description = result.get("error", {}).get("description", "")
-                        logger.error(f"❌ Crypto Pay API ошибка (transfer): {error_name} (код: {error_code}), сообщение: {error_message}, описание: {error_description}, данные: {data}")
-                        return {
-                            "error": True,
-                            "code": error_code,
-                            "name": error_name,
-                            "message": error_message,
-                            "description": error_description
-                        }
+        async with http_request("POST", url, headers=headers, json=data, idempotent=True) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (transfer): статус {response.status}, результат: {result}")
+            if response.status == 200:
+                if result.get("ok"):
+                    return result.get("result")
                 else:
-                    logger.error(f"❌ Crypto Pay API HTTP ошибка (transfer): статус {response.status}, ответ: {result}")
-                    error_info = result.get("error", {})
-                    error_code = error_info.get("code", response.status)
-                    error_name = error_info.get("name", "HTTP_ERROR")
-                    error_message = error_info.get("message", "HTTP error")
-                    error_description = error_info.get("description", "")
+                    error_code = result.get("error", {}).get("code", "unknown")
+                    error_name = result.get("error", {}).get("name", "unknown")
+                    error_message = result.get("error", {}).get("message", "unknown")
+                    error_description = result.get("error", {}).get("description", "")
+                    logger.error(f"❌ Crypto Pay API ошибка (transfer): {error_name} (код: {error_code}), сообщение: {error_message}, описание: {error_description}, данные: {data}")
                     return {
                         "error": True,
                         "code": error_code,
@@ -334,6 +313,20 @@ class CryptoPay:
                         "message": error_message,
                         "description": error_description
                     }
+            else:
+                logger.error(f"❌ Crypto Pay API HTTP ошибка (transfer): статус {response.status}, ответ: {result}")
+                error_info = result.get("error", {})
+                error_code = error_info.get("code", response.status)
+                error_name = error_info.get("name", "HTTP_ERROR")
+                error_message = error_info.get("message", "HTTP error")
+                error_description = error_info.get("description", "")
+                return {
+                    "error": True,
+                    "code": error_code,
+                    "name": error_name,
+                    "message": error_message,
+                    "description": error_description
+                }
     
     async def get_exchange_rates(self) -> Optional[list]:
         """Получить курсы обмена"""
@@ -341,22 +334,21 @@ class CryptoPay:
         headers = {"Crypto-Pay-API-Token": self.token}
         
         logger.info(f"📤 Запрос getExchangeRates")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                result = await response.json()
-                logger.info(f"📡 Crypto Pay API ответ (getExchangeRates): статус {response.status}, результат: {result}")
-                if response.status == 200:
-                    if result.get("ok"):
-                        return result.get("result", [])
-                    else:
-                        error_code = result.get("error", {}).get("code", "unknown")
-                        error_name = result.get("error", {}).get("name", "unknown")
-                        error_message = result.get("error", {}).get("message", "unknown")
-                        logger.error(f"❌ Crypto Pay API ошибка (getExchangeRates): {error_name} (код: {error_code}), сообщение: {error_message}")
-                        return None
+        async with http_request("GET", url, headers=headers) as response:
+            result = await response.json()
+            logger.info(f"📡 Crypto Pay API ответ (getExchangeRates): статус {response.status}, результат: {result}")
+            if response.status == 200:
+                if result.get("ok"):
+                    return result.get("result", [])
                 else:
-                    logger.error(f"❌ Crypto Pay API HTTP ошибка (getExchangeRates): статус {response.status}, ответ: {result}")
+                    error_code = result.get("error", {}).get("code", "unknown")
+                    error_name = result.get("error", {}).get("name", "unknown")
+                    error_message = result.get("error", {}).get("message", "unknown")
+                    logger.error(f"❌ Crypto Pay API ошибка (getExchangeRates): {error_name} (код: {error_code}), сообщение: {error_message}")
                     return None
+            else:
+                logger.error(f"❌ Crypto Pay API HTTP ошибка (getExchangeRates): статус {response.status}, ответ: {result}")
+                return None
 
 
 # Создаем глобальный экземпляр
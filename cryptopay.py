@@ -1,8 +1,9 @@
-import aiohttp
 from decimal import Decimal
 from typing import Optional, Dict, List, Union
 import logging
 
+from http_client import http_request
+
 class CryptoPayAPI:
     def __init__(self, api_token: str, testnet: bool = False):
         self.api_token = api_token
@@ -13,18 +14,19 @@ class CryptoPayAPI:
         return await self._make_request("POST", "deleteCheck", json={"check_id": check_id})
 
     async def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict:
-        async with aiohttp.ClientSession() as session:
-            async with session.request(
-                method,
-                f"{self.base_url}/{endpoint}",
-                headers=self.headers,
-                **kwargs
-            ) as response:
-                try:
-                    return await response.json()
-                except Exception as e:
-                    logging.error(f"Failed to parse JSON response: {e}")
-                    return {}
+        # transfer идемпотентен благодаря spend_id
+        async with http_request(
+            method,
+            f"{self.base_url}/{endpoint}",
+            idempotent=True if endpoint == "transfer" else None,
+            headers=self.headers,
+            **kwargs
+        ) as response:
+            try:
+                return await response.json()
+            except Exception as e:
+                logging.error(f"Failed to parse JSON response: {e}")
+                return {}
 
     async def create_invoice(
         self,
@@ -1,19 +1,701 @@
 import aiosqlite
+import asyncio
+import contextvars
+import json
 import os
 import logging
-from typing import Optional, List, Dict
+import time
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
+from typing import AsyncIterator, Optional, List, Dict
+
+from leaderboard import Leaderboard
+from rollups import DailyStatsRollup, rebuild_rollups, record_deposit, record_withdrawal
 
 DATABASE_PATH = os.getenv("DATABASE_PATH", "database.db")
+# Количество соединений только для чтения в пуле (плюс одно соединение для записи)
+DATABASE_READERS = int(os.getenv("DATABASE_READERS", "4"))
+# Параметры фоновой записи журнала игр: интервал сброса (сек), размер пачки и емкость очереди
+GAME_LOG_FLUSH_INTERVAL = float(os.getenv("GAME_LOG_FLUSH_INTERVAL", "0.2"))
+GAME_LOG_BATCH_SIZE = int(os.getenv("GAME_LOG_BATCH_SIZE", "500"))
+GAME_LOG_QUEUE_SIZE = int(os.getenv("GAME_LOG_QUEUE_SIZE", "10000"))
+# Попыток записи пачки, максимальная пауза между ними (сек) и ожидание записи при остановке (сек)
+GAME_LOG_WRITE_ATTEMPTS = int(os.getenv("GAME_LOG_WRITE_ATTEMPTS", "5"))
+GAME_LOG_RETRY_MAX_DELAY = float(os.getenv("GAME_LOG_RETRY_MAX_DELAY", "8"))
+GAME_LOG_CLOSE_TIMEOUT = float(os.getenv("GAME_LOG_CLOSE_TIMEOUT", "30"))
 logger = logging.getLogger(__name__)
 
+# PRAGMA, применяемые к каждому соединению пула
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -20000",  # ~20 МБ страничного кэша на соединение
+    "PRAGMA mmap_size = 268435456",  # 256 МБ memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# Соединение, которое держит текущая задача: _Lease.
+# Позволяет вложенным вызовам методов Database переиспользовать уже взятое соединение.
+_held_connection: contextvars.ContextVar = contextvars.ContextVar("held_connection", default=None)
+
+
+class _Lease:
+    """Взятое из пула соединение; после возврата в пул active=False"""
+
+    __slots__ = ("task", "conn", "write", "active")
+
+    def __init__(self, task: Optional[asyncio.Task], conn: aiosqlite.Connection, write: bool):
+        self.task = task
+        self.conn = conn
+        self.write = write
+        self.active = True
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite: одно соединение для записи и N для чтения (WAL)"""
+
+    def __init__(self, db_path: str, readers: int = DATABASE_READERS):
+        self.db_path = db_path
+        self.readers_count = max(1, readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock: Optional[asyncio.Lock] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+
+    async def _connect(self, readonly: bool) -> aiosqlite.Connection:
+        conn = aiosqlite.connect(self.db_path)
+        # Поток соединения не должен удерживать процесс при выходе, если пул не закрыт явно
+        conn.daemon = True
+        await conn
+        conn.row_factory = aiosqlite.Row
+        if not readonly:
+            await conn.execute("PRAGMA journal_mode = WAL")
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        if readonly:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        """Открыть соединения пула (вызывается лениво при первом обращении)"""
+        async with self._open_lock:
+            if self._opened:
+                return
+            # Соединение для записи открываем первым, чтобы включить WAL до появления читателей
+            self._writer = await self._connect(readonly=False)
+            self._writer_lock = asyncio.Lock()
+            self._readers = asyncio.Queue()
+            for _ in range(self.readers_count):
+                conn = await self._connect(readonly=True)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+            self._opened = True
+            logger.info(f"🗄 Пул соединений SQLite открыт: {self.db_path} (1 writer + {self.readers_count} readers)")
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        async with self._open_lock:
+            if not self._opened:
+                return
+            self._opened = False
+            async with self._writer_lock:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                await self._writer.close()
+            for conn in self._all_readers:
+                await conn.close()
+            self._writer = None
+            self._readers = None
+            self._all_readers = []
+            logger.info(f"🗄 Пул соединений SQLite закрыт: {self.db_path}")
+
+    @asynccontextmanager
+    async def connection(self, write: bool = True):
+        """Взять соединение из пула на время блока async with
+
+        Вложенные вызовы в той же задаче переиспользуют уже взятое соединение:
+        чтение внутри записи идет через writer и видит незакоммиченные изменения.
+        Незакоммиченная транзакция при выходе из внешнего блока откатывается,
+        как это происходило при закрытии отдельного соединения.
+        """
+        task = asyncio.current_task()
+        held = _held_connection.get()
+        # Неактивная аренда остается в контексте, если блок завершился в другом контексте
+        # (брошенный асинхронный генератор закрывается сборщиком мусора) - ее не используем
+        if held and held.active and held.task is task and (held.write or not write):
+            yield held.conn
+            return
+
+        if not self._opened:
+            await self.open()
+
+        if write:
+            await self._writer_lock.acquire()
+            conn = self._writer
+        else:
+            conn = await self._readers.get()
+
+        lease = _Lease(task, conn, write)
+        token = _held_connection.set(lease)
+        try:
+            yield conn
+        finally:
+            # Соединение возвращается в пул до сброса переменной контекста: сброс может не пройти
+            try:
+                try:
+                    if conn.in_transaction:
+                        await conn.rollback()
+                finally:
+                    lease.active = False
+                    if write:
+                        self._writer_lock.release()
+                    else:
+                        self._readers.put_nowait(conn)
+            finally:
+                try:
+                    _held_connection.reset(token)
+                except ValueError:
+                    # Блок закрыт в другом контексте (финализация брошенного генератора)
+                    pass
+
+
+_POOLS: Dict[str, ConnectionPool] = {}
+
+
+def get_pool(db_path: str = DATABASE_PATH) -> ConnectionPool:
+    """Получить общий для процесса пул соединений для файла базы данных"""
+    pool = _POOLS.get(db_path)
+    if pool is None:
+        pool = ConnectionPool(db_path)
+        _POOLS[db_path] = pool
+    return pool
+
+
+GAME_INSERT_SQL = """INSERT INTO games (user_id, game_type, bet, result, win, bet_type, currency)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+class GameLogWriter:
+    """Фоновая пакетная запись журнала игр (write-behind)
+
+    Обработчики кладут строки в ограниченную очередь; фоновая задача пишет их
+    через executemany одной транзакцией каждые GAME_LOG_FLUSH_INTERVAL секунд
+    или при наборе GAME_LOG_BATCH_SIZE строк. Если очередь заполнена, enqueue
+    ждет освобождения места (backpressure).
+
+    Строки журнала не выбрасываются. Пачка, которую не удалось записать,
+    повторяется GAME_LOG_WRITE_ATTEMPTS раз с растущей паузой, затем строки
+    пишутся по одной, а те, что не записались и так, сохраняются в файл
+    <база>.games-spill.jsonl - очередь не застревает на одной пачке. Файл
+    дописывается в базу при следующем init_db (replay_spill).
+
+    Запись пачки идет отдельной задачей (_storing) и при остановке не
+    прерывается: close дожидается ее, поэтому закоммиченная пачка не будет
+    записана второй раз.
+
+    Слушатели (listeners) получают каждую пачку: persist(db, rows) - в той же
+    транзакции до коммита, apply(rows) - после коммита, пока соединение записи
+    еще удерживается.
+    """
+
+    def __init__(self, pool: ConnectionPool, listeners: Optional[list] = None,
+                 flush_interval: float = GAME_LOG_FLUSH_INTERVAL,
+                 batch_size: int = GAME_LOG_BATCH_SIZE, queue_size: int = GAME_LOG_QUEUE_SIZE):
+        self.pool = pool
+        self.listeners = list(listeners or [])
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.spill_path = f"{pool.db_path}.games-spill.jsonl"
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._storing: Optional[asyncio.Task] = None  # запись текущей пачки
+        self._closed = False
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.failed_writes = 0
+        self.spilled_rows = 0
+
+    async def enqueue(self, row: tuple):
+        """Поставить строку игры в очередь на запись"""
+        if self._closed:
+            # Писатель уже остановлен - пишем напрямую, чтобы не потерять запись
+            await self._store([row], attempts=1)
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        await self._queue.put(row)
+
+    async def _run(self):
+        while True:
+            row = await self._queue.get()
+            batch = [row]
+            deadline = asyncio.get_running_loop().time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Отмена _run (close) не прерывает запись пачки - ее дождется close
+            self._storing = asyncio.ensure_future(self._store(batch))
+            await asyncio.shield(self._storing)
+            self._storing = None
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _store(self, batch: List[tuple], attempts: int = GAME_LOG_WRITE_ATTEMPTS):
+        """Записать пачку с повторами; не записанные строки - по одной, остаток - в файл"""
+        delay = 0.5
+        for attempt in range(1, attempts + 1):
+            if await self._write(batch):
+                return
+            if attempt < attempts:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, GAME_LOG_RETRY_MAX_DELAY)
+        failed = await self._write_rows(batch) if len(batch) > 1 else batch
+        if failed:
+            self._spill(failed)
+
+    async def _write_rows(self, rows: List[tuple]) -> List[tuple]:
+        """Записать строки по одной (одна плохая строка не топит пачку). Возвращает незаписанные"""
+        failed = []
+        for row in rows:
+            if not await self._write([row]):
+                failed.append(row)
+        return failed
+
+    async def _write(self, batch: List[tuple]) -> bool:
+        """Записать пачку одной транзакцией. False - запись не удалась, пачка не записана"""
+        try:
+            async with self.pool.connection(write=True) as db:
+                await db.executemany(GAME_INSERT_SQL, batch)
+                for listener in self.listeners:
+                    await listener.persist(db, batch)
+                await db.commit()
+                for listener in self.listeners:
+                    try:
+                        listener.apply(batch)
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработчика пачки игр {type(listener).__name__}: {e}", exc_info=True)
+        except Exception as e:
+            self.failed_writes += 1
+            logger.error(f"❌ Ошибка записи пачки игр ({len(batch)} шт.): {e}")
+            return False
+        self.flushed_rows += len(batch)
+        self.flushed_batches += 1
+        return True
+
+    def _spill(self, rows: List[tuple]):
+        """Сохранить незаписанные строки в файл для записи при следующем запуске"""
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.spilled_rows += len(rows)
+        logger.warning(f"⚠️ {len(rows)} игр не записаны в базу и сохранены в {self.spill_path}")
+
+    async def replay_spill(self):
+        """Дописать в базу строки, сохраненные в файл при прошлых ошибках записи"""
+        if not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            rows = [tuple(json.loads(line)) for line in f if line.strip()]
+        failed = []
+        for i in range(0, len(rows), self.batch_size):
+            batch = rows[i:i + self.batch_size]
+            if not await self._write(batch):
+                failed.extend(await self._write_rows(batch))
+        if failed:
+            # Оставляем в файле только строки, которые так и не записались
+            with open(self.spill_path, "w", encoding="utf-8") as f:
+                for row in failed:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            logger.error(f"❌ Не удалось дописать сохраненные игры: осталось {len(failed)} шт. в {self.spill_path}")
+        else:
+            os.remove(self.spill_path)
+        logger.info(f"✅ Дописано сохраненных игр: {len(rows) - len(failed)}")
+
+    async def flush(self):
+        """Дождаться записи всех строк, уже поставленных в очередь"""
+        if self._task is not None and not self._task.done():
+            await self._queue.join()
+
+    async def close(self, timeout: float = GAME_LOG_CLOSE_TIMEOUT):
+        """Остановить фоновую задачу, записав остаток очереди (или сохранив его в файл)"""
+        if self._closed:
+            return
+        try:
+            await asyncio.wait_for(self.flush(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Журнал игр не записан за {timeout} с, остаток будет сохранен в файл")
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._storing is not None:
+            # Начатая пачка дописывается (или сохраняется в файл) самой задачей записи
+            await self._storing
+            self._storing = None
+        # Строки, попавшие в очередь после flush
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+            self._queue.task_done()
+        if batch:
+            await self._store(batch, attempts=1)
+
+
+_GAME_LOGS: Dict[str, GameLogWriter] = {}
+_LEADERBOARDS: Dict[str, Leaderboard] = {}
+
+
+def get_leaderboard(db_path: str = DATABASE_PATH) -> Leaderboard:
+    """Получить общие для процесса рейтинги оборота для файла базы данных"""
+    leaderboard = _LEADERBOARDS.get(db_path)
+    if leaderboard is None:
+        leaderboard = Leaderboard(get_pool(db_path))
+        _LEADERBOARDS[db_path] = leaderboard
+    return leaderboard
+
+
+def get_game_log(db_path: str = DATABASE_PATH) -> GameLogWriter:
+    """Получить общий для процесса писатель журнала игр для файла базы данных"""
+    game_log = _GAME_LOGS.get(db_path)
+    if game_log is None:
+        game_log = GameLogWriter(get_pool(db_path), listeners=[get_leaderboard(db_path), DailyStatsRollup()])
+        _GAME_LOGS[db_path] = game_log
+    return game_log
+
+
+async def close_all_pools():
+    """Сбросить журналы игр и закрыть все пулы соединений (при остановке бота)"""
+    for game_log in list(_GAME_LOGS.values()):
+        await game_log.close()
+    for pool in list(_POOLS.values()):
+        await pool.close()
+
+
+# Колонки, добавленные в таблицы после их первого выпуска: (таблица, колонка, объявление)
+LEGACY_COLUMNS = (
+    ("partners", "level_percents", "TEXT"),
+    ("users", "referral_balance", "REAL DEFAULT 0.00"),
+    ("users", "locked_balance", "REAL DEFAULT 0.00"),
+    ("users", "rollover_requirement", "REAL DEFAULT 0.00"),
+    ("users", "total_lost", "REAL DEFAULT 0.00"),
+    ("users", "arbuzz_balance", "REAL DEFAULT 0.00"),
+    ("users", "last_daily_arbuzz_date", "TEXT"),
+    ("users", "first_win_today_arbuzz", "BOOLEAN DEFAULT 0"),
+    ("users", "last_win_date", "TEXT"),
+    ("games", "bet_type", "TEXT"),
+    ("games", "currency", "TEXT DEFAULT 'dollar'"),
+    ("checks", "rollover_multiplier", "REAL DEFAULT 1.0"),
+    ("checks", "deposit_type", "TEXT DEFAULT 'no_deposit'"),
+    ("checks", "min_deposit", "REAL DEFAULT 0.0"),
+    ("promo_codes", "rollover_multiplier", "REAL DEFAULT 1.0"),
+    ("promo_codes", "deposit_type", "TEXT DEFAULT 'no_deposit'"),
+    ("promo_codes", "min_deposit", "REAL DEFAULT 0.0"),
+    ("promo_codes", "activation_link", "TEXT"),
+    ("relay_gifts", "slug", "TEXT"),
+    ("relay_gifts", "gift_date", "INTEGER"),
+    ("relay_gifts", "from_user_id", "INTEGER"),
+    ("relay_gifts", "from_username", "TEXT"),
+    ("pvp_duels", "duel_mode", "TEXT DEFAULT 'standard'"),
+    ("pvp_duels", "min_bet", "REAL DEFAULT 0.0"),
+    ("pvp_duels", "max_bet", "REAL DEFAULT 0.0"),
+    ("pvp_duels", "auto_start_players", "INTEGER DEFAULT 0"),
+    ("pvp_participants", "bet_amount", "REAL"),
+)
+
+# Вторичные индексы под горячие фильтры (UNIQUE-ограничения и PRIMARY KEY уже индексированы)
+SECONDARY_INDEXES = (
+    # Топ/оборот пользователя: фильтр по user_id и периоду, покрывает currency и bet
+    "CREATE INDEX IF NOT EXISTS idx_games_user_created ON games (user_id, created_at, currency, bet)",
+    # Топ за период по всем пользователям и статистика за день
+    "CREATE INDEX IF NOT EXISTS idx_games_created ON games (created_at, user_id, currency, bet)",
+    "CREATE INDEX IF NOT EXISTS idx_lottery_tickets_user ON lottery_tickets (lottery_id, user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_pvp_tickets_duel ON pvp_tickets (duel_id, ticket_position)",
+    "CREATE INDEX IF NOT EXISTS idx_pvp_duels_status ON pvp_duels (status)",
+    "CREATE INDEX IF NOT EXISTS idx_promo_activations_user ON promo_activations (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_relay_gifts_emoji ON relay_gifts (emoji, is_available, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_relay_gifts_name ON relay_gifts (gift_name, is_available, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_relay_gifts_slug ON relay_gifts (slug, is_available, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_chain_payments_user ON chain_payments (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_users_referred_by ON users (referred_by)",
+    "CREATE INDEX IF NOT EXISTS idx_users_referral_code ON users (referral_code)",
+    "CREATE INDEX IF NOT EXISTS idx_deposits_user ON deposits (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_deposits_created ON deposits (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_withdrawals_user ON withdrawals (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_withdrawals_created ON withdrawals (created_at)",
+)
+
+
+async def _migrate_legacy_columns(db: aiosqlite.Connection):
+    """Добавить колонки, которых нет в старых базах (раньше - ALTER TABLE в try/except)"""
+    for table, column, declaration in LEGACY_COLUMNS:
+        async with db.execute(f"PRAGMA table_info({table})") as cursor:
+            existing = {row[1] for row in await cursor.fetchall()}
+        if column not in existing:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+async def _migrate_secondary_indexes(db: aiosqlite.Connection):
+    """Создать вторичные индексы"""
+    for statement in SECONDARY_INDEXES:
+        await db.execute(statement)
+    await db.execute("ANALYZE")
+
+
+async def _migrate_turnover_daily(db: aiosqlite.Connection):
+    """Дневные корзины оборота для топа (заполняются из истории игр)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS turnover_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            turnover REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (user_id, day)
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_turnover_daily_day ON turnover_daily (day, user_id, turnover)")
+    await db.execute("""
+        INSERT OR REPLACE INTO turnover_daily (user_id, day, turnover)
+        SELECT user_id, DATE(created_at, 'localtime'), SUM(bet)
+        FROM games
+        WHERE (currency IS NULL OR currency != 'arbuzz') AND user_id IS NOT NULL
+        GROUP BY user_id, DATE(created_at, 'localtime')
+    """)
+
+
+async def _migrate_avatar_cache(db: aiosqlite.Connection):
+    """Кэш аватаров пользователей (file_path из Bot API, NULL - фото нет)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS avatar_cache (
+            user_id INTEGER PRIMARY KEY,
+            file_path TEXT,
+            updated_at REAL NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_avatar_cache_updated ON avatar_cache (updated_at)")
+
+
+async def _migrate_chain_cursors(db: aiosqlite.Connection):
+    """Курсоры сканирования блокчейна: последняя обработанная транзакция по адресу"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS chain_cursors (
+            address TEXT PRIMARY KEY,
+            last_lt INTEGER NOT NULL,
+            last_hash TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+async def _migrate_broadcasts(db: aiosqlite.Connection):
+    """Фоновые рассылки с сохраняемым прогрессом и отметка пользователей, заблокировавших бота"""
+    async with db.execute("PRAGMA table_info(users)") as cursor:
+        existing = {row[1] for row in await cursor.fetchall()}
+    if "blocked_bot" not in existing:
+        await db.execute("ALTER TABLE users ADD COLUMN blocked_bot BOOLEAN DEFAULT 0")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            admin_chat_id INTEGER,
+            progress_message_id INTEGER,
+            total INTEGER DEFAULT 0,
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)")
+
+
+async def _migrate_export_cursors(db: aiosqlite.Connection):
+    """Курсоры выгрузок: последний выгруженный ID по типу данных (режим «с прошлой выгрузки»)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS export_cursors (
+            kind TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+async def _migrate_daily_stats(db: aiosqlite.Connection):
+    """Дневные агрегаты статистики (заполняются из истории игр, депозитов и выводов)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            games INTEGER NOT NULL DEFAULT 0,
+            bets REAL NOT NULL DEFAULT 0.0,
+            wins REAL NOT NULL DEFAULT 0.0,
+            win_games INTEGER NOT NULL DEFAULT 0,
+            lost_bets REAL NOT NULL DEFAULT 0.0,
+            deposits REAL NOT NULL DEFAULT 0.0,
+            deposits_count INTEGER NOT NULL DEFAULT 0,
+            withdrawals REAL NOT NULL DEFAULT 0.0,
+            withdrawals_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, currency)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS game_type_daily (
+            day TEXT NOT NULL,
+            game_type TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            games INTEGER NOT NULL DEFAULT 0,
+            bets REAL NOT NULL DEFAULT 0.0,
+            wins REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (day, game_type, currency)
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            currency TEXT NOT NULL,
+            games INTEGER NOT NULL DEFAULT 0,
+            bets REAL NOT NULL DEFAULT 0.0,
+            wins REAL NOT NULL DEFAULT 0.0,
+            win_games INTEGER NOT NULL DEFAULT 0,
+            lost_bets REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (user_id, day, currency)
+        )
+    """)
+    # Новые пользователи за день - диапазон по created_at вместо DATE(created_at) = ?
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)")
+    await rebuild_rollups(db)
+
+
+async def _migrate_session_snapshots(db: aiosqlite.Connection):
+    """Снимок игровых сессий из памяти (SESSION_SNAPSHOT) для восстановления после перезапуска"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS session_snapshots (
+            store TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (store, key)
+        )
+    """)
+
+
+async def _migrate_media_file_ids(db: aiosqlite.Connection):
+    """file_id загруженных в Telegram изображений меню по хэшу содержимого (file_id свой у каждого бота)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS media_file_ids (
+            bot_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            filename TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (bot_id, content_hash)
+        )
+    """)
+
+
+async def _migrate_roulette(db: aiosqlite.Connection):
+    """Ставки и итоги раундов рулетки мини-аппа по номеру раунда"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS roulette_bets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            round_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            sector INTEGER NOT NULL,
+            bet REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_roulette_bets_round ON roulette_bets (round_id)")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS roulette_rounds (
+            round_id INTEGER PRIMARY KEY,
+            status TEXT NOT NULL,
+            winning_sector INTEGER,
+            winner_id INTEGER,
+            pot REAL NOT NULL DEFAULT 0.0,
+            bets_count INTEGER NOT NULL DEFAULT 0,
+            settled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# Версионированные миграции схемы: (версия, описание, функция). Текущая версия хранится в PRAGMA user_version
+MIGRATIONS = (
+    (1, "колонки, добавленные после первого выпуска", _migrate_legacy_columns),
+    (2, "вторичные индексы", _migrate_secondary_indexes),
+    (3, "дневные корзины оборота", _migrate_turnover_daily),
+    (4, "кэш аватаров", _migrate_avatar_cache),
+    (5, "курсоры сканирования блокчейна", _migrate_chain_cursors),
+    (6, "фоновые рассылки", _migrate_broadcasts),
+    (7, "курсоры выгрузок", _migrate_export_cursors),
+    (8, "дневные агрегаты статистики", _migrate_daily_stats),
+    (9, "снимок игровых сессий", _migrate_session_snapshots),
+    (10, "file_id изображений меню", _migrate_media_file_ids),
+    (11, "раунды рулетки", _migrate_roulette),
+)
+
+
+async def run_migrations(db: aiosqlite.Connection) -> int:
+    """Применить миграции новее текущей версии схемы. Возвращает итоговую версию"""
+    async with db.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+    for target, description, migrate in MIGRATIONS:
+        if target <= version:
+            continue
+        await migrate(db)
+        await db.execute(f"PRAGMA user_version = {target}")
+        await db.commit()
+        version = target
+        logger.info(f"🗄 Применена миграция схемы #{target}: {description}")
+    return version
+
 
 class Database:
     def __init__(self):
         self.db_path = DATABASE_PATH
 
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool(self.db_path)
+
+    def writer(self):
+        """Соединение для записи (единственное, операции сериализуются)"""
+        return self.pool.connection(write=True)
+
+    def reader(self):
+        """Соединение только для чтения из пула"""
+        return self.pool.connection(write=False)
+
+    @property
+    def game_log(self) -> GameLogWriter:
+        return get_game_log(self.db_path)
+
+    @property
+    def leaderboard(self) -> Leaderboard:
+        return get_leaderboard(self.db_path)
+
+    async def close(self):
+        """Записать очередь журнала игр и закрыть пул соединений этой базы данных"""
+        await self.game_log.close()
+        await self.pool.close()
+
     async def init_db(self):
         """Инициализация базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Таблица пользователей
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -97,88 +779,6 @@ class Database:
                 )
             """)
             
-            # Добавляем поле level_percents если его нет (миграция)
-            try:
-                await db.execute("ALTER TABLE partners ADD COLUMN level_percents TEXT")
-            except:
-                pass  # Поле уже существует
-            
-            # Добавляем поле referral_balance если его нет (миграция)
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN referral_balance REAL DEFAULT 0.00")
-            except:
-                pass  # Поле уже существует
-            
-            # Добавляем поля для отыгрыша в users (миграция)
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN locked_balance REAL DEFAULT 0.00")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN rollover_requirement REAL DEFAULT 0.00")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN total_lost REAL DEFAULT 0.00")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN arbuzz_balance REAL DEFAULT 0.00")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN last_daily_arbuzz_date TEXT")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN first_win_today_arbuzz BOOLEAN DEFAULT 0")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN last_win_date TEXT")
-            except:
-                pass
-            
-            # Добавляем поле bet_type в games (миграция)
-            try:
-                await db.execute("ALTER TABLE games ADD COLUMN bet_type TEXT")
-            except:
-                pass  # Поле уже существует
-            
-            # Добавляем поле currency в games (миграция)
-            try:
-                await db.execute("ALTER TABLE games ADD COLUMN currency TEXT DEFAULT 'dollar'")
-            except:
-                pass  # Поле уже существует
-            
-            # Добавляем поля для отыгрыша и типа депозита в checks (миграция)
-            try:
-                await db.execute("ALTER TABLE checks ADD COLUMN rollover_multiplier REAL DEFAULT 1.0")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE checks ADD COLUMN deposit_type TEXT DEFAULT 'no_deposit'")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE checks ADD COLUMN min_deposit REAL DEFAULT 0.0")
-            except:
-                pass
-            
-            # Добавляем поля для отыгрыша и типа депозита в promo_codes (миграция)
-            try:
-                await db.execute("ALTER TABLE promo_codes ADD COLUMN rollover_multiplier REAL DEFAULT 1.0")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE promo_codes ADD COLUMN deposit_type TEXT DEFAULT 'no_deposit'")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE promo_codes ADD COLUMN min_deposit REAL DEFAULT 0.0")
-            except:
-                pass
-
             # Таблица депозитов
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS deposits (
@@ -285,28 +885,6 @@ class Database:
                 )
             """)
             
-            # Миграция: добавляем новые поля если их нет
-            try:
-                await db.execute("ALTER TABLE relay_gifts ADD COLUMN slug TEXT")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE relay_gifts ADD COLUMN gift_date INTEGER")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE relay_gifts ADD COLUMN from_user_id INTEGER")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE relay_gifts ADD COLUMN from_username TEXT")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE promo_codes ADD COLUMN activation_link TEXT")
-            except:
-                pass
-
             # Таблица активаций промокодов
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS promo_activations (
@@ -458,28 +1036,6 @@ class Database:
                 )
             """)
             
-            # Миграции для новых полей PvP (слот-турнир режим)
-            try:
-                await db.execute("ALTER TABLE pvp_duels ADD COLUMN duel_mode TEXT DEFAULT 'standard'")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE pvp_duels ADD COLUMN min_bet REAL DEFAULT 0.0")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE pvp_duels ADD COLUMN max_bet REAL DEFAULT 0.0")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE pvp_duels ADD COLUMN auto_start_players INTEGER DEFAULT 0")
-            except:
-                pass
-            try:
-                await db.execute("ALTER TABLE pvp_participants ADD COLUMN bet_amount REAL")
-            except:
-                pass
-
             # Таблица стикеров для мини-приложения
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS stickers (
@@ -494,10 +1050,15 @@ class Database:
 
             await db.commit()
 
+            # Миграции схемы (новые колонки, индексы)
+            await run_migrations(db)
+
+        # Игры, сохраненные в файл при прошлой остановке без доступа к базе
+        await self.game_log.replay_spill()
+
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Получить пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM users WHERE user_id = ?", (user_id,)
             ) as cursor:
@@ -506,7 +1067,7 @@ class Database:
 
     async def create_user(self, user_id: int, username: str, referral_code: Optional[str] = None):
         """Создать пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Проверяем, существует ли пользователь ДО обработки реферального кода
             existing_user = await self.get_user(user_id)
             is_new_user = not existing_user
@@ -515,7 +1076,6 @@ class Database:
             # Реферал засчитывается ТОЛЬКО если это новый пользователь
             if is_new_user and referral_code:
                 # Найти пользователя по реферальному коду
-                db.row_factory = aiosqlite.Row
                 async with db.execute(
                     "SELECT user_id FROM users WHERE referral_code = ?", (referral_code,)
                 ) as cursor:
@@ -546,7 +1106,7 @@ class Database:
 
     async def update_user_base_bet(self, user_id: int, base_bet: float):
         """Обновить базовую ставку пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 "UPDATE users SET base_bet = ? WHERE user_id = ?",
                 (base_bet, user_id)
@@ -555,32 +1115,156 @@ class Database:
 
     async def update_balance(self, user_id: int, amount: float):
         """Обновить баланс пользователя (положительное значение - пополнение, отрицательное - списание)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Получаем текущий баланс для логирования
-            db.row_factory = aiosqlite.Row
-            async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cursor:
+        async with self.writer() as db:
+            # Одним запросом обновляем баланс и получаем новое значение для логирования
+            async with db.execute(
+                "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
+                (amount, user_id),
+            ) as cursor:
                 row = await cursor.fetchone()
-                old_balance = row[0] if row else 0.0
-            
-            # Обновляем баланс
+            await db.commit()
+        
+        new_balance = row[0] if row else 0.0
+        old_balance = new_balance - amount if row else 0.0
+        
+        # Логируем операцию
+        operation = "ПОПОЛНЕНИЕ" if amount > 0 else "СПИСАНИЕ"
+        logger.info(
+            f"💰 {operation}: user_id={user_id}, "
+            f"сумма={amount:+.2f} USD, "
+            f"баланс: {old_balance:.2f} → {new_balance:.2f} USD"
+        )
+    
+    async def debit_balance(self, user_id: int, amount: float) -> Optional[float]:
+        """Списать средства, только если их хватает (атомарно, без гонки между проверкой и списанием)
+        
+        Returns:
+            Новый баланс или None, если средств недостаточно или пользователь не найден
+        """
+        async with self.writer() as db:
+            new_balance = await self._debit(db, user_id, amount)
+            if new_balance is None:
+                return None
+            await db.commit()
+        
+        logger.info(
+            f"💰 СПИСАНИЕ: user_id={user_id}, "
+            f"сумма={-amount:+.2f} USD, "
+            f"баланс: {new_balance + amount:.2f} → {new_balance:.2f} USD"
+        )
+        return new_balance
+    
+    async def place_bet(self, user_id: int, bet: float) -> Optional[float]:
+        """Списать ставку и уменьшить требование отыгрыша одной транзакцией
+        
+        Returns:
+            Новый баланс (с учетом разблокированных средств) или None, если средств недостаточно
+        """
+        async with self.writer() as db:
+            new_balance = await self._debit(db, user_id, bet)
+            if new_balance is None:
+                return None
+            debited_balance = new_balance
+            unlocked_balance = await self._unlock_rollover(db, user_id, bet)
+            if unlocked_balance is not None:
+                new_balance = unlocked_balance
+            await db.commit()
+        
+        logger.info(
+            f"💰 СТАВКА: user_id={user_id}, "
+            f"сумма={-bet:+.2f} USD, "
+            f"баланс: {debited_balance + bet:.2f} → {new_balance:.2f} USD"
+        )
+        return new_balance
+    
+    async def debit_withdrawal(self, user_id: int, amount: float) -> Optional[tuple]:
+        """Списать сумму вывода, только если ее хватает (до создания чека, одной транзакцией)
+        
+        Пока отыгрыш не выполнен, сумма списывается сначала из locked_balance, затем из balance;
+        иначе сначала из balance, затем из locked_balance (если отыгрыша нет).
+        
+        Returns:
+            (списано из balance, списано из locked_balance) или None, если средств недостаточно
+        """
+        async with self.writer() as db:
+            async with db.execute(
+                "SELECT balance, locked_balance, rollover_requirement FROM users WHERE user_id = ?",
+                (user_id,),
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return None
+            balance, locked_balance, rollover_requirement = row
+            if locked_balance > 0 and rollover_requirement > 0:
+                from_locked = min(amount, locked_balance)
+                from_balance = amount - from_locked
+            else:
+                from_balance = min(amount, max(balance, 0.0))
+                from_locked = amount - from_balance if rollover_requirement == 0 else 0.0
+            # Допуск на погрешность float: "вывести все" передает ровно balance + locked_balance
+            if (from_balance + from_locked < amount - 1e-9 or from_balance > balance + 1e-9
+                    or from_locked > max(locked_balance, 0.0) + 1e-9):
+                return None
             await db.execute(
-                "UPDATE users SET balance = balance + ? WHERE user_id = ?",
-                (amount, user_id),
+                "UPDATE users SET balance = balance - ?, locked_balance = locked_balance - ? WHERE user_id = ?",
+                (from_balance, from_locked, user_id),
             )
             await db.commit()
-            
-            # Получаем новый баланс для логирования
-            async with db.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)) as cursor:
-                row = await cursor.fetchone()
-                new_balance = row[0] if row else 0.0
-            
-            # Логируем операцию
-            operation = "ПОПОЛНЕНИЕ" if amount > 0 else "СПИСАНИЕ"
-            logger.info(
-                f"💰 {operation}: user_id={user_id}, "
-                f"сумма={amount:+.2f} USD, "
-                f"баланс: {old_balance:.2f} → {new_balance:.2f} USD"
+        
+        logger.info(
+            f"💰 ВЫВОД: user_id={user_id}, сумма={-amount:+.2f} USD "
+            f"(баланс {-from_balance:+.2f}, заблокированный {-from_locked:+.2f})"
+        )
+        return from_balance, from_locked
+    
+    async def refund_withdrawal(self, user_id: int, from_balance: float, from_locked: float):
+        """Вернуть сумму, списанную debit_withdrawal (чек на вывод не создан)"""
+        async with self.writer() as db:
+            await db.execute(
+                "UPDATE users SET balance = balance + ?, locked_balance = locked_balance + ? WHERE user_id = ?",
+                (from_balance, from_locked, user_id),
             )
+            await db.commit()
+        logger.info(f"💰 ВОЗВРАТ ВЫВОДА: user_id={user_id}, сумма={from_balance + from_locked:+.2f} USD")
+    
+    async def _debit(self, db: aiosqlite.Connection, user_id: int, amount: float) -> Optional[float]:
+        """Условное списание в текущей транзакции. Возвращает новый баланс или None"""
+        async with db.execute(
+            "UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ? RETURNING balance",
+            (amount, user_id, amount),
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+    
+    async def _unlock_rollover(self, db: aiosqlite.Connection, user_id: int, bet_amount: float) -> Optional[float]:
+        """Уменьшить отыгрыш и разблокировать средства одним UPDATE в текущей транзакции
+        
+        Доля разблокируемых средств равна доле выполненного требования:
+        - требование выполнено (или его нет) - весь locked_balance переходит в balance
+        - иначе переходит locked_balance * bet / rollover_requirement
+        
+        Returns:
+            Новый баланс или None, если отыгрыша и заблокированных средств нет
+        """
+        unlocked = """CASE
+                WHEN locked_balance <= 0 THEN 0.0
+                WHEN rollover_requirement <= :bet THEN locked_balance
+                ELSE locked_balance * :bet / rollover_requirement
+            END"""
+        async with db.execute(
+            f"""UPDATE users
+                SET balance = balance + {unlocked},
+                    locked_balance = locked_balance - {unlocked},
+                    rollover_requirement = CASE
+                        WHEN rollover_requirement <= 0 THEN rollover_requirement
+                        ELSE MAX(0.0, rollover_requirement - :bet)
+                    END
+                WHERE user_id = :user_id AND (rollover_requirement > 0 OR locked_balance > 0)
+                RETURNING balance""",
+            {"bet": bet_amount, "user_id": user_id},
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
     
     async def add_locked_balance(self, user_id: int, amount: float, rollover_multiplier: float):
         """Добавить заблокированный баланс с отыгрышем (deprecated, используйте add_rollover_requirement)"""
@@ -595,7 +1279,7 @@ class Database:
         - Устанавливается требование отыгрыша (rollover_requirement) - сумма, которую нужно отыграть
         - После выполнения отыгрыша, средства из locked_balance перейдут в balance
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Добавляем средства в заблокированный баланс (нельзя вывести до выполнения отыгрыша)
             await db.execute(
                 "UPDATE users SET locked_balance = locked_balance + ? WHERE user_id = ?",
@@ -618,52 +1302,9 @@ class Database:
         - При отыгрыше: rollover_requirement уменьшается
         - Когда требование полностью выполнено: средства из locked_balance переходят в balance (становятся доступными для вывода)
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            # Получаем текущее требование и балансы
-            user = await self.get_user(user_id)
-            if not user:
-                return
-            
-            current_requirement = user.get("rollover_requirement", 0.0)
-            locked_balance = user.get("locked_balance", 0.0)
-            
-            if current_requirement <= 0:
-                # Если требования нет, но есть заблокированный баланс - переводим в доступный
-                if locked_balance > 0:
-                    await db.execute(
-                        "UPDATE users SET balance = balance + ?, locked_balance = 0.0 WHERE user_id = ?",
-                        (locked_balance, user_id),
-                    )
-                    await db.commit()
-                return
-            
-            # Уменьшаем требование на сумму ставки
-            old_requirement = current_requirement
-            new_requirement = max(0.0, current_requirement - bet_amount)
-            await db.execute(
-                "UPDATE users SET rollover_requirement = ? WHERE user_id = ?",
-                (new_requirement, user_id),
-            )
-            
-            # Если требование полностью выполнено, переводим все заблокированные средства в доступный баланс
-            if new_requirement == 0.0 and locked_balance > 0:
-                await db.execute(
-                    "UPDATE users SET balance = balance + ?, locked_balance = 0.0 WHERE user_id = ?",
-                    (locked_balance, user_id),
-                )
-            elif old_requirement > 0 and locked_balance > 0:
-                # Вычисляем, какую долю требования выполнили
-                completed_fraction = (old_requirement - new_requirement) / old_requirement
-                # Переводим соответствующую долю заблокированных средств в доступный баланс
-                unlocked_amount = locked_balance * completed_fraction
-                
-                if unlocked_amount > 0:
-                    await db.execute(
-                        "UPDATE users SET balance = balance + ?, locked_balance = locked_balance - ? WHERE user_id = ?",
-                        (unlocked_amount, unlocked_amount, user_id),
-                    )
-            
-            await db.commit()
+        async with self.writer() as db:
+            if await self._unlock_rollover(db, user_id, bet_amount) is not None:
+                await db.commit()
     
     async def get_withdrawable_balance(self, user_id: int) -> float:
         """Получить сумму, которую можно вывести (обычный баланс + заблокированный, если отыгрыш выполнен)"""
@@ -689,7 +1330,7 @@ class Database:
     
     async def decrease_locked_balance(self, user_id: int, amount: float):
         """Уменьшить заблокированный баланс"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 "UPDATE users SET locked_balance = locked_balance - ? WHERE user_id = ?",
                 (amount, user_id),
@@ -703,7 +1344,7 @@ class Database:
 
     async def update_setting(self, user_id: int, setting: str, value):
         """Обновить настройку пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 f"UPDATE users SET {setting} = ? WHERE user_id = ?",
                 (value, user_id),
@@ -711,19 +1352,12 @@ class Database:
             await db.commit()
 
     async def add_game(self, user_id: int, game_type: str, bet: float, result: int, win: float, bet_type: str = None, currency: str = "dollar"):
-        """Добавить запись об игре"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                """INSERT INTO games (user_id, game_type, bet, result, win, bet_type, currency)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, game_type, bet, result, win, bet_type, currency),
-            )
-            await db.commit()
+        """Добавить запись об игре (пишется в БД фоновой пачкой, см. GameLogWriter)"""
+        await self.game_log.enqueue((user_id, game_type, bet, result, win, bet_type, currency))
 
     async def get_jackpot(self, jackpot_type: str) -> Optional[Dict]:
         """Получить информацию о джекпоте"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM jackpots WHERE jackpot_type = ? ORDER BY id DESC LIMIT 1",
                 (jackpot_type,),
@@ -733,7 +1367,7 @@ class Database:
 
     async def create_or_update_jackpot(self, jackpot_type: str, bet: float, amount: float):
         """Создать или обновить джекпот"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             jackpot = await self.get_jackpot(jackpot_type)
             if jackpot:
                 await db.execute(
@@ -752,7 +1386,7 @@ class Database:
 
     async def add_jackpot_winner(self, user_id: int, jackpot_type: str, amount: float):
         """Добавить победителя джекпота"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 """INSERT INTO jackpot_winners (user_id, jackpot_type, amount)
                    VALUES (?, ?, ?)""",
@@ -762,8 +1396,7 @@ class Database:
 
     async def get_jackpot_winners(self, jackpot_type: str, limit: int = 10) -> List[Dict]:
         """Получить список победителей джекпота"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 """SELECT jw.*, u.username 
                    FROM jackpot_winners jw
@@ -778,7 +1411,7 @@ class Database:
 
     async def create_partner(self, user_id: int, prefix: str, referral_percent: float, level_percents: str = None):
         """Создать партнера"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Проверяем, существует ли уже партнер
             partner = await self.get_partner(user_id)
             if partner:
@@ -811,8 +1444,7 @@ class Database:
 
     async def get_partner(self, user_id: int) -> Optional[Dict]:
         """Получить партнера"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM partners WHERE user_id = ?", (user_id,)
             ) as cursor:
@@ -821,7 +1453,7 @@ class Database:
 
     async def update_partner_stats(self, user_id: int, referrals: int = 0, volume: float = 0.0):
         """Обновить статистику партнера"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 """UPDATE partners 
                    SET total_referrals = total_referrals + ?,
@@ -833,8 +1465,7 @@ class Database:
 
     async def get_all_partners(self) -> List[Dict]:
         """Получить всех партнеров"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 """SELECT p.*, u.username 
                    FROM partners p
@@ -846,7 +1477,7 @@ class Database:
 
     async def delete_partner(self, user_id: int):
         """Удалить партнера"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 "DELETE FROM partners WHERE user_id = ?", (user_id,)
             )
@@ -854,7 +1485,7 @@ class Database:
 
     async def get_user_top_position(self, user_id: int) -> int:
         """Получить позицию пользователя в топе по сумме потраченных на игры денег"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             # Получаем сумму всех ставок пользователя
             async with db.execute(
                 """SELECT COALESCE(SUM(bet), 0) as total_spent 
@@ -882,8 +1513,7 @@ class Database:
 
     async def get_user_top_win(self, user_id: int) -> Optional[Dict]:
         """Получить максимальный выигрыш пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 """SELECT win, bet, game_type 
                    FROM games 
@@ -906,131 +1536,61 @@ class Database:
     async def get_top_by_turnover(self, period: str = "all", limit: int = 10) -> List[Dict]:
         """Получить топ игроков по обороту (сумма всех ставок)
         
+        Периоды считаются по календарным дням: "day" - сегодня, "week" - 7 дней,
+        "month" - 30 дней (включая сегодня), "all" - все время.
+        
         Args:
-            period: "day", "week", или "all"
+            period: "day", "week", "month" или "all"
             limit: количество игроков в топе
         
         Returns:
             Список словарей с user_id, username, turnover
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # Определяем условие для периода
-            # Используем более надежный способ фильтрации по дате
-            if period == "day":
-                # Фильтр для текущего дня (с учетом локального времени)
-                date_filter = "DATE(g.created_at, 'localtime') = DATE('now', 'localtime')"
-            elif period == "week":
-                date_filter = "g.created_at >= datetime('now', '-7 days', 'localtime')"
-            elif period == "month":
-                date_filter = "g.created_at >= datetime('now', '-30 days', 'localtime')"
-            else:  # all
-                date_filter = "1=1"
-            
-            query = f"""
-                SELECT 
-                    g.user_id,
-                    u.username,
-                    COALESCE(SUM(g.bet), 0) as turnover
-                FROM games g
-                LEFT JOIN users u ON g.user_id = u.user_id
-                WHERE {date_filter} AND (g.currency IS NULL OR g.currency != 'arbuzz')
-                GROUP BY g.user_id
-                HAVING turnover > 0
-                ORDER BY turnover DESC
-                LIMIT ?
-            """
-            
-            async with db.execute(query, (limit,)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        top = await self.leaderboard.top(period, limit)
+        if not top:
+            return []
+        
+        # Имена пользователей одним запросом
+        user_ids = [user_id for user_id, _ in top]
+        placeholders = ",".join("?" * len(user_ids))
+        async with self.reader() as db:
+            async with db.execute(
+                f"SELECT user_id, username FROM users WHERE user_id IN ({placeholders})", user_ids
+            ) as cursor:
+                usernames = {row[0]: row[1] for row in await cursor.fetchall()}
+        
+        return [
+            {"user_id": user_id, "username": usernames.get(user_id), "turnover": turnover}
+            for user_id, turnover in top
+        ]
     
     async def get_user_turnover_position(self, user_id: int, period: str = "all") -> int:
         """Получить позицию пользователя в топе по обороту
         
         Args:
             user_id: ID пользователя
-            period: "day", "week", или "all"
+            period: "day", "week", "month" или "all"
         
         Returns:
             Позиция в топе (начиная с 1)
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            # Определяем условие для периода
-            if period == "day":
-                date_filter = "DATE(created_at, 'localtime') = DATE('now', 'localtime')"
-            elif period == "week":
-                date_filter = "created_at >= datetime('now', '-7 days', 'localtime')"
-            elif period == "month":
-                date_filter = "created_at >= datetime('now', '-30 days', 'localtime')"
-            else:  # all
-                date_filter = "1=1"
-            
-            # Получаем оборот пользователя (исключая арбуз коины)
-            async with db.execute(
-                f"""
-                SELECT COALESCE(SUM(bet), 0) as turnover
-                FROM games
-                WHERE user_id = ? AND {date_filter} AND (currency IS NULL OR currency != 'arbuzz')
-                """,
-                (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                user_turnover = row[0] if row else 0
-            
-            # Считаем сколько пользователей имеют больший оборот (исключая арбуз коины)
-            async with db.execute(
-                f"""
-                SELECT COUNT(*) + 1 as position
-                FROM (
-                    SELECT user_id, SUM(bet) as turnover
-                    FROM games
-                    WHERE user_id != ? AND {date_filter} AND (currency IS NULL OR currency != 'arbuzz')
-                    GROUP BY user_id
-                    HAVING SUM(bet) > ?
-                )
-                """,
-                (user_id, user_turnover)
-            ) as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row else 1
+        return await self.leaderboard.position(user_id, period)
     
     async def get_user_turnover(self, user_id: int, period: str = "all") -> float:
         """Получить оборот пользователя (сумма всех ставок)
         
         Args:
             user_id: ID пользователя
-            period: "day", "week", или "all"
+            period: "day", "week", "month" или "all"
         
         Returns:
             Оборот пользователя
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            # Определяем условие для периода
-            if period == "day":
-                date_filter = "DATE(created_at, 'localtime') = DATE('now', 'localtime')"
-            elif period == "week":
-                date_filter = "created_at >= datetime('now', '-7 days', 'localtime')"
-            elif period == "month":
-                date_filter = "created_at >= datetime('now', '-30 days', 'localtime')"
-            else:  # all
-                date_filter = "1=1"
-            
-            async with db.execute(
-                f"""
-                SELECT COALESCE(SUM(bet), 0) as turnover
-                FROM games
-                WHERE user_id = ? AND {date_filter} AND (currency IS NULL OR currency != 'arbuzz')
-                """,
-                (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row else 0.0
+        return await self.leaderboard.turnover(user_id, period)
 
     async def get_user_favorite_game(self, user_id: int) -> Optional[str]:
         """Получить любимую игру пользователя (самая часто играемая)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 """SELECT game_type, COUNT(*) as count 
                    FROM games 
@@ -1057,17 +1617,18 @@ class Database:
 
     async def add_deposit(self, user_id: int, amount: float, method: str):
         """Добавить запись о депозите"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 """INSERT INTO deposits (user_id, amount, method)
                    VALUES (?, ?, ?)""",
                 (user_id, amount, method),
             )
+            await record_deposit(db, amount)
             await db.commit()
 
     async def add_deposit_with_status(self, user_id: int, amount: float, method: str, status: str = "pending") -> int:
         """Добавить запись о депозите с произвольным статусом. Возвращает ID депозита."""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Обновление схемы: создаем таблицу для защиты от дублей по tx_hash
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS chain_payments (
@@ -1082,12 +1643,13 @@ class Database:
                    VALUES (?, ?, ?, ?)""",
                 (user_id, amount, method, status),
             )
+            await record_deposit(db, amount)
             await db.commit()
             return cursor.lastrowid
 
     async def is_chain_payment_new(self, tx_hash: str) -> bool:
         """Проверить, что tx_hash еще не зафиксирован"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT 1 FROM chain_payments WHERE tx_hash = ?",
                 (tx_hash,)
@@ -1097,26 +1659,101 @@ class Database:
 
     async def save_chain_payment(self, tx_hash: str, user_id: int, amount: float):
         """Зафиксировать tx_hash, чтобы не было дублей"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 "INSERT OR IGNORE INTO chain_payments (tx_hash, user_id, amount) VALUES (?, ?, ?)",
                 (tx_hash, user_id, amount)
             )
             await db.commit()
 
+    async def get_known_chain_payments(self, tx_hashes: List[str]) -> set:
+        """Вернуть множество tx_hash из списка, которые уже зафиксированы (одним запросом)"""
+        if not tx_hashes:
+            return set()
+        placeholders = ",".join("?" * len(tx_hashes))
+        async with self.reader() as db:
+            async with db.execute(
+                f"SELECT tx_hash FROM chain_payments WHERE tx_hash IN ({placeholders})",
+                list(tx_hashes)
+            ) as cursor:
+                return {row[0] for row in await cursor.fetchall()}
+
+    async def get_chain_cursor(self, address: str) -> Optional[tuple]:
+        """Получить курсор сканирования адреса: (last_lt, last_hash) или None"""
+        async with self.reader() as db:
+            async with db.execute(
+                "SELECT last_lt, last_hash FROM chain_cursors WHERE address = ?",
+                (address,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return (row[0], row[1]) if row else None
+
+    async def credit_chain_payments(self, payments: List[tuple], method: str,
+                                    address: str, cursor: Optional[tuple] = None) -> List[Dict]:
+        """Зачислить пачку платежей из блокчейна и сдвинуть курсор одной транзакцией
+        
+        Args:
+            payments: список (tx_hash, user_id, amount)
+            method: метод депозита для таблицы deposits
+            address: адрес, курсор которого сдвигается
+            cursor: (last_lt, last_hash) самой новой просмотренной транзакции
+        
+        Returns:
+            Зачисленные платежи: tx_hash, user_id, amount, balance (None - пользователь не найден)
+        """
+        credited = []
+        async with self.writer() as db:
+            for tx_hash, user_id, amount in payments:
+                # tx_hash фиксируется первым: повторная обработка транзакции ничего не начислит
+                async with db.execute(
+                    """INSERT INTO chain_payments (tx_hash, user_id, amount) VALUES (?, ?, ?)
+                       ON CONFLICT(tx_hash) DO NOTHING RETURNING tx_hash""",
+                    (tx_hash, user_id, amount)
+                ) as cur:
+                    if await cur.fetchone() is None:
+                        continue
+                async with db.execute(
+                    "UPDATE users SET balance = balance + ? WHERE user_id = ? RETURNING balance",
+                    (amount, user_id)
+                ) as cur:
+                    row = await cur.fetchone()
+                if row is not None:
+                    await db.execute(
+                        "INSERT INTO deposits (user_id, amount, method) VALUES (?, ?, ?)",
+                        (user_id, amount, method)
+                    )
+                    await record_deposit(db, amount)
+                credited.append({
+                    "tx_hash": tx_hash,
+                    "user_id": user_id,
+                    "amount": amount,
+                    "balance": row[0] if row else None,
+                })
+            if cursor is not None:
+                await db.execute(
+                    """INSERT INTO chain_cursors (address, last_lt, last_hash, updated_at)
+                       VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                       ON CONFLICT(address) DO UPDATE SET last_lt = excluded.last_lt,
+                           last_hash = excluded.last_hash, updated_at = excluded.updated_at""",
+                    (address, cursor[0], cursor[1])
+                )
+            await db.commit()
+        return credited
+
     async def add_withdrawal(self, user_id: int, amount: float, method: str, gift_emoji: str = None, gift_name: str = None):
         """Добавить запись о выводе"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 """INSERT INTO withdrawals (user_id, amount, method, gift_emoji, gift_name)
                    VALUES (?, ?, ?, ?, ?)""",
                 (user_id, amount, method, gift_emoji, gift_name),
             )
+            await record_withdrawal(db, amount)
             await db.commit()
 
     async def get_user_total_deposits(self, user_id: int) -> float:
         """Получить общую сумму депозитов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT COALESCE(SUM(amount), 0) as total FROM deposits WHERE user_id = ?",
                 (user_id,)
@@ -1126,7 +1763,7 @@ class Database:
 
     async def get_user_total_withdrawals(self, user_id: int) -> float:
         """Получить общую сумму выводов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT COALESCE(SUM(amount), 0) as total FROM withdrawals WHERE user_id = ?",
                 (user_id,)
@@ -1136,8 +1773,7 @@ class Database:
 
     async def get_deposit_by_id(self, deposit_id: int) -> Optional[Dict]:
         """Получить депозит по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM deposits WHERE id = ?",
                 (deposit_id,)
@@ -1147,15 +1783,144 @@ class Database:
                     return dict(row)
                 return None
 
-    async def get_user_total_turnover(self, user_id: int) -> float:
-        """Получить общий оборот пользователя (сумма всех ставок, исключая арбуз коины)"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def get_cached_avatars(self, updated_since: float, limit: int) -> List[tuple]:
+        """Получить свежие записи кэша аватаров: (user_id, file_path, updated_at)"""
+        async with self.reader() as db:
             async with db.execute(
-                "SELECT COALESCE(SUM(bet), 0) as total FROM games WHERE user_id = ? AND (currency IS NULL OR currency != 'arbuzz')",
-                (user_id,)
+                """SELECT user_id, file_path, updated_at FROM avatar_cache
+                   WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT ?""",
+                (updated_since, limit)
             ) as cursor:
-                row = await cursor.fetchone()
-                return row[0] if row else 0.0
+                return [tuple(row) for row in await cursor.fetchall()]
+
+    async def save_cached_avatars(self, rows: List[tuple]):
+        """Сохранить записи кэша аватаров (user_id, file_path, updated_at) одной транзакцией"""
+        async with self.writer() as db:
+            await db.executemany(
+                """INSERT INTO avatar_cache (user_id, file_path, updated_at) VALUES (?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET file_path = excluded.file_path, updated_at = excluded.updated_at""",
+                rows
+            )
+            await db.commit()
+
+    async def get_media_file_ids(self, bot_id: int) -> Dict[str, str]:
+        """file_id загруженных изображений бота: хэш содержимого -> file_id"""
+        async with self.reader() as db:
+            async with db.execute(
+                "SELECT content_hash, file_id FROM media_file_ids WHERE bot_id = ?", (bot_id,)
+            ) as cursor:
+                return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    async def save_media_file_id(self, bot_id: int, content_hash: str, file_id: str, filename: str):
+        """Запомнить file_id изображения по хэшу содержимого"""
+        async with self.writer() as db:
+            await db.execute(
+                """INSERT INTO media_file_ids (bot_id, content_hash, file_id, filename, updated_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(bot_id, content_hash) DO UPDATE SET file_id = excluded.file_id,
+                       filename = excluded.filename, updated_at = excluded.updated_at""",
+                (bot_id, content_hash, file_id, filename, time.time())
+            )
+            await db.commit()
+
+    async def delete_media_file_id(self, bot_id: int, content_hash: str):
+        """Забыть file_id изображения (Telegram его больше не принимает)"""
+        async with self.writer() as db:
+            await db.execute(
+                "DELETE FROM media_file_ids WHERE bot_id = ? AND content_hash = ?", (bot_id, content_hash)
+            )
+            await db.commit()
+
+    async def get_last_roulette_round(self) -> int:
+        """Номер последнего раунда рулетки, для которого есть ставки или итог (0 - раундов не было)"""
+        async with self.reader() as db:
+            async with db.execute("""
+                SELECT MAX(COALESCE((SELECT MAX(round_id) FROM roulette_rounds), 0),
+                           COALESCE((SELECT MAX(round_id) FROM roulette_bets), 0))
+            """) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def save_roulette_bets(self, rows: List[tuple]):
+        """Записать ставки рулетки (round_id, user_id, sector, bet) одной транзакцией"""
+        async with self.writer() as db:
+            await db.executemany(
+                "INSERT INTO roulette_bets (round_id, user_id, sector, bet) VALUES (?, ?, ?, ?)", rows
+            )
+            await db.commit()
+
+    async def settle_roulette_round(self, round_id: int, bets: List[tuple], winning_sector: int,
+                                    winner_id: int, pot: float, bets_count: int):
+        """Итог раунда рулетки одной транзакцией: еще не записанные ставки раунда,
+        строка roulette_rounds и зачисление банка победителю"""
+        async with self.writer() as db:
+            await db.executemany(
+                "INSERT INTO roulette_bets (round_id, user_id, sector, bet) VALUES (?, ?, ?, ?)", bets
+            )
+            await db.execute(
+                """INSERT INTO roulette_rounds (round_id, status, winning_sector, winner_id, pot, bets_count)
+                   VALUES (?, 'settled', ?, ?, ?, ?)""",
+                (round_id, winning_sector, winner_id, pot, bets_count)
+            )
+            await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (pot, winner_id))
+            await db.commit()
+
+    async def refund_unsettled_roulette_rounds(self) -> List[tuple]:
+        """Вернуть ставки раундов рулетки без итога (прерваны перезапуском)
+
+        Returns:
+            Возвраты (round_id, user_id, сумма)
+        """
+        async with self.writer() as db:
+            refunds = await self._refund_roulette_rounds(db)
+            await db.commit()
+            return refunds
+
+    async def refund_roulette_round(self, round_id: int, bets: List[tuple]) -> List[tuple]:
+        """Отменить раунд рулетки, итог которого не удалось записать: еще не записанные
+        ставки раунда и возврат всех его ставок одной транзакцией
+
+        Returns:
+            Возвраты (round_id, user_id, сумма)
+        """
+        async with self.writer() as db:
+            await db.executemany(
+                "INSERT INTO roulette_bets (round_id, user_id, sector, bet) VALUES (?, ?, ?, ?)", bets
+            )
+            refunds = await self._refund_roulette_rounds(db, round_id)
+            await db.commit()
+            return refunds
+
+    async def _refund_roulette_rounds(self, db: aiosqlite.Connection,
+                                      round_id: Optional[int] = None) -> List[tuple]:
+        """Вернуть ставки раундов без итога (или только раунда round_id) в текущей транзакции"""
+        query = """
+            SELECT round_id, user_id, SUM(bet) FROM roulette_bets
+            WHERE round_id NOT IN (SELECT round_id FROM roulette_rounds)
+        """
+        params: tuple = ()
+        if round_id is not None:
+            query += " AND round_id = ?"
+            params = (round_id,)
+        async with db.execute(query + " GROUP BY round_id, user_id", params) as cursor:
+            refunds = [tuple(row) for row in await cursor.fetchall()]
+        if not refunds:
+            return []
+        await db.executemany(
+            "UPDATE users SET balance = balance + ? WHERE user_id = ?",
+            [(amount, user_id) for _round_id, user_id, amount in refunds]
+        )
+        rounds = {}
+        for refund_round_id, _user_id, amount in refunds:
+            rounds[refund_round_id] = rounds.get(refund_round_id, 0.0) + amount
+        await db.executemany(
+            "INSERT INTO roulette_rounds (round_id, status, pot) VALUES (?, 'refunded', ?)",
+            list(rounds.items())
+        )
+        return refunds
+
+    async def get_user_total_turnover(self, user_id: int) -> float:
+        """Получить общий оборот пользователя (сумма всех ставок, исключая арбуз коины)"""
+        return await self.leaderboard.turnover(user_id, "all")
 
     async def create_check(self, creator_id: int, check_code: str, total_activations: int, 
                           amount_per_activation: float, requires_captcha: bool, 
@@ -1164,7 +1929,7 @@ class Database:
                           button_url: Optional[str] = None, rollover_multiplier: float = 1.0,
                           deposit_type: str = 'no_deposit', min_deposit: float = 0.0) -> int:
         """Создать чек"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             cursor = await db.execute(
                 """INSERT INTO checks (check_code, creator_id, total_activations, remaining_activations,
                    amount_per_activation, requires_captcha, captcha_result, image_url, text, button_text, button_url,
@@ -1179,49 +1944,91 @@ class Database:
 
     async def get_check(self, check_code: str) -> Optional[Dict]:
         """Получить чек по коду"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM checks WHERE check_code = ?", (check_code,)
             ) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
-    async def activate_check(self, check_id: int, user_id: int) -> bool:
-        """Активировать чек для пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем, не активировал ли уже этот пользователь
-            async with db.execute(
-                "SELECT 1 FROM check_activations WHERE check_id = ? AND user_id = ?",
-                (check_id, user_id)
-            ) as cursor:
-                if await cursor.fetchone():
-                    return False  # Уже активировал
-            
-            # Проверяем, есть ли еще активации
-            check = await self.get_check_by_id(check_id)
-            if not check or check["remaining_activations"] <= 0:
-                return False
-            
-            # Добавляем активацию
-            await db.execute(
-                "INSERT INTO check_activations (check_id, user_id) VALUES (?, ?)",
-                (check_id, user_id)
-            )
-            
-            # Уменьшаем количество оставшихся активаций
-            await db.execute(
-                "UPDATE checks SET remaining_activations = remaining_activations - 1 WHERE id = ?",
-                (check_id,)
+    async def activate_check(self, check_id: int, user_id: int) -> Optional[Dict]:
+        """Активировать чек и зачислить сумму одной транзакцией
+
+        Returns:
+            Итог активации (см. _activate) или None, если пользователь уже активировал
+            чек, активации закончились или пользователь не найден
+        """
+        async with self.writer() as db:
+            activation = await self._activate(
+                db, user_id,
+                "INSERT INTO check_activations (check_id, user_id) VALUES (?, ?) "
+                "ON CONFLICT (check_id, user_id) DO NOTHING RETURNING id",
+                """UPDATE checks SET remaining_activations = remaining_activations - 1
+                   WHERE id = ? AND remaining_activations > 0
+                   RETURNING amount_per_activation, rollover_multiplier, remaining_activations, total_activations""",
+                check_id,
             )
-            
+            if activation is None:
+                return None
             await db.commit()
-            return True
+
+        logger.info(
+            f"🎫 ЧЕК #{check_id}: user_id={user_id}, сумма=+{activation['amount']:.2f} USD, "
+            f"осталось активаций {activation['remaining_activations']}/{activation['total_activations']}"
+        )
+        return activation
+
+    async def _activate(self, db: aiosqlite.Connection, user_id: int, insert_sql: str,
+                        claim_sql: str, code_id: int) -> Optional[Dict]:
+        """Активация чека или промокода в текущей транзакции
+
+        Запись активации вставляется с ON CONFLICT DO NOTHING (повторная активация
+        ничего не вставляет), счетчик уменьшается условным UPDATE ... WHERE
+        remaining_activations > 0 RETURNING, поэтому не уходит в минус при любом
+        числе одновременных активаций. Сумма зачисляется в той же транзакции: с
+        отыгрышем - в locked_balance, без него - в balance. При None транзакция не
+        фиксируется.
+
+        Returns:
+            {amount, rollover_multiplier, remaining_activations, total_activations,
+             balance, locked_balance, rollover_requirement} или None
+        """
+        async with db.execute(insert_sql, (code_id, user_id)) as cursor:
+            if await cursor.fetchone() is None:
+                return None  # Уже активировал
+        async with db.execute(claim_sql, (code_id,)) as cursor:
+            claimed = await cursor.fetchone()
+        if claimed is None:
+            return None  # Активации закончились (или код удален)
+        amount, rollover_multiplier, remaining, total = claimed
+        rollover_multiplier = rollover_multiplier or 1.0
+        if rollover_multiplier > 1.0:
+            # Средства с отыгрышем нельзя вывести до выполнения требования
+            credit_sql = """UPDATE users
+                SET locked_balance = locked_balance + ?, rollover_requirement = rollover_requirement + ?
+                WHERE user_id = ? RETURNING balance, locked_balance, rollover_requirement"""
+            params = (amount, amount * rollover_multiplier, user_id)
+        else:
+            credit_sql = """UPDATE users SET balance = balance + ?
+                WHERE user_id = ? RETURNING balance, locked_balance, rollover_requirement"""
+            params = (amount, user_id)
+        async with db.execute(credit_sql, params) as cursor:
+            credited = await cursor.fetchone()
+        if credited is None:
+            return None  # Пользователь не найден
+        return {
+            "amount": amount,
+            "rollover_multiplier": rollover_multiplier,
+            "remaining_activations": remaining,
+            "total_activations": total,
+            "balance": credited[0],
+            "locked_balance": credited[1],
+            "rollover_requirement": credited[2],
+        }
 
     async def get_check_by_id(self, check_id: int) -> Optional[Dict]:
         """Получить чек по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM checks WHERE id = ?", (check_id,)
             ) as cursor:
@@ -1230,7 +2037,7 @@ class Database:
 
     async def has_user_activated_check(self, check_id: int, user_id: int) -> bool:
         """Проверить, активировал ли пользователь чек"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT 1 FROM check_activations WHERE check_id = ? AND user_id = ?",
                 (check_id, user_id)
@@ -1239,8 +2046,7 @@ class Database:
 
     async def get_checks_by_creator(self, creator_id: int, limit: int = 5) -> List[Dict]:
         """Получить список чеков пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 """SELECT * FROM checks
                    WHERE creator_id = ?
@@ -1253,8 +2059,7 @@ class Database:
 
     async def delete_check(self, check_code: str, creator_id: int) -> bool:
         """Удалить чек вместе с активациями"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.writer() as db:
             async with db.execute(
                 "SELECT * FROM checks WHERE check_code = ? AND creator_id = ?",
                 (check_code, creator_id),
@@ -1277,8 +2082,7 @@ class Database:
     async def search_users(self, query: str, limit: int = 5) -> List[Dict]:
         """Поиск пользователей по username или ID"""
         normalized = f"%{query.lower()}%"
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 """SELECT * FROM users
                    WHERE LOWER(COALESCE(username, '')) LIKE ?
@@ -1292,8 +2096,7 @@ class Database:
 
     async def get_referral_count(self, user_id: int) -> int:
         """Получить количество рефералов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT COUNT(*) as count FROM users WHERE referred_by = ?",
                 (user_id,),
@@ -1312,8 +2115,7 @@ class Database:
         Returns:
             dict с информацией о начисленном бонусе или None
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.writer() as db:
             # Получаем информацию о игроке
             user = await self.get_user(user_id)
             if not user or not user.get("referred_by"):
@@ -1390,7 +2192,7 @@ class Database:
                                 rollover_multiplier: float = 1.0, deposit_type: str = 'no_deposit',
                                 min_deposit: float = 0.0) -> int:
         """Создать промокод"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             cursor = await db.execute(
                 """INSERT INTO promo_codes (code, amount, total_activations, remaining_activations,
                    requires_channel_subscription, channel_username, created_by, activation_link,
@@ -1404,49 +2206,49 @@ class Database:
 
     async def get_promo_code(self, code: str) -> Optional[Dict]:
         """Получить промокод по коду"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM promo_codes WHERE code = ?", (code,)
             ) as cursor:
                 row = await cursor.fetchone()
                 return dict(row) if row else None
 
-    async def activate_promo_code(self, promo_id: int, user_id: int) -> bool:
-        """Активировать промокод для пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем, не активировал ли уже этот пользователь
-            async with db.execute(
-                "SELECT 1 FROM promo_activations WHERE promo_id = ? AND user_id = ?",
-                (promo_id, user_id)
-            ) as cursor:
-                if await cursor.fetchone():
-                    return False  # Уже активировал
-            
-            # Проверяем, есть ли еще активации
-            promo = await self.get_promo_code_by_id(promo_id)
-            if not promo or promo["remaining_activations"] <= 0:
-                return False
-            
-            # Добавляем активацию
-            await db.execute(
-                "INSERT INTO promo_activations (promo_id, user_id) VALUES (?, ?)",
-                (promo_id, user_id)
+    async def activate_promo_code(self, promo_id: int, user_id: int) -> Optional[Dict]:
+        """Активировать промокод, зачислить сумму и записать депозит одной транзакцией
+
+        Returns:
+            Итог активации (см. _activate) или None, если пользователь уже активировал
+            промокод, активации закончились или пользователь не найден
+        """
+        async with self.writer() as db:
+            activation = await self._activate(
+                db, user_id,
+                "INSERT INTO promo_activations (promo_id, user_id) VALUES (?, ?) "
+                "ON CONFLICT (promo_id, user_id) DO NOTHING RETURNING id",
+                """UPDATE promo_codes SET remaining_activations = remaining_activations - 1
+                   WHERE id = ? AND remaining_activations > 0
+                   RETURNING amount, rollover_multiplier, remaining_activations, total_activations""",
+                promo_id,
             )
-            
-            # Уменьшаем количество оставшихся активаций
+            if activation is None:
+                return None
+            # Промокод учитывается как депозит для статистики
             await db.execute(
-                "UPDATE promo_codes SET remaining_activations = remaining_activations - 1 WHERE id = ?",
-                (promo_id,)
+                "INSERT INTO deposits (user_id, amount, method) VALUES (?, ?, 'promo_code')",
+                (user_id, activation["amount"]),
             )
-            
+            await record_deposit(db, activation["amount"])
             await db.commit()
-            return True
+
+        logger.info(
+            f"🎟️ ПРОМОКОД #{promo_id}: user_id={user_id}, сумма=+{activation['amount']:.2f} USD, "
+            f"осталось активаций {activation['remaining_activations']}/{activation['total_activations']}"
+        )
+        return activation
 
     async def get_promo_code_by_id(self, promo_id: int) -> Optional[Dict]:
         """Получить промокод по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM promo_codes WHERE id = ?", (promo_id,)
             ) as cursor:
@@ -1455,7 +2257,7 @@ class Database:
 
     async def has_user_activated_promo(self, promo_id: int, user_id: int) -> bool:
         """Проверить, активировал ли пользователь промокод"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT 1 FROM promo_activations WHERE promo_id = ? AND user_id = ?",
                 (promo_id, user_id)
@@ -1464,8 +2266,7 @@ class Database:
 
     async def get_all_promo_codes(self) -> List[Dict]:
         """Получить все промокоды"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 """SELECT * FROM promo_codes
                    ORDER BY created_at DESC"""
@@ -1475,7 +2276,7 @@ class Database:
 
     async def delete_promo_code(self, promo_id: int) -> bool:
         """Удалить промокод"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute("DELETE FROM promo_codes WHERE id = ?", (promo_id,))
             await db.commit()
             return True
@@ -1484,7 +2285,7 @@ class Database:
                                 total_activations: int = None, requires_channel_subscription: bool = None,
                                 channel_username: str = None) -> bool:
         """Обновить промокод"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             updates = []
             params = []
             
@@ -1495,15 +2296,11 @@ class Database:
                 updates.append("amount = ?")
                 params.append(amount)
             if total_activations is not None:
+                # Остаток пересчитывается в том же UPDATE: уже использованные активации сохраняются
+                updates.append("remaining_activations = MAX(0, ? - (total_activations - remaining_activations))")
+                params.append(total_activations)
                 updates.append("total_activations = ?")
                 params.append(total_activations)
-                # Также обновляем remaining_activations если нужно
-                promo = await self.get_promo_code_by_id(promo_id)
-                if promo:
-                    used = promo['total_activations'] - promo['remaining_activations']
-                    new_remaining = max(0, total_activations - used)
-                    updates.append("remaining_activations = ?")
-                    params.append(new_remaining)
             if requires_channel_subscription is not None:
                 updates.append("requires_channel_subscription = ?")
                 params.append(1 if requires_channel_subscription else 0)
@@ -1522,48 +2319,152 @@ class Database:
 
     async def get_all_users(self) -> List[Dict]:
         """Получить всех пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM users ORDER BY created_at DESC"
             ) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
-    async def get_all_deposits(self) -> List[Dict]:
-        """Получить все депозиты"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_broadcast_recipients(self, after_user_id: int, limit: int) -> List[int]:
+        """Следующая порция получателей рассылки (keyset-пагинация по user_id, без заблокировавших бота)"""
+        async with self.reader() as db:
             async with db.execute(
-                "SELECT * FROM deposits ORDER BY created_at DESC"
+                """SELECT user_id FROM users
+                   WHERE user_id > ? AND user_id != 0 AND COALESCE(blocked_bot, 0) = 0
+                   ORDER BY user_id LIMIT ?""",
+                (after_user_id, limit)
             ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                return [row[0] for row in await cursor.fetchall()]
 
-    async def get_all_withdrawals(self) -> List[Dict]:
-        """Получить все выводы"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def count_broadcast_recipients(self) -> int:
+        """Количество пользователей, которым можно отправить рассылку"""
+        async with self.reader() as db:
             async with db.execute(
-                "SELECT * FROM withdrawals ORDER BY created_at DESC"
+                "SELECT COUNT(*) FROM users WHERE user_id != 0 AND COALESCE(blocked_bot, 0) = 0"
             ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                return (await cursor.fetchone())[0]
 
-    async def get_all_games(self) -> List[Dict]:
-        """Получить все игры"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM games ORDER BY created_at DESC"
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+    async def set_user_blocked_bot(self, user_id: int, blocked: bool):
+        """Отметить, что пользователь заблокировал бота (или снова доступен)"""
+        async with self.writer() as db:
+            await db.execute(
+                "UPDATE users SET blocked_bot = ? WHERE user_id = ? AND COALESCE(blocked_bot, 0) != ?",
+                (int(blocked), user_id, int(blocked))
+            )
+            await db.commit()
+
+    async def create_broadcast(self, kind: str, payload: str, total: int,
+                               admin_chat_id: Optional[int] = None) -> int:
+        """Создать запись рассылки. Возвращает ID"""
+        async with self.writer() as db:
+            cursor = await db.execute(
+                "INSERT INTO broadcasts (kind, payload, total, admin_chat_id) VALUES (?, ?, ?, ?)",
+                (kind, payload, total, admin_chat_id)
+            )
+            await db.commit()
+            return cursor.lastrowid
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[Dict]:
+        """Получить рассылку по ID"""
+        async with self.reader() as db:
+            async with db.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def get_running_broadcasts(self) -> List[Dict]:
+        """Незавершенные рассылки (для продолжения после перезапуска)"""
+        async with self.reader() as db:
+            async with db.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id") as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def save_broadcast_progress(self, broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                                      blocked: int, blocked_user_ids: List[int]):
+        """Сохранить прогресс рассылки и отметить заблокировавших бота одной транзакцией"""
+        async with self.writer() as db:
+            if blocked_user_ids:
+                await db.executemany(
+                    "UPDATE users SET blocked_bot = 1 WHERE user_id = ?",
+                    [(user_id,) for user_id in blocked_user_ids]
+                )
+            await db.execute(
+                """UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ?
+                   WHERE id = ?""",
+                (last_user_id, sent, failed, blocked, broadcast_id)
+            )
+            await db.commit()
+
+    async def set_broadcast_progress_message(self, broadcast_id: int, message_id: int):
+        async with self.writer() as db:
+            await db.execute(
+                "UPDATE broadcasts SET progress_message_id = ? WHERE id = ?",
+                (message_id, broadcast_id)
+            )
+            await db.commit()
+
+    async def finish_broadcast(self, broadcast_id: int, status: str = "completed"):
+        """Завершить рассылку (completed / cancelled)"""
+        async with self.writer() as db:
+            await db.execute(
+                "UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (status, broadcast_id)
+            )
+            await db.commit()
+
+    async def iter_rows(self, query: str, params: tuple = (), batch_size: int = 1000) -> AsyncIterator[List[tuple]]:
+        """Потоково читать результат запроса пачками по batch_size строк
+
+        Соединение чтения удерживается, пока генератор не исчерпан или не закрыт,
+        строки в память целиком не загружаются.
+        """
+        async with self.reader() as db:
+            async with db.execute(query, params) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield [tuple(row) for row in rows]
+
+    async def get_export_cursor(self, kind: str) -> int:
+        """Последний выгруженный ID для типа выгрузки (0 - выгрузок еще не было)"""
+        async with self.reader() as db:
+            async with db.execute("SELECT last_id FROM export_cursors WHERE kind = ?", (kind,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else 0
+
+    async def save_export_cursor(self, kind: str, last_id: int):
+        """Запомнить последний выгруженный ID (курсор только растет)"""
+        async with self.writer() as db:
+            await db.execute(
+                """INSERT INTO export_cursors (kind, last_id) VALUES (?, ?)
+                   ON CONFLICT(kind) DO UPDATE SET last_id = MAX(last_id, excluded.last_id),
+                                                   exported_at = CURRENT_TIMESTAMP""",
+                (kind, last_id)
+            )
+            await db.commit()
+
+    async def save_session_snapshot(self, rows: List[tuple]):
+        """Заменить снимок игровых сессий: (хранилище, ключ, значение, истекает) одной транзакцией"""
+        async with self.writer() as db:
+            await db.execute("DELETE FROM session_snapshots")
+            await db.executemany(
+                "INSERT INTO session_snapshots (store, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            await db.commit()
+
+    async def pop_session_snapshot(self) -> List[tuple]:
+        """Прочитать и удалить снимок игровых сессий"""
+        async with self.writer() as db:
+            async with db.execute("SELECT store, key, value, expires_at FROM session_snapshots") as cursor:
+                rows = [tuple(row) for row in await cursor.fetchall()]
+            await db.execute("DELETE FROM session_snapshots")
+            await db.commit()
+            return rows
 
     async def get_deposits_by_date_range(self, start_date, end_date) -> List[Dict]:
         """Получить депозиты за период"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM deposits WHERE created_at >= ? AND created_at <= ? ORDER BY created_at ASC",
                 (start_date.isoformat(), end_date.isoformat())
@@ -1573,8 +2474,7 @@ class Database:
 
     async def get_withdrawals_by_date_range(self, start_date, end_date) -> List[Dict]:
         """Получить выводы за период"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM withdrawals WHERE created_at >= ? AND created_at <= ? ORDER BY created_at ASC",
                 (start_date.isoformat(), end_date.isoformat())
@@ -1582,16 +2482,100 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
+    async def get_daily_amounts(self, table: str, days: int) -> List[tuple]:
+        """Суммы по дням за последние days дней: [(YYYY-MM-DD, сумма)] для deposits / withdrawals"""
+        if table not in ("deposits", "withdrawals"):
+            raise ValueError(f"Неизвестная таблица: {table}")
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        async with self.reader() as db:
+            async with db.execute(
+                f"""SELECT day, SUM({table}) FROM daily_stats
+                    WHERE day >= ? AND {table}_count > 0
+                    GROUP BY day ORDER BY day""",
+                (since,)
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+
+    async def get_daily_registrations(self, days: int) -> List[tuple]:
+        """Регистрации по дням за последние days дней: [(YYYY-MM-DD, количество)]"""
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        async with self.reader() as db:
+            async with db.execute(
+                """SELECT DATE(created_at, 'localtime') AS day, COUNT(*) FROM users
+                   WHERE created_at >= DATE(?, '-1 day')
+                   GROUP BY day HAVING day >= ? ORDER BY day""",
+                (since, since)
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+
+    async def get_game_type_counts(self) -> List[tuple]:
+        """Количество игр по типам: [(game_type, количество)] по убыванию"""
+        async with self.reader() as db:
+            async with db.execute(
+                """SELECT game_type, SUM(games) AS total FROM game_type_daily
+                   GROUP BY game_type ORDER BY total DESC"""
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+
+    async def get_overview_totals(self) -> Dict:
+        """Итоги для обзорного графика одним запросом"""
+        async with self.reader() as db:
+            async with db.execute(
+                """SELECT COALESCE(SUM(deposits), 0) AS total_deposits,
+                          COALESCE(SUM(withdrawals), 0) AS total_withdrawals,
+                          (SELECT COUNT(*) FROM users) AS total_users,
+                          COALESCE(SUM(games), 0) AS total_games
+                   FROM daily_stats"""
+            ) as cursor:
+                return dict(await cursor.fetchone())
+
+    async def get_games_summary(self, day: Optional[str] = None) -> Dict:
+        """Игры, оборот (без арбузз коинов) и выигрыши за день YYYY-MM-DD или за все время"""
+        async with self.reader() as db:
+            async with db.execute(
+                f"""SELECT COALESCE(SUM(games), 0) AS games,
+                           COALESCE(SUM(CASE WHEN currency != 'arbuzz' THEN bets ELSE 0 END), 0) AS turnover,
+                           COALESCE(SUM(wins), 0) AS wins
+                    FROM daily_stats {"WHERE day = ?" if day else ""}""",
+                (day,) if day else ()
+            ) as cursor:
+                return dict(await cursor.fetchone())
+
+    async def count_new_users(self, day: str) -> int:
+        """Количество пользователей, зарегистрированных в день YYYY-MM-DD (по местному времени)"""
+        async with self.reader() as db:
+            # created_at в UTC: диапазон с запасом в сутки идет по индексу, день - по местному времени
+            async with db.execute(
+                """SELECT COUNT(*) FROM users
+                   WHERE created_at >= DATE(?, '-1 day') AND created_at < DATE(?, '+2 days')
+                   AND DATE(created_at, 'localtime') = ?""",
+                (day, day, day)
+            ) as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def get_user_games_summary(self, user_id: int, day: Optional[str] = None) -> Dict:
+        """Статистика игр пользователя за день YYYY-MM-DD или за все время"""
+        async with self.reader() as db:
+            async with db.execute(
+                f"""SELECT COALESCE(SUM(games), 0) AS games,
+                           COALESCE(SUM(CASE WHEN currency != 'arbuzz' THEN bets ELSE 0 END), 0) AS turnover,
+                           COALESCE(SUM(wins), 0) AS wins,
+                           COALESCE(SUM(win_games), 0) AS win_games,
+                           COALESCE(SUM(CASE WHEN currency != 'arbuzz' THEN lost_bets ELSE 0 END), 0) AS lost
+                    FROM user_daily_stats WHERE user_id = ? {"AND day = ?" if day else ""}""",
+                (user_id, day) if day else (user_id,)
+            ) as cursor:
+                return dict(await cursor.fetchone())
+
     # ==================== МЕТОДЫ ДЛЯ РАБОТЫ С ПОДАРКАМИ РЕЛАЕРА ====================
     
     async def add_relay_gift(self, message_id: int, emoji: str, gift_name: str = None, 
                            gift_id: int = None, slug: str = None, gift_date: int = None,
                            from_user_id: int = None, from_username: str = None) -> bool:
         """Добавить или обновить подарок релаера в базе данных"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             try:
                 # Сначала проверяем, существует ли запись
-                db.row_factory = aiosqlite.Row
                 async with db.execute(
                     "SELECT is_available FROM relay_gifts WHERE message_id = ?", 
                     (message_id,)
@@ -1622,69 +2606,9 @@ class Database:
                 logger.error(f"Ошибка при добавлении подарка релаера: {e}")
                 return False
     
-    async def get_available_relay_gift(self, emoji: str = None, gift_name: str = None, slug: str = None) -> Optional[Dict]:
-        """Получить доступный подарок релаера по эмодзи, имени или slug (приоритет по названию)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # ПРИОРИТЕТ 1: Ищем сначала по названию (точное совпадение)
-            if gift_name:
-                async with db.execute("""
-                    SELECT * FROM relay_gifts 
-                    WHERE gift_name = ? AND is_available = 1 
-                    AND gift_name IS NOT NULL AND gift_name != ''
-                    ORDER BY created_at ASC 
-                    LIMIT 1
-                """, (gift_name,)) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return dict(row)
-            
-            # ПРИОРИТЕТ 2: Ищем по названию (частичное совпадение, case-insensitive)
-            if gift_name:
-                async with db.execute("""
-                    SELECT * FROM relay_gifts 
-                    WHERE LOWER(gift_name) LIKE LOWER(?) AND is_available = 1 
-                    AND gift_name IS NOT NULL AND gift_name != ''
-                    ORDER BY created_at ASC 
-                    LIMIT 1
-                """, (f"%{gift_name}%",)) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return dict(row)
-            
-            # ПРИОРИТЕТ 3: Ищем по slug (если указан)
-            if slug:
-                async with db.execute("""
-                    SELECT * FROM relay_gifts 
-                    WHERE slug = ? AND is_available = 1 
-                    AND slug IS NOT NULL AND slug != ''
-                    ORDER BY created_at ASC 
-                    LIMIT 1
-                """, (slug,)) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return dict(row)
-            
-            # ПРИОРИТЕТ 4: Ищем по эмодзи (если указано)
-            if emoji:
-                async with db.execute("""
-                    SELECT * FROM relay_gifts 
-                    WHERE emoji = ? AND is_available = 1 
-                    AND emoji != '' AND emoji IS NOT NULL
-                    AND gift_name IS NOT NULL AND gift_name != ''
-                    ORDER BY created_at ASC 
-                    LIMIT 1
-                """, (emoji,)) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        return dict(row)
-            
-            return None
-    
     async def mark_gift_as_transferred(self, message_id: int, user_id: int) -> bool:
         """Отметить подарок как переданный пользователю"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             try:
                 await db.execute("""
                     UPDATE relay_gifts 
@@ -1699,7 +2623,7 @@ class Database:
     
     async def get_relay_gifts_count(self, emoji: str = None) -> int:
         """Получить количество доступных подарков релаера (опционально по эмодзи)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             if emoji:
                 async with db.execute("""
                     SELECT COUNT(*) as count FROM relay_gifts 
@@ -1715,36 +2639,42 @@ class Database:
                     row = await cursor.fetchone()
                     return row[0] if row else 0
     
-    async def clear_unavailable_gifts(self, available_message_ids: List[int]) -> int:
-        """Очистить подарки, которых больше нет в профиле релеера"""
-        async with aiosqlite.connect(self.db_path) as db:
-            try:
-                if not available_message_ids:
-                    # Если список пуст, не удаляем ничего (может быть ошибка синхронизации)
-                    return 0
-                
-                # Формируем плейсхолдеры для IN запроса
-                placeholders = ','.join('?' * len(available_message_ids))
-                
-                # Удаляем подарки, которых нет в списке доступных (и которые еще не переданы)
-                # Не удаляем переданные подарки, так как они могут быть нужны для истории
-                cursor = await db.execute(f"""
-                    DELETE FROM relay_gifts 
-                    WHERE message_id NOT IN ({placeholders}) 
-                    AND is_available = 1
-                """, available_message_ids)
-                
+    async def get_available_relay_gift_ids(self) -> List[int]:
+        """message_id всех доступных подарков релеера"""
+        async with self.reader() as db:
+            async with db.execute("SELECT message_id FROM relay_gifts WHERE is_available = 1") as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def apply_relay_gifts_diff(self, upserts: List[tuple], removed_message_ids: List[int]) -> int:
+        """Применить изменения инвентаря релеера одной транзакцией
+
+        upserts - (message_id, emoji, gift_name, gift_id, slug) новых или изменившихся подарков,
+        removed_message_ids - подарки, которых больше нет в профиле. Переданные подарки
+        (is_available = 0) не обновляются и не удаляются. Возвращает число удаленных записей.
+        """
+        async with self.writer() as db:
+            if upserts:
+                await db.executemany("""
+                    INSERT INTO relay_gifts (message_id, emoji, gift_name, gift_id, slug, is_available)
+                    VALUES (?, ?, ?, ?, ?, 1)
+                    ON CONFLICT(message_id) DO UPDATE SET
+                        emoji = excluded.emoji, gift_name = excluded.gift_name,
+                        gift_id = excluded.gift_id, slug = excluded.slug
+                    WHERE relay_gifts.is_available = 1
+                """, upserts)
+            deleted_count = 0
+            if removed_message_ids:
+                cursor = await db.executemany(
+                    "DELETE FROM relay_gifts WHERE message_id = ? AND is_available = 1",
+                    [(message_id,) for message_id in removed_message_ids]
+                )
                 deleted_count = cursor.rowcount
-                await db.commit()
-                return deleted_count
-            except Exception as e:
-                logger.error(f"Ошибка при очистке недоступных подарков: {e}")
-                return 0
-    
+            await db.commit()
+            return deleted_count
+
     async def get_all_relay_gifts(self, emoji: str = None, include_transferred: bool = False) -> List[Dict]:
         """Получить все подарки релаера из базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             if emoji:
                 if include_transferred:
                     async with db.execute("""
@@ -1783,7 +2713,7 @@ class Database:
     
     async def create_support_message(self, user_id: int, username: str, message_text: str) -> int:
         """Создать сообщение поддержки от пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             cursor = await db.execute("""
                 INSERT INTO support_messages (user_id, username, message_text)
                 VALUES (?, ?, ?)
@@ -1793,8 +2723,7 @@ class Database:
     
     async def get_support_message(self, message_id: int) -> Optional[Dict]:
         """Получить сообщение поддержки по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM support_messages WHERE id = ?", (message_id,)
             ) as cursor:
@@ -1803,8 +2732,7 @@ class Database:
     
     async def get_unreplied_support_messages(self) -> List[Dict]:
         """Получить все неотвеченные сообщения поддержки"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT * FROM support_messages 
                 WHERE replied_to IS NULL
@@ -1815,7 +2743,7 @@ class Database:
     
     async def reply_to_support_message(self, message_id: int, reply_text: str, admin_id: int) -> bool:
         """Ответить на сообщение поддержки"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute("""
                 UPDATE support_messages 
                 SET replied_to = ?, reply_text = ?, replied_at = CURRENT_TIMESTAMP, replied_by = ?
@@ -1842,7 +2770,7 @@ class Database:
             max_bet: Максимальная ставка (для slot_tournament)
             auto_start_players: Количество игроков для автозапуска (0 = по max_players)
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             if duel_id:
                 # Создаем дуэль с указанным ID
                 await db.execute("""
@@ -1878,8 +2806,7 @@ class Database:
     
     async def get_pvp_duel(self, duel_id: int = None, unique_link: str = None) -> Optional[Dict]:
         """Получить PvP дуэль по ID или ссылке"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             if duel_id:
                 async with db.execute(
                     "SELECT * FROM pvp_duels WHERE id = ?", (duel_id,)
@@ -1896,8 +2823,7 @@ class Database:
     
     async def get_pvp_participants(self, duel_id: int) -> List[Dict]:
         """Получить список участников дуэли"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT p.*, u.username 
                 FROM pvp_participants p
@@ -1916,7 +2842,7 @@ class Database:
             user_id: ID пользователя
             bet_amount: Ставка (для slot_tournament режима, опционально)
         """
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Проверяем, не присоединился ли уже
             async with db.execute(
                 "SELECT 1 FROM pvp_participants WHERE duel_id = ? AND user_id = ?",
@@ -1989,7 +2915,7 @@ class Database:
     
     async def cancel_pvp_duel(self, duel_id: int, creator_id: int) -> bool:
         """Отменить PvP дуэль (только создатель)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Проверяем, что это создатель
             duel = await self.get_pvp_duel(duel_id=duel_id)
             if not duel or duel["creator_id"] != creator_id:
@@ -2008,7 +2934,7 @@ class Database:
     
     async def start_pvp_duel(self, duel_id: int, channel_message_id: int) -> bool:
         """Начать PvP дуэль"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute("""
                 UPDATE pvp_duels SET status = 'active', channel_message_id = ? WHERE id = ?
             """, (channel_message_id, duel_id))
@@ -2017,7 +2943,7 @@ class Database:
     
     async def finish_pvp_duel(self, duel_id: int, winner_id: int) -> bool:
         """Завершить PvP дуэль с победителем"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute("""
                 UPDATE pvp_duels SET status = 'finished', winner_id = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?
             """, (winner_id, duel_id))
@@ -2026,7 +2952,7 @@ class Database:
     
     async def update_participant_result(self, duel_id: int, user_id: int, dice_result: int, dice_emoji: str) -> bool:
         """Обновить результат участника"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute("""
                 UPDATE pvp_participants SET dice_result = ?, dice_emoji = ? WHERE duel_id = ? AND user_id = ?
             """, (dice_result, dice_emoji, duel_id, user_id))
@@ -2035,8 +2961,7 @@ class Database:
     
     async def get_user_pvp_duels(self, user_id: int, status: str = None) -> List[Dict]:
         """Получить дуэли пользователя (созданные или в которых участвует)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             if status:
                 async with db.execute("""
                     SELECT DISTINCT d.* FROM pvp_duels d
@@ -2058,8 +2983,7 @@ class Database:
     
     async def get_active_pvp_duels(self) -> List[Dict]:
         """Получить активные дуэли (ожидающие присоединения)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT d.*, COUNT(p.id) as current_players
                 FROM pvp_duels d
@@ -2075,7 +2999,7 @@ class Database:
     
     async def get_pvp_tickets_count(self, duel_id: int) -> int:
         """Получить количество проданных билетов для дуэли"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT COUNT(*) as count FROM pvp_tickets WHERE duel_id = ?",
                 (duel_id,)
@@ -2085,8 +3009,7 @@ class Database:
     
     async def get_pvp_tickets(self, duel_id: int) -> List[Dict]:
         """Получить все билеты для дуэли"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT t.*, u.username 
                 FROM pvp_tickets t
@@ -2097,20 +3020,56 @@ class Database:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     
+    async def get_pvp_ticket_positions(self, duel_id: int) -> List[tuple]:
+        """Занятые позиции билетов дуэли: (позиция, user_id)"""
+        async with self.reader() as db:
+            async with db.execute(
+                "SELECT ticket_position, user_id FROM pvp_tickets WHERE duel_id = ? ORDER BY id ASC",
+                (duel_id,)
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+
+    async def _insert_pvp_tickets(self, db: aiosqlite.Connection, duel_id: int, user_id: int,
+                                  amount: float, ticket_positions: List[int]):
+        await db.executemany("""
+            INSERT INTO pvp_tickets (duel_id, user_id, ticket_position, amount)
+            VALUES (?, ?, ?, ?)
+        """, [(duel_id, user_id, position, amount / len(ticket_positions)) for position in ticket_positions])
+
     async def add_pvp_tickets(self, duel_id: int, user_id: int, amount: float, ticket_positions: List[int]) -> bool:
         """Добавить билеты для пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            for position in ticket_positions:
-                await db.execute("""
-                    INSERT INTO pvp_tickets (duel_id, user_id, ticket_position, amount)
-                    VALUES (?, ?, ?, ?)
-                """, (duel_id, user_id, position, amount / len(ticket_positions)))
+        async with self.writer() as db:
+            await self._insert_pvp_tickets(db, duel_id, user_id, amount, ticket_positions)
             await db.commit()
             return True
+
+    async def buy_pvp_tickets(self, duel_id: int, user_id: int, amount: float,
+                              ticket_positions: List[int]) -> Optional[float]:
+        """Купить билеты одной транзакцией: списание, билеты и пополнение банка дуэли
+
+        Returns:
+            Новый баланс или None, если средств недостаточно (ничего не записано)
+        """
+        async with self.writer() as db:
+            new_balance = await self._debit(db, user_id, amount)
+            if new_balance is None:
+                return None
+            await self._insert_pvp_tickets(db, duel_id, user_id, amount, ticket_positions)
+            await db.execute(
+                "UPDATE pvp_duels SET total_pot = total_pot + ? WHERE id = ?",
+                (amount, duel_id)
+            )
+            await db.commit()
+
+        logger.info(
+            f"🎫 БИЛЕТЫ PvP #{duel_id}: user_id={user_id}, билетов={len(ticket_positions)}, "
+            f"сумма={-amount:+.2f} USD, баланс: {new_balance + amount:.2f} → {new_balance:.2f} USD"
+        )
+        return new_balance
     
     async def get_user_tickets_count(self, duel_id: int, user_id: int) -> int:
         """Получить количество билетов пользователя в дуэли"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT COUNT(*) as count FROM pvp_tickets WHERE duel_id = ? AND user_id = ?",
                 (duel_id, user_id)
@@ -2120,8 +3079,7 @@ class Database:
     
     async def get_ticket_owner(self, duel_id: int, ticket_position: int) -> Optional[Dict]:
         """Получить владельца билета по позиции"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT t.*, u.username 
                 FROM pvp_tickets t
@@ -2137,9 +3095,8 @@ class Database:
                                  username: str = None, invite_link: str = None, 
                                  bot_is_admin: bool = True):
         """Добавить или обновить информацию о чате"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             # Проверяем, существует ли чат
-            db.row_factory = aiosqlite.Row
             async with db.execute(
                 "SELECT chat_id FROM chats WHERE chat_id = ?", (chat_id,)
             ) as cursor:
@@ -2163,7 +3120,7 @@ class Database:
     
     async def increment_chat_messages(self, chat_id: int):
         """Увеличить счетчик сообщений от бота в чате"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute("""
                 UPDATE chats 
                 SET messages_count = messages_count + 1, 
@@ -2174,8 +3131,7 @@ class Database:
     
     async def get_all_chats(self) -> List[Dict]:
         """Получить все чаты где бот является администратором"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT * FROM chats 
                 WHERE bot_is_admin = 1
@@ -2186,8 +3142,7 @@ class Database:
     
     async def get_chat(self, chat_id: int) -> Optional[Dict]:
         """Получить информацию о чате"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM chats WHERE chat_id = ?", (chat_id,)
             ) as cursor:
@@ -2204,8 +3159,7 @@ class Database:
         Returns:
             Список словарей с chat_id, title, username, turnover
         """
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             
             # Проверяем, есть ли поле chat_id в таблице games
             # Если нет, используем альтернативный метод (по messages_count)
@@ -2283,7 +3237,7 @@ class Database:
     
     async def update_user_total_lost(self, user_id: int, amount: float):
         """Увеличить сумму проигранных средств пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 "UPDATE users SET total_lost = total_lost + ? WHERE user_id = ?",
                 (amount, user_id),
@@ -2299,7 +3253,7 @@ class Database:
     
     async def update_arbuzz_balance(self, user_id: int, amount: float):
         """Обновить баланс арбузз коинов пользователя (положительное значение - пополнение, отрицательное - списание)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute(
                 "UPDATE users SET arbuzz_balance = arbuzz_balance + ? WHERE user_id = ?",
                 (amount, user_id),
@@ -2309,7 +3263,7 @@ class Database:
     
     async def check_and_give_daily_arbuzz(self, user_id: int) -> bool:
         """Проверить и выдать ежедневные 100 арбузз коинов (если еще не выданы сегодня)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             from datetime import datetime
             today = datetime.now().date().isoformat()
             
@@ -2335,7 +3289,7 @@ class Database:
         if bet_type != "dollar":  # Только для побед на доллары
             return False
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             from datetime import datetime
             today = datetime.now().date().isoformat()
             
@@ -2360,7 +3314,7 @@ class Database:
     
     async def reset_daily_win_flag(self, user_id: int):
         """Сбросить флаг первой победы в день (вызывается при смене дня)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             from datetime import datetime
             today = datetime.now().date().isoformat()
             
@@ -2385,7 +3339,7 @@ class Database:
                             finish_value: str = None, finish_datetime: str = None, 
                             finish_participants: int = None) -> int:
         """Создать лотерею"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             cursor = await db.execute("""
                 INSERT INTO lotteries (title, description, ticket_price, max_tickets_per_user,
                     finish_type, finish_value, finish_datetime, finish_participants, created_by)
@@ -2398,7 +3352,7 @@ class Database:
     async def add_lottery_prize(self, lottery_id: int, position: int, prize_type: str, 
                                prize_value: str, prize_description: str = None) -> bool:
         """Добавить приз для определенного места в лотерее"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             try:
                 await db.execute("""
                     INSERT OR REPLACE INTO lottery_prizes 
@@ -2413,8 +3367,7 @@ class Database:
     
     async def get_lottery(self, lottery_id: int) -> Optional[Dict]:
         """Получить информацию о лотерее"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM lotteries WHERE id = ?", (lottery_id,)
             ) as cursor:
@@ -2423,8 +3376,7 @@ class Database:
     
     async def get_active_lotteries(self) -> List[Dict]:
         """Получить все активные лотереи"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT * FROM lotteries 
                 WHERE status = 'active'
@@ -2435,8 +3387,7 @@ class Database:
     
     async def get_lottery_prizes(self, lottery_id: int) -> List[Dict]:
         """Получить все призы лотереи"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT * FROM lottery_prizes 
                 WHERE lottery_id = ?
@@ -2446,49 +3397,47 @@ class Database:
                 return [dict(row) for row in rows]
     
     async def buy_lottery_ticket(self, lottery_id: int, user_id: int) -> Optional[int]:
-        """Купить билет лотереи. Возвращает номер билета или None при ошибке"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Проверяем лотерею
-            lottery = await self.get_lottery(lottery_id)
-            if not lottery or lottery["status"] != "active":
+        """Купить билет лотереи. Возвращает номер билета или None при ошибке
+        
+        Резерв номера, проверка лимита, списание и выдача билета выполняются в одной транзакции
+        """
+        async with self.writer() as db:
+            # Резервируем следующий номер билета в активной лотерее
+            async with db.execute("""
+                UPDATE lotteries SET total_tickets = total_tickets + 1
+                WHERE id = ? AND status = 'active'
+                RETURNING total_tickets, ticket_price, max_tickets_per_user
+            """, (lottery_id,)) as cursor:
+                lottery = await cursor.fetchone()
+            if not lottery:
                 return None
             
-            # Проверяем лимит билетов на пользователя
-            user_tickets = await self.get_user_lottery_tickets_count(lottery_id, user_id)
-            if user_tickets >= lottery["max_tickets_per_user"]:
-                return None
+            ticket_number, ticket_price, max_tickets = lottery
             
-            # Проверяем баланс
-            user = await self.get_user(user_id)
-            if not user or user["balance"] < lottery["ticket_price"]:
+            # Списываем средства, если хватает баланса и не превышен лимит билетов на пользователя
+            async with db.execute("""
+                UPDATE users SET balance = balance - ?
+                WHERE user_id = ? AND balance >= ?
+                AND (SELECT COUNT(*) FROM lottery_tickets WHERE lottery_id = ? AND user_id = ?) < ?
+                RETURNING balance
+            """, (ticket_price, user_id, ticket_price, lottery_id, user_id, max_tickets)) as cursor:
+                debited = await cursor.fetchone()
+            if not debited:
+                # Откат резерва номера произойдет при выходе без commit
                 return None
             
-            # Списываем средства
-            await db.execute(
-                "UPDATE users SET balance = balance - ? WHERE user_id = ?",
-                (lottery["ticket_price"], user_id)
-            )
-            
-            # Генерируем номер билета (следующий доступный)
-            next_ticket_number = lottery["total_tickets"] + 1
-            
             # Добавляем билет
             await db.execute("""
                 INSERT INTO lottery_tickets (lottery_id, user_id, ticket_number)
                 VALUES (?, ?, ?)
-            """, (lottery_id, user_id, next_ticket_number))
-            
-            # Увеличиваем счетчик билетов
-            await db.execute("""
-                UPDATE lotteries SET total_tickets = total_tickets + 1 WHERE id = ?
-            """, (lottery_id,))
+            """, (lottery_id, user_id, ticket_number))
             
             await db.commit()
-            return next_ticket_number
+            return ticket_number
     
     async def get_user_lottery_tickets_count(self, lottery_id: int, user_id: int) -> int:
         """Получить количество билетов пользователя в лотерее"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT COUNT(*) as count FROM lottery_tickets 
                 WHERE lottery_id = ? AND user_id = ?
@@ -2498,8 +3447,7 @@ class Database:
     
     async def get_lottery_tickets(self, lottery_id: int) -> List[Dict]:
         """Получить все билеты лотереи"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT t.*, u.username 
                 FROM lottery_tickets t
@@ -2512,7 +3460,7 @@ class Database:
     
     async def finish_lottery(self, lottery_id: int) -> bool:
         """Завершить лотерею (изменить статус)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             await db.execute("""
                 UPDATE lotteries 
                 SET status = 'finished', finished_at = CURRENT_TIMESTAMP 
@@ -2525,7 +3473,7 @@ class Database:
                                 prize_type: str, prize_value: str, prize_description: str,
                                 position: int) -> bool:
         """Добавить победителя лотереи"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             try:
                 await db.execute("""
                     INSERT INTO lottery_winners 
@@ -2542,8 +3490,7 @@ class Database:
     
     async def get_lottery_winners(self, lottery_id: int) -> List[Dict]:
         """Получить всех победителей лотереи"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT w.*, u.username 
                 FROM lottery_winners w
@@ -2556,8 +3503,7 @@ class Database:
     
     async def get_all_lotteries(self) -> List[Dict]:
         """Получить все лотереи"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute("""
                 SELECT * FROM lotteries 
                 ORDER BY created_at DESC
@@ -2567,7 +3513,7 @@ class Database:
     
     async def delete_lottery(self, lottery_id: int) -> bool:
         """Удалить лотерею (только если нет билетов)"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             lottery = await self.get_lottery(lottery_id)
             if not lottery:
                 return False
@@ -2582,7 +3528,7 @@ class Database:
     
     async def save_sticker(self, name: str, file_id: str, file_unique_id: str, sticker_type: Optional[str] = None) -> bool:
         """Сохранить стикер"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             try:
                 await db.execute("""
                     INSERT OR REPLACE INTO stickers (name, file_id, file_unique_id, sticker_type)
@@ -2596,8 +3542,7 @@ class Database:
     
     async def get_sticker(self, name: str) -> Optional[Dict]:
         """Получить стикер по имени"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             async with db.execute(
                 "SELECT * FROM stickers WHERE name = ?", (name,)
             ) as cursor:
@@ -2606,8 +3551,7 @@ class Database:
     
     async def get_all_stickers(self, sticker_type: Optional[str] = None) -> List[Dict]:
         """Получить все стикеры или по типу"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.reader() as db:
             if sticker_type:
                 async with db.execute(
                     "SELECT * FROM stickers WHERE sticker_type = ? ORDER BY name", (sticker_type,)
@@ -2623,7 +3567,7 @@ class Database:
     
     async def delete_sticker(self, name: str) -> bool:
         """Удалить стикер"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.writer() as db:
             try:
                 await db.execute("DELETE FROM stickers WHERE name = ?", (name,))
                 await db.commit()
@@ -0,0 +1,284 @@
+"""
+Потоковая выгрузка данных для админки (CSV, CSV.gz, Excel)
+
+Каждая выгрузка - один SQL-запрос с JOIN на users (без запроса пользователя
+на каждую строку), который читается пачками через курсор и сразу пишется
+в SpooledTemporaryFile: небольшие файлы остаются в памяти, большие уходят
+на диск, поэтому потребление памяти не зависит от размера таблицы.
+Поддерживаются периоды (24 часа / 7 / 30 дней) и режим «с прошлой выгрузки»
+по курсору последнего выгруженного ID.
+"""
+import asyncio
+import csv
+import gzip
+import io
+import logging
+import os
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from tempfile import SpooledTemporaryFile
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+from aiogram.types.input_file import InputFile
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+try:
+    from openpyxl import Workbook
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+    logger.warning("openpyxl не установлен, экспорт в Excel будет недоступен")
+
+# Сколько строк читать из БД за раз
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+# Файл держится в памяти до этого размера (байт), дальше - на диске
+EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(8 * 1024 * 1024)))
+# Ограничение Bot API на размер отправляемого файла
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024
+
+# Период выгрузки -> сколько дней назад (None - без ограничения)
+EXPORT_PERIODS = {
+    "all": ("📦 Все время", None),
+    "day": ("📅 24 часа", 1),
+    "week": ("📅 7 дней", 7),
+    "month": ("📅 30 дней", 30),
+    "new": ("🆕 С прошлой выгрузки", None),
+}
+
+EXPORT_FORMATS = {
+    "csv": "CSV",
+    "gz": "CSV.gz",
+    "xlsx": "Excel",
+}
+
+# Тип выгрузки: заголовок, SQL (WHERE подставляется в {where}), колонка даты
+# для периода и колонка ID для режима «с прошлой выгрузки» (None - не поддерживается)
+EXPORTS: Dict[str, Dict] = {
+    "users": {
+        "title": "Пользователи",
+        "caption": "📊 Экспорт пользователей",
+        "header": ["ID", "Username", "Баланс (USD)", "Баланс реферальный", "Заблокирован", "Отыгрыш",
+                   "Объем", "Заработано", "Реферальный код", "Приглашен", "Создан"],
+        "sql": """SELECT u.user_id, COALESCE(u.username, ''), COALESCE(u.balance, 0),
+                         COALESCE(u.referral_balance, 0), COALESCE(u.locked_balance, 0),
+                         COALESCE(u.rollover_requirement, 0), COALESCE(u.total_volume, 0),
+                         COALESCE(u.total_earned, 0), COALESCE(u.referral_code, ''),
+                         COALESCE(u.referred_by, ''), u.created_at
+                  FROM users u {where}
+                  ORDER BY u.created_at DESC""",
+        "date_column": "u.created_at",
+        "id_column": None,
+    },
+    "deposits": {
+        "title": "Депозиты",
+        "caption": "💰 Экспорт депозитов",
+        "header": ["ID", "User ID", "Username", "Сумма (USD)", "Метод", "Статус", "Дата"],
+        "sql": """SELECT d.id, d.user_id, COALESCE(u.username, 'N/A'), COALESCE(d.amount, 0),
+                         COALESCE(d.method, ''), COALESCE(d.status, ''), d.created_at
+                  FROM deposits d LEFT JOIN users u ON u.user_id = d.user_id {where}
+                  ORDER BY d.id""",
+        "date_column": "d.created_at",
+        "id_column": "d.id",
+    },
+    "withdrawals": {
+        "title": "Выводы",
+        "caption": "💸 Экспорт выводов",
+        "header": ["ID", "User ID", "Username", "Сумма (USD)", "Метод", "Подарок", "Статус", "Дата"],
+        "sql": """SELECT w.id, w.user_id, COALESCE(u.username, 'N/A'), COALESCE(w.amount, 0),
+                         COALESCE(w.method, ''),
+                         TRIM(COALESCE(w.gift_emoji, '') || ' ' || COALESCE(w.gift_name, '')),
+                         COALESCE(w.status, ''), w.created_at
+                  FROM withdrawals w LEFT JOIN users u ON u.user_id = w.user_id {where}
+                  ORDER BY w.id""",
+        "date_column": "w.created_at",
+        "id_column": "w.id",
+    },
+    "games": {
+        "title": "Игры",
+        "caption": "🎮 Экспорт игр",
+        "header": ["ID", "User ID", "Username", "Тип игры", "Ставка", "Результат", "Выигрыш", "Валюта", "Дата"],
+        "sql": """SELECT g.id, g.user_id, COALESCE(u.username, 'N/A'), COALESCE(g.game_type, ''),
+                         COALESCE(g.bet, 0), COALESCE(g.result, 0), COALESCE(g.win, 0),
+                         COALESCE(g.currency, 'dollar'), g.created_at
+                  FROM games g LEFT JOIN users u ON u.user_id = g.user_id {where}
+                  ORDER BY g.id""",
+        "date_column": "g.created_at",
+        "id_column": "g.id",
+    },
+    "promo": {
+        "title": "Промокоды",
+        "caption": "🎟️ Экспорт промокодов",
+        "header": ["ID", "Код", "Сумма", "Всего активаций", "Осталось", "Требует подписки", "Канал",
+                   "Отыгрыш", "Тип депозита", "Мин. депозит", "Создан"],
+        "sql": """SELECT p.id, p.code, p.amount, p.total_activations, p.remaining_activations,
+                         p.requires_channel_subscription, COALESCE(p.channel_username, ''),
+                         COALESCE(p.rollover_multiplier, 1.0), COALESCE(p.deposit_type, ''),
+                         COALESCE(p.min_deposit, 0), p.created_at
+                  FROM promo_codes p {where}
+                  ORDER BY p.id""",
+        "date_column": "p.created_at",
+        "id_column": "p.id",
+    },
+    "partners": {
+        "title": "Партнеры",
+        "caption": "🤝 Экспорт партнеров",
+        "header": ["ID", "User ID", "Username", "Префикс", "Процент", "Уровни", "Рефералов", "Объем", "Создан"],
+        "sql": """SELECT p.id, p.user_id, COALESCE(u.username, 'N/A'), COALESCE(p.prefix, ''),
+                         COALESCE(p.referral_percent, 0), COALESCE(p.level_percents, ''),
+                         COALESCE(p.total_referrals, 0), COALESCE(p.total_volume, 0), p.created_at
+                  FROM partners p LEFT JOIN users u ON u.user_id = p.user_id {where}
+                  ORDER BY p.id""",
+        "date_column": "p.created_at",
+        "id_column": "p.id",
+    },
+}
+
+# Листы выгрузки «Все данные»
+ALL_DATA_KINDS = ("users", "deposits", "withdrawals", "games")
+
+db = Database()
+
+
+class SpooledInputFile(InputFile):
+    """Файл для отправки в Telegram, читаемый частями из SpooledTemporaryFile"""
+
+    def __init__(self, file, filename: str, chunk_size: int = 64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+
+
+class ExportResult:
+    """Готовый файл выгрузки. Закрывается после отправки"""
+
+    __slots__ = ("file", "filename", "caption", "rows", "size", "cursors")
+
+    def __init__(self, file, filename: str, caption: str, rows: int, cursors: Dict[str, int]):
+        self.file = file
+        self.filename = filename
+        self.caption = caption
+        self.rows = rows
+        self.file.seek(0, io.SEEK_END)
+        self.size = self.file.tell()
+        # Тип выгрузки -> максимальный выгруженный ID (сохраняется после успешной отправки)
+        self.cursors = cursors
+
+    def input_file(self) -> SpooledInputFile:
+        return SpooledInputFile(self.file, self.filename)
+
+    def close(self):
+        self.file.close()
+
+
+def supports_incremental(kind: str) -> bool:
+    return kind in EXPORTS and EXPORTS[kind]["id_column"] is not None
+
+
+def _query(kind: str, period: str, since_id: int) -> Tuple[str, tuple]:
+    spec = EXPORTS[kind]
+    conditions: List[str] = []
+    params: List = []
+    days = EXPORT_PERIODS.get(period, (None, None))[1]
+    if days:
+        conditions.append(f"{spec['date_column']} >= ?")
+        params.append((datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S"))
+    if period == "new" and spec["id_column"]:
+        conditions.append(f"{spec['id_column']} > ?")
+        params.append(since_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return spec["sql"].format(where=where), tuple(params)
+
+
+async def _rows(kind: str, period: str, cursors: Dict[str, int]) -> AsyncGenerator[List[tuple], None]:
+    """Пачки строк выгрузки; попутно запоминает максимальный ID для курсора"""
+    spec = EXPORTS[kind]
+    since_id = await db.get_export_cursor(kind) if period == "new" else 0
+    query, params = _query(kind, period, since_id)
+    track_cursor = spec["id_column"] is not None and period in ("all", "new")
+    # aclosing: соединение чтения возвращается в пул сразу, даже если чтение прервано
+    async with aclosing(db.iter_rows(query, params, EXPORT_BATCH_SIZE)) as batches:
+        async for batch in batches:
+            if track_cursor:
+                cursors[kind] = max(cursors.get(kind, since_id), batch[-1][0])
+            yield batch
+
+
+async def _write_csv(kind: str, period: str, compress: bool, cursors: Dict[str, int]) -> Tuple[SpooledTemporaryFile, int]:
+    file = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    binary = gzip.GzipFile(fileobj=file, mode="wb") if compress else file
+    # UTF-8 с BOM, чтобы Excel правильно открыл кириллицу
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    writer = csv.writer(text)
+    writer.writerow(EXPORTS[kind]["header"])
+    rows = 0
+    try:
+        async with aclosing(_rows(kind, period, cursors)) as batches:
+            async for batch in batches:
+                writer.writerows(batch)
+                rows += len(batch)
+        text.flush()
+    finally:
+        # Отсоединяем обертки, не закрывая сам временный файл
+        text.detach()
+        if compress:
+            binary.close()
+    return file, rows
+
+
+async def _write_xlsx(kinds, period: str, cursors: Dict[str, int]) -> Tuple[SpooledTemporaryFile, int]:
+    # write_only: строки сразу сериализуются во временные файлы openpyxl, а не держатся в памяти
+    workbook = Workbook(write_only=True)
+    rows = 0
+    for kind in kinds:
+        sheet = workbook.create_sheet(title=EXPORTS[kind]["title"])
+        sheet.append(EXPORTS[kind]["header"])
+        async with aclosing(_rows(kind, period, cursors)) as batches:
+            async for batch in batches:
+                for row in batch:
+                    sheet.append(row)
+                rows += len(batch)
+    file = SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    # Сборка zip-архива xlsx - блокирующая операция, выполняем в потоке
+    await asyncio.to_thread(workbook.save, file)
+    return file, rows
+
+
+async def build_export(kind: str, period: str = "all", fmt: str = "csv") -> ExportResult:
+    """Сформировать файл выгрузки kind ("users", ..., "all") за период period в формате fmt"""
+    cursors: Dict[str, int] = {}
+    suffix = "" if period == "all" else f"_{period}"
+    stamp = datetime.now().strftime("%Y%m%d_%H%M")
+    if kind == "all":
+        if OPENPYXL_AVAILABLE:
+            file, rows = await _write_xlsx(ALL_DATA_KINDS, period, cursors)
+            return ExportResult(file, f"all_data_export{suffix}_{stamp}.xlsx",
+                                "📦 Экспорт всех данных (Excel)", rows, cursors)
+        # Без openpyxl отдаем пользователей одним CSV
+        kind, caption = "users", "📦 Экспорт всех данных (CSV)"
+        fmt = "csv" if fmt == "xlsx" else fmt
+    else:
+        caption = EXPORTS[kind]["caption"]
+    if fmt == "xlsx" and OPENPYXL_AVAILABLE:
+        file, rows = await _write_xlsx((kind,), period, cursors)
+        filename = f"{kind}_export{suffix}_{stamp}.xlsx"
+    else:
+        compress = fmt == "gz"
+        file, rows = await _write_csv(kind, period, compress, cursors)
+        filename = f"{kind}_export{suffix}_{stamp}.csv" + (".gz" if compress else "")
+    period_title = EXPORT_PERIODS.get(period, ("", None))[0]
+    if period != "all" and period_title:
+        caption = f"{caption} ({period_title})"
+    return ExportResult(file, filename, caption, rows, cursors)
+
+
+async def commit_export(result: ExportResult):
+    """Сдвинуть курсоры «с прошлой выгрузки» после успешной отправки файла"""
+    for kind, last_id in result.cursors.items():
+        await db.save_export_cursor(kind, last_id)
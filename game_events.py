@@ -0,0 +1,65 @@
+"""
+Шина завершения игр мини-приложения
+
+Для каждой игры создается asyncio.Future, который разрешается в момент
+готовности результата (process_game_result, обработка слотов, таймаут).
+Ожидающие (сторож игры, long-poll запросы мини-аппа) просыпаются сразу,
+без периодического опроса MINI_APP_GAMES.
+"""
+import asyncio
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GameResultBus:
+    """game_id -> Future с итоговой записью игры"""
+
+    def __init__(self):
+        self._futures: Dict[int, asyncio.Future] = {}
+
+    def _future(self, game_id: int) -> asyncio.Future:
+        future = self._futures.get(game_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._futures[game_id] = future
+        return future
+
+    def register(self, game_id: int):
+        """Зарегистрировать игру до ее запуска, чтобы результат нельзя было пропустить"""
+        self._future(game_id)
+
+    def resolve(self, game_id: int, game: Dict):
+        """Сообщить о завершении игры (status completed/error/timeout в записи игры)"""
+        future = self._futures.get(game_id)
+        if future is None:
+            return
+        if not future.done():
+            future.set_result(game)
+
+    def is_registered(self, game_id: int) -> bool:
+        return game_id in self._futures
+
+    def is_done(self, game_id: int) -> bool:
+        future = self._futures.get(game_id)
+        return future is not None and future.done()
+
+    async def wait(self, game_id: int, timeout: float) -> Optional[Dict]:
+        """Дождаться результата игры. None - таймаут или игра не зарегистрирована"""
+        future = self._futures.get(game_id)
+        if future is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def discard(self, game_id: int):
+        """Забыть игру (после отдачи результата или при отмене)"""
+        future = self._futures.pop(game_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+
+game_results = GameResultBus()
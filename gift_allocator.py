@@ -0,0 +1,170 @@
+"""
+Резервирование подарков релеера для вывода
+
+Доступные подарки (relay_gifts, is_available = 1) держатся в памяти в
+очередях FIFO по названию и по эмодзи. Выдача подарка - синхронная операция
+без await, поэтому два одновременных вывода не могут получить один и тот же
+NFT. Подарок резервируется на время передачи и затем подтверждается
+(отмечается переданным в базе) или возвращается в начало очереди. Резерв,
+не подтвержденный за GIFT_RESERVATION_TIMEOUT секунд, освобождается.
+
+Состояние строится из таблицы relay_gifts при первом обращении и
+перечитывается после синхронизации инвентаря релеера.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from database import Database
+from gifts import gift_catalog
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд подарок остается зарезервированным без подтверждения
+GIFT_RESERVATION_TIMEOUT = int(os.getenv("GIFT_RESERVATION_TIMEOUT", "300"))
+
+db = Database()
+
+
+def _name_key(name: Optional[str], slug: Optional[str] = None) -> Optional[str]:
+    """Ключ очереди по названию: имя подарка из каталога, иначе название в нижнем регистре"""
+    gift = (gift_catalog.find(name) if name else None) or (gift_catalog.by_slug(slug) if slug else None)
+    if gift:
+        return gift["name"]
+    return name.strip().lower() if name and name.strip() else None
+
+
+class GiftAllocator:
+    """Очереди доступных подарков релеера и их резервирование"""
+
+    def __init__(self, timeout: float = GIFT_RESERVATION_TIMEOUT):
+        self.timeout = timeout
+        self._gifts: Dict[int, Dict] = {}  # message_id -> запись relay_gifts (доступные и зарезервированные)
+        self._by_name: Dict[str, Deque[int]] = {}
+        self._by_emoji: Dict[str, Deque[int]] = {}
+        self._reserved: Dict[int, tuple] = {}  # message_id -> (user_id, истекает)
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    def _enqueue(self, message_id: int, front: bool = False):
+        gift = self._gifts[message_id]
+        queues = []
+        if gift["name_key"]:
+            queues.append(self._by_name.setdefault(gift["name_key"], deque()))
+        if gift.get("emoji"):
+            queues.append(self._by_emoji.setdefault(gift["emoji"], deque()))
+        for queue in queues:
+            if front:
+                queue.appendleft(message_id)
+            else:
+                queue.append(message_id)
+
+    def _pop(self, queue: Optional[Deque[int]]) -> Optional[int]:
+        """Первый свободный подарок очереди. Выданные и удаленные id пропускаются (ленивое удаление)"""
+        while queue:
+            message_id = queue.popleft()
+            if message_id in self._gifts and message_id not in self._reserved:
+                return message_id
+        return None
+
+    def _release_expired(self):
+        now = time.monotonic()
+        for message_id, (user_id, expires_at) in list(self._reserved.items()):
+            if expires_at <= now:
+                logger.warning(f"⏳ Резерв подарка {message_id} для пользователя {user_id} истек, возвращаю в очередь")
+                self.release(message_id)
+
+    async def _load(self, database: Database):
+        async with database.reader() as conn:
+            async with conn.execute("""
+                SELECT message_id, emoji, gift_name, gift_id, slug FROM relay_gifts
+                WHERE is_available = 1
+                ORDER BY created_at ASC, id ASC
+            """) as cursor:
+                rows = await cursor.fetchall()
+        self._gifts = {}
+        self._by_name = {}
+        self._by_emoji = {}
+        for row in rows:
+            if row["message_id"] in self._reserved:
+                self._gifts[row["message_id"]] = self._record(dict(row))
+                continue
+            self.add(dict(row))
+        # Резервы подарков, которых больше нет в базе, не нужны
+        for message_id in [message_id for message_id in self._reserved if message_id not in self._gifts]:
+            del self._reserved[message_id]
+        self._loaded = True
+
+    async def refresh(self, database: Optional[Database] = None):
+        """Перечитать доступные подарки из relay_gifts (резервы сохраняются)"""
+        async with self._lock:
+            await self._load(database or db)
+        logger.info(f"🎁 Очереди подарков релеера: {len(self._gifts)} подарков, {len(self._reserved)} в резерве")
+
+    async def _ensure_loaded(self):
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    await self._load(db)
+
+    @staticmethod
+    def _record(row: Dict) -> Dict:
+        row["name_key"] = _name_key(row.get("gift_name"), row.get("slug"))
+        return row
+
+    def add(self, row: Dict):
+        """Добавить доступный подарок (запись relay_gifts) в конец очереди"""
+        message_id = row["message_id"]
+        if message_id in self._gifts:
+            return
+        self._gifts[message_id] = self._record(dict(row))
+        self._enqueue(message_id)
+
+    def discard(self, message_id: int):
+        """Убрать подарок (его больше нет у релеера)"""
+        self._gifts.pop(message_id, None)
+        self._reserved.pop(message_id, None)
+
+    async def reserve(self, user_id: int, gift_name: Optional[str] = None,
+                      emoji: Optional[str] = None) -> Optional[Dict]:
+        """Зарезервировать самый старый доступный подарок: по названию, затем по эмодзи
+
+        По эмодзи подарок выдается, только если эмодзи однозначно задает подарок
+        каталога (или названия не передано). Возвращает запись relay_gifts или None.
+        """
+        await self._ensure_loaded()
+        # Дальше без await: выбор и резерв атомарны для event loop
+        self._release_expired()
+        message_id = None
+        name_key = _name_key(gift_name)
+        if name_key:
+            message_id = self._pop(self._by_name.get(name_key))
+        if message_id is None and emoji and (not gift_name or len(gift_catalog.by_emoji(emoji)) <= 1):
+            message_id = self._pop(self._by_emoji.get(emoji))
+        if message_id is None:
+            return None
+        self._reserved[message_id] = (user_id, time.monotonic() + self.timeout)
+        gift = dict(self._gifts[message_id])
+        gift.pop("name_key", None)
+        return gift
+
+    def release(self, message_id: int):
+        """Вернуть зарезервированный подарок в начало очереди (передача не удалась)"""
+        if self._reserved.pop(message_id, None) is not None and message_id in self._gifts:
+            self._enqueue(message_id, front=True)
+
+    async def confirm(self, message_id: int, user_id: int) -> bool:
+        """Подтвердить выдачу: отметить подарок переданным в базе и убрать из очередей"""
+        async with self._lock:
+            marked = await db.mark_gift_as_transferred(message_id, user_id)
+            self.discard(message_id)
+        return marked
+
+    def stats(self) -> Dict[str, int]:
+        return {"available": len(self._gifts) - len(self._reserved), "reserved": len(self._reserved)}
+
+
+gift_allocator = GiftAllocator()
@@ -1,136 +1,280 @@
-# Конфигурация подарков с премиум эмодзи и ценами
+# Каталог подарков с премиум эмодзи и ценами
 # Формат: {"emoji": "🐸", "name": "Plush Pepe", "price_ton": 5222.00, "price_ton_black": 15665.99}
 # price_ton - обычная цена, price_ton_black - цена с черным фоном
+# Эмодзи у разных подарков может совпадать (💎, 💍, 🐸 ...), поэтому ключ подарка - имя
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+GIFTS = [
+    {"emoji": "🐸", "name": "Plush Pepe", "price_ton": 5750.00, "price_ton_black": 17250.00},
+    {"emoji": "❤️‍🔥", "name": "Heart Locket", "price_ton": 1029.99, "price_ton_black": 3089.97},
+    {"emoji": "🧢", "name": "Durov's Cap", "price_ton": 737.00, "price_ton_black": 2211.00},
+    {"emoji": "🍑", "name": "Precious Peach", "price_ton": 347.90, "price_ton_black": 1043.70},
+    {"emoji": "🗿", "name": "Heroic Helmet", "price_ton": 220.99, "price_ton_black": 662.97},
+    {"emoji": "💪🏻", "name": "Mighty Arm", "price_ton": 169.80, "price_ton_black": 509.40},
+    {"emoji": "💎", "name": "Astral Shard", "price_ton": 128.69, "price_ton_black": 386.07},
+    {"emoji": "🗡", "name": "Nail Bracelet", "price_ton": 96.99, "price_ton_black": 290.97},
+    {"emoji": "👜", "name": "Loot Bag", "price_ton": 89.89, "price_ton_black": 269.67},
+    {"emoji": "", "name": "Mini Oscar", "price_ton": 80.98, "price_ton_black": 242.94},  # Нет эмодзи
+    {"emoji": "🍼", "name": "Perfume Bottle", "price_ton": 74.98, "price_ton_black": 224.94},
+    {"emoji": "💎", "name": "Ion Gem", "price_ton": 73.95, "price_ton_black": 221.85},
+    {"emoji": "🧱", "name": "Artisan Brick", "price_ton": 68.00, "price_ton_black": 204.00},
+    {"emoji": "🧙🏻", "name": "Magic Potion", "price_ton": 64.99, "price_ton_black": 194.97},
+    {"emoji": "🐈‍⬛", "name": "Scared Cat", "price_ton": 62.00, "price_ton_black": 186.00},
+    {"emoji": "💍", "name": "Gem Signet", "price_ton": 55.99, "price_ton_black": 167.97},
+    {"emoji": "🖖🏻", "name": "Westside Sign", "price_ton": 56.97, "price_ton_black": 170.91},
+    {"emoji": "💍", "name": "Bonded Ring", "price_ton": 45.50, "price_ton_black": 136.50},
+    {"emoji": "💡", "name": "Genie Lamp", "price_ton": 42.73, "price_ton_black": 128.19},
+    {"emoji": "⌚️", "name": "Swiss Watch", "price_ton": 38.10, "price_ton_black": 114.30},
+    {"emoji": "🫦", "name": "Sharp Tongue", "price_ton": 35.57, "price_ton_black": 106.71},
+    {"emoji": "🐸", "name": "Kissed Frog", "price_ton": 37.00, "price_ton_black": 111.00},
+    {"emoji": "💍", "name": "Signet Ring", "price_ton": 29.14, "price_ton_black": 87.42},
+    {"emoji": "🚘", "name": "Low Rider", "price_ton": 30.84, "price_ton_black": 92.52},
+    {"emoji": "🏍", "name": "Neko Helmet", "price_ton": 28.86, "price_ton_black": 86.58},
+    {"emoji": "💀", "name": "Electric Skull", "price_ton": 28.00, "price_ton_black": 84.00},
+    {"emoji": "🚬", "name": "Vintage Cigar", "price_ton": 25.26, "price_ton_black": 75.78},
+    {"emoji": "🧸", "name": "Toy Bear", "price_ton": 25.50, "price_ton_black": 76.50},
+    {"emoji": "💍", "name": "Diamond Ring", "price_ton": 20.60, "price_ton_black": 61.80},
+    {"emoji": "🧍🏼‍♀️", "name": "Voodoo Doll", "price_ton": 21.90, "price_ton_black": 65.70},
+    {"emoji": "🌹", "name": "Eternal Rose", "price_ton": 18.00, "price_ton_black": 54.00},
+    {"emoji": "🎃", "name": "Mad Pumpkin", "price_ton": 14.29, "price_ton_black": 42.87},
+    {"emoji": "💘", "name": "Cupid Charm", "price_ton": 13.90, "price_ton_black": 41.70},
+    {"emoji": "👩🏻‍🦳", "name": "Ionic Dryer", "price_ton": 12.99, "price_ton_black": 38.97},
+    {"emoji": "💗", "name": "Love Potion", "price_ton": 12.29, "price_ton_black": 36.87},
+    {"emoji": "🕸", "name": "Trapped Heart", "price_ton": 9.85, "price_ton_black": 29.55},
+    {"emoji": "🧹", "name": "Flying Broom", "price_ton": 8.91, "price_ton_black": 26.73},
+    {"emoji": "🏵", "name": "Skull Flower", "price_ton": 8.87, "price_ton_black": 26.61},
+    {"emoji": "☠️", "name": "Crystal Ball", "price_ton": 8.42, "price_ton_black": 25.26},
+    {"emoji": "🎼", "name": "Record Player", "price_ton": 8.76, "price_ton_black": 26.28},
+    {"emoji": "🎩", "name": "Top Hat", "price_ton": 9.36, "price_ton_black": 28.08},
+    {"emoji": "👢", "name": "Sky Stilettos", "price_ton": 7.10, "price_ton_black": 21.30},
+    {"emoji": "🕯", "name": "Love Candle", "price_ton": 8.00, "price_ton_black": 24.00},
+    {"emoji": "🚬", "name": "Snoop Cigar", "price_ton": 7.68, "price_ton_black": 23.04},
+    {"emoji": "🔔", "name": "Sleigh Bell", "price_ton": 7.58, "price_ton_black": 22.74},
+    {"emoji": "🍬", "name": "Valentine Box", "price_ton": 6.00, "price_ton_black": 18.00},
+    {"emoji": "🌸", "name": "Sakura Flower", "price_ton": 6.08, "price_ton_black": 18.24},
+    {"emoji": "⭐️", "name": "Hanging Star", "price_ton": 5.54, "price_ton_black": 16.62},
+    {"emoji": "👁", "name": "Evil Eye", "price_ton": 5.48, "price_ton_black": 16.44},
+    {"emoji": "🐒", "name": "Jolly Chimp", "price_ton": 5.26, "price_ton_black": 15.78},
+    {"emoji": "🐰", "name": "Jelly Bunny", "price_ton": 4.50, "price_ton_black": 13.50},
+    {"emoji": "🍓", "name": "Berry Box", "price_ton": 4.01, "price_ton_black": 12.03},
+    {"emoji": "🧁", "name": "Bunny Muffin", "price_ton": 4.29, "price_ton_black": 12.87},
+    {"emoji": "🕯", "name": "Eternal Candle", "price_ton": 4.12, "price_ton_black": 12.36},
+    {"emoji": "👔", "name": "Bow Tie", "price_ton": 3.60, "price_ton_black": 10.80},
+    {"emoji": "🧤", "name": "Snow Mittens", "price_ton": 4.37, "price_ton_black": 13.11},
+    {"emoji": "⌨️", "name": "Input Key", "price_ton": 3.96, "price_ton_black": 11.88},
+    {"emoji": "🗡", "name": "Light Sword", "price_ton": 3.99, "price_ton_black": 11.97},
+    {"emoji": "🍄", "name": "Spy Agaric", "price_ton": 4.47, "price_ton_black": 13.41},
+    {"emoji": "🛍", "name": "Joyful Bundle", "price_ton": 4.02, "price_ton_black": 12.06},
+    {"emoji": "🪷", "name": "Lush Bouquet", "price_ton": 3.59, "price_ton_black": 10.77},
+    {"emoji": "👒", "name": "Witch Hat", "price_ton": 3.79, "price_ton_black": 11.37},
+    {"emoji": "❄️", "name": "Snow Globe", "price_ton": 4.18, "price_ton_black": 12.54},
+    {"emoji": "🪣", "name": "Hex Pot", "price_ton": 3.39, "price_ton_black": 10.17},
+    {"emoji": "🧺", "name": "Spring Basket", "price_ton": 3.21, "price_ton_black": 9.63},
+    {"emoji": "🌿", "name": "Swag Bag", "price_ton": 3.42, "price_ton_black": 10.26},
+    {"emoji": "🫙", "name": "Restless Jar", "price_ton": 3.47, "price_ton_black": 10.41},
+    {"emoji": "🥚", "name": "Easter Egg", "price_ton": 2.94, "price_ton_black": 8.82},
+    {"emoji": "🧑🏻‍🎄", "name": "Santa Hat", "price_ton": 3.93, "price_ton_black": 11.79},
+    {"emoji": "🌙", "name": "Moon Pendant", "price_ton": 2.30, "price_ton_black": 6.90},
+    {"emoji": "🐶", "name": "Snoop Dogg", "price_ton": 2.96, "price_ton_black": 8.88},
+    {"emoji": "📓", "name": "Star Notepad", "price_ton": 3.25, "price_ton_black": 9.75},
+    {"emoji": "🍷", "name": "Spiced Wine", "price_ton": 2.86, "price_ton_black": 8.58},
+    {"emoji": "🎁", "name": "Jack-in-the-Box", "price_ton": 3.12, "price_ton_black": 9.36},
+    {"emoji": "🚀", "name": "Stellar Rocket", "price_ton": 2.74, "price_ton_black": 8.22},
+    {"emoji": "🧦", "name": "Fresh Socks", "price_ton": 2.55, "price_ton_black": 7.65},
+    {"emoji": "🪄", "name": "Party Sparkler", "price_ton": 2.80, "price_ton_black": 8.40},
+    {"emoji": "🍭", "name": "Hypno Lollipop", "price_ton": 2.69, "price_ton_black": 8.07},
+    {"emoji": "🪅", "name": "Winter Wreath", "price_ton": 2.90, "price_ton_black": 8.70},
+    {"emoji": "🎂", "name": "Mousse Cake", "price_ton": 2.64, "price_ton_black": 7.92},
+    {"emoji": "🔔", "name": "Jingle Bells", "price_ton": 3.12, "price_ton_black": 9.36},
+    {"emoji": "📱", "name": "Tama Gadget", "price_ton": 2.79, "price_ton_black": 8.37},
+    {"emoji": "💝", "name": "Cookie Heart", "price_ton": 2.60, "price_ton_black": 7.80},
+    {"emoji": "💩", "name": "Happy Brownie", "price_ton": 2.49, "price_ton_black": 7.47},
+    {"emoji": "🍪", "name": "Ginger Cookie", "price_ton": 2.55, "price_ton_black": 7.65},
+    {"emoji": "🎅🏼", "name": "Big Year", "price_ton": 2.30, "price_ton_black": 6.90},
+    {"emoji": "🤡", "name": "Jester Hat", "price_ton": 2.46, "price_ton_black": 7.38},
+    {"emoji": "🐍", "name": "Pet Snake", "price_ton": 2.47, "price_ton_black": 7.41},
+    {"emoji": "🍀", "name": "Clover Pin", "price_ton": 2.40, "price_ton_black": 7.20},
+    {"emoji": "☕️", "name": "Holiday Drink", "price_ton": 2.46, "price_ton_black": 7.38},
+    {"emoji": "☀️", "name": "Faith Amulet", "price_ton": 2.50, "price_ton_black": 7.50},
+    {"emoji": "🍬", "name": "Candy Cane", "price_ton": 2.25, "price_ton_black": 6.75},
+    {"emoji": "🍮", "name": "Whip Cupcake", "price_ton": 2.37, "price_ton_black": 7.11},
+    {"emoji": "🧦", "name": "Xmas Stocking", "price_ton": 2.20, "price_ton_black": 6.60},
+    {"emoji": "🍭", "name": "Lol Pop", "price_ton": 2.19, "price_ton_black": 6.57},
+    {"emoji": "📆", "name": "Desk Calendar", "price_ton": 2.25, "price_ton_black": 6.75},
+    {"emoji": "📦", "name": "Snake Box", "price_ton": 2.34, "price_ton_black": 7.02},
+    {"emoji": "🐍", "name": "Lunar Snake", "price_ton": 2.24, "price_ton_black": 6.72},
+    {"emoji": "🎉", "name": "B-Day Candle", "price_ton": 2.29, "price_ton_black": 6.87},
+    {"emoji": "🍽", "name": "Instant Ramen", "price_ton": 2.17, "price_ton_black": 6.51},
+    {"emoji": "🍦", "name": "Ice Cream", "price_ton": 2.16, "price_ton_black": 6.48},
+    {"emoji": "🎂", "name": "Homemade Cake", "price_ton": 2.35, "price_ton_black": 7.05},
+]
+
+
+# Цена подарка при выводе (+10%) и при депозите (-10%) относительно базовой
+WITHDRAW_PRICE_MULTIPLIER = 1.1
+DEPOSIT_PRICE_MULTIPLIER = 0.9
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokens(text: str) -> List[str]:
+    """Нормализованные токены имени: "Durov's Cap" -> ["durov", "s", "cap"]"""
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def _slug_key(slug: str) -> str:
+    """Ключ slug уникального подарка: "PlushPepe-1234" -> "plushpepe" """
+    base = (slug or "").rsplit("-", 1)[0]
+    return "".join(_tokens(base))
+
+
+class GiftCatalog:
+    """Индексы каталога подарков: по имени, эмодзи, slug и токенам имени
+
+    Строится один раз при импорте; поиск по имени, эмодзи и slug - O(1),
+    нечеткий поиск по названию модели идет только по подаркам с общими токенами.
+    """
+
+    def __init__(self, gifts: Iterable[Dict]):
+        # Подарки по убыванию цены (порядок списков и приоритет при неоднозначном поиске)
+        # с предрассчитанными ценами вывода и депозита в TON
+        self.gifts: List[Dict] = sorted(
+            (
+                {
+                    **gift,
+                    "withdraw_price_ton": gift["price_ton"] * WITHDRAW_PRICE_MULTIPLIER,
+                    "deposit_price_ton": gift["price_ton"] * DEPOSIT_PRICE_MULTIPLIER,
+                }
+                for gift in gifts
+            ),
+            key=lambda gift: gift["price_ton"],
+            reverse=True,
+        )
+        self._by_name: Dict[str, Dict] = {}
+        self._by_compact: Dict[str, Dict] = {}
+        self._by_emoji: Dict[str, List[Dict]] = {}
+        self._by_token: Dict[str, List[Dict]] = {}
+        for gift in self.gifts:
+            tokens = _tokens(gift["name"])
+            self._by_name.setdefault(" ".join(tokens), gift)
+            self._by_compact.setdefault("".join(tokens), gift)
+            if gift["emoji"]:
+                self._by_emoji.setdefault(gift["emoji"], []).append(gift)
+            for token in set(tokens):
+                self._by_token.setdefault(token, []).append(gift)
+        self._usd_rate: Optional[float] = None
+        self._usd_prices: Dict[str, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self.gifts)
+
+    def by_name(self, name: str) -> Optional[Dict]:
+        """Точное совпадение имени (без учета регистра, пробелов, дефисов и апострофов)"""
+        tokens = _tokens(name)
+        return self._by_name.get(" ".join(tokens)) or self._by_compact.get("".join(tokens))
+
+    def by_emoji(self, emoji: str) -> List[Dict]:
+        """Все подарки с этим эмодзи (их может быть несколько)"""
+        return self._by_emoji.get(emoji, [])
+
+    def by_slug(self, slug: str) -> Optional[Dict]:
+        """Подарок по slug уникального подарка ("PlushPepe-1234")"""
+        return self._by_compact.get(_slug_key(slug))
+
+    @lru_cache(maxsize=1024)
+    def find(self, name: str) -> Optional[Dict]:
+        """Найти подарок по имени или названию модели
+
+        Сначала точное совпадение, затем подарки, у которых одно имя содержит
+        другое; кандидаты берутся из индекса токенов (больше общих токенов - выше).
+        """
+        if not name or not name.strip():
+            return None
+        gift = self.by_name(name)
+        if gift:
+            return gift
+        tokens = _tokens(name)
+        compact = "".join(tokens)
+        if not compact:
+            return None
+        scores: Dict[str, int] = {}
+        for token in set(tokens):
+            for candidate in self._by_token.get(token, ()):
+                scores[candidate["name"]] = scores.get(candidate["name"], 0) + 1
+        candidates = sorted(
+            (gift for gift in self.gifts if gift["name"] in scores),
+            key=lambda gift: -scores[gift["name"]],
+        )
+        # Часть слова (например, "Pep") в индекс токенов не попадает - тогда проверяем весь каталог
+        for gift in candidates or self.gifts:
+            gift_compact = "".join(_tokens(gift["name"]))
+            if compact in gift_compact or gift_compact in compact:
+                return gift
+        return None
+
+    def match(self, emoji: Optional[str] = None, name: Optional[str] = None) -> Optional[Dict]:
+        """Подарок для записи релеера: по имени, а по эмодзи - только если он однозначен"""
+        if name:
+            gift = self.by_name(name)
+            if gift:
+                return gift
+        if emoji:
+            gifts = self.by_emoji(emoji)
+            if len(gifts) == 1:
+                return gifts[0]
+        return None
+
+    def prices_usd(self, ton_rate: float) -> Dict[str, Dict]:
+        """Таблица цен в USD по имени подарка (пересчитывается только при смене курса)"""
+        if ton_rate != self._usd_rate:
+            self._usd_prices = {
+                gift["name"]: {
+                    "price_usd": gift["price_ton"] * ton_rate,
+                    "price_usd_black": gift["price_ton_black"] * ton_rate,
+                    "withdraw_price_usd": gift["withdraw_price_ton"] * ton_rate,
+                    "deposit_price_usd": gift["deposit_price_ton"] * ton_rate,
+                }
+                for gift in self.gifts
+            }
+            self._usd_rate = ton_rate
+        return self._usd_prices
+
+
+gift_catalog = GiftCatalog(GIFTS)
 
-GIFTS_CONFIG = {
-    "🐸": {"name": "Plush Pepe", "price_ton": 5750.00, "price_ton_black": 17250.00},
-    "❤️‍🔥": {"name": "Heart Locket", "price_ton": 1029.99, "price_ton_black": 3089.97},
-    "🧢": {"name": "Durov's Cap", "price_ton": 737.00, "price_ton_black": 2211.00},
-    "🍑": {"name": "Precious Peach", "price_ton": 347.90, "price_ton_black": 1043.70},
-    "🗿": {"name": "Heroic Helmet", "price_ton": 220.99, "price_ton_black": 662.97},
-    "💪🏻": {"name": "Mighty Arm", "price_ton": 169.80, "price_ton_black": 509.40},
-    "💎": {"name": "Astral Shard", "price_ton": 128.69, "price_ton_black": 386.07},
-    "🗡": {"name": "Nail Bracelet", "price_ton": 96.99, "price_ton_black": 290.97},
-    "👜": {"name": "Loot Bag", "price_ton": 89.89, "price_ton_black": 269.67},
-    "": {"name": "Mini Oscar", "price_ton": 80.98, "price_ton_black": 242.94},  # Нет эмодзи
-    "🍼": {"name": "Perfume Bottle", "price_ton": 74.98, "price_ton_black": 224.94},
-    "💎": {"name": "Ion Gem", "price_ton": 73.95, "price_ton_black": 221.85},
-    "🧱": {"name": "Artisan Brick", "price_ton": 68.00, "price_ton_black": 204.00},
-    "🧙🏻": {"name": "Magic Potion", "price_ton": 64.99, "price_ton_black": 194.97},
-    "🐈‍⬛": {"name": "Scared Cat", "price_ton": 62.00, "price_ton_black": 186.00},
-    "💍": {"name": "Gem Signet", "price_ton": 55.99, "price_ton_black": 167.97},
-    "🖖🏻": {"name": "Westside Sign", "price_ton": 56.97, "price_ton_black": 170.91},
-    "💍": {"name": "Bonded Ring", "price_ton": 45.50, "price_ton_black": 136.50},
-    "💡": {"name": "Genie Lamp", "price_ton": 42.73, "price_ton_black": 128.19},
-    "⌚️": {"name": "Swiss Watch", "price_ton": 38.10, "price_ton_black": 114.30},
-    "🫦": {"name": "Sharp Tongue", "price_ton": 35.57, "price_ton_black": 106.71},
-    "🐸": {"name": "Kissed Frog", "price_ton": 37.00, "price_ton_black": 111.00},
-    "💍": {"name": "Signet Ring", "price_ton": 29.14, "price_ton_black": 87.42},
-    "🚘": {"name": "Low Rider", "price_ton": 30.84, "price_ton_black": 92.52},
-    "🏍": {"name": "Neko Helmet", "price_ton": 28.86, "price_ton_black": 86.58},
-    "💀": {"name": "Electric Skull", "price_ton": 28.00, "price_ton_black": 84.00},
-    "🚬": {"name": "Vintage Cigar", "price_ton": 25.26, "price_ton_black": 75.78},
-    "🧸": {"name": "Toy Bear", "price_ton": 25.50, "price_ton_black": 76.50},
-    "💍": {"name": "Diamond Ring", "price_ton": 20.60, "price_ton_black": 61.80},
-    "🧍🏼‍♀️": {"name": "Voodoo Doll", "price_ton": 21.90, "price_ton_black": 65.70},
-    "🌹": {"name": "Eternal Rose", "price_ton": 18.00, "price_ton_black": 54.00},
-    "🎃": {"name": "Mad Pumpkin", "price_ton": 14.29, "price_ton_black": 42.87},
-    "💘": {"name": "Cupid Charm", "price_ton": 13.90, "price_ton_black": 41.70},
-    "👩🏻‍🦳": {"name": "Ionic Dryer", "price_ton": 12.99, "price_ton_black": 38.97},
-    "💗": {"name": "Love Potion", "price_ton": 12.29, "price_ton_black": 36.87},
-    "🕸": {"name": "Trapped Heart", "price_ton": 9.85, "price_ton_black": 29.55},
-    "🧹": {"name": "Flying Broom", "price_ton": 8.91, "price_ton_black": 26.73},
-    "🏵": {"name": "Skull Flower", "price_ton": 8.87, "price_ton_black": 26.61},
-    "☠️": {"name": "Crystal Ball", "price_ton": 8.42, "price_ton_black": 25.26},
-    "🎼": {"name": "Record Player", "price_ton": 8.76, "price_ton_black": 26.28},
-    "🎩": {"name": "Top Hat", "price_ton": 9.36, "price_ton_black": 28.08},
-    "👢": {"name": "Sky Stilettos", "price_ton": 7.10, "price_ton_black": 21.30},
-    "🕯": {"name": "Love Candle", "price_ton": 8.00, "price_ton_black": 24.00},
-    "🚬": {"name": "Snoop Cigar", "price_ton": 7.68, "price_ton_black": 23.04},
-    "🔔": {"name": "Sleigh Bell", "price_ton": 7.58, "price_ton_black": 22.74},
-    "🍬": {"name": "Valentine Box", "price_ton": 6.00, "price_ton_black": 18.00},
-    "🌸": {"name": "Sakura Flower", "price_ton": 6.08, "price_ton_black": 18.24},
-    "⭐️": {"name": "Hanging Star", "price_ton": 5.54, "price_ton_black": 16.62},
-    "👁": {"name": "Evil Eye", "price_ton": 5.48, "price_ton_black": 16.44},
-    "🐒": {"name": "Jolly Chimp", "price_ton": 5.26, "price_ton_black": 15.78},
-    "🐰": {"name": "Jelly Bunny", "price_ton": 4.50, "price_ton_black": 13.50},
-    "🍓": {"name": "Berry Box", "price_ton": 4.01, "price_ton_black": 12.03},
-    "🧁": {"name": "Bunny Muffin", "price_ton": 4.29, "price_ton_black": 12.87},
-    "🕯": {"name": "Eternal Candle", "price_ton": 4.12, "price_ton_black": 12.36},
-    "👔": {"name": "Bow Tie", "price_ton": 3.60, "price_ton_black": 10.80},
-    "🧤": {"name": "Snow Mittens", "price_ton": 4.37, "price_ton_black": 13.11},
-    "⌨️": {"name": "Input Key", "price_ton": 3.96, "price_ton_black": 11.88},
-    "🗡": {"name": "Light Sword", "price_ton": 3.99, "price_ton_black": 11.97},
-    "🍄": {"name": "Spy Agaric", "price_ton": 4.47, "price_ton_black": 13.41},
-    "🛍": {"name": "Joyful Bundle", "price_ton": 4.02, "price_ton_black": 12.06},
-    "🪷": {"name": "Lush Bouquet", "price_ton": 3.59, "price_ton_black": 10.77},
-    "👒": {"name": "Witch Hat", "price_ton": 3.79, "price_ton_black": 11.37},
-    "❄️": {"name": "Snow Globe", "price_ton": 4.18, "price_ton_black": 12.54},
-    "🪣": {"name": "Hex Pot", "price_ton": 3.39, "price_ton_black": 10.17},
-    "🧺": {"name": "Spring Basket", "price_ton": 3.21, "price_ton_black": 9.63},
-    "🌿": {"name": "Swag Bag", "price_ton": 3.42, "price_ton_black": 10.26},
-    "🫙": {"name": "Restless Jar", "price_ton": 3.47, "price_ton_black": 10.41},
-    "🥚": {"name": "Easter Egg", "price_ton": 2.94, "price_ton_black": 8.82},
-    "🧑🏻‍🎄": {"name": "Santa Hat", "price_ton": 3.93, "price_ton_black": 11.79},
-    "🌙": {"name": "Moon Pendant", "price_ton": 2.30, "price_ton_black": 6.90},
-    "🐶": {"name": "Snoop Dogg", "price_ton": 2.96, "price_ton_black": 8.88},
-    "📓": {"name": "Star Notepad", "price_ton": 3.25, "price_ton_black": 9.75},
-    "🍷": {"name": "Spiced Wine", "price_ton": 2.86, "price_ton_black": 8.58},
-    "🎁": {"name": "Jack-in-the-Box", "price_ton": 3.12, "price_ton_black": 9.36},
-    "🚀": {"name": "Stellar Rocket", "price_ton": 2.74, "price_ton_black": 8.22},
-    "🧦": {"name": "Fresh Socks", "price_ton": 2.55, "price_ton_black": 7.65},
-    "🪄": {"name": "Party Sparkler", "price_ton": 2.80, "price_ton_black": 8.40},
-    "🍭": {"name": "Hypno Lollipop", "price_ton": 2.69, "price_ton_black": 8.07},
-    "🪅": {"name": "Winter Wreath", "price_ton": 2.90, "price_ton_black": 8.70},
-    "🎂": {"name": "Mousse Cake", "price_ton": 2.64, "price_ton_black": 7.92},
-    "🔔": {"name": "Jingle Bells", "price_ton": 3.12, "price_ton_black": 9.36},
-    "📱": {"name": "Tama Gadget", "price_ton": 2.79, "price_ton_black": 8.37},
-    "💝": {"name": "Cookie Heart", "price_ton": 2.60, "price_ton_black": 7.80},
-    "💩": {"name": "Happy Brownie", "price_ton": 2.49, "price_ton_black": 7.47},
-    "🍪": {"name": "Ginger Cookie", "price_ton": 2.55, "price_ton_black": 7.65},
-    "🎅🏼": {"name": "Big Year", "price_ton": 2.30, "price_ton_black": 6.90},
-    "🤡": {"name": "Jester Hat", "price_ton": 2.46, "price_ton_black": 7.38},
-    "🐍": {"name": "Pet Snake", "price_ton": 2.47, "price_ton_black": 7.41},
-    "🍀": {"name": "Clover Pin", "price_ton": 2.40, "price_ton_black": 7.20},
-    "☕️": {"name": "Holiday Drink", "price_ton": 2.46, "price_ton_black": 7.38},
-    "☀️": {"name": "Faith Amulet", "price_ton": 2.50, "price_ton_black": 7.50},
-    "🍬": {"name": "Candy Cane", "price_ton": 2.25, "price_ton_black": 6.75},
-    "🍮": {"name": "Whip Cupcake", "price_ton": 2.37, "price_ton_black": 7.11},
-    "🧦": {"name": "Xmas Stocking", "price_ton": 2.20, "price_ton_black": 6.60},
-    "🍭": {"name": "Lol Pop", "price_ton": 2.19, "price_ton_black": 6.57},
-    "📆": {"name": "Desk Calendar", "price_ton": 2.25, "price_ton_black": 6.75},
-    "📦": {"name": "Snake Box", "price_ton": 2.34, "price_ton_black": 7.02},
-    "🐍": {"name": "Lunar Snake", "price_ton": 2.24, "price_ton_black": 6.72},
-    "🎉": {"name": "B-Day Candle", "price_ton": 2.29, "price_ton_black": 6.87},
-    "🍽": {"name": "Instant Ramen", "price_ton": 2.17, "price_ton_black": 6.51},
-    "🍦": {"name": "Ice Cream", "price_ton": 2.16, "price_ton_black": 6.48},
-    "🎂": {"name": "Homemade Cake", "price_ton": 2.35, "price_ton_black": 7.05},
-}
 
 def get_gift_by_emoji(emoji: str):
-    """Получить информацию о подарке по эмодзи"""
-    return GIFTS_CONFIG.get(emoji)
+    """Получить информацию о подарке по эмодзи (первый, если эмодзи у нескольких подарков)"""
+    gifts = gift_catalog.by_emoji(emoji)
+    return gifts[0] if gifts else None
 
 def get_gift_by_name(name: str):
     """Получить информацию о подарке по имени"""
-    for emoji, info in GIFTS_CONFIG.items():
-        if info["name"].lower() == name.lower():
-            return {"emoji": emoji, **info}
-    return None
+    return gift_catalog.by_name(name)
+
+def get_available_gifts(relay_gifts: Iterable[Dict]) -> Dict[str, Dict]:
+    """Сгруппировать доступные подарки релеера по подаркам каталога: {имя: подарок}"""
+    available = {}
+    for relay_gift in relay_gifts:
+        gift = gift_catalog.match(relay_gift.get("emoji"), relay_gift.get("gift_name"))
+        if gift and gift["name"] not in available:
+            available[gift["name"]] = gift
+    return available
+
 
 def format_gifts_list() -> str:
     """Форматировать список подарков для отображения"""
     text = "🎁 <b>Подарки</b>\n\n"
     
-    # Сортируем по цене от большего к меньшему
-    sorted_gifts = sorted(GIFTS_CONFIG.items(), key=lambda x: x[1]["price_ton"], reverse=True)
-    
     # Добавляем информацию о стоимости в свернутую цитату
     text += "<blockquote expandable>\n"
     text += "💰 <b>Оценочная стоимость (⚫️ - фон):</b>\n\n"
     
-    # Показываем ВСЕ подарки в свернутой цитате
-    for emoji, info in sorted_gifts:
+    # Показываем ВСЕ подарки в свернутой цитате (по убыванию цены)
+    for info in gift_catalog.gifts:
+        emoji = info["emoji"]
         name = info["name"]
         price_ton = info["price_ton"]
         price_ton_black = info.get("price_ton_black", price_ton)
@@ -148,10 +292,8 @@ def format_all_gifts_list() -> str:
     """Форматировать полный список всех подарков для свернутой цитаты"""
     text = ""
     
-    # Сортируем по цене от большего к меньшему
-    sorted_gifts = sorted(GIFTS_CONFIG.items(), key=lambda x: x[1]["price_ton"], reverse=True)
-    
-    for emoji, info in sorted_gifts:
+    for info in gift_catalog.gifts:
+        emoji = info["emoji"]
         name = info["name"]
         price_ton = info["price_ton"]
         price_ton_black = info.get("price_ton_black", price_ton)
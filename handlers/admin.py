@@ -6,40 +6,25 @@ from aiogram.fsm.state import State, StatesGroup
 from datetime import datetime, timedelta
 from typing import Optional
 import asyncio
-import aiosqlite
 import random
 import string
 import os
-import io
-import csv
 
+from activations import activation_engine
 from database import Database
 from config import ADMIN_IDS
 from keyboards import get_admin_keyboard
 from crypto_pay import crypto_pay
+from broadcast import get_broadcast_engine
+from charts import MATPLOTLIB_AVAILABLE, build_chart
+from exports import (
+    EXPORTS, EXPORT_PERIODS, EXPORT_FORMATS, OPENPYXL_AVAILABLE, TELEGRAM_UPLOAD_LIMIT,
+    build_export, commit_export, supports_incremental,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Импорты для графиков и экспорта
-try:
-    import matplotlib
-    matplotlib.use('Agg')  # Используем backend без GUI
-    import matplotlib.pyplot as plt
-    import matplotlib.dates as mdates
-    from matplotlib import font_manager
-    MATPLOTLIB_AVAILABLE = True
-except ImportError:
-    MATPLOTLIB_AVAILABLE = False
-    logger.warning("matplotlib не установлен, графики будут недоступны")
-
-try:
-    import pandas as pd
-    PANDAS_AVAILABLE = True
-except ImportError:
-    PANDAS_AVAILABLE = False
-    logger.warning("pandas не установлен, экспорт в Excel будет недоступен")
-
 router = Router()
 db = Database()
 
@@ -669,98 +654,24 @@ async def send_broadcast(callback: CallbackQuery, state: FSMContext):
     # Если общая рассылка, продолжаем рассылку пользователям
     # Если рассылка только пользователям или общая рассылка
     if broadcast_type in ["users", "all"]:
-        # Рассылка пользователям
+        # Рассылка пользователям идет в фоне; прогресс - в отдельном сообщении админу
+        # В рассылке используем только InlineKeyboardMarkup
         try:
-            users = await db.get_all_users()
+            broadcast_id = await get_broadcast_engine(bot).start(
+                "users",
+                text,
+                photo_id=photo_id if has_photo else None,
+                reply_markup=reply_markup,
+                admin_chat_id=callback.message.chat.id
+            )
+            await callback.message.answer(f"📤 Рассылка #{broadcast_id} запущена в фоне")
         except Exception as e:
-            logger.error(f"❌ Ошибка при получении списка пользователей: {e}", exc_info=True)
+            logger.error(f"❌ Ошибка при запуске рассылки: {e}", exc_info=True)
             await callback.message.answer(
                 f"❌ <b>Ошибка!</b>\n\n"
-                f"Не удалось получить список пользователей: {str(e)}",
+                f"Не удалось запустить рассылку: {str(e)}",
                 parse_mode="HTML"
             )
-            await state.clear()
-            await callback.answer()
-            return
-        
-        total = len(users)
-        sent = 0
-        failed = 0
-        blocked = 0
-        
-        if total == 0:
-            await callback.message.answer("❌ В базе данных нет пользователей для рассылки")
-            await state.clear()
-            await callback.answer()
-            return
-        
-        await callback.message.answer(f"📤 Начинаю рассылку для {total} пользователей...")
-        logger.info(f"📢 Начинаю рассылку для {total} пользователей")
-        
-        for user in users:
-            user_id = user["user_id"]
-            try:
-                # Проверяем, что reply_markup не является ReplyKeyboardMarkup или ReplyKeyboardRemove (не поддерживается в рассылке)
-                from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
-                final_reply_markup = reply_markup
-                if isinstance(reply_markup, (ReplyKeyboardMarkup, ReplyKeyboardRemove)):
-                    # В рассылке не используем ReplyKeyboardMarkup или ReplyKeyboardRemove, только InlineKeyboardMarkup или None
-                    final_reply_markup = None
-                
-                if has_photo:
-                    await bot.send_photo(
-                        chat_id=user_id,
-                        photo=photo_id,
-                        caption=text,
-                        reply_markup=final_reply_markup,
-                        parse_mode="HTML"
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id=user_id,
-                        text=text,
-                        reply_markup=final_reply_markup,
-                        parse_mode="HTML"
-                    )
-                sent += 1
-                if sent % 10 == 0:  # Логируем каждые 10 сообщений
-                    logger.info(f"📤 Отправлено: {sent}/{total}")
-                await asyncio.sleep(0.05)  # Небольшая задержка чтобы не попасть в лимит
-            except Exception as e:
-                failed += 1
-                error_msg = str(e)
-                error_lower = error_msg.lower()
-                # Игнорируем стандартные ошибки (бот заблокирован, чат не найден и т.д.)
-                if any(phrase in error_lower for phrase in [
-                    "bot was blocked", 
-                    "chat not found", 
-                    "user is deactivated",
-                    "peer_id_invalid",
-                    "forbidden",
-                    "blocked"
-                ]):
-                    blocked += 1
-                    # Это нормальные ошибки, не логируем
-                    pass
-                elif any(phrase in error_lower for phrase in [
-                    "bad request: message is too long",
-                    "bad request: can't parse entities"
-                ]):
-                    # Ошибки форматирования - логируем
-                    logger.warning(f"⚠️ Ошибка форматирования при отправке пользователю {user_id}: {error_msg}")
-                else:
-                    # Логируем нестандартные ошибки с полным текстом
-                    logger.warning(f"⚠️ Ошибка отправки пользователю {user_id}: {error_msg}")
-        
-        result_text = f"✅ <b>Рассылка завершена!</b>\n\n"
-        result_text += f"📊 Всего пользователей: {total}\n"
-        result_text += f"✅ Отправлено: {sent}\n"
-        result_text += f"❌ Ошибок: {failed}"
-        if blocked > 0:
-            result_text += f"\n🚫 Заблокировано: {blocked}"
-        
-        await callback.message.answer(result_text, parse_mode="HTML")
-        logger.info(f"✅ Рассылка завершена: отправлено {sent}, ошибок {failed}, заблокировано {blocked}")
     
     await state.clear()
     await callback.answer()
@@ -774,6 +685,20 @@ async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
+@router.callback_query(F.data.startswith("broadcast_stop_"))
+async def stop_broadcast(callback: CallbackQuery):
+    """Остановить идущую фоновую рассылку"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа")
+        return
+    
+    broadcast_id = int(callback.data.split("_")[-1])
+    if get_broadcast_engine(callback.bot).stop(broadcast_id):
+        await callback.answer("⏹ Рассылка будет остановлена после текущей порции")
+    else:
+        await callback.answer("Рассылка уже завершена", show_alert=True)
+
+
 @router.callback_query(F.data == "admin_deposit")
 async def admin_deposit_menu(callback: CallbackQuery, state: FSMContext):
     """Меню пополнения баланса"""
@@ -2203,31 +2128,18 @@ async def show_general_stats(callback: CallbackQuery):
         await callback.answer("❌ У вас нет доступа")
         return
     
-    # Получаем общую статистику из БД
-    import aiosqlite
+    # Игры, оборот и выигрыши - из дневных агрегатов, без сканирования таблицы games
+    summary = await db.get_games_summary()
+    total_games = summary["games"]
+    total_bets = summary["turnover"]
+    total_wins = summary["wins"]
     
-    async with aiosqlite.connect(db.db_path) as database:
-        database.row_factory = aiosqlite.Row
-        
-        # Всего пользователей
-        async with database.execute("SELECT COUNT(*) as count FROM users") as cursor:
-            total_users = (await cursor.fetchone())["count"]
-        
-        # Всего игр
-        async with database.execute("SELECT COUNT(*) as count FROM games") as cursor:
-            total_games = (await cursor.fetchone())["count"]
-        
-        # Общий оборот (сумма всех ставок, исключая арбуз коины)
-        async with database.execute("SELECT SUM(bet) as total FROM games WHERE currency IS NULL OR currency != 'arbuzz'") as cursor:
-            total_bets = (await cursor.fetchone())["total"] or 0
-        
-        # Общие выигрыши
-        async with database.execute("SELECT SUM(win) as total FROM games WHERE win > 0") as cursor:
-            total_wins = (await cursor.fetchone())["total"] or 0
-        
-        # Общий баланс всех пользователей
-        async with database.execute("SELECT SUM(balance) as total FROM users") as cursor:
-            total_balance = (await cursor.fetchone())["total"] or 0
+    async with db.reader() as database:
+        # Всего пользователей и их общий баланс
+        async with database.execute("SELECT COUNT(*) as count, SUM(balance) as total FROM users") as cursor:
+            row = await cursor.fetchone()
+            total_users = row["count"]
+            total_balance = row["total"] or 0
     
     text = f"""📊 <b>Общая статистика</b>
 
@@ -2248,39 +2160,13 @@ async def show_today_stats(callback: CallbackQuery):
         await callback.answer("❌ У вас нет доступа")
         return
     
-    import aiosqlite
-    today = datetime.now().date()
+    today = datetime.now().date().isoformat()
     
-    async with aiosqlite.connect(db.db_path) as database:
-        database.row_factory = aiosqlite.Row
-        
-        # Новые пользователи сегодня
-        async with database.execute(
-            "SELECT COUNT(*) as count FROM users WHERE DATE(created_at) = ?",
-            (today,)
-        ) as cursor:
-            new_users = (await cursor.fetchone())["count"]
-        
-        # Игры сегодня
-        async with database.execute(
-            "SELECT COUNT(*) as count FROM games WHERE DATE(created_at) = ?",
-            (today,)
-        ) as cursor:
-            games_today = (await cursor.fetchone())["count"]
-        
-        # Оборот сегодня (исключая арбуз коины)
-        async with database.execute(
-            "SELECT SUM(bet) as total FROM games WHERE DATE(created_at) = ? AND (currency IS NULL OR currency != 'arbuzz')",
-            (today,)
-        ) as cursor:
-            bets_today = (await cursor.fetchone())["total"] or 0
-        
-        # Выигрыши сегодня
-        async with database.execute(
-            "SELECT SUM(win) as total FROM games WHERE DATE(created_at) = ? AND win > 0",
-            (today,)
-        ) as cursor:
-            wins_today = (await cursor.fetchone())["total"] or 0
+    new_users = await db.count_new_users(today)
+    summary = await db.get_games_summary(today)
+    games_today = summary["games"]
+    bets_today = summary["turnover"]
+    wins_today = summary["wins"]
     
     text = f"""📅 <b>Статистика за сегодня</b>
 
@@ -2305,50 +2191,20 @@ async def build_user_stats_text(user_id: int, period: str = "all") -> Optional[s
     if not user:
         return None
     
-    # Определяем условие для периода
+    # Статистика игр - из дневных агрегатов пользователя
     if period == "day":
-        date_filter = "DATE(created_at) = DATE('now', 'localtime')"
+        summary = await db.get_user_games_summary(user_id, datetime.now().date().isoformat())
         period_text = "за сегодня"
     else:
-        date_filter = "1=1"
+        summary = await db.get_user_games_summary(user_id)
         period_text = "всего"
     
-    async with aiosqlite.connect(db.db_path) as database:
-        database.row_factory = aiosqlite.Row
-        
-        async with database.execute(
-            f"SELECT COUNT(*) as count FROM games WHERE user_id = ? AND {date_filter}",
-            (user_id,)
-        ) as cursor:
-            total_games = (await cursor.fetchone())["count"]
-        
-        async with database.execute(
-            f"SELECT SUM(bet) as total FROM games WHERE user_id = ? AND {date_filter} AND (currency IS NULL OR currency != 'arbuzz')",
-            (user_id,)
-        ) as cursor:
-            total_bets = (await cursor.fetchone())["total"] or 0
-        
-        async with database.execute(
-            f"SELECT SUM(win) as total FROM games WHERE user_id = ? AND win > 0 AND {date_filter}",
-            (user_id,)
-        ) as cursor:
-            total_wins = (await cursor.fetchone())["total"] or 0
-        
-        async with database.execute(
-            f"SELECT COUNT(*) as count FROM games WHERE user_id = ? AND win > 0 AND {date_filter}",
-            (user_id,)
-        ) as cursor:
-            win_games = (await cursor.fetchone())["count"]
-        
-        # Для статистики за день считаем проигрыши за день
-        if period == "day":
-            async with database.execute(
-                f"SELECT SUM(bet) as total FROM games WHERE user_id = ? AND win = 0 AND {date_filter} AND (currency IS NULL OR currency != 'arbuzz')",
-                (user_id,)
-            ) as cursor:
-                day_lost = (await cursor.fetchone())["total"] or 0
-        else:
-            day_lost = None
+    total_games = summary["games"]
+    total_bets = summary["turnover"]
+    total_wins = summary["wins"]
+    win_games = summary["win_games"]
+    # Для статистики за день считаем проигрыши за день
+    day_lost = summary["lost"] if period == "day" else None
     
     balance = user["balance"]
     username = user.get("username", "Неизвестно")
@@ -3030,11 +2886,6 @@ async def promo_broadcast_all(callback: CallbackQuery):
     
     await callback.answer("📢 Начинаю рассылку...")
     
-    # Получаем всех пользователей
-    users = await db.get_all_users()
-    total_users = len(users)
-    logger.info(f"📢 Начинаю рассылку промокода {promo['code']} для {total_users} пользователей")
-    
     # Используем основной экземпляр бота из callback
     bot = callback.bot
     
@@ -3059,38 +2910,14 @@ async def promo_broadcast_all(callback: CallbackQuery):
         [InlineKeyboardButton(text="🎟️ Активировать промокод", url=promo_link)],
     ])
     
-    sent = 0
-    failed = 0
-    blocked = 0
-    
-    for user in users:
-        try:
-            await bot.send_message(
-                user['user_id'],
-                promo_text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
-            sent += 1
-            if sent % 10 == 0:  # Логируем каждые 10 сообщений
-                logger.info(f"📤 Отправлено: {sent}/{total_users}")
-            await asyncio.sleep(0.05)  # Задержка между сообщениями
-        except Exception as e:
-            failed += 1
-            error_msg = str(e).lower()
-            if "blocked" in error_msg or "forbidden" in error_msg:
-                blocked += 1
-            logger.debug(f"Ошибка при отправке промокода пользователю {user['user_id']}: {e}")
-    
-    result_text = f"✅ <b>Рассылка завершена!</b>\n\n"
-    result_text += f"📊 Всего пользователей: {total_users}\n"
-    result_text += f"✅ Отправлено: {sent}\n"
-    result_text += f"❌ Ошибок: {failed}"
-    if blocked > 0:
-        result_text += f"\n🚫 Заблокировано: {blocked}"
-    
-    await callback.message.answer(result_text, parse_mode="HTML")
-    logger.info(f"✅ Рассылка завершена: отправлено {sent}, ошибок {failed}")
+    # Рассылка идет в фоне; прогресс - в отдельном сообщении админу
+    broadcast_id = await get_broadcast_engine(bot).start(
+        "promo",
+        promo_text,
+        reply_markup=keyboard,
+        admin_chat_id=callback.message.chat.id
+    )
+    logger.info(f"📢 Рассылка промокода {promo['code']} запущена: #{broadcast_id}")
 
 
 @router.callback_query(F.data == "promo_cancel_broadcast")
@@ -3372,6 +3199,7 @@ async def handle_edit_activations(message: Message, state: FSMContext):
         return
     
     await db.update_promo_code(promo_id, total_activations=activations)
+    activation_engine.reopen_promo(promo_id)
     await message.answer(f"✅ Количество активаций обновлено: {activations}")
     await state.clear()
 
@@ -3615,209 +3443,98 @@ async def admin_export_menu(callback: CallbackQuery):
 
 @router.callback_query(F.data.startswith("export_"))
 async def export_data(callback: CallbackQuery):
-    """Экспорт данных в CSV"""
+    """Экспорт данных: выбор периода"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет доступа")
         return
     
     export_type = callback.data.replace("export_", "")
+    if export_type not in EXPORTS and export_type != "all":
+        await callback.answer("❌ Неизвестный тип экспорта", show_alert=True)
+        return
+    
+    buttons = []
+    for period, (title, _days) in EXPORT_PERIODS.items():
+        if period == "new" and not supports_incremental(export_type):
+            continue
+        buttons.append([InlineKeyboardButton(text=title, callback_data=f"exportp_{export_type}_{period}")])
+    buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_export")])
     
+    await callback.message.edit_text(
+        "📥 <b>Экспорт данных</b>\n\n"
+        "Выберите период:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("exportp_"))
+async def export_data_period(callback: CallbackQuery):
+    """Экспорт данных: выбор формата"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа")
+        return
+    
+    _, export_type, period = callback.data.split("_", 2)
+    if export_type == "all":
+        # Все данные выгружаются одним Excel-файлом с листами
+        await send_export(callback, export_type, period, "xlsx")
+        return
+    
+    buttons = [[
+        InlineKeyboardButton(text=title, callback_data=f"exportf_{export_type}_{period}_{fmt}")
+        for fmt, title in EXPORT_FORMATS.items()
+        if fmt != "xlsx" or OPENPYXL_AVAILABLE
+    ]]
+    buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data=f"export_{export_type}")])
+    
+    await callback.message.edit_text(
+        "📥 <b>Экспорт данных</b>\n\n"
+        "Выберите формат файла:",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("exportf_"))
+async def export_data_format(callback: CallbackQuery):
+    """Экспорт данных: формирование и отправка файла"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа")
+        return
+    
+    _, export_type, period, fmt = callback.data.split("_", 3)
+    await send_export(callback, export_type, period, fmt)
+
+
+async def send_export(callback: CallbackQuery, export_type: str, period: str, fmt: str):
+    """Сформировать файл выгрузки потоково и отправить его админу"""
+    await callback.answer("⏳ Генерирую файл...")
+    result = None
     try:
-        await callback.answer("⏳ Генерирую файл...")
-        
-        # Создаем CSV в памяти
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        if export_type == "users":
-            users = await db.get_all_users()
-            writer.writerow(["ID", "Username", "Баланс (USD)", "Баланс реферальный", "Заблокирован", "Отыгрыш", "Объем", "Заработано", "Реферальный код", "Приглашен", "Создан"])
-            for user in users:
-                writer.writerow([
-                    user.get("user_id"),
-                    user.get("username", ""),
-                    user.get("balance", 0),
-                    user.get("referral_balance", 0),
-                    user.get("locked_balance", 0),
-                    user.get("rollover_requirement", 0),
-                    user.get("total_volume", 0),
-                    user.get("total_earned", 0),
-                    user.get("referral_code", ""),
-                    user.get("referred_by", ""),
-                    user.get("created_at", "")
-                ])
-            filename = "users_export.csv"
-            caption = "📊 Экспорт пользователей"
-            
-        elif export_type == "deposits":
-            deposits = await db.get_all_deposits()
-            writer.writerow(["ID", "User ID", "Username", "Сумма (USD)", "Метод", "Статус", "Дата"])
-            for deposit in deposits:
-                user = await db.get_user(deposit.get("user_id"))
-                username = user.get("username", "N/A") if user else "N/A"
-                writer.writerow([
-                    deposit.get("id"),
-                    deposit.get("user_id"),
-                    username,
-                    deposit.get("amount", 0),
-                    deposit.get("method", ""),
-                    deposit.get("status", ""),
-                    deposit.get("created_at", "")
-                ])
-            filename = "deposits_export.csv"
-            caption = "💰 Экспорт депозитов"
-            
-        elif export_type == "withdrawals":
-            withdrawals = await db.get_all_withdrawals()
-            writer.writerow(["ID", "User ID", "Username", "Сумма (USD)", "Метод", "Подарок", "Статус", "Дата"])
-            for withdrawal in withdrawals:
-                user = await db.get_user(withdrawal.get("user_id"))
-                username = user.get("username", "N/A") if user else "N/A"
-                gift_info = ""
-                if withdrawal.get("gift_emoji") or withdrawal.get("gift_name"):
-                    gift_info = f"{withdrawal.get('gift_emoji', '')} {withdrawal.get('gift_name', '')}"
-                writer.writerow([
-                    withdrawal.get("id"),
-                    withdrawal.get("user_id"),
-                    username,
-                    withdrawal.get("amount", 0),
-                    withdrawal.get("method", ""),
-                    gift_info,
-                    withdrawal.get("status", ""),
-                    withdrawal.get("created_at", "")
-                ])
-            filename = "withdrawals_export.csv"
-            caption = "💸 Экспорт выводов"
-            
-        elif export_type == "games":
-            games = await db.get_all_games()
-            writer.writerow(["ID", "User ID", "Username", "Тип игры", "Ставка", "Результат", "Выигрыш", "Дата"])
-            for game in games:
-                user = await db.get_user(game.get("user_id"))
-                username = user.get("username", "N/A") if user else "N/A"
-                writer.writerow([
-                    game.get("id"),
-                    game.get("user_id"),
-                    username,
-                    game.get("game_type", ""),
-                    game.get("bet", 0),
-                    game.get("result", 0),
-                    game.get("win", 0),
-                    game.get("created_at", "")
-                ])
-            filename = "games_export.csv"
-            caption = "🎮 Экспорт игр"
-            
-        elif export_type == "promo":
-            promo_codes = await db.get_all_promo_codes()
-            writer.writerow(["ID", "Код", "Сумма", "Всего активаций", "Осталось", "Требует подписки", "Канал", "Отыгрыш", "Тип депозита", "Мин. депозит", "Создан"])
-            for promo in promo_codes:
-                writer.writerow([
-                    promo.get("id"),
-                    promo.get("code", ""),
-                    promo.get("amount", 0),
-                    promo.get("total_activations", 0),
-                    promo.get("remaining_activations", 0),
-                    promo.get("requires_channel_subscription", False),
-                    promo.get("channel_username", ""),
-                    promo.get("rollover_multiplier", 1.0),
-                    promo.get("deposit_type", ""),
-                    promo.get("min_deposit", 0),
-                    promo.get("created_at", "")
-                ])
-            filename = "promo_export.csv"
-            caption = "🎟️ Экспорт промокодов"
-            
-        elif export_type == "partners":
-            partners = await db.get_all_partners()
-            writer.writerow(["ID", "User ID", "Username", "Префикс", "Процент", "Уровни", "Рефералов", "Объем", "Создан"])
-            for partner in partners:
-                user = await db.get_user(partner.get("user_id"))
-                username = user.get("username", "N/A") if user else "N/A"
-                writer.writerow([
-                    partner.get("id"),
-                    partner.get("user_id"),
-                    username,
-                    partner.get("prefix", ""),
-                    partner.get("referral_percent", 0),
-                    partner.get("level_percents", ""),
-                    partner.get("total_referrals", 0),
-                    partner.get("total_volume", 0),
-                    partner.get("created_at", "")
-                ])
-            filename = "partners_export.csv"
-            caption = "🤝 Экспорт партнеров"
-            
-        elif export_type == "all":
-            # Экспорт всех данных в один файл (разные листы если Excel, или несколько CSV)
-            if PANDAS_AVAILABLE:
-                # Используем Excel с несколькими листами
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    # Пользователи
-                    users = await db.get_all_users()
-                    if users:
-                        df_users = pd.DataFrame(users)
-                        df_users.to_excel(writer, sheet_name='Пользователи', index=False)
-                    
-                    # Депозиты
-                    deposits = await db.get_all_deposits()
-                    if deposits:
-                        df_deposits = pd.DataFrame(deposits)
-                        df_deposits.to_excel(writer, sheet_name='Депозиты', index=False)
-                    
-                    # Выводы
-                    withdrawals = await db.get_all_withdrawals()
-                    if withdrawals:
-                        df_withdrawals = pd.DataFrame(withdrawals)
-                        df_withdrawals.to_excel(writer, sheet_name='Выводы', index=False)
-                    
-                    # Игры
-                    games = await db.get_all_games()
-                    if games:
-                        df_games = pd.DataFrame(games)
-                        df_games.to_excel(writer, sheet_name='Игры', index=False)
-                
-                output.seek(0)
-                file_data = output.read()
-                file_obj = BufferedInputFile(file_data, filename="all_data_export.xlsx")
-                await callback.message.answer_document(
-                    document=file_obj,
-                    caption="📦 Экспорт всех данных (Excel)"
-                )
-                await callback.answer("✅ Файл отправлен")
-                return
-            else:
-                # Если pandas недоступен, отправляем CSV с пользователями
-                users = await db.get_all_users()
-                writer.writerow(["ID", "Username", "Баланс (USD)", "Создан"])
-                for user in users:
-                    writer.writerow([
-                        user.get("user_id"),
-                        user.get("username", ""),
-                        user.get("balance", 0),
-                        user.get("created_at", "")
-                    ])
-                filename = "all_data_export.csv"
-                caption = "📦 Экспорт всех данных (CSV)"
-        else:
-            await callback.answer("❌ Неизвестный тип экспорта", show_alert=True)
+        result = await build_export(export_type, period, fmt)
+        if result.size > TELEGRAM_UPLOAD_LIMIT:
+            await callback.message.answer(
+                f"❌ Файл слишком большой ({result.size / 1024 / 1024:.1f} МБ, лимит Telegram 50 МБ).\n"
+                f"Выберите меньший период или формат CSV.gz."
+            )
             return
         
-        # Отправляем CSV файл
-        output.seek(0)
-        file_data = output.getvalue().encode('utf-8-sig')  # UTF-8 с BOM для Excel
-        file_obj = BufferedInputFile(file_data, filename=filename)
-        
         await callback.message.answer_document(
-            document=file_obj,
-            caption=caption
+            document=result.input_file(),
+            caption=f"{result.caption}\nСтрок: {result.rows}"
         )
-        await callback.answer("✅ Файл отправлен")
+        # Курсор «с прошлой выгрузки» сдвигаем только после успешной отправки
+        await commit_export(result)
         
     except Exception as e:
         logger.error(f"❌ Ошибка при экспорте данных: {e}", exc_info=True)
-        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
+        await callback.message.answer(f"❌ Ошибка экспорта: {str(e)}")
+    finally:
+        if result is not None:
+            result.close()
 
 
 @router.callback_query(F.data == "admin_charts")
@@ -3902,275 +3619,18 @@ async def generate_chart(callback: CallbackQuery):
     try:
         await callback.answer("⏳ Генерирую график...")
         
-        # Настройка русского шрифта для matplotlib
-        try:
-            plt.rcParams['font.family'] = 'DejaVu Sans'
-            plt.rcParams['axes.unicode_minus'] = False
-        except:
-            pass
-        
-        fig, ax = plt.subplots(figsize=(12, 6))
-        
-        if chart_type == "profit":
-            # График доходов/расходов
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=30)
-            
-            deposits = await db.get_deposits_by_date_range(start_date, end_date)
-            withdrawals = await db.get_withdrawals_by_date_range(start_date, end_date)
-            
-            # Группируем по дням
-            deposit_dict = {}
-            withdrawal_dict = {}
-            
-            for deposit in deposits:
-                try:
-                    created_at = deposit.get("created_at", "")
-                    if created_at:
-                        # Пробуем разные форматы даты
-                        try:
-                            date = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
-                        except:
-                            try:
-                                date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").date()
-                            except:
-                                date = datetime.strptime(created_at.split()[0], "%Y-%m-%d").date()
-                        deposit_dict[date] = deposit_dict.get(date, 0) + deposit.get("amount", 0)
-                except:
-                    pass
-            
-            for withdrawal in withdrawals:
-                try:
-                    created_at = withdrawal.get("created_at", "")
-                    if created_at:
-                        # Пробуем разные форматы даты
-                        try:
-                            date = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
-                        except:
-                            try:
-                                date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").date()
-                            except:
-                                date = datetime.strptime(created_at.split()[0], "%Y-%m-%d").date()
-                        withdrawal_dict[date] = withdrawal_dict.get(date, 0) + withdrawal.get("amount", 0)
-                except:
-                    pass
-            
-            # Создаем список всех дат
-            all_dates = sorted(set(list(deposit_dict.keys()) + list(withdrawal_dict.keys())))
-            
-            deposit_values = [deposit_dict.get(date, 0) for date in all_dates]
-            withdrawal_values = [withdrawal_dict.get(date, 0) for date in all_dates]
-            profit_values = [deposit_values[i] - withdrawal_values[i] for i in range(len(all_dates))]
-            
-            ax.plot(all_dates, deposit_values, label='Депозиты', marker='o', linewidth=2)
-            ax.plot(all_dates, withdrawal_values, label='Выводы', marker='s', linewidth=2)
-            ax.plot(all_dates, profit_values, label='Прибыль', marker='^', linewidth=2, linestyle='--')
-            
-            ax.set_title('Доходы и расходы за последние 30 дней', fontsize=14, fontweight='bold')
-            ax.set_xlabel('Дата')
-            ax.set_ylabel('Сумма (USD)')
-            ax.legend()
-            ax.grid(True, alpha=0.3)
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            
-        elif chart_type == "deposits":
-            # График депозитов по дням
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=30)
-            
-            deposits = await db.get_deposits_by_date_range(start_date, end_date)
-            
-            deposit_dict = {}
-            for deposit in deposits:
-                try:
-                    created_at = deposit.get("created_at", "")
-                    if created_at:
-                        try:
-                            date = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
-                        except:
-                            try:
-                                date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").date()
-                            except:
-                                date = datetime.strptime(created_at.split()[0], "%Y-%m-%d").date()
-                        deposit_dict[date] = deposit_dict.get(date, 0) + deposit.get("amount", 0)
-                except:
-                    pass
-            
-            dates = sorted(deposit_dict.keys())
-            values = [deposit_dict[date] for date in dates]
-            
-            ax.bar(dates, values, color='green', alpha=0.7)
-            ax.set_title('Депозиты за последние 30 дней', fontsize=14, fontweight='bold')
-            ax.set_xlabel('Дата')
-            ax.set_ylabel('Сумма (USD)')
-            ax.grid(True, alpha=0.3, axis='y')
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            
-        elif chart_type == "withdrawals":
-            # График выводов по дням
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=30)
-            
-            withdrawals = await db.get_withdrawals_by_date_range(start_date, end_date)
-            
-            withdrawal_dict = {}
-            for withdrawal in withdrawals:
-                try:
-                    created_at = withdrawal.get("created_at", "")
-                    if created_at:
-                        try:
-                            date = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
-                        except:
-                            try:
-                                date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").date()
-                            except:
-                                date = datetime.strptime(created_at.split()[0], "%Y-%m-%d").date()
-                        withdrawal_dict[date] = withdrawal_dict.get(date, 0) + withdrawal.get("amount", 0)
-                except:
-                    pass
-            
-            dates = sorted(withdrawal_dict.keys())
-            values = [withdrawal_dict[date] for date in dates]
-            
-            ax.bar(dates, values, color='red', alpha=0.7)
-            ax.set_title('Выводы за последние 30 дней', fontsize=14, fontweight='bold')
-            ax.set_xlabel('Дата')
-            ax.set_ylabel('Сумма (USD)')
-            ax.grid(True, alpha=0.3, axis='y')
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            
-        elif chart_type == "games":
-            # График игр по типам
-            games = await db.get_all_games()
-            
-            game_types = {}
-            for game in games:
-                game_type = game.get("game_type", "unknown")
-                game_types[game_type] = game_types.get(game_type, 0) + 1
-            
-            if game_types:
-                types = list(game_types.keys())
-                counts = list(game_types.values())
-                
-                ax.bar(types, counts, color='blue', alpha=0.7)
-                ax.set_title('Распределение игр по типам', fontsize=14, fontweight='bold')
-                ax.set_xlabel('Тип игры')
-                ax.set_ylabel('Количество')
-                ax.grid(True, alpha=0.3, axis='y')
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-            else:
-                ax.text(0.5, 0.5, 'Нет данных', ha='center', va='center', fontsize=16)
-                ax.set_title('Распределение игр по типам', fontsize=14, fontweight='bold')
-            
-        elif chart_type == "users":
-            # График регистраций пользователей
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=30)
-            
-            users = await db.get_all_users()
-            
-            user_dict = {}
-            for user in users:
-                created_at = user.get("created_at", "")
-                if created_at:
-                    try:
-                        try:
-                            date = datetime.fromisoformat(created_at.replace('Z', '+00:00')).date()
-                        except:
-                            try:
-                                date = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").date()
-                            except:
-                                date = datetime.strptime(created_at.split()[0], "%Y-%m-%d").date()
-                        if start_date.date() <= date <= end_date.date():
-                            user_dict[date] = user_dict.get(date, 0) + 1
-                    except:
-                        pass
-            
-            if user_dict:
-                dates = sorted(user_dict.keys())
-                values = [user_dict[date] for date in dates]
-                
-                ax.bar(dates, values, color='purple', alpha=0.7)
-                ax.set_title('Регистрации пользователей за последние 30 дней', fontsize=14, fontweight='bold')
-                ax.set_xlabel('Дата')
-                ax.set_ylabel('Количество')
-                ax.grid(True, alpha=0.3, axis='y')
-                ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m'))
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-            else:
-                ax.text(0.5, 0.5, 'Нет данных', ha='center', va='center', fontsize=16)
-                ax.set_title('Регистрации пользователей', fontsize=14, fontweight='bold')
-            
-        elif chart_type == "overview":
-            # Общая статистика (pie chart)
-            deposits = await db.get_all_deposits()
-            withdrawals = await db.get_all_withdrawals()
-            users = await db.get_all_users()
-            games = await db.get_all_games()
-            
-            total_deposits = sum(d.get("amount", 0) for d in deposits)
-            total_withdrawals = sum(w.get("amount", 0) for w in withdrawals)
-            total_users = len(users)
-            total_games = len(games)
-            
-            # Создаем несколько графиков
-            fig, axes = plt.subplots(2, 2, figsize=(14, 10))
-            
-            # График 1: Доходы vs Расходы
-            axes[0, 0].pie([total_deposits, total_withdrawals], 
-                          labels=['Депозиты', 'Выводы'],
-                          autopct='%1.1f%%',
-                          colors=['green', 'red'])
-            axes[0, 0].set_title('Депозиты vs Выводы', fontweight='bold')
-            
-            # График 2: Прибыль
-            profit = total_deposits - total_withdrawals
-            axes[0, 1].bar(['Прибыль'], [profit], color='blue' if profit > 0 else 'red')
-            axes[0, 1].set_title(f'Общая прибыль: ${profit:.2f}', fontweight='bold')
-            axes[0, 1].set_ylabel('USD')
-            
-            # График 3: Пользователи
-            axes[1, 0].bar(['Пользователи'], [total_users], color='purple')
-            axes[1, 0].set_title(f'Всего пользователей: {total_users}', fontweight='bold')
-            axes[1, 0].set_ylabel('Количество')
-            
-            # График 4: Игры
-            axes[1, 1].bar(['Игры'], [total_games], color='orange')
-            axes[1, 1].set_title(f'Всего игр: {total_games}', fontweight='bold')
-            axes[1, 1].set_ylabel('Количество')
-            
-            plt.tight_layout()
-        
-        # Сохраняем график в память
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
-        buffer.seek(0)
-        
-        file_obj = BufferedInputFile(buffer.read(), filename=f"chart_{chart_type}.png")
+        # Агрегация в SQLite, отрисовка - в отдельном процессе
+        image = await build_chart(db, chart_type)
+        file_obj = BufferedInputFile(image, filename=f"chart_{chart_type}.png")
         
         await callback.message.answer_photo(
             photo=file_obj,
             caption=f"📈 График: {chart_type}"
         )
         
-        plt.close(fig)
-        await callback.answer("✅ График отправлен")
-        
     except Exception as e:
         logger.error(f"❌ Ошибка при генерации графика: {e}", exc_info=True)
-        await callback.answer(f"❌ Ошибка: {str(e)}", show_alert=True)
-        try:
-            plt.close('all')
-        except:
-            pass
+        await callback.message.answer(f"❌ Ошибка построения графика: {str(e)}")
 
 
 @router.callback_query(F.data == "admin_lotteries")
@@ -4813,38 +4273,10 @@ async def send_lottery_broadcast(bot: Bot, lottery_id: int, lottery_data: dict):
             except Exception as e:
                 logger.error(f"❌ Ошибка при отправке в {channel}: {e}")
         
-        # Рассылаем всем пользователям
+        # Рассылаем всем пользователям (в фоне)
         try:
-            all_users = await db.get_all_users()
-            logger.info(f"📢 Начинаю рассылку лотереи #{lottery_id} всем пользователям. Всего пользователей: {len(all_users)}")
-            
-            success_count = 0
-            error_count = 0
-            
-            for user in all_users:
-                user_id = user.get("user_id")
-                if not user_id or user_id == 0:
-                    continue
-                
-                try:
-                    await bot.send_message(
-                        chat_id=user_id,
-                        text=text,
-                        reply_markup=keyboard,
-                        parse_mode="HTML"
-                    )
-                    success_count += 1
-                    
-                    if success_count % 30 == 0:
-                        await asyncio.sleep(1)
-                        
-                except Exception as e:
-                    error_count += 1
-                    if error_count % 10 == 0:
-                        logger.warning(f"Ошибка при отправке пользователю {user_id} (ошибок уже: {error_count}): {e}")
-                    continue
-            
-            logger.info(f"✅ Рассылка лотереи завершена. Успешно: {success_count}, Ошибок: {error_count}")
+            broadcast_id = await get_broadcast_engine(bot).start("lottery", text, reply_markup=keyboard)
+            logger.info(f"📢 Рассылка лотереи #{lottery_id} запущена: #{broadcast_id}")
             
         except Exception as e:
             logger.error(f"❌ Ошибка при рассылке всем пользователям: {e}", exc_info=True)
@@ -5035,8 +4467,9 @@ async def lottery_finish_draw(callback: CallbackQuery):
                 logger.error(f"Ошибка при отправке уведомления победителю: {e}")
         
         elif prize["prize_type"] == "gift":
-            # Ищем подарок
-            gift = await db.get_available_relay_gift(gift_name=prize["prize_value"])
+            # Резервируем подарок
+            from gift_allocator import gift_allocator
+            gift = await gift_allocator.reserve(ticket["user_id"], gift_name=prize["prize_value"])
             if gift:
                 # Отправляем подарок (нужно будет добавить логику отправки)
                 from relay_account import get_relay_client
@@ -5044,9 +4477,14 @@ async def lottery_finish_draw(callback: CallbackQuery):
                 if relay_client:
                     try:
                         # Логика отправки подарка
-                        await db.mark_gift_as_transferred(gift["message_id"], ticket["user_id"])
+                        await gift_allocator.confirm(gift["message_id"], ticket["user_id"])
                     except Exception as e:
+                        gift_allocator.release(gift["message_id"])
                         logger.error(f"Ошибка при отправке подарка: {e}")
+                else:
+                    # Без релеера подарок не передать - возвращаем резерв
+                    gift_allocator.release(gift["message_id"])
+                    logger.warning(f"🎁 Релеер недоступен, резерв подарка {gift['message_id']} снят")
                 
                 # Отправляем уведомление
                 try:
@@ -4,6 +4,8 @@ from aiogram.types import Message, ChatMemberUpdated
 from aiogram.filters import ChatMemberUpdatedFilter, IS_MEMBER, IS_NOT_MEMBER
 
 from database import Database
+from config import REQUIRED_CHANNEL_ID
+from utils.subscription import update_subscription_from_member
 
 router = Router(name="chat_tracking")
 db = Database()
@@ -74,6 +76,14 @@ async def bot_removed_from_chat(event: ChatMemberUpdated):
         logger.error(f"❌ Ошибка при обработке удаления бота из чата: {e}", exc_info=True)
 
 
+@router.chat_member(F.chat.id == REQUIRED_CHANNEL_ID)
+async def required_channel_member_updated(event: ChatMemberUpdated):
+    """Подписка/отписка от обязательного канала - обновляем кэш проверки подписки"""
+    user_id = event.new_chat_member.user.id
+    subscribed = update_subscription_from_member(event.chat.id, user_id, event.new_chat_member.status)
+    logger.info(f"📢 Пользователь {user_id} {'подписался на' if subscribed else 'отписался от'} канал(а) {event.chat.id}")
+
+
 @router.message(F.chat.type.in_(['group', 'supergroup']) & F.from_user.is_bot)
 async def track_bot_messages(message: Message, bot: Bot):
     """Отслеживание сообщений от бота в группах - выполняется в фоне, не блокирует обработку"""
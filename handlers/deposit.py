@@ -1,14 +1,14 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import random
 import logging
-import os
 import aiosqlite
 
 from database import Database
+from media_cache import media_registry
 from config import TON_ADDRESS, MAX_DEPOSIT
 from crypto_pay import crypto_pay
 from ton_price import get_ton_to_usd_rate, usd_to_ton, ton_to_usd
@@ -44,47 +44,38 @@ async def send_photo_deposit(callback: CallbackQuery, image_filename: str, text:
         # Если редактирование не удалось, отправляем новое сообщение с фото
         logger.warning(f"Не удалось отредактировать сообщение: {edit_error}. Отправляю новое сообщение с фото.")
     
-    # Отправляем новое сообщение с фото
-    image_path = os.path.join(os.getcwd(), image_filename)
-    if os.path.exists(image_path):
-        photo_bytes = None
-        use_fs_input = False
-        
-        try:
-            # Читаем файл в байты для более надежной отправки
-            with open(image_path, 'rb') as f:
-                photo_bytes = f.read()
-            
-            # Проверяем, что файл не пустой
-            if len(photo_bytes) == 0:
-                logger.warning(f"Файл {image_filename} пустой, пробую использовать FSInputFile")
-                use_fs_input = True
-        except Exception as e:
-            logger.warning(f"Не удалось прочитать файл {image_filename} в байты: {e}. Пробую использовать FSInputFile")
-            use_fs_input = True
-        
-        try:
-            # Используем FSInputFile для прямого чтения или BufferedInputFile для байтов
-            if use_fs_input:
-                photo = FSInputFile(image_path)
-            else:
-                photo = BufferedInputFile(photo_bytes, filename=image_filename)
-            
-            await callback.message.answer_photo(
-                photo=photo,
-                caption=text,
-                reply_markup=keyboard,
-                parse_mode="HTML"
-            )
+    # Отправляем новое сообщение с фото (после первой загрузки - по file_id из media_cache)
+    try:
+        sent = await media_registry.answer_photo(
+            callback.message,
+            image_filename,
+            caption=text,
+            reply_markup=keyboard,
+            parse_mode="HTML"
+        )
+        if sent is not None:
             return True
-        except Exception as e:
-            logger.error(f"Ошибка при отправке фото {image_filename}: {e}")
-            await callback.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
-            return False
-    else:
-        logger.warning(f"Файл {image_filename} не найден по пути: {image_path}")
-        await callback.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
-        return False
+        logger.warning(f"Файл {image_filename} не найден или пустой")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке фото {image_filename}: {e}")
+    await callback.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+    return False
+
+
+def _insufficient_withdrawal_text(balance: float, locked_balance: float,
+                                  rollover_requirement: float, html: bool = True) -> str:
+    """Текст отказа в выводе по балансу на момент запроса"""
+    bold = (lambda text: f"<b>{text}</b>") if html else (lambda text: text)
+    if locked_balance > 0 and rollover_requirement > 0:
+        return (
+            f"❌ {bold('Недостаточно средств для вывода')}\n\n"
+            f"💰 Доступно для вывода: ${balance:.2f}\n"
+            f"🔒 Заблокировано (с отыгрышем): ${locked_balance:.2f}\n"
+            f"📊 Требуется отыграть: ${rollover_requirement:.2f}\n\n"
+            f"Максимальная сумма для вывода: {bold(f'${balance + locked_balance:.2f}')}"
+        )
+    withdrawable = balance + locked_balance if rollover_requirement == 0 else balance
+    return f"❌ Недостаточно средств на балансе. Доступно: ${withdrawable:.2f}"
 
 
 async def safe_edit_message(callback: CallbackQuery, text: str, keyboard=None):
@@ -268,7 +259,7 @@ async def withdraw_gifts_menu(callback: CallbackQuery):
         await callback.answer("❌ Недостаточно средств на балансе", show_alert=True)
         return
     
-    from gifts import GIFTS_CONFIG
+    from gifts import get_available_gifts
     from keyboards import get_gifts_withdrawal_keyboard
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     
@@ -276,28 +267,8 @@ async def withdraw_gifts_menu(callback: CallbackQuery):
     available_relay_gifts = await db.get_all_relay_gifts(include_transferred=False)
     logger.info(f"📊 Найдено доступных подарков в БД релеера: {len(available_relay_gifts)}")
     
-    # Создаем словарь доступных подарков из БД (группируем по эмодзи и названию)
-    available_gifts_dict = {}
-    for relay_gift in available_relay_gifts:
-        emoji = relay_gift.get("emoji", "")
-        gift_name = relay_gift.get("gift_name", "")
-        
-        # Ищем подарок в конфиге по эмодзи или названию
-        gift_config = None
-        for config_emoji, config_info in GIFTS_CONFIG.items():
-            # Сравниваем по эмодзи (если есть) или по названию
-            if emoji and config_emoji == emoji:
-                gift_config = {"emoji": config_emoji, **config_info}
-                break
-            elif gift_name and config_info.get("name", "").lower() == gift_name.lower():
-                gift_config = {"emoji": config_emoji, **config_info}
-                break
-        
-        if gift_config:
-            # Используем ключ из конфига (эмодзи) для группировки
-            key = config_emoji if config_emoji else gift_name
-            if key not in available_gifts_dict:
-                available_gifts_dict[key] = gift_config
+    # Создаем словарь доступных подарков из БД (группируем по подарку каталога)
+    available_gifts_dict = get_available_gifts(available_relay_gifts)
     
     # Если нет доступных подарков в БД, показываем сообщение
     if not available_gifts_dict:
@@ -349,32 +320,14 @@ async def gifts_page_handler(callback: CallbackQuery):
     except (ValueError, IndexError):
         page = 0
     
-    from gifts import GIFTS_CONFIG
+    from gifts import get_available_gifts
     from keyboards import get_gifts_withdrawal_keyboard
     
     # Получаем доступные подарки из БД релеера (обновляем список)
     available_relay_gifts = await db.get_all_relay_gifts(include_transferred=False)
     
     # Создаем словарь доступных подарков из БД
-    available_gifts_dict = {}
-    for relay_gift in available_relay_gifts:
-        emoji = relay_gift.get("emoji", "")
-        gift_name = relay_gift.get("gift_name", "")
-        
-        # Ищем подарок в конфиге по эмодзи или названию
-        gift_config = None
-        for config_emoji, config_info in GIFTS_CONFIG.items():
-            if emoji and config_emoji == emoji:
-                gift_config = {"emoji": config_emoji, **config_info}
-                break
-            elif gift_name and config_info.get("name", "").lower() == gift_name.lower():
-                gift_config = {"emoji": config_emoji, **config_info}
-                break
-        
-        if gift_config:
-            key = config_emoji if config_emoji else gift_name
-            if key not in available_gifts_dict:
-                available_gifts_dict[key] = gift_config
+    available_gifts_dict = get_available_gifts(available_relay_gifts)
     
     if not available_gifts_dict:
         text = f"""🎁 <b>Вывод подарками</b>
@@ -426,18 +379,12 @@ async def withdraw_gift(callback: CallbackQuery):
     
     gift_name = parts[2].replace("_", " ") if len(parts) > 2 else ""
     
-    from gifts import GIFTS_CONFIG, get_gift_by_name
+    from gifts import get_gift_by_name, gift_catalog
+    from gift_allocator import gift_allocator
     
-    # Ищем подарок по имени
+    # Ищем подарок по имени (дефисы в callback_data заменены на "_", каталог их не различает)
     gift_info = get_gift_by_name(gift_name)
     
-    # Если не нашли, ищем в конфиге напрямую
-    if not gift_info:
-        for emoji, info in GIFTS_CONFIG.items():
-            if info["name"].lower() == gift_name.lower():
-                gift_info = {"emoji": emoji, **info}
-                break
-    
     if not gift_info:
         await callback.answer("❌ Подарок не найден", show_alert=True)
         return
@@ -446,30 +393,21 @@ async def withdraw_gift(callback: CallbackQuery):
     gift_emoji = gift_info.get("emoji", "")
     gift_name_for_search = gift_info.get("name")
     
-    # Цена подарка в TON (из конфига)
+    # Цена подарка в TON (из каталога)
     # При выводе цена на 10% больше базовой
-    gift_price_ton = gift_info["price_ton"] * 1.1
+    gift_price_ton = gift_info["withdraw_price_ton"]
     
-    # Конвертируем цену подарка в USD для списания с баланса
-    gift_price_usd = ton_to_usd(gift_price_ton, ton_rate)
+    # Цена подарка в USD для списания с баланса (таблица цен каталога по текущему курсу)
+    gift_price_usd = gift_catalog.prices_usd(ton_rate)[gift_info["name"]]["withdraw_price_usd"]
     
-    if balance_usd < gift_price_usd:
+    # Списываем баланс до передачи подарка, только если хватает средств
+    logger.info(f"💰 Начинаю списание баланса для вывода подарка: user_id={callback.from_user.id}, сумма={gift_price_usd:.2f} USD ({gift_price_ton:.4f} TON), подарок={gift_info['name']}")
+    actual_balance_usd = await db.debit_balance(callback.from_user.id, gift_price_usd)
+    if actual_balance_usd is None:
         await callback.answer("❌ Недостаточно средств на балансе", show_alert=True)
         return
-    
-    # Списываем баланс сразу после проверки (до передачи подарка)
-    logger.info(f"💰 Начинаю списание баланса для вывода подарка: user_id={callback.from_user.id}, сумма={gift_price_usd:.2f} USD ({gift_price_ton:.4f} TON), подарок={gift_info['name']}")
-    await db.update_balance(callback.from_user.id, -gift_price_usd)
     balance_deducted = True  # Флаг, что баланс был списан
-    
-    # Получаем актуальный баланс после списания
-    updated_user = await db.get_user(callback.from_user.id)
-    if updated_user:
-        actual_balance_usd = updated_user["balance"]
-        logger.info(f"✅ Баланс списан. Новый баланс: {actual_balance_usd:.2f} USD (было: {balance_usd:.2f} USD)")
-    else:
-        logger.error(f"❌ Не удалось получить обновленный баланс пользователя {callback.from_user.id}")
-        actual_balance_usd = balance_usd - gift_price_usd
+    logger.info(f"✅ Баланс списан. Новый баланс: {actual_balance_usd:.2f} USD")
     
     # Проверяем наличие подарка у релаера
     from relay_account import get_relay_client
@@ -481,36 +419,15 @@ async def withdraw_gift(callback: CallbackQuery):
     
     if relay_client:
         try:
-            # ПРИОРИТЕТ 1: Ищем подарок в базе данных релаера по названию (приоритет поиска)
-            saved_gift = await db.get_available_relay_gift(emoji=gift_emoji, gift_name=gift_name_for_search)
-            
-            # ПРИОРИТЕТ 2: Если не нашли по точному названию, пробуем найти по частичному совпадению
-            if not saved_gift and gift_name_for_search:
-                # Пробуем разные варианты названия
-                search_variants = [
-                    gift_name_for_search,  # Точное название
-                    gift_name_for_search.lower(),  # В нижнем регистре
-                    gift_name_for_search.upper(),  # В верхнем регистре
-                ]
-                
-                for variant in search_variants:
-                    saved_gift = await db.get_available_relay_gift(gift_name=variant)
-                    if saved_gift:
-                        logger.info(f"✅ Подарок найден по варианту названия: '{variant}'")
-                        break
-            
-            # ПРИОРИТЕТ 3: Если все еще не нашли, ищем по эмодзи (если есть)
-            if not saved_gift and gift_emoji:
-                saved_gift = await db.get_available_relay_gift(emoji=gift_emoji)
+            # Резервируем самый старый доступный подарок: по названию, затем по эмодзи.
+            # Резерв атомарный - параллельный вывод не получит тот же NFT
+            saved_gift = await gift_allocator.reserve(
+                callback.from_user.id, gift_name=gift_name_for_search, emoji=gift_emoji
+            )
             
-            # Если не нашли, логируем для отладки
             if not saved_gift:
-                logger.warning(f"⚠️ Подарок {gift_emoji} {gift_name_for_search} не найден в базе данных релаера. Ищем все доступные подарки...")
-                # Получаем все доступные подарки для отладки
-                all_gifts = await db.get_all_relay_gifts(include_transferred=False)
-                logger.info(f"📊 Всего доступных подарков в БД: {len(all_gifts)}")
-                for gift in all_gifts[:10]:  # Показываем первые 10 для отладки
-                    logger.info(f"  - Эмодзи: {gift.get('emoji', 'N/A')}, Имя: {gift.get('gift_name', 'N/A')}, Slug: {gift.get('slug', 'N/A')}")
+                logger.warning(f"⚠️ Подарок {gift_emoji} {gift_name_for_search} не найден среди доступных подарков релаера "
+                               f"({gift_allocator.stats()})")
             
             if saved_gift:
                 # Получаем подарок из Telethon
@@ -538,7 +455,7 @@ async def withdraw_gift(callback: CallbackQuery):
                     
                     if gift_transferred:
                         # Отмечаем подарок как переданный
-                        await db.mark_gift_as_transferred(saved_gift['message_id'], callback.from_user.id)
+                        await gift_allocator.confirm(saved_gift['message_id'], callback.from_user.id)
                         logger.info(f"✅ Подарок {gift_emoji} {gift_info['name']} передан пользователю {callback.from_user.id}")
                     else:
                         logger.warning(f"⚠️ Не удалось передать подарок пользователю {callback.from_user.id}")
@@ -548,6 +465,10 @@ async def withdraw_gift(callback: CallbackQuery):
                 logger.warning(f"⚠️ Подарок {gift_emoji} {gift_info['name']} не найден в базе данных релаера")
         except Exception as e:
             logger.error(f"❌ Ошибка при передаче подарка: {e}", exc_info=True)
+        finally:
+            if saved_gift and not gift_transferred:
+                # Передача не удалась - подарок снова доступен для вывода
+                gift_allocator.release(saved_gift['message_id'])
     else:
         logger.warning("⚠️ Клиент релаера недоступен, пропускаем передачу подарка")
     
@@ -570,19 +491,6 @@ async def withdraw_gift(callback: CallbackQuery):
             new_balance_usd = actual_balance_usd
         new_balance_ton = usd_to_ton(new_balance_usd, ton_rate)
         
-        # Финальная проверка: убеждаемся, что баланс действительно списан
-        verification_user = await db.get_user(callback.from_user.id)
-        if verification_user:
-            verified_balance = verification_user["balance"]
-            expected_balance = balance_usd - gift_price_usd
-            if abs(verified_balance - expected_balance) > 0.01:  # Допускаем небольшую погрешность округления
-                logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА: Баланс не соответствует ожидаемому! user_id={callback.from_user.id}, ожидалось={expected_balance:.2f} USD, фактически={verified_balance:.2f} USD")
-                # Принудительно списываем баланс еще раз
-                await db.update_balance(callback.from_user.id, -(verified_balance - expected_balance))
-                logger.info(f"🔧 Баланс исправлен принудительным списанием")
-            else:
-                logger.info(f"✅ Проверка баланса пройдена: user_id={callback.from_user.id}, баланс={verified_balance:.2f} USD (ожидалось {expected_balance:.2f} USD)")
-        
         logger.info(f"✅ Вывод подарка завершен: user_id={callback.from_user.id}, подарок={gift_info['name']}, списано={gift_price_usd:.2f} USD, остаток={new_balance_usd:.2f} USD")
         
         # Получаем дополнительную информацию о подарке
@@ -1443,50 +1351,6 @@ async def handle_custom_withdraw_amount(message: Message, state: FSMContext):
         locked_balance = user.get("locked_balance", 0.0)
         rollover_requirement = user.get("rollover_requirement", 0.0)
         
-        # Проверяем, есть ли заблокированные средства с отыгрышем
-        if locked_balance > 0 and rollover_requirement > 0:
-            # Есть заблокированные средства с невыполненным отыгрышем
-            # Если сумма вывода меньше заблокированной суммы, разрешаем вывод
-            if amount <= locked_balance:
-                # Разрешаем вывод из заблокированных средств
-                pass  # Продолжаем обработку
-            elif amount > locked_balance:
-                # Если сумма вывода больше заблокированной, проверяем обычный баланс
-                # Можно вывести только обычный баланс (не заблокированные средства!)
-                if balance < (amount - locked_balance):
-                    await message.answer(
-                        f"❌ <b>Недостаточно средств для вывода</b>\n\n"
-                        f"💰 Доступно для вывода: ${balance:.2f}\n"
-                        f"🔒 Заблокировано (с отыгрышем): ${locked_balance:.2f}\n"
-                        f"📊 Требуется отыграть: ${rollover_requirement:.2f}\n\n"
-                        f"⚠️ <b>Внимание!</b> У вас есть средства, полученные с отыгрышем.\n"
-                        f"Эти средства можно использовать для игр, но вывести их можно будет только после выполнения требования отыгрыша.\n\n"
-                        f"Вы можете вывести только обычный баланс: <b>${balance:.2f}</b>",
-                        parse_mode="HTML"
-                    )
-                    await state.clear()
-                    return
-                # Дополнительная проверка: сумма вывода не должна превышать обычный баланс + заблокированную сумму
-                if amount > (balance + locked_balance):
-                    await message.answer(
-                        f"❌ <b>Недостаточно средств для вывода</b>\n\n"
-                        f"💰 Доступно для вывода: ${balance:.2f}\n"
-                        f"🔒 Заблокировано (с отыгрышем): ${locked_balance:.2f}\n"
-                        f"📊 Требуется отыграть: ${rollover_requirement:.2f}\n\n"
-                        f"⚠️ <b>Внимание!</b> Вы пытаетесь вывести сумму, которая превышает доступные средства.\n"
-                        f"Максимальная сумма для вывода: <b>${balance + locked_balance:.2f}</b>",
-                        parse_mode="HTML"
-                    )
-                    await state.clear()
-                    return
-        else:
-            # Нет заблокированных средств или отыгрыш выполнен - проверяем общий доступный баланс
-            withdrawable_balance = await db.get_withdrawable_balance(message.from_user.id)
-            if withdrawable_balance < amount:
-                await message.answer(f"❌ Недостаточно средств на балансе. Доступно: ${withdrawable_balance:.2f}")
-                await state.clear()
-                return
-        
         commission = amount * 0.002  # 0.20% комиссия
         final_amount = amount - commission
         
@@ -1514,7 +1378,18 @@ async def handle_custom_withdraw_amount(message: Message, state: FSMContext):
             logger.error(f"❌ Ошибка при проверке баланса Crypto Pay: {e}")
             # Продолжаем создание чека, если проверка не удалась
         
+        # Списываем до создания чека, только если хватает средств; если чек не создан - возвращаем
+        withdrawn = await db.debit_withdrawal(message.from_user.id, amount)
+        if withdrawn is None:
+            await message.answer(
+                _insufficient_withdrawal_text(balance, locked_balance, rollover_requirement),
+                parse_mode="HTML"
+            )
+            await state.clear()
+            return
+        
         # Создаем чек через Crypto Pay API
+        created = False
         try:
             check = await crypto_pay.create_check(
                 asset="USDT",
@@ -1552,29 +1427,7 @@ async def handle_custom_withdraw_amount(message: Message, state: FSMContext):
             # API возвращает bot_check_url, а не check_url
             check_url = check.get("bot_check_url") or check.get("check_url")
             if check and check_url:
-                # Списываем баланс с учетом отыгрыша
-                if locked_balance > 0 and rollover_requirement > 0:
-                    # Есть заблокированные средства с невыполненным отыгрышем
-                    if amount <= locked_balance:
-                        # Если сумма вывода меньше или равна заблокированной сумме, списываем из заблокированного баланса
-                        await db.decrease_locked_balance(message.from_user.id, amount)
-                    else:
-                        # Если сумма вывода больше заблокированной суммы, списываем сначала заблокированный, потом обычный
-                        await db.decrease_locked_balance(message.from_user.id, locked_balance)
-                        remaining = amount - locked_balance
-                        await db.update_balance(message.from_user.id, -remaining)
-                else:
-                    # Нет заблокированных средств или отыгрыш выполнен - списываем как обычно
-                    if balance >= amount:
-                        # Если достаточно обычного баланса, списываем только его
-                        await db.update_balance(message.from_user.id, -amount)
-                    else:
-                        # Если недостаточно обычного баланса, списываем весь обычный и часть заблокированного
-                        remaining = amount - balance
-                        await db.update_balance(message.from_user.id, -balance)
-                        # Уменьшаем заблокированный баланс
-                        await db.decrease_locked_balance(message.from_user.id, remaining)
-                
+                created = True
                 # Записываем вывод
                 await db.add_withdrawal(message.from_user.id, amount, "crypto_pay")
                 
@@ -1615,6 +1468,9 @@ async def handle_custom_withdraw_amount(message: Message, state: FSMContext):
             logger.error(f"❌ Ошибка при создании чека: {e}", exc_info=True)
             await message.answer("❌ Ошибка создания чека на вывод. Попробуйте позже.")
             await state.clear()
+        finally:
+            if not created:
+                await db.refund_withdrawal(message.from_user.id, *withdrawn)
             
     except ValueError:
         await message.answer("❌ Пожалуйста, введите корректное число (например: 10.5 или 10)")
@@ -1657,46 +1513,6 @@ async def handle_withdrawal(callback: CallbackQuery):
     else:
         amount = float(callback.data.split("_")[1])
     
-    # Проверяем доступный баланс
-    if locked_balance > 0 and rollover_requirement > 0:
-        # Есть заблокированные средства с невыполненным отыгрышем
-        # Если сумма вывода меньше заблокированной суммы, разрешаем вывод
-        if amount <= locked_balance:
-            # Разрешаем вывод из заблокированных средств
-            pass  # Продолжаем обработку
-        elif amount > locked_balance:
-            # Если сумма вывода больше заблокированной, проверяем общий баланс
-            total_available = balance + locked_balance
-            if amount > total_available:
-                await callback.answer(
-                    f"❌ Недостаточно средств для вывода\n\n"
-                    f"💰 Доступно для вывода: ${balance:.2f}\n"
-                    f"🔒 Заблокировано (с отыгрышем): ${locked_balance:.2f}\n"
-                    f"📊 Требуется отыграть: ${rollover_requirement:.2f}\n\n"
-                    f"⚠️ Вы пытаетесь вывести сумму, которая превышает доступные средства.\n"
-                    f"Максимальная сумма для вывода: ${total_available:.2f}",
-                    show_alert=True
-                )
-                return
-            # Проверяем, что обычного баланса достаточно для части, превышающей заблокированную сумму
-            if balance < (amount - locked_balance):
-                await callback.answer(
-                    f"❌ Недостаточно средств для вывода\n\n"
-                    f"💰 Доступно для вывода: ${balance:.2f}\n"
-                    f"🔒 Заблокировано (с отыгрышем): ${locked_balance:.2f}\n"
-                    f"📊 Требуется отыграть: ${rollover_requirement:.2f}\n\n"
-                    f"⚠️ Внимание! У вас есть средства, полученные с отыгрышем.\n"
-                    f"Вы можете вывести только обычный баланс: ${balance:.2f}",
-                    show_alert=True
-                )
-                return
-    else:
-        # Нет заблокированных средств или отыгрыш выполнен - проверяем общий доступный баланс
-        withdrawable_balance = await db.get_withdrawable_balance(callback.from_user.id)
-        if withdrawable_balance < amount:
-            await callback.answer("Недостаточно средств на балансе", show_alert=True)
-            return
-    
     commission = amount * 0.002  # 0.20% комиссия
     final_amount = amount - commission
     
@@ -1723,7 +1539,17 @@ async def handle_withdrawal(callback: CallbackQuery):
         logger.error(f"❌ Ошибка при проверке баланса Crypto Pay: {e}")
         # Продолжаем создание чека, если проверка не удалась
     
+    # Списываем до создания чека, только если хватает средств; если чек не создан - возвращаем
+    withdrawn = await db.debit_withdrawal(callback.from_user.id, amount)
+    if withdrawn is None:
+        await callback.answer(
+            _insufficient_withdrawal_text(balance, locked_balance, rollover_requirement, html=False),
+            show_alert=True
+        )
+        return
+    
     # Создаем чек через Crypto Pay API
+    created = False
     try:
         check = await crypto_pay.create_check(
             asset="USDT",
@@ -1760,32 +1586,7 @@ async def handle_withdrawal(callback: CallbackQuery):
         # API возвращает bot_check_url, а не check_url
         check_url = check.get("bot_check_url") or check.get("check_url") if check else None
         if check and check_url:
-            # Списываем баланс с учетом отыгрыша
-            if locked_balance > 0 and rollover_requirement > 0:
-                # Есть заблокированные средства с невыполненным отыгрышем
-                if amount <= locked_balance:
-                    # Если сумма вывода меньше или равна заблокированной сумме, списываем из заблокированного баланса
-                    await db.decrease_locked_balance(callback.from_user.id, amount)
-                else:
-                    # Если сумма вывода больше заблокированной суммы, списываем сначала заблокированный, потом обычный
-                    await db.decrease_locked_balance(callback.from_user.id, locked_balance)
-                    remaining = amount - locked_balance
-                    await db.update_balance(callback.from_user.id, -remaining)
-            else:
-                # Нет заблокированных средств или отыгрыш выполнен - списываем как обычно
-                current_user = await db.get_user(callback.from_user.id)
-                current_balance = current_user.get("balance", 0.0)
-                current_locked = current_user.get("locked_balance", 0.0)
-                
-                if current_balance >= amount:
-                    # Если достаточно обычного баланса, списываем только его
-                    await db.update_balance(callback.from_user.id, -amount)
-                else:
-                    # Если недостаточно обычного баланса, списываем весь обычный и часть заблокированного
-                    remaining = amount - current_balance
-                    await db.update_balance(callback.from_user.id, -current_balance)
-                    # Уменьшаем заблокированный баланс
-                    await db.decrease_locked_balance(callback.from_user.id, remaining)
+            created = True
             
             # Записываем вывод
             await db.add_withdrawal(callback.from_user.id, amount, "crypto_pay")
@@ -1822,6 +1623,9 @@ async def handle_withdrawal(callback: CallbackQuery):
     except Exception as e:
         logger.error(f"❌ Ошибка при создании чека: {e}", exc_info=True)
         await callback.answer("Ошибка создания чека на вывод", show_alert=True)
+    finally:
+        if not created:
+            await db.refund_withdrawal(callback.from_user.id, *withdrawn)
 
 @router.callback_query(F.data.startswith("confirm_transfer_"))
 async def confirm_transfer(callback: CallbackQuery, state: FSMContext):
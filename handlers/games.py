@@ -1,16 +1,18 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, FSInputFile, BufferedInputFile, InputMediaPhoto
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 import random
 import asyncio
 import logging
 import time
-import os
 import math
 import re
 
 from database import Database
 from config import GAME_CONFIGS, MAX_BET
+from session_store import SessionStore
+from media_cache import media_registry
+from outcomes import outcome_table
 
 logger = logging.getLogger(__name__)
 from keyboards import (
@@ -23,22 +25,29 @@ from keyboards import (
 router = Router(name="games")
 db = Database()
 
+# Подписи символов слотов в результатах (utils.checks.decode_slot_symbols -> текст)
+SLOT_SYMBOL_LABELS = {"7": "7️⃣", "Bar": "BAR"}
+
+STATE_TIMEOUT = 30  # секунды
+# Время жизни записей игровых сессий (секунды с последней записи)
+GAME_STATE_TTL = 10 * STATE_TIMEOUT
+LAST_GAME_TTL = 24 * 60 * 60
+BASE_BET_TTL = 7 * 24 * 60 * 60
+
 # Состояния для игр
-GAME_STATES = {}
+GAME_STATES = SessionStore("game_states", GAME_STATE_TTL, persistent=True)
 
 # Состояния по message_id для быстрого поиска
-DICE_MESSAGE_STATES = {}
+DICE_MESSAGE_STATES = SessionStore("dice_messages", GAME_STATE_TTL, persistent=True)
 
 # Последняя игра для каждого пользователя (для кнопки "Повторить игру")
-LAST_GAME = {}  # {user_id: {"game_type": str, "bet_type": str, "bet": float}}
+LAST_GAME = SessionStore("last_game", LAST_GAME_TTL, persistent=True)  # {user_id: {"game_type": str, "bet_type": str, "bet": float}}
 
 # Активные игры для блокировки кнопок (для игр с несколькими бросками)
-ACTIVE_GAMES = {}  # {user_id: True}
+ACTIVE_GAMES = SessionStore("active_games", GAME_STATE_TTL)  # {user_id: время начала}
 
 # Базовая ставка для арбузов для каждого пользователя
-BASE_BET_ARBUZZ = {}  # {user_id: float}
-
-STATE_TIMEOUT = 30  # секунды
+BASE_BET_ARBUZZ = SessionStore("base_bet_arbuzz", BASE_BET_TTL, persistent=True)  # {user_id: float}
 
 
 def _clear_game_state(user_id: int):
@@ -73,14 +82,6 @@ def is_user_busy(user_id: int) -> bool:
     return user_id in ACTIVE_GAMES or user_id in GAME_STATES
 
 
-def get_multiplier(config: dict, bet_type: str) -> float:
-    """Возвращает коэффициент с учетом динамических типов ставок"""
-    multipliers = config.get("multipliers", {})
-    if bet_type.startswith("exact_"):
-        return multipliers.get("exact", 1.0)
-    return multipliers.get(bet_type, 1.0)
-
-
 async def process_game_result(bot, user_id: int, chat_id: int, game_type: str, bet_type: str, 
                               bet: float, required_throws: int, emoticon: str, currency: str = "dollar"):
     """Обрабатывает результат игры после всех бросков"""
@@ -125,136 +126,17 @@ async def process_game_result(bot, user_id: int, chat_id: int, game_type: str, b
             logger.error(f"❌ Конфигурация игры {game_type} не найдена")
             return
         
-        # Проверяем выигрыш
-        multiplier = get_multiplier(config, bet_type)
+        # Для "Кубик: +- 7" нужны 2 броска
+        if game_type == "dice_7" and len(throws) < 2:
+            # Если еще не все броски, продолжаем
+            logger.warning(f"⚠️ Недостаточно бросков для dice_7: {len(throws)}/2")
+            return
+        
+        # Проверяем выигрыш по скомпилированной таблице правил (outcomes.py)
+        is_win, multiplier = outcome_table.evaluate(game_type, bet_type, throws)
         win = 0
-        is_win = False
         first_result = throws[0] if throws else 0
         
-        # Логика проверки выигрыша (копируем из handle_dice_result)
-        if game_type == "dice":
-            if bet_type == "even":
-                is_win = first_result % 2 == 0
-            elif bet_type == "odd":
-                is_win = first_result % 2 == 1
-            elif bet_type.startswith("exact_"):
-                target_num = int(bet_type.split("_")[1])
-                is_win = first_result == target_num
-            elif bet_type == "pair":
-                is_win = len(throws) >= 2 and throws[0] == throws[1]
-            elif bet_type == "3_even":
-                is_win = len(throws) >= 3 and all(t % 2 == 0 for t in throws[:3])
-            elif bet_type == "3_odd":
-                is_win = len(throws) >= 3 and all(t % 2 == 1 for t in throws[:3])
-            elif bet_type == "18":
-                is_win = len(throws) >= 5 and sum(throws[:5]) == 18
-            elif bet_type == "21":
-                is_win = len(throws) >= 5 and sum(throws[:5]) == 21
-            elif bet_type == "111":
-                is_win = len(throws) >= 3 and all(t == 1 for t in throws[:3])
-            elif bet_type == "333":
-                is_win = len(throws) >= 3 and all(t == 3 for t in throws[:3])
-            elif bet_type == "666":
-                is_win = len(throws) >= 3 and all(t == 6 for t in throws[:3])
-        
-        elif game_type == "dart":
-            if bet_type == "red":
-                is_win = first_result in [2, 4, 6]  
-            elif bet_type == "white":
-                is_win = first_result in [3, 5]
-            elif bet_type == "center":
-                is_win = first_result == 6  
-            elif bet_type == "miss":
-                is_win = first_result == 1
-            elif bet_type == "3_red":
-                is_win = len(throws) >= 3 and all(t in [2, 4, 6] for t in throws[:3])  
-            elif bet_type == "3_white":
-                is_win = len(throws) >= 3 and all(t in [3, 5] for t in throws[:3])
-            elif bet_type == "3_center":
-                is_win = len(throws) >= 3 and all(t == 6 for t in throws[:3])  
-            elif bet_type == "3_miss":
-                is_win = len(throws) >= 3 and all(t == 1 for t in throws[:3])
-        
-        elif game_type == "bowling":
-            if bet_type == "0-3":
-                is_win = first_result <= 3
-            elif bet_type == "4-6":
-                is_win = 4 <= first_result <= 6
-            elif bet_type == "strike":
-                is_win = first_result == 6
-            elif bet_type == "miss":
-                is_win = first_result in [0, 1]  # 1 также считается промахом
-            elif bet_type == "2_strike":
-                is_win = len(throws) >= 2 and all(t == 6 for t in throws[:2])
-            elif bet_type == "3_strike":
-                is_win = len(throws) >= 3 and all(t == 6 for t in throws[:3])
-            elif bet_type == "2_miss":
-                is_win = len(throws) >= 2 and all(t in [0, 1] for t in throws[:2])  # 1 также считается промахом
-            elif bet_type == "3_miss":
-                is_win = len(throws) >= 3 and all(t in [0, 1] for t in throws[:3])  # 1 также считается промахом
-        
-        elif game_type == "football":
-            # Для футбола: 3, 4, 5 - гол, 1, 2 - мимо, 3 - в центр (штанга)
-            if bet_type == "goal":
-                # Гол: значения 3, 4, 5
-                is_win = first_result in [3, 4, 5]
-            elif bet_type == "miss":
-                # Мимо: значения 1, 2
-                is_win = first_result in [1, 2]
-            elif bet_type == "center":
-                # В центр (штанга): значение 3
-                is_win = first_result == 3
-            elif bet_type == "hattrick":
-                # 3 гола подряд (3, 4 или 5)
-                is_win = len(throws) >= 3 and all(t in [3, 4, 5] for t in throws[:3])
-            elif bet_type == "5_goals":
-                # 5 голов подряд (3, 4 или 5)
-                is_win = len(throws) >= 5 and all(t in [3, 4, 5] for t in throws[:5])
-            elif bet_type == "10_goals":
-                # 10 голов подряд (3, 4 или 5)
-                is_win = len(throws) >= 10 and all(t in [3, 4, 5] for t in throws[:10])
-            elif bet_type == "6_miss":
-                # 6 промахов подряд (1, 2 или 3)
-                is_win = len(throws) >= 6 and all(t in [1, 2, 3] for t in throws[:6])
-        
-        elif game_type == "basketball":
-            # Для баскетбола: 4 и 5 - попадание (гол), 2 - мимо, 5 - чистый гол, 3 - застрял, 1 - мимо
-            # Значение 5 - это чистый гол, но он также считается простым попаданием
-            if bet_type == "hit":
-                is_win = first_result in [4, 5]
-            elif bet_type == "miss":
-                is_win = first_result in [1, 2]
-            elif bet_type == "clean":
-                is_win = first_result == 5
-            elif bet_type == "stuck":
-                is_win = first_result == 3
-            elif bet_type == "2_hit":
-                is_win = len(throws) >= 2 and all(t in [4, 5] for t in throws[:2])
-            elif bet_type == "3_hit":
-                is_win = len(throws) >= 3 and all(t in [4, 5] for t in throws[:3])
-            elif bet_type == "2_clean":
-                is_win = len(throws) >= 2 and all(t == 5 for t in throws[:2])
-            elif bet_type == "3_clean":
-                is_win = len(throws) >= 3 and all(t == 5 for t in throws[:3])
-            elif bet_type == "6_hit":
-                is_win = len(throws) >= 6 and all(t in [4, 5] for t in throws[:6])
-        
-        elif game_type == "dice_7":
-            # Для "Кубик: +- 7" нужны 2 броска
-            if len(throws) < 2:
-                # Если еще не все броски, продолжаем
-                logger.warning(f"⚠️ Недостаточно бросков для dice_7: {len(throws)}/2")
-                return
-            
-            dice_sum = sum(throws[:2])
-            
-            if bet_type == "less_7":
-                is_win = dice_sum < 7
-            elif bet_type == "equal_7":
-                is_win = dice_sum == 7
-            elif bet_type == "more_7":
-                is_win = dice_sum > 7
-        
         # Рассчитываем выигрыш
         if is_win:
             win = bet * multiplier
@@ -299,6 +181,7 @@ async def process_game_result(bot, user_id: int, chat_id: int, game_type: str, b
         if state.get("mini_app") and state.get("game_id"):
             try:
                 from api_server import MINI_APP_GAMES
+                from game_events import game_results
                 game_id = state.get("game_id")
                 user = await db.get_user(user_id)
                 new_balance = user.get('balance', 0.0) if user else 0.0
@@ -324,6 +207,7 @@ async def process_game_result(bot, user_id: int, chat_id: int, game_type: str, b
                     MINI_APP_GAMES[game_id]['new_balance'] = new_balance
                     MINI_APP_GAMES[game_id]['game_type'] = game_type
                     logger.info(f"✅ Результат игры из мини-аппа сохранен: game_id={game_id}, result={game_result}, throws={MINI_APP_GAMES[game_id].get('throws')}, win={win}")
+                    game_results.resolve(game_id, MINI_APP_GAMES[game_id])
                 else:
                     logger.error(f"❌ game_id {game_id} не найден в MINI_APP_GAMES!")
             except Exception as e:
@@ -795,52 +679,25 @@ async def send_game_photo(callback: CallbackQuery, image_filename: str, text: st
     else:
         final_keyboard = keyboard
     
-    image_path = os.path.join(os.getcwd(), image_filename)
-    if not os.path.exists(image_path):
-        logger.warning(f"Файл {image_filename} не найден по пути: {image_path}")
-        await _fallback_edit_message(callback, text, final_keyboard)
-        return False
-
-    photo_bytes = None
-    use_fs_input = False
-    
-    try:
-        # Читаем файл в байты для более надежной отправки
-        with open(image_path, 'rb') as f:
-            photo_bytes = f.read()
-        
-        # Проверяем, что файл не пустой
-        if len(photo_bytes) == 0:
-            logger.warning(f"Файл {image_filename} пустой, пробую использовать FSInputFile")
-            use_fs_input = True
-    except Exception as e:
-        logger.warning(f"Не удалось прочитать файл {image_filename} в байты: {e}. Пробую использовать FSInputFile")
-        use_fs_input = True
-    
     async def _send_new_photo():
-        # Создаем новый экземпляр для отправки
-        if use_fs_input:
-            photo = FSInputFile(image_path)
-        else:
-            photo = BufferedInputFile(photo_bytes, filename=image_filename)
-        await callback.message.answer_photo(
-            photo=photo,
+        return await media_registry.answer_photo(
+            callback.message,
+            image_filename,
             caption=text,
             reply_markup=final_keyboard,
             parse_mode="HTML"
         )
 
+    # Изображение берется из media_cache: после первой загрузки отправляется только file_id
     try:
         if callback.message.photo:
-            # Для редактирования медиа
-            if use_fs_input:
-                photo_for_edit = FSInputFile(image_path)
-            else:
-                photo_for_edit = BufferedInputFile(photo_bytes, filename=image_filename)
-            media = InputMediaPhoto(media=photo_for_edit, caption=text, parse_mode="HTML")
-            await callback.message.edit_media(media=media, reply_markup=final_keyboard)
+            result = await media_registry.edit_photo(callback.message, image_filename, text, final_keyboard)
         else:
-            await _send_new_photo()
+            result = await _send_new_photo()
+        if result is None:
+            logger.warning(f"Файл {image_filename} не найден или пустой")
+            await _fallback_edit_message(callback, text, final_keyboard)
+            return False
         return True
     except Exception as e:
         logger.error(f"Ошибка при обновлении фото {image_filename}: {e}", exc_info=True)
@@ -850,12 +707,12 @@ async def send_game_photo(callback: CallbackQuery, image_filename: str, text: st
         except Exception:
             pass
         try:
-            await _send_new_photo()
-            return True
+            if await _send_new_photo() is not None:
+                return True
         except Exception as e2:
             logger.error(f"Ошибка при отправке нового фото {image_filename}: {e2}", exc_info=True)
-            await _fallback_edit_message(callback, text, final_keyboard)
-            return False
+        await _fallback_edit_message(callback, text, final_keyboard)
+        return False
 
 
 async def _fallback_edit_message(callback: CallbackQuery, text: str, keyboard):
@@ -1226,10 +1083,18 @@ async def start_game_with_params(bot, user_id: int, chat_id: int, game_type: str
         await db.update_arbuzz_balance(user_id, -bet)
         logger.info(f"💰 Списан демо-баланс: {bet:.0f} AC для пользователя {user_id}")
     else:
-        # Списываем доллары
-        # Уменьшаем отыгрыш при ставке (только для долларов)
-        await db.decrease_rollover(user_id, bet)
-        await db.update_balance(user_id, -bet)
+        # Списываем доллары и уменьшаем отыгрыш (только для долларов) одной транзакцией.
+        # Списание условное: параллельная ставка из мини-аппа не уведет баланс в минус
+        if await db.place_bet(user_id, bet) is None:
+            if callback_for_answer:
+                await callback_for_answer.answer("❌ Недостаточно средств!", show_alert=True)
+            elif message_for_answer:
+                if message_for_answer.chat.type in ['group', 'supergroup']:
+                    await message_for_answer.reply("❌ Недостаточно средств!")
+                else:
+                    await message_for_answer.answer("❌ Недостаточно средств!")
+            logger.warning(f"❌ Списание ставки ${bet:.2f} отклонено: недостаточно средств у пользователя {user_id}")
+            return False
         logger.info(f"💰 Списан баланс: ${bet:.2f} для пользователя {user_id}")
     
     # Отправляем dice через Telegram API
@@ -2290,11 +2155,12 @@ BAR BAR BAR - 5x
             except Exception as e:
                 logger.error(f"Ошибка при редактировании сообщения слотов: {e}")
         
-        # Уменьшаем отыгрыш при ставке
-        await db.decrease_rollover(user_id, total_bet)
-        
-        # Списываем баланс
-        await db.update_balance(user_id, -total_bet)
+        # Списываем баланс и уменьшаем отыгрыш при ставке одной транзакцией
+        if await db.place_bet(user_id, total_bet) is None:
+            ACTIVE_GAMES.pop(user_id, None)
+            logger.warning(f"❌ Списание ставки слотов ${total_bet:.2f} отклонено: недостаточно средств у пользователя {user_id}")
+            await callback.message.answer(f"❌ Недостаточно средств! Нужно ${total_bet:.2f}")
+            return
         logger.info(f"💰 Списан баланс для слотов: ${total_bet:.2f} ({num_spins} спинов по ${base_bet:.2f})")
         
         # Отправляем слоты быстро подряд
@@ -2319,42 +2185,10 @@ BAR BAR BAR - 5x
             # Telegram slots dice: значение от 1 до 64, где каждая комбинация кодируется 3 двухбитными значениями
             slot_value = slot_message.dice.value
             
-            # Определяем символы на основе официальной логики Telegram:
-            # value состоит из трёх 2-битных значений (по одному на каждый барабан), инкрементированных на 1.
-            # map := [1,2,3,0]
-            # Если value == 64 — это выигрыш 7 7 7.
-            symbols = []
-            if slot_value == 64:
-                # Выигрышная комбинация: 7 7 7
-                symbols = ["7️⃣", "7️⃣", "7️⃣"]
-            else:
-                mapping = [1, 2, 3, 0]
-                v = slot_value - 1
-                left_idx = mapping[v & 3]
-                center_idx = mapping[(v >> 2) & 3]
-                right_idx = mapping[(v >> 4) & 3]
-                
-                # Порядок эмодзи подогнан под реальную анимацию Telegram:
-                # index 1 -> BAR, 2 -> виноград, 3 -> лимон
-                base_symbols = ["7️⃣", "BAR", "🍇", "🍋"]
-                symbols = [
-                    base_symbols[left_idx],
-                    base_symbols[center_idx],
-                    base_symbols[right_idx],
-                ]
-            
-            # Проверяем выигрыш (используя множители из config.py)
-            multiplier = 0
-            if symbols[0] == symbols[1] == symbols[2]:
-                # 3 одинаковых символа
-                if symbols[0] == "7️⃣" or symbols[0] == "7":
-                    multiplier = 20  # 777 - 20x
-                elif symbols[0] == "🍇":
-                    multiplier = 10  # 🍇🍇🍇 - 10x
-                elif symbols[0] == "🍋":
-                    multiplier = 7   # 🍋🍋🍋 - 7x
-                elif symbols[0] == "BAR" or symbols[0] == "Bar":
-                    multiplier = 5   # BAR BAR BAR - 5x
+            # Символы барабанов и множитель (из config.py) по таблице всех 64 значений слота
+            symbols, multiplier = outcome_table.slot(slot_value)
+            # Подписи символов как в анимации Telegram
+            symbols = [SLOT_SYMBOL_LABELS.get(symbol, symbol) for symbol in symbols]
             
             win = base_bet * multiplier
             total_win += win
@@ -429,13 +429,11 @@ async def cmd_send_money_group(message: Message):
         await db.create_user(sender_id, message.from_user.username or message.from_user.first_name or "User")
         sender = await db.get_user(sender_id)
     
-    if sender["balance"] < amount:
+    # Списываем у отправителя, только если хватает средств
+    if await db.debit_balance(sender_id, amount) is None:
         await message.reply(f"❌ Недостаточно средств. Ваш баланс: ${sender['balance']:.2f}")
         return
     
-    # Списываем у отправителя
-    await db.update_balance(sender_id, -amount)
-    
     # Начисляем получателю
     recipient = await db.get_user(recipient_id)
     if not recipient:
@@ -577,14 +575,15 @@ async def cmd_withdraw_amount_group(message: Message):
     from crypto_pay import crypto_pay
     from ton_price import get_ton_to_usd_rate, usd_to_ton
     
-    balance = user["balance"]
-    if balance < amount:
-        await message.reply(f"❌ Недостаточно средств. Ваш баланс: ${balance:.2f}")
+    # Списываем до создания чека, только если хватает средств; если чек не создан - возвращаем
+    if await db.debit_balance(user_id, amount) is None:
+        await message.reply(f"❌ Недостаточно средств. Ваш баланс: ${user['balance']:.2f}")
         return
     
     commission = amount * 0.002  # 0.20% комиссия
     final_amount = amount - commission
     
+    created = False
     try:
         check = await crypto_pay.create_check(
             asset="USDT",
@@ -598,7 +597,7 @@ async def cmd_withdraw_amount_group(message: Message):
         
         check_url = check.get("bot_check_url") or check.get("check_url") if check else None
         if check and check_url:
-            await db.update_balance(user_id, -amount)
+            created = True
             await db.add_withdrawal(user_id, amount, "crypto_pay")
             
             text = f"""✅ <b>Чек на вывод создан</b>
@@ -621,6 +620,9 @@ async def cmd_withdraw_amount_group(message: Message):
     except Exception as e:
         logger.error(f"Ошибка при создании чека: {e}", exc_info=True)
         await message.reply("❌ Ошибка создания чека. Попробуйте позже.")
+    finally:
+        if not created:
+            await db.update_balance(user_id, amount)
 
 
 @router.message(F.text.regexp(re.compile(r'^вывод$', re.IGNORECASE)))
@@ -721,16 +723,14 @@ async def cmd_pvp_group(message: Message, state: FSMContext):
         await db.create_user(user_id, message.from_user.username or message.from_user.first_name or "User")
         user = await db.get_user(user_id)
     
-    if user["balance"] < amount:
-        await message.reply(f"❌ Недостаточно средств. Ваш баланс: ${user['balance']:.2f}")
-        return
-    
     # Используем логику из pvp.py для создания дуэли
     # По умолчанию используем боулинг, но можно расширить
     game_type = "bowling"  # Можно сделать выбор игры
     
-    # Списываем ставку
-    await db.update_balance(user_id, -amount)
+    # Списываем ставку, только если хватает средств
+    if await db.debit_balance(user_id, amount) is None:
+        await message.reply(f"❌ Недостаточно средств. Ваш баланс: ${user['balance']:.2f}")
+        return
     
     # Создаем дуэль
     import uuid
@@ -163,16 +163,15 @@ async def handle_chosen_inline_result(chosen_result: ChosenInlineResult, bot: Bo
     text = data["text"]
     total_cost = amount * activations
     
-    if user["balance"] < total_cost:
+    user_id = chosen_result.from_user.id
+    # Списываем, только если хватает средств
+    if await db.debit_balance(user_id, total_cost) is None:
         await bot.edit_message_text(
             inline_message_id=chosen_result.inline_message_id,
             text=f"❌ Недостаточно средств (нужно ${total_cost:.2f}, у вас ${user['balance']:.2f}).",
             parse_mode="HTML",
         )
         return
-    
-    user_id = chosen_result.from_user.id
-    await db.update_balance(user_id, -total_cost)
     check_code = generate_check_code()
     await db.create_check(
         creator_id=user_id,
@@ -2,7 +2,6 @@ import asyncio
 import logging
 import uuid
 import random
-import aiosqlite
 from typing import Optional, Dict, List
 
 from aiogram import Router, F, Bot
@@ -11,6 +10,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from database import Database
+from ticket_board import ticket_boards
 from keyboards import (
     get_pvp_menu_keyboard,
     get_pvp_game_select_keyboard,
@@ -196,10 +196,6 @@ async def handle_text_pvp_command(message: Message):
             await message.reply("❌ Минимальная ставка: $0.10")
             return
         
-        if bet_amount > balance:
-            await message.reply(f"❌ Недостаточно средств. Ваш баланс: ${balance:.2f}")
-            return
-        
         # Проверяем, не занят ли пользователь другой игрой
         from handlers.games import is_user_busy
         if is_user_busy(user_id):
@@ -216,8 +212,10 @@ async def handle_text_pvp_command(message: Message):
             f"max_players={max_players}, bet_amount={bet_amount}"
         )
         
-        # Списываем ставку
-        await db.update_balance(user_id, -bet_amount)
+        # Списываем ставку (только если хватает средств)
+        if await db.debit_balance(user_id, bet_amount) is None:
+            await message.reply(f"❌ Недостаточно средств. Ваш баланс: ${balance:.2f}")
+            return
         
         # Создаем дуэль
         duel_id = await db.create_pvp_duel(
@@ -458,11 +456,6 @@ async def pvp_enter_bet(message: Message, state: FSMContext):
             # Но в PvP ставки всегда в долларах, поэтому конвертируем 1:1 или используем как есть
             # Пока оставим как есть - арбузы используются как валюта в PvP тоже
             await state.update_data(use_arbuzz=True)
-        else:
-            if bet_amount > user["balance"]:
-                logger.warning(f"⚠️ Недостаточно средств: баланс ${user['balance']:.2f}, нужно ${bet_amount:.2f}")
-                await message.answer(f"❌ Недостаточно средств. Ваш баланс: ${user['balance']:.2f}")
-                return
         
         data = await state.get_data()
         game_type = data.get("game_type")
@@ -481,7 +474,10 @@ async def pvp_enter_bet(message: Message, state: FSMContext):
             await db.update_arbuzz_balance(user_id, -bet_amount)
             currency_text = f"{bet_amount:.0f} AC"
         else:
-            await db.update_balance(user_id, -bet_amount)
+            if await db.debit_balance(user_id, bet_amount) is None:
+                logger.warning(f"⚠️ Недостаточно средств: нужно ${bet_amount:.2f}")
+                await message.answer(f"❌ Недостаточно средств. Ваш баланс: ${user['balance']:.2f}")
+                return
             currency_text = f"${bet_amount:.2f}"
         
         # Генерируем уникальную ссылку
@@ -613,14 +609,11 @@ async def pvp_join_duel(callback: CallbackQuery, state: FSMContext):
         await callback.answer("❌ Вы уже присоединились к этой дуэли", show_alert=True)
         return
     
-    # Стандартный режим
-    if user["balance"] < duel["bet_amount"]:
+    # Стандартный режим: списываем ставку, только если хватает средств
+    if await db.debit_balance(user_id, duel["bet_amount"]) is None:
         await callback.answer(f"❌ Недостаточно средств. Нужно: ${duel['bet_amount']:.2f}", show_alert=True)
         return
     
-    # Списываем ставку
-    await db.update_balance(user_id, -duel["bet_amount"])
-    
     # Присоединяемся
     success = await db.join_pvp_duel(duel_id, user_id)
     
@@ -915,7 +908,7 @@ async def pvp_play_with_bot(callback: CallbackQuery):
     if not bot_is_participant:
         # Добавляем бота как участника
         position = len(participants) + 1
-        async with aiosqlite.connect(db.db_path) as database:
+        async with db.writer() as database:
             await database.execute("""
                 INSERT INTO pvp_participants (duel_id, user_id, position)
                 VALUES (?, ?, ?)
@@ -930,7 +923,7 @@ async def pvp_play_with_bot(callback: CallbackQuery):
         # Обновляем статус дуэли на ready, если заполнена
         updated_participants = await db.get_pvp_participants(duel_id)
         if len(updated_participants) >= duel["max_players"]:
-            async with aiosqlite.connect(db.db_path) as database:
+            async with db.writer() as database:
                 await database.execute("""
                     UPDATE pvp_duels SET status = 'ready', started_at = CURRENT_TIMESTAMP WHERE id = ?
                 """, (duel_id,))
@@ -994,19 +987,16 @@ async def pvp_join_via_link(message: Message, state: FSMContext):
     
     
     # Стандартный режим
-    # Проверяем баланс
-    if user["balance"] < duel["bet_amount"]:
-        await message.reply(f"❌ Недостаточно средств. Нужно: ${duel['bet_amount']:.2f}")
-        return
-    
     # Проверяем, не присоединился ли уже
     participants = await db.get_pvp_participants(duel_id)
     if any(p["user_id"] == user_id for p in participants):
         await message.reply("❌ Вы уже присоединились к этой дуэли")
         return
     
-    # Списываем ставку
-    await db.update_balance(user_id, -duel["bet_amount"])
+    # Списываем ставку, только если хватает средств
+    if await db.debit_balance(user_id, duel["bet_amount"]) is None:
+        await message.reply(f"❌ Недостаточно средств. Нужно: ${duel['bet_amount']:.2f}")
+        return
     
     # Присоединяемся
     success = await db.join_pvp_duel(duel_id, user_id)
@@ -1049,7 +1039,7 @@ async def start_pvp_game_in_channel(bot: Bot, duel_id: int):
         
         # Специальная логика для PvP #500 - обрабатывается отдельно
         if duel_id == 500:
-            tickets_count = await db.get_pvp_tickets_count(duel_id)
+            tickets_count = (await ticket_boards.get(duel_id)).count
             if tickets_count < 128:
                 logger.error(f"Недостаточно билетов для дуэли {duel_id}: {tickets_count}/128")
                 return
@@ -1880,19 +1870,17 @@ async def handle_pvp_500_game(bot: Bot, duel_id: int, duel: Dict):
         
         # Первый победитель - позиция = slot1_value
         winner1_position = slot1_value
-        winner1_ticket = await db.get_ticket_owner(duel_id, winner1_position)
+        board = await ticket_boards.get(duel_id)
+        winner1_id = board.owner(winner1_position)
         
-        if not winner1_ticket:
+        if winner1_id is None:
             logger.error(f"PvP #500: Не найден билет на позиции {winner1_position}")
-            # Берем первый доступный билет
-            tickets = await db.get_pvp_tickets(duel_id)
-            if tickets:
-                winner1_ticket = tickets[0]
-            else:
+            # Берем первый проданный билет
+            taken = board.taken_positions()
+            if not taken:
                 logger.error("PvP #500: Нет билетов вообще!")
                 return
-        
-        winner1_id = winner1_ticket["user_id"]
+            winner1_id = board.owner(taken[0])
         
         # Кидаем второй слот
         slot2_message = None
@@ -1943,25 +1931,16 @@ async def handle_pvp_500_game(bot: Bot, duel_id: int, duel: Dict):
             if winner2_position == 0:
                 winner2_position = 128
         
-        winner2_ticket = await db.get_ticket_owner(duel_id, winner2_position)
+        winner2_id = board.owner(winner2_position)
         
-        if not winner2_ticket:
+        if winner2_id is None:
             logger.error(f"PvP #500: Не найден билет на позиции {winner2_position}")
-            # Берем следующий доступный билет
-            tickets = await db.get_pvp_tickets(duel_id)
-            for ticket in tickets:
-                if ticket["ticket_position"] != winner1_position:
-                    winner2_ticket = ticket
-                    break
-            if not winner2_ticket:
-                # Если не нашли, берем первый билет (но не тот же что winner1)
-                if tickets and len(tickets) > 1:
-                    winner2_ticket = tickets[1]
-                else:
-                    logger.error("PvP #500: Не удалось найти второго победителя!")
-                    return
-        
-        winner2_id = winner2_ticket["user_id"]
+            # Берем первый проданный билет, кроме билета первого победителя
+            taken = board.taken_positions(exclude=(winner1_position,))
+            if not taken:
+                logger.error("PvP #500: Не удалось найти второго победителя!")
+                return
+            winner2_id = board.owner(taken[0])
         
         # Вычисляем выигрыш (с комиссией 10%)
         total_pot = duel["total_pot"]
@@ -2050,8 +2029,7 @@ async def handle_pvp_500_join(message: Message, duel: Dict, user_id: int, user:
             return
         
         # Проверяем, заполнена ли дуэль (128 билетов)
-        tickets_count = await db.get_pvp_tickets_count(500)
-        if tickets_count >= 128:
+        if (await ticket_boards.get(500)).free == 0:
             await message.reply("❌ Все билеты распроданы! Дуэль заполнена.")
             return
         
@@ -2146,71 +2124,30 @@ async def handle_pvp500_amount(message: Message, state: FSMContext):
         ticket_count = int(amount / 0.1)
         
         # Проверяем, есть ли место для всех билетов
-        current_tickets = await db.get_pvp_tickets_count(duel_id)
-        if current_tickets + ticket_count > 128:
-            available = 128 - current_tickets
+        board = await ticket_boards.get(duel_id)
+        if ticket_count > board.free:
             await message.reply(
                 f"❌ Недостаточно свободных билетов!\n"
-                f"Доступно: {available} билетов\n"
+                f"Доступно: {board.free} билетов\n"
                 f"Вы пытаетесь купить: {ticket_count} билетов"
             )
             return
         
-        # Списываем средства
-        await db.update_balance(user_id, -amount)
-        
-        # Распределяем позиции билетов
-        ticket_positions = []
-        
-        if amount > 0.5:
-            # Если покупка > 0.5: 5 билетов в начало (1-5), остальные в конец (124-128)
-            # Получаем занятые позиции
-            existing_tickets = await db.get_pvp_tickets(duel_id)
-            occupied_start = {t["ticket_position"] for t in existing_tickets if 1 <= t["ticket_position"] <= 5}
-            occupied_end = {t["ticket_position"] for t in existing_tickets if 124 <= t["ticket_position"] <= 128}
-            
-            # Распределяем 5 билетов в начало
-            start_positions = [i for i in range(1, 6) if i not in occupied_start][:5]
-            ticket_positions.extend(start_positions)
-            
-            # Остальные билеты в конец
-            remaining = ticket_count - len(start_positions)
-            if remaining > 0:
-                end_positions = [i for i in range(124, 129) if i not in occupied_end][:remaining]
-                ticket_positions.extend(end_positions)
-                
-                # Если все еще остались билеты, заполняем оставшиеся позиции по порядку
-                if len(ticket_positions) < ticket_count:
-                    all_occupied = {t["ticket_position"] for t in existing_tickets}
-                    for pos in range(1, 129):
-                        if pos not in all_occupied and len(ticket_positions) < ticket_count:
-                            ticket_positions.append(pos)
-        else:
-            # Если покупка <= 0.5: распределяем по порядку
-            existing_tickets = await db.get_pvp_tickets(duel_id)
-            all_occupied = {t["ticket_position"] for t in existing_tickets}
-            
-            for pos in range(1, 129):
-                if pos not in all_occupied and len(ticket_positions) < ticket_count:
-                    ticket_positions.append(pos)
-        
-        # Добавляем билеты
-        await db.add_pvp_tickets(duel_id, user_id, amount, ticket_positions)
-        
-        # Обновляем банк
-        async with aiosqlite.connect(db.db_path) as database:
-            await database.execute(
-                "UPDATE pvp_duels SET total_pot = total_pot + ? WHERE id = ?",
-                (amount, duel_id)
-            )
-            await database.commit()
+        # Позиции занимаются сразу, списание, билеты и банк дуэли пишутся одной транзакцией
+        purchase = await ticket_boards.buy(duel_id, user_id, amount, ticket_count)
+        if purchase is None:
+            if ticket_count > board.free:
+                await message.reply(f"❌ Недостаточно свободных билетов! Доступно: {board.free} билетов")
+            else:
+                await message.reply("❌ Недостаточно средств")
+            return
         
-        # Проверяем, заполнилась ли дуэль
-        current_tickets = await db.get_pvp_tickets_count(duel_id)
+        ticket_positions, duel_filled = purchase
+        current_tickets = board.count
         
         await state.clear()
         
-        if current_tickets >= 128:
+        if duel_filled:
             # Дуэль заполнена, запускаем игру
             await message.reply(
                 f"✅ Вы купили {ticket_count} билетов на сумму ${amount:.2f}!\n"
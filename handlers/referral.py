@@ -1,6 +1,5 @@
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
-import aiosqlite
 
 from database import Database
 from utils.referrals import build_referral_view
@@ -68,8 +67,7 @@ async def withdraw_referral_balance(callback: CallbackQuery):
         referral_balance = user.get("referral_balance")
         if referral_balance is None:
             # Если поля нет в результате, проверяем напрямую в базе
-            async with aiosqlite.connect(db.db_path) as database:
-                database.row_factory = aiosqlite.Row
+            async with db.reader() as database:
                 async with database.execute(
                     "SELECT referral_balance FROM users WHERE user_id = ?", (user_id,)
                 ) as cursor:
@@ -103,7 +101,7 @@ async def withdraw_referral_balance(callback: CallbackQuery):
         
         # Переводим реферальный баланс на основной баланс
         logger.info(f"💸 Перевод ${referral_balance:.2f} с реферального баланса на основной для пользователя {user_id}")
-        async with aiosqlite.connect(db.db_path) as database:
+        async with db.writer() as database:
             # Сначала проверяем, существует ли поле referral_balance
             try:
                 await database.execute(
@@ -121,7 +119,7 @@ async def withdraw_referral_balance(callback: CallbackQuery):
                 await db.update_balance(user_id, referral_balance)
                 # Обнуляем referral_balance отдельным запросом
                 try:
-                    async with aiosqlite.connect(db.db_path) as database2:
+                    async with db.writer() as database2:
                         await database2.execute(
                             "UPDATE users SET referral_balance = 0.00 WHERE user_id = ?",
                             (user_id,)
@@ -6,6 +6,7 @@ from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup, InlineKe
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from activations import ACTIVATED, ALREADY_ACTIVATED, SOLD_OUT, activation_engine
 from database import Database
 from utils.checks import (
     decode_slot_symbols,
@@ -462,8 +463,11 @@ async def handle_check_button_text(message: Message, state: FSMContext):
     min_deposit = data.get("min_deposit", 0.0)
     rollover_multiplier = data.get("rollover_multiplier", 1.0)
     
-    # Списываем баланс
-    await db.update_balance(user_id, -total_cost)
+    # Списываем баланс, только если хватает средств
+    if await db.debit_balance(user_id, total_cost) is None:
+        await message.answer(f"❌ Недостаточно средств. Нужно: ${total_cost:.2f}, ваш баланс: ${user['balance']:.2f}")
+        await state.clear()
+        return
     
     # Генерируем уникальный код чека
     check_code = generate_check_code()
@@ -605,16 +609,14 @@ async def handle_captcha_button(callback: CallbackQuery, state: FSMContext):
             return
         
         # Активируем чек
-        success = await db.activate_check(check_id, user_id)
-        if success:
-            amount = check["amount_per_activation"]
-            rollover_multiplier = check.get("rollover_multiplier", 1.0)
+        status, activation = await activation_engine.activate_check(check_id, user_id)
+        if status == ACTIVATED:
+            amount = activation["amount"]
+            rollover_multiplier = activation["rollover_multiplier"]
             
-            # Если есть отыгрыш, добавляем средства в заблокированный баланс
+            # Средства с отыгрышем зачислены в заблокированный баланс
             if rollover_multiplier > 1.0:
-                await db.add_rollover_requirement(user_id, amount, rollover_multiplier)
-                user = await db.get_user(user_id)
-                rollover_requirement = user.get("rollover_requirement", 0.0)
+                rollover_requirement = activation["rollover_requirement"]
                 
                 text = f"""✅ <b>Чек активирован!</b>
 
@@ -623,9 +625,6 @@ async def handle_captcha_button(callback: CallbackQuery, state: FSMContext):
 
 ⚠️ <b>Внимание:</b> Вы сможете использовать полученные средства для игр, но вывести их можно будет только после выполнения требования отыгрыша."""
             else:
-                # Если отыгрыша нет, добавляем на обычный баланс
-                await db.update_balance(user_id, amount)
-                
                 text = f"""✅ <b>Чек активирован!</b>
 
 💰 Получено: ${amount:.2f}
@@ -650,6 +649,10 @@ async def handle_captcha_button(callback: CallbackQuery, state: FSMContext):
             
             await notify_check_owner(db, callback.message.bot, check["id"], check_code, callback.from_user)
             await callback.answer("✅ Капча пройдена! Чек активирован")
+        elif status == ALREADY_ACTIVATED:
+            await callback.answer("❌ Вы уже активировали этот чек", show_alert=True)
+        elif status == SOLD_OUT:
+            await callback.answer("❌ Чек исчерпан (все активации использованы)", show_alert=True)
         else:
             await callback.answer("❌ Ошибка при активации чека", show_alert=True)
         
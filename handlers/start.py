@@ -1,18 +1,17 @@
 import asyncio
 import logging
-import os
-import aiosqlite
-from io import BytesIO
 
 from html import escape
 
 from aiogram import Router, F, Bot
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, BufferedInputFile
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from activations import ACTIVATED, ALREADY_ACTIVATED, SOLD_OUT, activation_engine
 from database import Database
+from media_cache import media_registry
 from keyboards import get_main_menu_keyboard, get_remove_keyboard
 from utils.checks import (
     format_user_text,
@@ -32,220 +31,44 @@ router = Router()
 db = Database()
 logger = logging.getLogger(__name__)
 
-# Проверяем доступность PIL для обработки изображений
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-    logger.warning("PIL не установлен, проверка изображений будет пропущена")
-
 
 async def send_photo(message_or_callback, image_filename: str, text: str, keyboard=None, is_callback: bool = False):
-    """Вспомогательная функция для отправки фото"""
-    image_path = os.path.join(os.getcwd(), image_filename)
-    logger.info(f"📷 Попытка отправить фото: {image_filename}, путь: {image_path}, существует: {os.path.exists(image_path)}")
-    
-    if os.path.exists(image_path):
-        photo_bytes = None
-        pil_processed = False
-        
-        # Пытаемся проверить и исправить изображение с помощью PIL
-        if PIL_AVAILABLE:
-            try:
-                # Открываем и проверяем изображение
-                img = Image.open(image_path)
-                img.verify()  # Проверяем целостность
-                
-                # Открываем снова для работы (verify закрывает файл)
-                img = Image.open(image_path)
-                img.load()  # Загружаем все данные
-                
-                # Сохраняем в BytesIO для получения исправленных байтов
-                output = BytesIO()
-                
-                # Определяем формат сохранения
-                if img.format == 'PNG':
-                    # Для PNG сохраняем как есть
-                    img.save(output, format='PNG', optimize=True)
-                elif img.format in ['JPEG', 'JPG']:
-                    # Для JPEG конвертируем в RGB если нужно
-                    if img.mode != 'RGB':
-                        if img.mode == 'RGBA':
-                            # Создаем белый фон и вставляем изображение
-                            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                            rgb_img.paste(img, mask=img.split()[-1])
-                            img = rgb_img
-                        else:
-                            # Для других режимов просто конвертируем
-                            img = img.convert('RGB')
-                    img.save(output, format='JPEG', quality=95, optimize=True)
-                else:
-                    # Для других форматов конвертируем в PNG
-                    if img.mode == 'RGBA':
-                        # Сохраняем RGBA как PNG
-                        img.save(output, format='PNG', optimize=True)
-                    else:
-                        # Конвертируем в RGB и сохраняем как PNG
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        img.save(output, format='PNG', optimize=True)
-                
-                photo_bytes = output.getvalue()
-                pil_processed = True
-                logger.info(f"✅ Изображение {image_filename} проверено и исправлено с помощью PIL")
-            except Exception as pil_error:
-                # Если PIL не может обработать файл, попробуем отправить напрямую
-                logger.warning(f"⚠️ PIL не смог обработать файл {image_filename}: {pil_error}. Пробую отправить напрямую.")
-        
-        # Если PIL не доступен или не смог обработать, читаем файл напрямую
-        if photo_bytes is None:
-            try:
-                with open(image_path, 'rb') as f:
-                    photo_bytes = f.read()
-                logger.info(f"📖 Файл {image_filename} прочитан напрямую ({len(photo_bytes)} байт)")
-            except Exception as read_error:
-                logger.error(f"❌ Не удалось прочитать файл {image_filename}: {read_error}")
-                photo_bytes = None
-        
-        # Проверяем, что файл не пустой
-        if not photo_bytes or len(photo_bytes) == 0:
-            logger.warning(f"⚠️ Файл {image_filename} пустой или не прочитан")
-            # Проверяем тип клавиатуры и тип чата
-            from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
-            if is_callback:
-                is_group = message_or_callback.message.chat.type in ['group', 'supergroup']
-            else:
-                is_group = message_or_callback.chat.type in ['group', 'supergroup']
-            is_reply_keyboard = isinstance(keyboard, ReplyKeyboardMarkup)
-            
-            # В группах всегда скрываем ReplyKeyboardMarkup
-            if is_group:
-                if is_reply_keyboard:
-                    final_keyboard = ReplyKeyboardRemove(remove_keyboard=True)
-                else:
-                    final_keyboard = keyboard  # InlineKeyboardMarkup или None
-            else:
-                final_keyboard = keyboard
-            
-            # Отправляем текстовое сообщение
-            try:
-                logger.info(f"🔄 Файл пустой, отправляю текстовое сообщение")
-                if is_callback:
-                    await message_or_callback.message.answer(text, reply_markup=final_keyboard, parse_mode="HTML")
-                else:
-                    await message_or_callback.answer(text, reply_markup=final_keyboard, parse_mode="HTML")
-                logger.info(f"✅ Текстовое сообщение успешно отправлено")
-                return False
-            except Exception as e:
-                logger.error(f"Критическая ошибка при отправке сообщения: {e}", exc_info=True)
-                return False
-        
-        # Пытаемся отправить фото
-        try:
-            # Используем BufferedInputFile для обработанных PIL изображений или FSInputFile для прямого чтения
-            if pil_processed:
-                photo = BufferedInputFile(photo_bytes, filename=image_filename)
-            else:
-                # Для прямого чтения используем FSInputFile
-                photo = FSInputFile(image_path)
-            
-            # Проверяем тип клавиатуры и тип чата
-            from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
-            if is_callback:
-                is_group = message_or_callback.message.chat.type in ['group', 'supergroup']
-            else:
-                is_group = message_or_callback.chat.type in ['group', 'supergroup']
-            is_reply_keyboard = isinstance(keyboard, ReplyKeyboardMarkup)
-            
-            # В группах всегда скрываем ReplyKeyboardMarkup
-            if is_group:
-                if is_reply_keyboard:
-                    final_keyboard = ReplyKeyboardRemove(remove_keyboard=True)
-                else:
-                    final_keyboard = keyboard  # InlineKeyboardMarkup или None
-            else:
-                final_keyboard = keyboard
-            
-            # Отправляем новое сообщение с фото
-            if is_callback:
-                await message_or_callback.message.answer_photo(
-                    photo=photo,
-                    caption=text,
-                    reply_markup=final_keyboard,
-                    parse_mode="HTML"
-                )
-            else:
-                await message_or_callback.answer_photo(
-                    photo=photo,
-                    caption=text,
-                    reply_markup=final_keyboard,
-                    parse_mode="HTML"
-                )
+    """Вспомогательная функция для отправки фото
+
+    Изображение берется из media_cache: после первой загрузки отправляется
+    только его file_id в Telegram.
+    """
+    from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
+    message = message_or_callback.message if is_callback else message_or_callback
+
+    # В группах всегда скрываем ReplyKeyboardMarkup
+    if message.chat.type in ['group', 'supergroup'] and isinstance(keyboard, ReplyKeyboardMarkup):
+        final_keyboard = ReplyKeyboardRemove(remove_keyboard=True)
+    else:
+        final_keyboard = keyboard
+
+    try:
+        sent = await media_registry.answer_photo(
+            message,
+            image_filename,
+            caption=text,
+            reply_markup=final_keyboard,
+            parse_mode="HTML"
+        )
+        if sent is not None:
             logger.info(f"✅ Фото {image_filename} успешно отправлено")
             return True
-        except Exception as e:
-            logger.error(f"Ошибка при отправке фото {image_filename}: {e}", exc_info=True)
-            # Проверяем тип клавиатуры и тип чата
-            from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
-            if is_callback:
-                is_group = message_or_callback.message.chat.type in ['group', 'supergroup']
-            else:
-                is_group = message_or_callback.chat.type in ['group', 'supergroup']
-            is_reply_keyboard = isinstance(keyboard, ReplyKeyboardMarkup)
-            
-            # В группах всегда скрываем ReplyKeyboardMarkup
-            if is_group:
-                if is_reply_keyboard:
-                    final_keyboard = ReplyKeyboardRemove(remove_keyboard=True)
-                else:
-                    final_keyboard = keyboard  # InlineKeyboardMarkup или None
-            else:
-                final_keyboard = keyboard
-            
-            # Если не удалось отправить фото, отправляем обычное сообщение
-            try:
-                logger.info(f"🔄 Попытка отправить текстовое сообщение вместо фото")
-                if is_callback:
-                    await message_or_callback.message.answer(text, reply_markup=final_keyboard, parse_mode="HTML")
-                else:
-                    await message_or_callback.answer(text, reply_markup=final_keyboard, parse_mode="HTML")
-                logger.info(f"✅ Текстовое сообщение успешно отправлено")
-                return False
-            except Exception as e2:
-                logger.error(f"Критическая ошибка при отправке сообщения: {e2}", exc_info=True)
-                return False
-    else:
-        logger.warning(f"Файл {image_filename} не найден по пути: {image_path}")
-        # Проверяем тип клавиатуры и тип чата
-        from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
-        if is_callback:
-            is_group = message_or_callback.message.chat.type in ['group', 'supergroup']
-        else:
-            is_group = message_or_callback.chat.type in ['group', 'supergroup']
-        is_reply_keyboard = isinstance(keyboard, ReplyKeyboardMarkup)
-        
-        # В группах всегда скрываем ReplyKeyboardMarkup
-        if is_group:
-            if is_reply_keyboard:
-                final_keyboard = ReplyKeyboardRemove(remove_keyboard=True)
-            else:
-                final_keyboard = keyboard  # InlineKeyboardMarkup или None
-        else:
-            final_keyboard = keyboard
-        
-        # Если файл не найден, отправляем обычное сообщение
-        try:
-            logger.info(f"🔄 Файл не найден, отправляю текстовое сообщение")
-            if is_callback:
-                await message_or_callback.message.answer(text, reply_markup=final_keyboard, parse_mode="HTML")
-            else:
-                await message_or_callback.answer(text, reply_markup=final_keyboard, parse_mode="HTML")
-            logger.info(f"✅ Текстовое сообщение успешно отправлено (файл не найден)")
-            return False
-        except Exception as e:
-            logger.error(f"Критическая ошибка при отправке сообщения: {e}", exc_info=True)
-            return False
+        logger.warning(f"Файл {image_filename} не найден или пустой, отправляю текстовое сообщение")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке фото {image_filename}: {e}", exc_info=True)
+
+    # Если не удалось отправить фото, отправляем обычное сообщение
+    try:
+        await message.answer(text, reply_markup=final_keyboard, parse_mode="HTML")
+        logger.info(f"✅ Текстовое сообщение успешно отправлено")
+    except Exception as e:
+        logger.error(f"Критическая ошибка при отправке сообщения: {e}", exc_info=True)
+    return False
 
 
 @router.message(Command("hidekeyboard", "скрыть"))
@@ -283,6 +106,9 @@ async def cmd_start(message: Message, state: FSMContext):
         
         logger.info(f"📝 Создание пользователя: {user_id}, {username}")
         
+        # Пользователь снова пишет боту - снимаем отметку о блокировке для рассылок
+        await db.set_user_blocked_bot(user_id, False)
+        
         # Создаем пользователя, если его нет
         try:
             referral_code = None
@@ -314,8 +140,7 @@ async def cmd_start(message: Message, state: FSMContext):
                     promo = await db.get_promo_code(promo_param)
                     if not promo:
                         # Пробуем найти по activation_link
-                        async with aiosqlite.connect(db.db_path) as database:
-                            database.row_factory = aiosqlite.Row
+                        async with db.reader() as database:
                             async with database.execute(
                                 "SELECT * FROM promo_codes WHERE activation_link = ?", (promo_param,)
                             ) as cursor:
@@ -982,16 +807,15 @@ async def handle_check_activation(message: Message, check_code: str, state: FSMC
             return
     
     # Если капча не нужна, сразу активируем
-    success = await db.activate_check(check["id"], user_id)
-    if success:
-        amount = check["amount_per_activation"]
-        rollover_multiplier = check.get("rollover_multiplier", 1.0)
+    # Активация и зачисление - одна транзакция
+    status, activation = await activation_engine.activate_check(check["id"], user_id)
+    if status == ACTIVATED:
+        amount = activation["amount"]
+        rollover_multiplier = activation["rollover_multiplier"]
         
-        # Если есть отыгрыш, добавляем средства в заблокированный баланс
+        # Средства с отыгрышем зачислены в заблокированный баланс
         if rollover_multiplier > 1.0:
-            await db.add_rollover_requirement(user_id, amount, rollover_multiplier)
-            user = await db.get_user(user_id)
-            rollover_requirement = user.get("rollover_requirement", 0.0)
+            rollover_requirement = activation["rollover_requirement"]
             
             text = f"""✅ <b>Чек активирован!</b>
 
@@ -1000,9 +824,6 @@ async def handle_check_activation(message: Message, check_code: str, state: FSMC
 
 ⚠️ <b>Внимание:</b> Вы сможете использовать полученные средства для игр, но вывести их можно будет только после выполнения требования отыгрыша."""
         else:
-            # Если отыгрыша нет, добавляем на обычный баланс
-            await db.update_balance(user_id, amount)
-            
             text = f"""✅ <b>Чек активирован!</b>
 
 💰 Получено: ${amount:.2f}
@@ -1025,6 +846,10 @@ async def handle_check_activation(message: Message, check_code: str, state: FSMC
             await message.answer(text, reply_markup=result_keyboard, parse_mode="HTML")
         
         await notify_check_owner(db, message.bot, check["id"], check_code, message.from_user)
+    elif status == ALREADY_ACTIVATED:
+        await message.answer("❌ Вы уже активировали этот чек")
+    elif status == SOLD_OUT:
+        await message.answer("❌ Чек исчерпан (все активации использованы)")
     else:
         await message.answer("❌ Ошибка при активации чека")
 
@@ -1143,19 +968,15 @@ async def handle_promo_activation(message: Message, promo_code: str, state: FSMC
             return
     
     # Активируем промокод
-    success = await db.activate_promo_code(promo_id, user_id)
-    if success:
-        amount = promo["amount"]
-        rollover_multiplier = promo.get("rollover_multiplier", 1.0)
+    # Активация, зачисление и запись депозита - одна транзакция
+    status, activation = await activation_engine.activate_promo(promo_id, user_id)
+    if status == ACTIVATED:
+        amount = activation["amount"]
+        rollover_multiplier = activation["rollover_multiplier"]
         
-        # Все равно записываем как депозит для статистики
-        await db.add_deposit(user_id, amount, "promo_code")
-        
-        # Если есть отыгрыш, добавляем средства в заблокированный баланс
+        # Средства с отыгрышем зачислены в заблокированный баланс
         if rollover_multiplier > 1.0:
-            await db.add_rollover_requirement(user_id, amount, rollover_multiplier)
-            user = await db.get_user(user_id)
-            rollover_requirement = user.get("rollover_requirement", 0.0)
+            rollover_requirement = activation["rollover_requirement"]
             
             text = f"""✅ <b>Промокод активирован!</b>
 
@@ -1167,12 +988,7 @@ async def handle_promo_activation(message: Message, promo_code: str, state: FSMC
 
 Спасибо за использование промокода! 🎉"""
         else:
-            # Если отыгрыша нет, добавляем на обычный баланс
-            await db.update_balance(user_id, amount)
-            
-            # Получаем обновленный баланс
-            updated_user = await db.get_user(user_id)
-            new_balance = updated_user["balance"]
+            new_balance = activation["balance"]
             
             text = f"""✅ <b>Промокод активирован!</b>
 
@@ -1183,6 +999,10 @@ async def handle_promo_activation(message: Message, promo_code: str, state: FSMC
 Спасибо за использование промокода! 🎉"""
         
         await message.answer(text, parse_mode="HTML")
+    elif status == ALREADY_ACTIVATED:
+        await message.answer("❌ Вы уже активировали этот промокод")
+    elif status == SOLD_OUT:
+        await message.answer("❌ Промокод исчерпан (все активации использованы)")
     else:
         await message.answer("❌ Ошибка при активации промокода")
     
@@ -1212,11 +1032,13 @@ async def check_subscription_callback(callback: CallbackQuery, bot: Bot, state:
     user_id = callback.from_user.id
     
     # Проверяем подписку (используем ID канала, если указан)
+    # Пользователь только что мог подписаться - спрашиваем Telegram в обход кэша
     is_subscribed = await check_subscription(
         bot, 
         user_id, 
         channel=REQUIRED_CHANNEL, 
-        channel_id=REQUIRED_CHANNEL_ID
+        channel_id=REQUIRED_CHANNEL_ID,
+        use_cache=False
     )
     
     if is_subscribed:
@@ -0,0 +1,125 @@
+"""
+Общие HTTP-сессии для внешних API (Crypto Pay, xRocket, toncenter, CoinGecko)
+
+На каждый хост создается одна долгоживущая aiohttp.ClientSession со своим
+пулом соединений (keep-alive, кэш DNS), поэтому повторные запросы идут по
+уже открытым TCP/TLS соединениям. Сессии закрываются через close_http_sessions()
+при остановке бота.
+"""
+import asyncio
+import logging
+import os
+import random
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from yarl import URL
+
+logger = logging.getLogger(__name__)
+
+# Таймауты запросов по умолчанию (сек)
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Размер пула соединений к одному хосту
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+# Повторы: количество и базовая задержка экспоненциального backoff с jitter (сек)
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.3"))
+HTTP_RETRY_BACKOFF_MAX = 5.0
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+
+# Статусы, при которых запрос можно повторить (для неидемпотентных - только 429)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# (scheme, host, port) -> (сессия, event loop, в котором она создана)
+_SESSIONS: Dict[Tuple[str, str, int], Tuple[aiohttp.ClientSession, asyncio.AbstractEventLoop]] = {}
+
+
+def get_session(url: str) -> aiohttp.ClientSession:
+    """Получить общую для процесса сессию для хоста из url"""
+    parsed = URL(url)
+    key = (parsed.scheme, parsed.host, parsed.port)
+    loop = asyncio.get_running_loop()
+    entry = _SESSIONS.get(key)
+    if entry is not None and not entry[0].closed and entry[1] is loop:
+        return entry[0]
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_SIZE,
+        limit_per_host=HTTP_POOL_SIZE,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+    _SESSIONS[key] = (session, loop)
+    logger.debug(f"🌐 Открыта HTTP-сессия для {parsed.host}")
+    return session
+
+
+def _backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Задержка перед повтором: Retry-After, иначе экспонента с полным jitter"""
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_RETRY_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_RETRY_BACKOFF_MAX, HTTP_RETRY_BACKOFF * 2 ** attempt))
+
+
+@asynccontextmanager
+async def http_request(method: str, url: str, retries: int = HTTP_RETRIES,
+                       idempotent: Optional[bool] = None, **kwargs):
+    """
+    Выполнить запрос через общую сессию хоста, с повторами
+
+    Ошибки установки соединения и 429 повторяются всегда (запрос не был обработан),
+    таймауты, обрывы и 5xx - только для идемпотентных запросов (по умолчанию GET/HEAD).
+    Остальные аргументы передаются в ClientSession.request (timeout, json, params, ...).
+    """
+    method = method.upper()
+    if idempotent is None:
+        idempotent = method in ("GET", "HEAD")
+    if isinstance(kwargs.get("timeout"), (int, float)):
+        kwargs["timeout"] = aiohttp.ClientTimeout(total=kwargs["timeout"])
+    attempt = 0
+    while True:
+        try:
+            response = await get_session(url).request(method, url, **kwargs)
+        except aiohttp.ClientConnectorError as e:
+            if attempt >= retries:
+                raise
+            logger.warning(f"⚠️ {method} {url}: ошибка соединения ({e}), повтор {attempt + 1}/{retries}")
+            delay = _backoff(attempt)
+        except (asyncio.TimeoutError, aiohttp.ServerDisconnectedError, aiohttp.ClientOSError) as e:
+            if not idempotent or attempt >= retries:
+                raise
+            logger.warning(f"⚠️ {method} {url}: {type(e).__name__}, повтор {attempt + 1}/{retries}")
+            delay = _backoff(attempt)
+        else:
+            retryable = response.status == 429 or (idempotent and response.status in RETRY_STATUSES)
+            if not retryable or attempt >= retries:
+                break
+            logger.warning(f"⚠️ {method} {url}: HTTP {response.status}, повтор {attempt + 1}/{retries}")
+            delay = _backoff(attempt, response.headers.get("Retry-After"))
+            response.release()
+        attempt += 1
+        await asyncio.sleep(delay)
+    try:
+        yield response
+    finally:
+        response.release()
+
+
+async def close_http_sessions():
+    """Закрыть все HTTP-сессии (при остановке бота)"""
+    sessions = [session for session, _ in _SESSIONS.values()]
+    _SESSIONS.clear()
+    for session in sessions:
+        if not session.closed:
+            await session.close()
+    if sessions:
+        logger.info(f"🌐 Закрыто HTTP-сессий: {len(sessions)}")
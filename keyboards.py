@@ -426,13 +426,12 @@ def get_gifts_withdrawal_keyboard(gifts_config: Dict, user_balance_ton: float, t
     # Сравниваем цены в TON напрямую
     # Создаем список доступных подарков
     available_gifts = []
-    for emoji, gift_info in gifts_config.items():
-        base_price_ton = gift_info.get("price_ton", 0)  # базовая цена в TON
-        price_ton = base_price_ton * 1.1  # +10% при выводе
+    for gift_info in gifts_config.values():
+        price_ton = gift_info["withdraw_price_ton"]  # +10% при выводе (предрассчитано в каталоге)
         # Сравниваем цены в TON
         if price_ton <= user_balance_ton:
             available_gifts.append({
-                "emoji": emoji,
+                "emoji": gift_info.get("emoji", ""),
                 "name": gift_info["name"],
                 "price_ton": price_ton
             })
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест активации промокода: N одновременных активаций одного кода
+
+Во временной базе создаются пользователи и промокод с ограниченным числом
+активаций, затем все активации запускаются одновременно (asyncio.gather)
+через activations.activation_engine. Часть пользователей активирует код
+дважды. После теста проверяется, что счетчик не ушел в минус, активаций не
+больше лимита, каждый пользователь получил сумму не больше одного раза, а
+балансы и депозиты совпадают с числом активаций. Вторая волна - те же
+пользователи еще раз: если код исчерпан, она показывает отсечку без
+обращения к базе.
+
+Запуск: python load_test_activations.py [--requests N] [--limit N] [--duplicates ДОЛЯ]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+import activations
+from activations import ACTIVATED, activation_engine
+from database import Database
+
+PROMO_AMOUNT = 0.5
+
+
+def percentile(values, share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+async def fire(user_ids, promo_id: int):
+    """Одновременные активации. Возвращает (итоги, задержки в мс, время волны в с)"""
+    async def activate(user_id: int):
+        started = time.perf_counter()
+        status, _ = await activation_engine.activate_promo(promo_id, user_id)
+        return status, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(activate(user_id) for user_id in user_ids))
+    elapsed = time.perf_counter() - started
+    return Counter(status for status, _ in results), [latency for _, latency in results], elapsed
+
+
+def report(title: str, statuses: Counter, latencies, elapsed: float):
+    print(f"\n===== {title} =====")
+    print(f"Запросов: {sum(statuses.values())} за {elapsed:.2f} с ({sum(statuses.values()) / elapsed:.0f} в секунду)")
+    for status, count in statuses.most_common():
+        print(f"    {status}: {count}")
+    print(f"Задержка: p50 {percentile(latencies, 0.5):.1f} мс, p99 {percentile(latencies, 0.99):.1f} мс, "
+          f"max {max(latencies):.1f} мс")
+
+
+def verify(path: str, promo_id: int, limit: int, activated: int) -> bool:
+    """Проверить инварианты по базе"""
+    conn = sqlite3.connect(path)
+    remaining = conn.execute("SELECT remaining_activations FROM promo_codes WHERE id = ?", (promo_id,)).fetchone()[0]
+    rows = conn.execute("SELECT COUNT(*) FROM promo_activations WHERE promo_id = ?", (promo_id,)).fetchone()[0]
+    credited_users, balance = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(balance), 0) FROM users WHERE balance > 0"
+    ).fetchone()
+    over_credited = conn.execute("SELECT COUNT(*) FROM users WHERE balance > ?", (PROMO_AMOUNT + 1e-9,)).fetchone()[0]
+    deposits = conn.execute("SELECT COUNT(*) FROM deposits WHERE method = 'promo_code'").fetchone()[0]
+    conn.close()
+
+    checks = [
+        ("счетчик не ушел в минус", remaining >= 0, remaining),
+        ("активаций не больше лимита", rows <= limit, rows),
+        ("остаток = лимит - активации", remaining == limit - rows, f"{remaining} = {limit} - {rows}"),
+        ("успешных ответов = записей активаций", activated == rows, f"{activated} = {rows}"),
+        ("зачислено пользователям = активациям", credited_users == rows, credited_users),
+        ("никто не получил сумму дважды", over_credited == 0, over_credited),
+        ("сумма балансов", abs(balance - rows * PROMO_AMOUNT) < 1e-6, f"{balance:.2f}"),
+        ("депозиты промокода", deposits == rows, deposits),
+    ]
+    print("\n===== Проверка базы =====")
+    for name, ok, value in checks:
+        print(f"    {'✅' if ok else '❌'} {name}: {value}")
+    return all(ok for _, ok, _ in checks)
+
+
+async def main(args):
+    path = os.path.join(tempfile.mkdtemp(), "load.db")
+    db = Database()
+    db.db_path = path
+    activations.db.db_path = path
+    await db.init_db()
+
+    users = max(1, int(args.requests * (1 - args.duplicates)))
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (user_id, username, balance) VALUES (?, ?, 0)",
+        ((user_id, f"user{user_id}") for user_id in range(1, users + 1)),
+    )
+    conn.commit()
+    conn.close()
+    promo_id = await db.create_promo_code("LOADTEST", PROMO_AMOUNT, args.limit, False, created_by=1)
+
+    # Каждый пользователь один раз, остальные запросы - повторные активации
+    user_ids = list(range(1, users + 1))
+    user_ids += random.choices(user_ids, k=args.requests - users)
+    random.shuffle(user_ids)
+    print(f"Промокод: {args.limit} активаций, запросов: {args.requests}, пользователей: {users}")
+
+    statuses, latencies, elapsed = await fire(user_ids, promo_id)
+    report("Волна 1: одновременные активации", statuses, latencies, elapsed)
+
+    statuses_after, latencies_after, elapsed_after = await fire(range(1, users + 1), promo_id)
+    report("Волна 2: те же пользователи еще раз", statuses_after, latencies_after, elapsed_after)
+    print(f"Отсечка в памяти: {activation_engine.metrics()}")
+
+    await db.close()
+    ok = verify(path, promo_id, args.limit, statuses[ACTIVATED])
+    print("\nИтог:", "✅ инварианты соблюдены" if ok else "❌ инварианты нарушены")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест одновременной активации промокода")
+    parser.add_argument("--requests", type=int, default=10_000, help="одновременных активаций")
+    parser.add_argument("--limit", type=int, default=1000, help="активаций у промокода")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="доля повторных активаций тех же пользователей")
+    raise SystemExit(0 if asyncio.run(main(parser.parse_args())) else 1)
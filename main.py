@@ -9,6 +9,8 @@ from aiogram.types import CallbackQuery
 
 from config import BOT_TOKEN, ADMIN_IDS
 from database import Database
+from http_client import close_http_sessions
+from charts import shutdown_chart_pool
 from handlers import (
     start_router,
     games_router,
@@ -234,6 +236,13 @@ async def start_bot():
     except Exception as e:
         logger.error(f"❌ Ошибка при запуске планировщика лотерей: {e}", exc_info=True)
     
+    # Продолжение рассылок, прерванных перезапуском
+    try:
+        from broadcast import get_broadcast_engine
+        await get_broadcast_engine(bot).resume_all()
+    except Exception as e:
+        logger.error(f"❌ Ошибка при продолжении рассылок: {e}", exc_info=True)
+    
     # Запуск API сервера параллельно с ботом
     try:
         from api_server import start_api_server
@@ -244,8 +253,46 @@ async def start_bot():
         logger.error(f"❌ Ошибка при запуске API сервера: {e}", exc_info=True)
         logger.warning("⚠️ API сервер не запущен, мини-апп может не работать")
     
+    # Игровые сессии: восстановление из снимка и фоновая очистка истекших записей
+    try:
+        from session_store import restore_session_snapshot, run_session_sweeper
+        await restore_session_snapshot(db)
+        from api_server import refund_interrupted_mini_app_games
+        await refund_interrupted_mini_app_games()
+        asyncio.create_task(run_session_sweeper())
+    except Exception as e:
+        logger.error(f"❌ Ошибка при восстановлении игровых сессий: {e}", exc_info=True)
+    
+    # Изображения меню: нормализуем один раз и, если задан MEDIA_UPLOAD_CHAT_ID, заранее получаем file_id
+    try:
+        from media_cache import MEDIA_UPLOAD_CHAT_ID, media_registry
+        if MEDIA_UPLOAD_CHAT_ID:
+            await media_registry.warm_up(bot, MEDIA_UPLOAD_CHAT_ID)
+        else:
+            await media_registry.prepare_all()
+    except Exception as e:
+        logger.error(f"❌ Ошибка при подготовке изображений меню: {e}", exc_info=True)
+    
     # Запуск polling с skip_updates для пропуска старых обновлений
-    await dp.start_polling(bot, skip_updates=True)
+    try:
+        await dp.start_polling(bot, skip_updates=True)
+    finally:
+        # Сохраняем снимок игровых сессий, закрываем общие HTTP-сессии внешних API,
+        # процессы отрисовки графиков и пул соединений с базой данных
+        try:
+            from session_store import save_session_snapshot
+            await save_session_snapshot(db)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при сохранении снимка игровых сессий: {e}", exc_info=True)
+        # Дописываем принятые ставки рулетки мини-аппа
+        try:
+            from api_server import roulette
+            await roulette.stop()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при остановке рулетки: {e}", exc_info=True)
+        await close_http_sessions()
+        shutdown_chart_pool()
+        await db.close()
 
 
 async def schedule_pvp_100_tasks(bot: Bot):
@@ -436,18 +483,24 @@ async def finish_lottery_draw(bot: Bot, lottery_id: int):
                     logger.error(f"Ошибка при отправке уведомления победителю: {e}")
             
             elif prize["prize_type"] == "gift":
-                # Ищем подарок
-                gift = await db.get_available_relay_gift(gift_name=prize["prize_value"])
+                # Резервируем подарок
+                from gift_allocator import gift_allocator
+                gift = await gift_allocator.reserve(ticket["user_id"], gift_name=prize["prize_value"])
                 if gift:
                     # Отправляем подарок
                     from relay_account import get_relay_client
                     relay_client = get_relay_client()
                     if relay_client:
                         try:
-                            await db.mark_gift_as_transferred(gift["message_id"], ticket["user_id"])
+                            await gift_allocator.confirm(gift["message_id"], ticket["user_id"])
                             logger.info(f"🎁 Подарок {prize['prize_value']} отправлен пользователю {ticket['user_id']}")
                         except Exception as e:
+                            gift_allocator.release(gift["message_id"])
                             logger.error(f"Ошибка при отправке подарка: {e}")
+                    else:
+                        # Без релеера подарок не передать - возвращаем резерв
+                        gift_allocator.release(gift["message_id"])
+                        logger.warning(f"🎁 Релеер недоступен, резерв подарка {gift['message_id']} снят")
                     
                     # Отправляем уведомление
                     try:
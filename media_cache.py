@@ -0,0 +1,264 @@
+"""
+Реестр изображений меню и их file_id в Telegram
+
+Изображение меню (старт.jpg, кошелек.jpg, игры.jpg ...) проверяется и
+перекодируется через PIL один раз - при запуске бота или при первом
+обращении, - загружается в Telegram один раз, а полученный file_id
+сохраняется в таблице media_file_ids по хэшу нормализованного содержимого.
+Дальше отправка меню - ссылка на file_id: без чтения файла, перекодирования
+и повторной загрузки байтов.
+
+Изменение файла на диске замечается по mtime и размеру: новое содержимое
+получает новый хэш и загружается заново. Если Telegram не принимает
+сохраненный file_id, он забывается и изображение загружается еще раз.
+file_id действителен только для бота, который его получил, поэтому
+хранится по bot_id.
+
+Заранее загрузить все изображения: MEDIA_UPLOAD_CHAT_ID=<чат> при запуске
+бота или python media_cache.py <chat_id> (сообщения в чате удаляются сразу
+после загрузки).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+from io import BytesIO
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputMediaPhoto, Message
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Папка с изображениями меню
+MEDIA_DIR = os.getenv("MEDIA_DIR", os.getcwd())
+# Чат для загрузки изображений при запуске бота (пусто - file_id получается при первой отправке)
+MEDIA_UPLOAD_CHAT_ID = os.getenv("MEDIA_UPLOAD_CHAT_ID")
+MEDIA_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Ошибки Telegram, после которых сохраненный file_id больше не используется
+_INVALID_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file identifier", "file reference")
+
+# Проверяем доступность PIL для обработки изображений
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logger.warning("PIL не установлен, изображения меню будут отправляться без проверки")
+
+db = Database()
+
+PhotoInput = Union[str, BufferedInputFile]
+
+
+def normalize_image(path: str) -> bytes:
+    """Проверить изображение и перекодировать его для Telegram
+
+    JPEG сохраняется в RGB, остальные форматы - в PNG. Без PIL или если PIL не
+    смог открыть файл, возвращаются байты файла как есть.
+    """
+    if PIL_AVAILABLE:
+        try:
+            img = Image.open(path)
+            img.verify()  # Проверяем целостность (verify закрывает файл)
+            img = Image.open(path)
+            img.load()
+            output = BytesIO()
+            if img.format == "PNG":
+                img.save(output, format="PNG", optimize=True)
+            elif img.format in ("JPEG", "JPG"):
+                if img.mode == "RGBA":
+                    # Прозрачность JPEG не поддерживает - кладем на белый фон
+                    rgb_img = Image.new("RGB", img.size, (255, 255, 255))
+                    rgb_img.paste(img, mask=img.split()[-1])
+                    img = rgb_img
+                elif img.mode != "RGB":
+                    img = img.convert("RGB")
+                img.save(output, format="JPEG", quality=95, optimize=True)
+            else:
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGB")
+                img.save(output, format="PNG", optimize=True)
+            return output.getvalue()
+        except Exception as e:
+            logger.warning(f"⚠️ PIL не смог обработать файл {os.path.basename(path)}: {e}. Использую файл как есть.")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class _Media:
+    __slots__ = ("filename", "content_hash", "data", "mtime_ns", "size")
+
+    def __init__(self, filename: str, data: bytes, mtime_ns: int, size: int):
+        self.filename = filename
+        self.content_hash = hashlib.sha256(data).hexdigest()
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.size = size
+
+
+class MediaRegistry:
+    """Нормализованные изображения меню и их file_id по ботам"""
+
+    def __init__(self, directory: str = MEDIA_DIR):
+        self.directory = directory
+        self._media: Dict[str, _Media] = {}
+        # bot_id -> {хэш содержимого: file_id}
+        self._file_ids: Dict[int, Dict[str, str]] = {}
+        self._load_lock = asyncio.Lock()
+        self.uploads = 0
+        self.cached_sends = 0
+
+    async def prepare(self, filename: str) -> Optional[_Media]:
+        """Нормализованное изображение (None - файла нет или он пустой)"""
+        path = os.path.join(self.directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._media.pop(filename, None)
+            return None
+        media = self._media.get(filename)
+        if media is not None and media.mtime_ns == stat.st_mtime_ns and media.size == stat.st_size:
+            return media
+        try:
+            # Перекодирование занимает десятки миллисекунд - не блокируем event loop
+            data = await asyncio.to_thread(normalize_image, path)
+        except OSError as e:
+            logger.error(f"❌ Не удалось прочитать файл {filename}: {e}")
+            return None
+        if not data:
+            logger.warning(f"⚠️ Файл {filename} пустой")
+            return None
+        media = _Media(filename, data, stat.st_mtime_ns, stat.st_size)
+        self._media[filename] = media
+        logger.info(f"🖼 Изображение {filename} подготовлено ({len(data)} байт, {media.content_hash[:12]})")
+        return media
+
+    async def prepare_all(self) -> int:
+        """Подготовить все изображения из папки (вызывается при запуске бота)"""
+        filenames = sorted(name for name in os.listdir(self.directory) if name.lower().endswith(MEDIA_EXTENSIONS))
+        for filename in filenames:
+            await self.prepare(filename)
+        logger.info(f"🖼 Изображения меню подготовлены: {len(self._media)}")
+        return len(self._media)
+
+    async def _file_ids_for(self, bot) -> Dict[str, str]:
+        file_ids = self._file_ids.get(bot.id)
+        if file_ids is not None:
+            return file_ids
+        async with self._load_lock:
+            if bot.id not in self._file_ids:
+                try:
+                    self._file_ids[bot.id] = await db.get_media_file_ids(bot.id)
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось загрузить file_id изображений: {e}")
+                    self._file_ids[bot.id] = {}
+        return self._file_ids[bot.id]
+
+    async def _remember(self, bot, media: _Media, message):
+        if not isinstance(message, Message) or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        file_ids = await self._file_ids_for(bot)
+        if file_ids.get(media.content_hash) == file_id:
+            return
+        file_ids[media.content_hash] = file_id
+        try:
+            await db.save_media_file_id(bot.id, media.content_hash, file_id, media.filename)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить file_id изображения {media.filename}: {e}")
+
+    async def _forget(self, bot, media: _Media):
+        (await self._file_ids_for(bot)).pop(media.content_hash, None)
+        try:
+            await db.delete_media_file_id(bot.id, media.content_hash)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось удалить file_id изображения {media.filename}: {e}")
+
+    async def _send(self, bot, filename: str, send: Callable[[PhotoInput], Awaitable]):
+        """Вызвать send(photo) с file_id, а если его нет или Telegram его не принял - с байтами изображения
+
+        Возвращает результат send или None, если изображения нет. Остальные
+        ошибки Telegram пробрасываются вызывающему.
+        """
+        media = await self.prepare(filename)
+        if media is None:
+            return None
+        file_id = (await self._file_ids_for(bot)).get(media.content_hash)
+        if file_id:
+            try:
+                result = await send(file_id)
+                self.cached_sends += 1
+                return result
+            except TelegramBadRequest as e:
+                if not any(error in str(e).lower() for error in _INVALID_FILE_ID_ERRORS):
+                    raise
+                logger.warning(f"⚠️ Telegram не принял file_id изображения {filename}: {e}. Загружаю заново.")
+                await self._forget(bot, media)
+        result = await send(BufferedInputFile(media.data, filename=filename))
+        self.uploads += 1
+        await self._remember(bot, media, result)
+        return result
+
+    async def answer_photo(self, message: Message, filename: str, **kwargs) -> Optional[Message]:
+        """message.answer_photo с изображением меню. None - изображения нет"""
+        return await self._send(message.bot, filename, lambda photo: message.answer_photo(photo=photo, **kwargs))
+
+    async def edit_photo(self, message: Message, filename: str, caption: str, reply_markup=None,
+                         parse_mode: str = "HTML"):
+        """Заменить фото сообщения на изображение меню. None - изображения нет"""
+        return await self._send(message.bot, filename, lambda photo: message.edit_media(
+            media=InputMediaPhoto(media=photo, caption=caption, parse_mode=parse_mode),
+            reply_markup=reply_markup,
+        ))
+
+    async def warm_up(self, bot, chat_id: Union[int, str]) -> int:
+        """Загрузить в чат chat_id изображения без file_id и удалить эти сообщения. Возвращает число загрузок"""
+        await self.prepare_all()
+        file_ids = await self._file_ids_for(bot)
+        uploaded = 0
+        for filename, media in list(self._media.items()):
+            if media.content_hash in file_ids:
+                continue
+            try:
+                message = await self._send(bot, filename, lambda photo: bot.send_photo(
+                    chat_id, photo=photo, disable_notification=True
+                ))
+                uploaded += 1
+                if message is not None:
+                    await bot.delete_message(chat_id, message.message_id)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось загрузить изображение {filename}: {e}")
+        logger.info(f"🖼 Загружено изображений меню: {uploaded}, всего с file_id: {len(file_ids)}")
+        return uploaded
+
+    def stats(self) -> Dict[str, int]:
+        return {"images": len(self._media), "uploads": self.uploads, "cached_sends": self.cached_sends}
+
+
+media_registry = MediaRegistry()
+
+
+async def _main(chat_id: str):
+    from aiogram import Bot
+    from config import BOT_TOKEN
+
+    await db.init_db()
+    bot = Bot(token=BOT_TOKEN)
+    try:
+        await media_registry.warm_up(bot, chat_id)
+    finally:
+        await bot.session.close()
+        await db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Запуск: python media_cache.py <chat_id>")
+        sys.exit(1)
+    asyncio.run(_main(sys.argv[1]))
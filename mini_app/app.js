@@ -2015,16 +2015,32 @@ async function launchGame(gameId, bet, mode) {
     }
 }
 
-// Проверить результат игры
+// Снять блокировки игры после ошибки или таймаута (в т.ч. для слотов)
+function unlockGameAfterFailure() {
+    appState.gameInProgress = false;
+    if (appState.currentGameId === 'slots') {
+        appState.slotsSpinUsed = false;
+        appState.slotsLastSymbols = null;
+        resetSlotsRows();
+        setSlotsSpinButtonState();
+    } else {
+        const startBtn = document.getElementById('start-game-btn');
+        if (startBtn) {
+            startBtn.disabled = false;
+            startBtn.style.opacity = '1';
+            startBtn.style.cursor = 'pointer';
+            startBtn.textContent = 'Начать игру';
+        }
+    }
+}
+
+// Проверить результат игры (long-poll: сервер отвечает, как только результат готов)
 async function checkGameResult(gameId) {
-    const maxAttempts = 40; // Максимум 20 секунд (40 попыток по 0.5 секунды)
-    let attempts = 0;
+    const deadline = Date.now() + 20000; // Максимум 20 секунд
     
-    const checkInterval = setInterval(async () => {
-        attempts++;
-        
+    while (Date.now() < deadline) {
         try {
-            const response = await fetch(`${API_BASE}/game/result/${gameId}`, {
+            const response = await fetch(`${API_BASE}/game/result/${gameId}?wait=8`, {
                 headers: {
                     'X-Telegram-Init-Data': tg.initData
                 }
@@ -2033,7 +2049,6 @@ async function checkGameResult(gameId) {
             if (response.ok) {
                 const data = await response.json();
                 if (data.completed) {
-                    clearInterval(checkInterval);
                     if (data.game_type === 'slots') {
                         handleSlotsGameCompleted(data);
                     } else {
@@ -2041,55 +2056,28 @@ async function checkGameResult(gameId) {
                     }
                     // Обновляем баланс
                     await loadUserData();
+                    return;
                 } else if (data.status === 'timeout' || data.status === 'error') {
-                    clearInterval(checkInterval);
                     showToast(data.status === 'timeout' ? 'Таймаут ожидания результата' : 'Ошибка игры');
-
-                    // Снимаем блокировки (в т.ч. для слотов)
-                    appState.gameInProgress = false;
-                    if (appState.currentGameId === 'slots') {
-                        appState.slotsSpinUsed = false;
-                        appState.slotsLastSymbols = null;
-                        resetSlotsRows();
-                        setSlotsSpinButtonState();
-                    } else {
-                        const startBtn = document.getElementById('start-game-btn');
-                        if (startBtn) {
-                            startBtn.disabled = false;
-                            startBtn.style.opacity = '1';
-                            startBtn.style.cursor = 'pointer';
-                            startBtn.textContent = 'Начать игру';
-                        }
-                    }
+                    unlockGameAfterFailure();
+                    return;
                 }
+                // Игра еще идет - сразу ждем снова
+                continue;
             }
         } catch (error) {
             console.error('Ошибка проверки результата:', error);
         }
-        
-        if (attempts >= maxAttempts) {
-            clearInterval(checkInterval);
-            showToast('Таймаут ожидания результата');
-            // Разблокируем кнопку при таймауте
-            appState.gameInProgress = false;
-            if (appState.currentGameId === 'slots') {
-                appState.slotsSpinUsed = false;
-                appState.slotsLastSymbols = null;
-                resetSlotsRows();
-                setSlotsSpinButtonState();
-            } else {
-                const startBtn = document.getElementById('start-game-btn');
-                if (startBtn) {
-                    startBtn.disabled = false;
-                    startBtn.style.opacity = '1';
-                    startBtn.style.cursor = 'pointer';
-                    startBtn.textContent = 'Начать игру';
-                }
-            }
-        }
-    }, 500); // Проверяем каждые 0.5 секунды для быстрого отклика
+        // Ошибка запроса - небольшая пауза перед повтором
+        await new Promise(resolve => setTimeout(resolve, 500));
+    }
+    
+    showToast('Таймаут ожидания результата');
+    // Разблокируем кнопку при таймауте
+    unlockGameAfterFailure();
 }
 
+
 // Отобразить результат игры
 function displayGameResult(result) {
     // Логируем для отладки
@@ -4907,6 +4895,7 @@ const rouletteState = {
     wheelCanvas: null,
     wheelCtx: null,
     isSpinning: false,
+    roundId: null, // Номер раунда, который показывает колесо (итог запрашивается именно для него)
     previousParticipants: 0, // Для отслеживания изменений количества участников
     allUsersInBets: [], // Все уникальные пользователи в ставках для отображения аватарок
     topTab: 'games', // 'games' или 'users'
@@ -5473,6 +5462,10 @@ async function loadRouletteData() {
             
             // Обновляем номер игры и количество игроков
             document.getElementById('roulette-game-id').textContent = data.game_id || '-';
+            // Во время вращения номер раунда не меняем: итог нужен для раунда, который крутится
+            if (!rouletteState.isSpinning && participants > 0 && data.game_id) {
+                rouletteState.roundId = data.game_id;
+            }
             document.getElementById('roulette-players-count').textContent = participants;
             
             // Обновляем ставки и общую сумму
@@ -5975,7 +5968,10 @@ async function spinWheel() {
     // Вычисляем размеры секторов (для логики вращения используем группировку по секторам рулетки)
     const sectorSizes = calculateSectorSizesForSpin();
     
-    // Выбираем случайный выигрышный сектор (из тех, где есть ставки)
+    // Выигрышный сектор определяет сервер по таймеру раунда - ждем итог этого раунда
+    const roundResult = await fetchRouletteResult(rouletteState.roundId);
+    
+    // Сектор для анимации: сектор из итога сервера, иначе случайный из тех, где есть ставки
     const sectorsWithBets = [];
     for (let i = 0; i < rouletteState.sectors; i++) {
         if (sectorSizes[i] > 0) {
@@ -5988,7 +5984,10 @@ async function spinWheel() {
     const availableSectors = sectorsWithBets.length > 0 ? sectorsWithBets : 
                              Array.from({length: rouletteState.sectors}, (_, i) => i);
     const randomWinningSectorIndex = Math.floor(Math.random() * availableSectors.length);
-    const randomWinningSector = availableSectors[randomWinningSectorIndex];
+    const serverSector = roundResult ? roundResult.winning_sector : undefined;
+    const randomWinningSector = (serverSector !== undefined && sectorSizes[serverSector] > 0)
+        ? serverSector
+        : availableSectors[randomWinningSectorIndex];
     
     // Вычисляем центр выигрышного сектора с учетом размеров секторов
     // Секторы начинаются сверху с -Math.PI/2
@@ -6087,12 +6086,9 @@ async function spinWheel() {
             
             rouletteState.isSpinning = false;
             
-            // Вычисляем реальный выигрышный сектор по положению указателя
-            const actualWinningSector = calculateWinningSectorFromRotation();
-            
-            // Небольшая задержка перед отправкой результата
+            // Небольшая задержка перед показом результата
             setTimeout(() => {
-                finishRound(actualWinningSector);
+                finishRound(roundResult);
             }, 300);
         }
     }
@@ -6100,8 +6096,8 @@ async function spinWheel() {
     animate();
 }
 
-// Завершение раунда
-async function finishRound(winningSector) {
+// Итог раунда roundId: раунд завершает таймер сервера, запрос ждет итога
+async function fetchRouletteResult(roundId) {
     try {
         const response = await fetch(`${API_BASE}/roulette/finish`, {
             method: 'POST',
@@ -6109,11 +6105,26 @@ async function finishRound(winningSector) {
                 'Content-Type': 'application/json',
                 'X-Telegram-Init-Data': getInitData()
             },
-            body: JSON.stringify({ winning_sector: winningSector })
+            body: JSON.stringify({ game_id: roundId })
         });
-        
-        if (response.ok) {
-            const data = await response.json();
+        if (!response.ok) return null;
+        const data = await response.json();
+        // Итог другого раунда не показываем: сектор и победитель были бы чужими
+        if (!data || (data.game_id !== undefined && data.game_id !== roundId)) {
+            console.warn('Итог другого раунда рулетки, пропускаю:', data && data.game_id, 'ожидался', roundId);
+            return null;
+        }
+        return data;
+    } catch (error) {
+        console.error('Ошибка получения итога раунда:', error);
+        return null;
+    }
+}
+
+// Завершение раунда
+async function finishRound(data) {
+    try {
+        if (data) {
             
             // Показываем результат
             const countdownEl = document.getElementById('roulette-countdown');
@@ -6243,6 +6254,9 @@ async function placeRouletteBet() {
         if (response.ok) {
             const data = await response.json();
             console.log('Данные ответа:', data);
+            if (data.game_id) {
+                rouletteState.roundId = data.game_id;
+            }
             
             // Показываем сообщение только после успешного ответа
             showToast('Ставка размещена!');
@@ -0,0 +1,199 @@
+"""
+Правила выигрыша игр на эмодзи Telegram
+
+Правило ставки задается данными: сколько первых бросков учитывается и что с
+ними проверяется (все броски из набора граней, пара, сумма). При импорте
+правила компилируются: для ставок до MAX_TABLE_THROWS бросков заранее
+перечисляются все выигрышные комбинации граней, и проверка результата - один
+поиск в множестве; длинные серии проверяются через frozenset.issuperset.
+Множители берутся из config.GAME_CONFIGS.
+
+Те же правила (RULES) использует симулятор RTP, поэтому проверка в боте и
+расчет доходности не расходятся.
+
+Сверка с прежней цепочкой if/elif и бенчмарк: python benchmark_outcomes.py
+"""
+import itertools
+from typing import Dict, FrozenSet, NamedTuple, Optional, Sequence, Tuple
+
+from config import GAME_CONFIGS
+from utils.checks import decode_slot_symbols
+
+# Грани, для которых строятся таблицы (0 - промах в правилах боулинга)
+FACES = range(0, 7)
+# До скольких бросков строить таблицу всех выигрышных комбинаций (7^5 = 16807)
+MAX_TABLE_THROWS = 5
+
+EVEN = frozenset({2, 4, 6})
+ODD = frozenset({1, 3, 5})
+
+
+class Rule(NamedTuple):
+    """Правило ставки: kind - all_in / pair / sum_eq / sum_lt / sum_gt"""
+    kind: str
+    throws: int = 1
+    faces: FrozenSet[int] = frozenset()
+    target: int = 0
+
+
+def _all(throws: int, *faces: int) -> Rule:
+    return Rule("all_in", throws, frozenset(faces))
+
+
+RULES: Dict[str, Dict[str, Rule]] = {
+    "dice": {
+        "even": Rule("all_in", 1, EVEN),
+        "odd": Rule("all_in", 1, ODD),
+        **{f"exact_{face}": _all(1, face) for face in range(1, 7)},
+        "pair": Rule("pair", 2),
+        "3_even": Rule("all_in", 3, EVEN),
+        "3_odd": Rule("all_in", 3, ODD),
+        "18": Rule("sum_eq", 5, target=18),
+        "21": Rule("sum_eq", 5, target=21),
+        "111": _all(3, 1),
+        "333": _all(3, 3),
+        "666": _all(3, 6),
+    },
+    "dart": {
+        "red": _all(1, 2, 4, 6),
+        "white": _all(1, 3, 5),
+        "center": _all(1, 6),
+        "miss": _all(1, 1),
+        "3_red": _all(3, 2, 4, 6),
+        "3_white": _all(3, 3, 5),
+        "3_center": _all(3, 6),
+        "3_miss": _all(3, 1),
+    },
+    "bowling": {
+        "0-3": _all(1, 0, 1, 2, 3),
+        "4-6": _all(1, 4, 5, 6),
+        "strike": _all(1, 6),
+        "miss": _all(1, 0, 1),  # 1 также считается промахом
+        "2_strike": _all(2, 6),
+        "3_strike": _all(3, 6),
+        "2_miss": _all(2, 0, 1),
+        "3_miss": _all(3, 0, 1),
+    },
+    "football": {
+        # 3, 4, 5 - гол, 1, 2 - мимо, 3 - в центр (штанга)
+        "goal": _all(1, 3, 4, 5),
+        "miss": _all(1, 1, 2),
+        "center": _all(1, 3),
+        "hattrick": _all(3, 3, 4, 5),
+        "5_goals": _all(5, 3, 4, 5),
+        "10_goals": _all(10, 3, 4, 5),
+        "6_miss": _all(6, 1, 2, 3),
+    },
+    "basketball": {
+        # 4 и 5 - попадание, 5 - чистый гол, 3 - застрял, 1 и 2 - мимо
+        "hit": _all(1, 4, 5),
+        "miss": _all(1, 1, 2),
+        "clean": _all(1, 5),
+        "stuck": _all(1, 3),
+        "2_hit": _all(2, 4, 5),
+        "3_hit": _all(3, 4, 5),
+        "2_clean": _all(2, 5),
+        "3_clean": _all(3, 5),
+        "6_hit": _all(6, 4, 5),
+    },
+    "dice_7": {
+        "less_7": Rule("sum_lt", 2, target=7),
+        "equal_7": Rule("sum_eq", 2, target=7),
+        "more_7": Rule("sum_gt", 2, target=7),
+    },
+}
+
+# Множитель слотов по символу трех одинаковых барабанов
+SLOT_TRIPLE_MULTIPLIERS = {
+    "7": "3_axe",
+    "🍇": "3_cherry",
+    "🍋": "3_lemon",
+    "Bar": "3_bar",
+}
+
+
+def rule_wins(rule: Rule, throws: Sequence[int]) -> bool:
+    """Проверить правило по броскам без таблиц (эталон для компиляции)"""
+    if len(throws) < rule.throws:
+        return False
+    head = throws[:rule.throws]
+    if rule.kind == "all_in":
+        return rule.faces.issuperset(head)
+    if rule.kind == "pair":
+        return head[0] == head[1]
+    total = sum(head)
+    if rule.kind == "sum_eq":
+        return total == rule.target
+    if rule.kind == "sum_lt":
+        return total < rule.target
+    if rule.kind == "sum_gt":
+        return total > rule.target
+    raise ValueError(f"Неизвестный тип правила: {rule.kind}")
+
+
+def multiplier_for(game_type: str, bet_type: str) -> float:
+    """Множитель ставки из GAME_CONFIGS (для exact_N - общий множитель exact)"""
+    multipliers = GAME_CONFIGS.get(game_type, {}).get("multipliers", {})
+    if bet_type.startswith("exact_"):
+        return multipliers.get("exact", 1.0)
+    return multipliers.get(bet_type, 1.0)
+
+
+class _CompiledRule:
+    __slots__ = ("rule", "throws", "multiplier", "winning")
+
+    def __init__(self, rule: Rule, multiplier: float):
+        self.rule = rule
+        self.throws = rule.throws
+        self.multiplier = multiplier
+        self.winning: Optional[FrozenSet[tuple]] = None
+        if rule.throws <= MAX_TABLE_THROWS:
+            self.winning = frozenset(
+                combination for combination in itertools.product(FACES, repeat=rule.throws)
+                if rule_wins(rule, combination)
+            )
+
+    def wins(self, throws: Sequence[int]) -> bool:
+        if self.winning is not None:
+            # Меньше бросков или грани вне FACES в таблице не встречаются - проигрыш
+            return tuple(throws[:self.throws]) in self.winning
+        return rule_wins(self.rule, throws)
+
+
+class OutcomeTable:
+    """Скомпилированные правила всех игр: (game_type, bet_type) -> выигрыш и множитель"""
+
+    def __init__(self, rules: Dict[str, Dict[str, Rule]] = RULES):
+        self._rules: Dict[Tuple[str, str], _CompiledRule] = {
+            (game_type, bet_type): _CompiledRule(rule, multiplier_for(game_type, bet_type))
+            for game_type, bets in rules.items()
+            for bet_type, rule in bets.items()
+        }
+        # Слоты: все 64 значения кубика Telegram -> (символы, множитель)
+        slot_multipliers = GAME_CONFIGS.get("slots", {}).get("multipliers", {})
+        self._slots = [None]
+        for value in range(1, 65):
+            symbols = decode_slot_symbols(value)
+            multiplier = 0
+            if symbols[0] == symbols[1] == symbols[2]:
+                multiplier = slot_multipliers.get(SLOT_TRIPLE_MULTIPLIERS[symbols[0]], 0)
+            self._slots.append((symbols, multiplier))
+
+    def evaluate(self, game_type: str, bet_type: str, throws: Sequence[int]) -> Tuple[bool, float]:
+        """(выигрыш, множитель) для бросков. Неизвестная ставка не выигрывает"""
+        compiled = self._rules.get((game_type, bet_type))
+        if compiled is None:
+            return False, multiplier_for(game_type, bet_type)
+        return compiled.wins(throws), compiled.multiplier
+
+    def required_throws(self, game_type: str, bet_type: str) -> int:
+        compiled = self._rules.get((game_type, bet_type))
+        return compiled.throws if compiled else 1
+
+    def slot(self, value: int) -> Tuple[list, float]:
+        """(символы барабанов, множитель) для значения слота 1-64"""
+        symbols, multiplier = self._slots[value]
+        return list(symbols), multiplier
+
+
+outcome_table = OutcomeTable()
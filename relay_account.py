@@ -174,43 +174,32 @@ async def transfer_gift_to_user(client: TelegramClient, gift: types.SavedStarGif
 
 
 def get_emoji_by_gift_name(gift_name: str) -> Optional[str]:
-    """Получить эмодзи подарка по его имени из конфига"""
-    from gifts import GIFTS_CONFIG
+    """Получить эмодзи подарка по его имени из каталога"""
+    from gifts import gift_catalog
     
-    for emoji, info in GIFTS_CONFIG.items():
-        if info["name"].lower() == gift_name.lower():
-            return emoji
-    return None
+    gift = gift_catalog.by_name(gift_name)
+    return gift["emoji"] if gift else None
 
 
 def get_gift_info_by_name(gift_name: str) -> Optional[Dict]:
-    """Получить информацию о подарке по имени из конфига"""
-    from gifts import GIFTS_CONFIG
-    
-    if not gift_name:
-        return None
-    
-    gift_name_lower = gift_name.lower().strip()
-    
-    # Сначала точное совпадение
-    for emoji, info in GIFTS_CONFIG.items():
-        if info["name"].lower() == gift_name_lower:
-            return {"emoji": emoji, **info}
+    """Получить информацию о подарке по имени из каталога (точное, затем частичное совпадение)"""
+    from gifts import gift_catalog
     
-    # Затем частичное совпадение (если название содержит имя подарка)
-    for emoji, info in GIFTS_CONFIG.items():
-        config_name_lower = info["name"].lower()
-        if gift_name_lower in config_name_lower or config_name_lower in gift_name_lower:
-            return {"emoji": emoji, **info}
-    
-    return None
+    gift = gift_catalog.find(gift_name)
+    return dict(gift) if gift else None
 
 
 def get_gift_info_from_attributes(gift: types.StarGiftUnique) -> Optional[Dict]:
-    """Получить информацию о подарке из его атрибутов и title"""
-    from gifts import GIFTS_CONFIG
+    """Получить информацию о подарке по slug, title или атрибутам"""
+    from gifts import gift_catalog
     
-    # Сначала пытаемся использовать title подарка (например, "Sakura Flower")
+    # slug уникального подарка (например, "SakuraFlower-123") однозначно задает модель
+    if getattr(gift, 'slug', None):
+        gift_info = gift_catalog.by_slug(gift.slug)
+        if gift_info:
+            return dict(gift_info)
+    
+    # Затем title подарка (например, "Sakura Flower")
     if hasattr(gift, 'title') and gift.title:
         gift_info = get_gift_info_by_name(gift.title)
         if gift_info:
@@ -229,110 +218,97 @@ def get_gift_info_from_attributes(gift: types.StarGiftUnique) -> Optional[Dict]:
     logger.info(f"  Атрибуты подарка: {attributes_info}")
     
     # Обычно первый атрибут - это модель (название подарка)
-    # Пытаемся найти подарок по первому атрибуту
     if len(attributes_info) > 0:
-        model_name = attributes_info[0]
-        
-        # Пытаемся найти подарок по названию модели
-        gift_info = get_gift_info_by_name(model_name)
-        if gift_info:
-            return gift_info
-        
-        # Если не нашли по точному совпадению, пытаемся найти по частичному совпадению
-        model_name_lower = model_name.lower()
-        for emoji, info in GIFTS_CONFIG.items():
-            gift_name_lower = info["name"].lower()
-            # Проверяем, содержит ли название модели название подарка или наоборот
-            if model_name_lower in gift_name_lower or gift_name_lower in model_name_lower:
-                return {"emoji": emoji, **info}
+        return get_gift_info_by_name(attributes_info[0])
     
     return None
 
 
+def _resolve_relay_gift(gift: types.StarGiftUnique) -> tuple:
+    """Определить (emoji, имя) подарка релеера по каталогу: title, затем slug и атрибуты"""
+    title = getattr(gift, 'title', None)
+    gift_info = get_gift_info_by_name(title) if title else None
+    if not gift_info:
+        gift_info = get_gift_info_from_attributes(gift)
+    if gift_info:
+        return gift_info.get("emoji", ""), gift_info.get("name")
+    # Подарка нет в каталоге - используем title как имя
+    logger.warning(f"⚠️ Подарок не найден в конфиге, используем title: {title}, Slug: {getattr(gift, 'slug', None)}")
+    return "", title
+
+
+# Отпечаток последнего синхронизированного инвентаря: message_id -> (slug, ключ группировки)
+# None - синхронизации еще не было, первая сверяется с базой целиком
+_inventory_fingerprint: Optional[Dict[int, tuple]] = None
+
+
+def _count_gifts(fingerprint: Dict[int, tuple]) -> Dict[str, int]:
+    gift_counts: Dict[str, int] = {}
+    for _slug, count_key in fingerprint.values():
+        if count_key:
+            gift_counts[count_key] = gift_counts.get(count_key, 0) + 1
+    return gift_counts
+
+
 async def sync_relay_gifts_to_db(database) -> Dict[str, int]:
-    """Синхронизировать подарки релеера с базой данных"""
-    """Возвращает словарь {emoji: count} с количеством подарков каждого типа"""
+    """Синхронизировать подарки релеера с базой данных
+
+    Возвращает словарь {emoji: count} с количеством подарков каждого типа.
+    Текущий инвентарь сравнивается с отпечатком прошлой синхронизации: в базу
+    одной транзакцией попадают только новые и исчезнувшие подарки, поэтому
+    синхронизация без изменений не делает ни одной записи.
+    """
+    global _inventory_fingerprint
     if not _relay_client:
         logger.warning("⚠️ Клиент релеера не инициализирован")
         return {}
     
     try:
         gifts = await get_self_gifts(_relay_client)
-        gift_counts = {}
-        available_message_ids = []  # Список message_id подарков, которые есть в профиле
-        
+        current: Dict[int, types.SavedStarGift] = {}
         for gift in gifts:
-            # Получаем информацию о подарке
-            msg_id = gift.msg_id if hasattr(gift, 'msg_id') else None
-            gift_id = gift.gift.id if hasattr(gift.gift, 'id') else None
-            slug = gift.gift.slug if hasattr(gift.gift, 'slug') else None
-            
+            msg_id = getattr(gift, 'msg_id', None)
             # Пропускаем подарки без message_id (они не могут быть сохранены)
-            if not msg_id or msg_id == 0:
-                logger.warning(f"⚠️ Пропускаю подарок без message_id: slug={slug}")
+            if not msg_id:
+                logger.warning(f"⚠️ Пропускаю подарок без message_id: slug={getattr(gift.gift, 'slug', None)}")
                 continue
-            
-            available_message_ids.append(msg_id)
-            
-            # Пытаемся определить подарок из title и атрибутов
-            # Сначала используем title напрямую
-            gift_name = None
-            emoji = ""
-            gift_info = None
-            
-            if hasattr(gift.gift, 'title') and gift.gift.title:
-                gift_title = gift.gift.title
-                logger.info(f"🔍 Пытаюсь определить подарок по title: '{gift_title}'")
-                # Пытаемся найти в конфиге по title
-                gift_info = get_gift_info_by_name(gift_title)
-                if gift_info:
-                    emoji = gift_info.get("emoji", "")
-                    gift_name = gift_info.get("name")
-                    logger.info(f"✅ Подарок определен по title при синхронизации: {gift_name} ({emoji})")
-                else:
-                    logger.warning(f"⚠️ Подарок '{gift_title}' не найден в конфиге по title")
-            
-            # Если не нашли по title, пытаемся по атрибутам
-            if not gift_info:
-                gift_info = get_gift_info_from_attributes(gift.gift)
-                if gift_info:
-                    emoji = gift_info.get("emoji", "")
-                    gift_name = gift_info.get("name")
-                    logger.info(f"✅ Подарок определен по атрибутам при синхронизации: {gift_name} ({emoji})")
-            
-            # Если все еще не нашли, используем title как имя подарка
-            if not gift_name and hasattr(gift.gift, 'title') and gift.gift.title:
-                gift_name = gift.gift.title
-                logger.warning(f"⚠️ Подарок не найден в конфиге, используем title: {gift_name}, Slug: {slug}")
-            
-            # Добавляем в базу данных
-            # Используем title как имя, если gift_name не определен
-            final_gift_name = gift_name
-            if not final_gift_name and hasattr(gift.gift, 'title') and gift.gift.title:
-                final_gift_name = gift.gift.title
-            
-            await database.add_relay_gift(
-                message_id=msg_id,
-                emoji=emoji,
-                gift_name=final_gift_name,
-                gift_id=gift_id,
-                slug=slug
-            )
-            
-            # Подсчитываем количество (используем эмодзи или имя для группировки)
-            if emoji:
-                gift_counts[emoji] = gift_counts.get(emoji, 0) + 1
-            elif final_gift_name:
-                # Если нет эмодзи, группируем по имени
-                gift_counts[final_gift_name] = gift_counts.get(final_gift_name, 0) + 1
+            current[msg_id] = gift
         
-        # Очищаем подарки, которых больше нет в профиле релеера
-        if available_message_ids:
-            deleted_count = await database.clear_unavailable_gifts(available_message_ids)
-            if deleted_count > 0:
-                logger.info(f"🗑️ Удалено {deleted_count} недоступных подарков из базы данных")
+        if not current:
+            # Пустой ответ может быть ошибкой запроса - ничего не удаляем
+            return _count_gifts(_inventory_fingerprint or {})
+        
+        previous = _inventory_fingerprint
+        if previous is None:
+            # Первая синхронизация: сверяем со всеми доступными подарками в базе
+            previous = {}
+            known_ids = set(await database.get_available_relay_gift_ids())
+        else:
+            known_ids = set(previous)
         
-        return gift_counts
+        fingerprint: Dict[int, tuple] = {}
+        upserts = []
+        for msg_id, gift in current.items():
+            slug = getattr(gift.gift, 'slug', None)
+            known = previous.get(msg_id)
+            if known is not None and known[0] == slug:
+                fingerprint[msg_id] = known
+                continue
+            emoji, gift_name = _resolve_relay_gift(gift.gift)
+            upserts.append((msg_id, emoji, gift_name, getattr(gift.gift, 'id', None), slug))
+            # Количество считаем по эмодзи, а без него - по имени
+            fingerprint[msg_id] = (slug, emoji or gift_name)
+        removed = [msg_id for msg_id in known_ids if msg_id not in current]
+        
+        if upserts or removed:
+            deleted_count = await database.apply_relay_gifts_diff(upserts, removed)
+            logger.info(f"🔄 Подарки релеера: +{len(upserts)} новых/измененных, -{deleted_count} недоступных")
+            # Очереди выдачи подарков перечитываются только при изменении инвентаря
+            from gift_allocator import gift_allocator
+            await gift_allocator.refresh(database)
+        _inventory_fingerprint = fingerprint
+        
+        return _count_gifts(fingerprint)
     except Exception as e:
         logger.error(f"❌ Ошибка при синхронизации подарков: {e}", exc_info=True)
         return {}
@@ -516,6 +492,16 @@ async def setup_gift_handler(client: TelegramClient, database, bot=None):
                         from_username=from_username
                     )
                     
+                    # Подарок сразу доступен для вывода
+                    from gift_allocator import gift_allocator
+                    gift_allocator.add({
+                        "message_id": event.message.id,
+                        "emoji": emoji or "",
+                        "gift_name": final_gift_name,
+                        "gift_id": gift_id,
+                        "slug": slug,
+                    })
+                    
                     # Уведомления админам о новых подарках отключены по запросу
 
 
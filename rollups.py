@@ -0,0 +1,194 @@
+"""
+Дневные агрегаты статистики (rollup-таблицы)
+
+daily_stats (день, валюта), game_type_daily (день, тип игры, валюта) и
+user_daily_stats (пользователь, день, валюта) обновляются инкрементально:
+игры - в транзакции записи пачки журнала игр (см. GameLogWriter в
+database.py), депозиты и выводы - в транзакции вставки записи. Статистика
+админки, графики и статистика пользователя читают O(дней) строк вместо
+сканирования таблицы games.
+
+День агрегата - date.today() в момент записи (коммита пачки игр или вставки
+платежа), а не время самой игры. created_at строк ставится той же вставкой,
+поэтому пересчет обычно дает те же дни. Расхождение возможно, если ставка
+сделана до полуночи, а пачка записана после нее: это задержка до
+GAME_LOG_FLUSH_INTERVAL, повторы записи или файл replay_spill. Такая игра
+попадает в новый день, и пересчет тоже отнесет ее к новому дню. Редкое
+расхождение в пределах коммита через полночь (date.today() вычислен до
+вставки) пересчет исправляет.
+
+Пересчет из истории: python rollups.py
+"""
+import asyncio
+import logging
+from datetime import date
+from typing import Dict, Iterable, Tuple
+
+logger = logging.getLogger(__name__)
+
+DAILY_GAMES_UPSERT_SQL = """
+    INSERT INTO daily_stats (day, currency, games, bets, wins, win_games, lost_bets)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, currency) DO UPDATE SET
+        games = games + excluded.games,
+        bets = bets + excluded.bets,
+        wins = wins + excluded.wins,
+        win_games = win_games + excluded.win_games,
+        lost_bets = lost_bets + excluded.lost_bets
+"""
+
+GAME_TYPE_UPSERT_SQL = """
+    INSERT INTO game_type_daily (day, game_type, currency, games, bets, wins)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day, game_type, currency) DO UPDATE SET
+        games = games + excluded.games,
+        bets = bets + excluded.bets,
+        wins = wins + excluded.wins
+"""
+
+USER_DAILY_UPSERT_SQL = """
+    INSERT INTO user_daily_stats (user_id, day, currency, games, bets, wins, win_games, lost_bets)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, day, currency) DO UPDATE SET
+        games = games + excluded.games,
+        bets = bets + excluded.bets,
+        wins = wins + excluded.wins,
+        win_games = win_games + excluded.win_games,
+        lost_bets = lost_bets + excluded.lost_bets
+"""
+
+PAYMENT_UPSERT_SQL = """
+    INSERT INTO daily_stats (day, currency, {column}, {column}_count) VALUES (?, 'dollar', ?, 1)
+    ON CONFLICT(day, currency) DO UPDATE SET
+        {column} = {column} + excluded.{column},
+        {column}_count = {column}_count + 1
+"""
+
+# Пересчет из истории. День - локальная дата, как у turnover_daily
+REBUILD_SQL = (
+    "DELETE FROM daily_stats",
+    "DELETE FROM game_type_daily",
+    "DELETE FROM user_daily_stats",
+    """INSERT INTO daily_stats (day, currency, games, bets, wins, win_games, lost_bets)
+       SELECT DATE(created_at, 'localtime'), COALESCE(currency, 'dollar'), COUNT(*),
+              COALESCE(SUM(bet), 0),
+              COALESCE(SUM(CASE WHEN win > 0 THEN win ELSE 0 END), 0),
+              SUM(CASE WHEN win > 0 THEN 1 ELSE 0 END),
+              COALESCE(SUM(CASE WHEN win = 0 THEN bet ELSE 0 END), 0)
+       FROM games
+       GROUP BY 1, 2""",
+    """INSERT INTO daily_stats (day, currency, deposits, deposits_count)
+       SELECT DATE(created_at, 'localtime'), 'dollar', COALESCE(SUM(amount), 0), COUNT(*)
+       FROM deposits
+       GROUP BY 1
+       ON CONFLICT(day, currency) DO UPDATE SET
+           deposits = excluded.deposits, deposits_count = excluded.deposits_count""",
+    """INSERT INTO daily_stats (day, currency, withdrawals, withdrawals_count)
+       SELECT DATE(created_at, 'localtime'), 'dollar', COALESCE(SUM(amount), 0), COUNT(*)
+       FROM withdrawals
+       GROUP BY 1
+       ON CONFLICT(day, currency) DO UPDATE SET
+           withdrawals = excluded.withdrawals, withdrawals_count = excluded.withdrawals_count""",
+    """INSERT INTO game_type_daily (day, game_type, currency, games, bets, wins)
+       SELECT DATE(created_at, 'localtime'), COALESCE(game_type, 'unknown'), COALESCE(currency, 'dollar'),
+              COUNT(*), COALESCE(SUM(bet), 0), COALESCE(SUM(CASE WHEN win > 0 THEN win ELSE 0 END), 0)
+       FROM games
+       GROUP BY 1, 2, 3""",
+    """INSERT INTO user_daily_stats (user_id, day, currency, games, bets, wins, win_games, lost_bets)
+       SELECT user_id, DATE(created_at, 'localtime'), COALESCE(currency, 'dollar'), COUNT(*),
+              COALESCE(SUM(bet), 0),
+              COALESCE(SUM(CASE WHEN win > 0 THEN win ELSE 0 END), 0),
+              SUM(CASE WHEN win > 0 THEN 1 ELSE 0 END),
+              COALESCE(SUM(CASE WHEN win = 0 THEN bet ELSE 0 END), 0)
+       FROM games
+       WHERE user_id IS NOT NULL
+       GROUP BY 1, 2, 3""",
+)
+
+
+def _add(bucket: Dict, key, bet: float, win):
+    """Добавить игру к агрегату [games, bets, wins, win_games, lost_bets]"""
+    totals = bucket.get(key)
+    if totals is None:
+        totals = bucket[key] = [0, 0.0, 0.0, 0, 0.0]
+    totals[0] += 1
+    totals[1] += bet
+    if win is not None and win > 0:
+        totals[2] += win
+        totals[3] += 1
+    elif win == 0:
+        totals[4] += bet
+
+
+class DailyStatsRollup:
+    """Слушатель журнала игр: добавляет пачку игр в дневные агрегаты"""
+
+    async def persist(self, db, rows: Iterable[tuple]):
+        """Обновить агрегаты в транзакции записи пачки игр
+
+        Вся пачка относится к дню записи (date.today()), а не ко дню ставки (см. описание модуля).
+        """
+        today = date.today().isoformat()
+        daily: Dict[str, list] = {}
+        by_type: Dict[Tuple[str, str], list] = {}
+        by_user: Dict[Tuple[int, str], list] = {}
+        for user_id, game_type, bet, _result, win, _bet_type, currency in rows:
+            currency = currency or "dollar"
+            bet = bet or 0.0
+            _add(daily, currency, bet, win)
+            _add(by_type, (game_type or "unknown", currency), bet, win)
+            if user_id is not None:
+                _add(by_user, (user_id, currency), bet, win)
+        await db.executemany(
+            DAILY_GAMES_UPSERT_SQL,
+            [(today, currency, *totals) for currency, totals in daily.items()],
+        )
+        await db.executemany(
+            GAME_TYPE_UPSERT_SQL,
+            [(today, game_type, currency, *totals[:3]) for (game_type, currency), totals in by_type.items()],
+        )
+        await db.executemany(
+            USER_DAILY_UPSERT_SQL,
+            [(user_id, today, currency, *totals) for (user_id, currency), totals in by_user.items()],
+        )
+
+    def apply(self, rows: Iterable[tuple]):
+        pass
+
+
+async def record_deposit(db, amount: float):
+    """Учесть депозит в дневной статистике за сегодня (в транзакции вставки депозита)"""
+    await db.execute(PAYMENT_UPSERT_SQL.format(column="deposits"), (date.today().isoformat(), amount or 0.0))
+
+
+async def record_withdrawal(db, amount: float):
+    """Учесть вывод в дневной статистике за сегодня (в транзакции вставки вывода)"""
+    await db.execute(PAYMENT_UPSERT_SQL.format(column="withdrawals"), (date.today().isoformat(), amount or 0.0))
+
+
+async def rebuild_rollups(db):
+    """Пересчитать все агрегаты из таблиц games, deposits и withdrawals (без коммита)"""
+    for statement in REBUILD_SQL:
+        await db.execute(statement)
+
+
+async def _backfill():
+    from database import Database, close_all_pools
+
+    database = Database()
+    await database.init_db()
+    try:
+        # Через соединение записи: пачки игр не закоммитятся посреди пересчета
+        async with database.writer() as db:
+            await rebuild_rollups(db)
+            await db.commit()
+            async with db.execute("SELECT COUNT(*), COALESCE(SUM(games), 0) FROM daily_stats") as cursor:
+                days, games = await cursor.fetchone()
+        logger.info(f"📊 Дневная статистика пересчитана: {days} строк, {games} игр")
+    finally:
+        await close_all_pools()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_backfill())
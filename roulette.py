@@ -0,0 +1,324 @@
+"""
+Рулетка мини-приложения: раунды на сервере
+
+RouletteEngine ведет текущий раунд: принимает ставки, на каждой ставке
+обновляет суммы по секторам и по игрокам и пересобирает общий снимок раунда.
+Запрос /api/roulette/data отдает этот снимок и поля игрока из словарей, не
+перебирая ставки.
+
+Отсчет (ROULETTE_ROUND_SECONDS) запускается, когда в раунде набирается
+ROULETTE_MIN_PLAYERS игроков. Раунд завершает таймер сервера, а не клиент.
+Выигрышный сектор выбирается с вероятностью, пропорциональной сумме ставок на
+нем (как размеры секторов колеса), победитель - случайная ставка сектора,
+выигрыш - весь банк.
+
+Ставки пишутся в roulette_bets пачками раз в ROULETTE_FLUSH_INTERVAL секунд
+и еще раз перед закрытием раунда, итог раунда (оставшиеся ставки, строка
+roulette_rounds и зачисление банка) - одной транзакцией. Запись итога
+повторяется ROULETTE_SETTLE_ATTEMPTS раз; если она так и не прошла, раунд
+отменяется и ставки возвращаются игрокам. Строки games с итоговым выигрышем
+уходят в журнал игр после завершения раунда. Ставки раундов, прерванных
+перезапуском, возвращаются игрокам при запуске.
+"""
+import asyncio
+import logging
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Длительность отсчета раунда (сек)
+ROULETTE_ROUND_SECONDS = int(os.getenv("ROULETTE_ROUND_SECONDS", "15"))
+# Сколько игроков нужно для запуска отсчета
+ROULETTE_MIN_PLAYERS = 2
+# Как часто (сек) записывать принятые ставки в базу
+ROULETTE_FLUSH_INTERVAL = 1.0
+# Сколько (сек) ждать итога в /api/roulette/finish, если таймер еще не сработал
+ROULETTE_RESULT_WAIT = 5.0
+# Сколько последних итогов хранить по номеру раунда
+ROULETTE_RESULTS_KEPT = 50
+# Попыток записать итог раунда, прежде чем отменить раунд и вернуть ставки
+ROULETTE_SETTLE_ATTEMPTS = 3
+# Пауза (сек) перед повтором записи итога, растет с каждой попыткой
+ROULETTE_SETTLE_RETRY_DELAY = 1.0
+
+_rng = random.SystemRandom()
+
+
+class RouletteRound:
+    """Ставки раунда и суммы, которые обновляются на каждой ставке"""
+
+    __slots__ = ("round_id", "bets", "sector_totals", "user_totals", "user_sectors",
+                 "profiles", "total", "bets_count", "deadline", "snapshot")
+
+    def __init__(self, round_id: int):
+        self.round_id = round_id
+        self.bets: Dict[int, List[Dict]] = {}  # {sector: [{user_id, bet, avatar, username}]}
+        self.sector_totals: Dict[int, float] = {}
+        self.user_totals: Dict[int, float] = {}
+        self.user_sectors: Dict[int, List[int]] = {}
+        self.profiles: Dict[int, Dict] = {}  # user_id -> {name, avatar}
+        self.total = 0.0
+        self.bets_count = 0
+        self.deadline: Optional[float] = None  # time.monotonic() окончания отсчета
+        self.snapshot: Dict = {}
+        self._rebuild_snapshot()
+
+    def add(self, user_id: int, bet: float, sector: int, username: str, name: str, avatar: Optional[str]):
+        self.bets.setdefault(sector, []).append({
+            'user_id': user_id,
+            'bet': bet,
+            'avatar': avatar,
+            'username': username,
+        })
+        self.sector_totals[sector] = self.sector_totals.get(sector, 0.0) + bet
+        self.user_totals[user_id] = self.user_totals.get(user_id, 0.0) + bet
+        sectors = self.user_sectors.setdefault(user_id, [])
+        if sector not in sectors:
+            sectors.append(sector)
+        self.profiles.setdefault(user_id, {'name': name, 'avatar': avatar})
+        self.total += bet
+        self.bets_count += 1
+        self._rebuild_snapshot()
+
+    def _rebuild_snapshot(self):
+        """Общая часть ответа /api/roulette/data (пересобирается на ставке, а не на опросе)"""
+        players = []
+        for user_id, sectors in self.user_sectors.items():
+            # Шанс = сумма ставок на секторах игрока / общая сумма всех ставок
+            sector_total = sum(self.sector_totals[sector] for sector in sectors)
+            avatar = self.profiles[user_id]['avatar']
+            players.append({
+                'user_id': user_id,
+                'name': self.profiles[user_id]['name'],
+                'avatar': avatar,
+                'photo_url': avatar,  # Для совместимости
+                'total_bet': self.user_totals[user_id],
+                'win_chance': round(sector_total / self.total * 100, 1) if self.total > 0 else 0,
+                'sectors': list(sectors),
+            })
+        players.sort(key=lambda player: player['total_bet'], reverse=True)
+        self.snapshot = {
+            'participants': len(self.user_totals),
+            'total_bets': self.total,
+            'bets': self.bets,
+            'players': players,
+            'game_id': self.round_id,
+        }
+
+    def pick_winner(self):
+        """(выигрышный сектор, ставка-победитель): сектор - пропорционально сумме ставок на нем"""
+        sectors = list(self.sector_totals)
+        winning_sector = _rng.choices(sectors, weights=[self.sector_totals[sector] for sector in sectors])[0]
+        return winning_sector, _rng.choice(self.bets[winning_sector])
+
+
+class RouletteEngine:
+    """Жизненный цикл раундов рулетки: ставки, таймер, итог и запись в базу"""
+
+    def __init__(self, db, round_seconds: int = ROULETTE_ROUND_SECONDS,
+                 min_players: int = ROULETTE_MIN_PLAYERS, flush_interval: float = ROULETTE_FLUSH_INTERVAL):
+        self.db = db
+        self.round_seconds = round_seconds
+        self.min_players = min_players
+        self.flush_interval = flush_interval
+        self._round = RouletteRound(1)
+        self._pending: List[tuple] = []  # (round_id, user_id, sector, bet) еще не записанные ставки
+        self._countdown_started = asyncio.Event()
+        self._settled = asyncio.Condition()
+        self._settling: Optional[RouletteRound] = None  # раунд, итог которого записывается
+        self._results: "OrderedDict[int, Dict]" = OrderedDict()  # round_id -> итог
+        self.last_result: Optional[Dict] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Вернуть ставки прерванных раундов, продолжить нумерацию и запустить таймер"""
+        for round_id, user_id, amount in await self.db.refund_unsettled_roulette_rounds():
+            logger.warning(f"↩️ Рулетка: раунд #{round_id} прерван, возвращено ${amount:.2f} пользователю {user_id}")
+        self._round = RouletteRound(await self.db.get_last_roulette_round() + 1)
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._run_flusher())]
+        logger.info(f"🎡 Рулетка запущена, текущий раунд #{self._round.round_id}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
+
+    async def place_bet(self, user_id: int, bet: float, sector: int, username: str,
+                        name: str, avatar: Optional[str]) -> Optional[int]:
+        """Списать ставку и добавить ее в текущий раунд. Возвращает номер раунда или None, если средств недостаточно"""
+        if await self.db.place_bet(user_id, bet) is None:
+            return None
+        # Дальше без await: ставка попадает в тот раунд, который текущий после списания
+        round_ = self._round
+        round_.add(user_id, bet, sector, username, name, avatar)
+        self._pending.append((round_.round_id, user_id, sector, bet))
+        if round_.deadline is None and len(round_.user_totals) >= self.min_players:
+            round_.deadline = time.monotonic() + self.round_seconds
+            self._countdown_started.set()
+            logger.info(f"🚀 Рулетка: раунд #{round_.round_id}, отсчет {self.round_seconds} с")
+        return round_.round_id
+
+    def snapshot(self, user_id: int) -> Dict:
+        """Данные раунда для игрока без перебора ставок"""
+        round_ = self._round
+        sectors = round_.user_sectors.get(user_id)
+        profile = round_.profiles.get(user_id)
+        return {
+            **round_.snapshot,
+            'user_bet': round_.user_totals.get(user_id, 0.0),
+            'user_sector': sectors[0] if sectors else None,
+            'user_avatar': profile['avatar'] if profile else None,
+            'countdown': self._countdown(round_),
+            'last_result': self.last_result,
+        }
+
+    def _countdown(self, round_: RouletteRound) -> int:
+        if round_.deadline is None:
+            return self.round_seconds
+        return max(0, math.ceil(round_.deadline - time.monotonic()))
+
+    async def wait_result(self, round_id: Optional[int] = None,
+                          timeout: float = ROULETTE_RESULT_WAIT) -> Optional[Dict]:
+        """Итог раунда round_id (по умолчанию - раунда, отсчет которого закончился)
+
+        Если раунд еще завершается или его отсчет заканчивается в пределах timeout,
+        запрос ждет итога именно этого раунда. None - итога нет (раунд не начат,
+        не закончился за timeout или слишком старый).
+        """
+        if round_id is None:
+            round_ = self._settling or self._round
+            round_id = round_.round_id
+        if round_id not in self._results and self._awaits_result(round_id, timeout):
+            async with self._settled:
+                try:
+                    await asyncio.wait_for(
+                        self._settled.wait_for(lambda: round_id in self._results), timeout
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        return self._results.get(round_id)
+
+    def _awaits_result(self, round_id: int, timeout: float) -> bool:
+        if self._settling is not None and self._settling.round_id == round_id:
+            return True
+        round_ = self._round
+        return (round_.round_id == round_id and round_.deadline is not None
+                and round_.deadline - time.monotonic() <= timeout)
+
+    async def _run(self):
+        while True:
+            round_ = self._round
+            if round_.deadline is None:
+                self._countdown_started.clear()
+                await self._countdown_started.wait()
+                continue
+            delay = round_.deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await self._settle(round_)
+            except Exception as e:
+                logger.error(f"❌ Ошибка завершения раунда рулетки #{round_.round_id}: {e}", exc_info=True)
+
+    async def _settle(self, round_: RouletteRound):
+        # Принятые ставки записываются до закрытия раунда: если итог не запишется, их можно вернуть
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"⚠️ Рулетка: ставки раунда #{round_.round_id} не записаны заранее, уйдут с итогом: {e}")
+
+        # Новый раунд открывается сразу: ставки, пришедшие во время записи итога, попадут в него
+        self._settling = round_
+        self._round = RouletteRound(round_.round_id + 1)
+        bets = [row for row in self._pending if row[0] == round_.round_id]
+        self._pending = [row for row in self._pending if row[0] != round_.round_id]
+
+        winning_sector, winner = round_.pick_winner()
+        win_amount = round_.total
+        for attempt in range(1, ROULETTE_SETTLE_ATTEMPTS + 1):
+            try:
+                await self.db.settle_roulette_round(
+                    round_.round_id, bets, winning_sector, winner['user_id'], win_amount, round_.bets_count
+                )
+                break
+            except Exception as e:
+                logger.error(f"❌ Рулетка: итог раунда #{round_.round_id} не записан "
+                             f"(попытка {attempt}/{ROULETTE_SETTLE_ATTEMPTS}): {e}")
+                if attempt < ROULETTE_SETTLE_ATTEMPTS:
+                    await asyncio.sleep(ROULETTE_SETTLE_RETRY_DELAY * attempt)
+        else:
+            await self._refund(round_, bets)
+            return
+        logger.info(
+            f"🎡 Раунд рулетки #{round_.round_id} завершен: сектор {winning_sector}, "
+            f"победитель user_id={winner['user_id']}, выигрыш=${win_amount:.2f}"
+        )
+        winner_chance = sum(round_.sector_totals[sector] for sector in round_.user_sectors[winner['user_id']])
+        self.last_result = {
+            'game_id': round_.round_id,
+            'winning_sector': winning_sector,
+            'winner': {
+                'user_id': winner['user_id'],
+                'username': winner.get('username') or f"User {winner['user_id']}",
+                'win_chance': round(winner_chance / win_amount * 100, 1) if win_amount > 0 else 0,
+            },
+            'win_amount': win_amount,
+        }
+        self._results[round_.round_id] = self.last_result
+        while len(self._results) > ROULETTE_RESULTS_KEPT:
+            self._results.popitem(last=False)
+        self._settling = None
+        async with self._settled:
+            self._settled.notify_all()
+
+        # Журнал игр: по строке на ставку, выигрыш - у ставки-победителя
+        for sector, sector_bets in round_.bets.items():
+            for bet_data in sector_bets:
+                win = win_amount if bet_data is winner else 0.0
+                await self.db.add_game(bet_data['user_id'], 'roulette', bet_data['bet'], sector, win)
+
+    async def _refund(self, round_: RouletteRound, bets: List[tuple]):
+        """Отменить раунд, итог которого не удалось записать, и вернуть ставки"""
+        try:
+            refunds = await self.db.refund_roulette_round(round_.round_id, bets)
+            logger.warning(f"↩️ Рулетка: раунд #{round_.round_id} отменен, ставки возвращены ({len(refunds)} игрокам)")
+        except Exception as e:
+            # Ставки вернутся в очередь записи; раунд без итога будет возвращен игрокам при запуске
+            self._pending = bets + self._pending
+            logger.error(f"❌ Рулетка: не удалось вернуть ставки раунда #{round_.round_id}: {e}")
+        self._results[round_.round_id] = {
+            'game_id': round_.round_id,
+            'winner': None,
+            'win_amount': 0,
+            'refunded': True,
+            'message': 'Раунд отменен, ставки возвращены',
+        }
+        self._settling = None
+        async with self._settled:
+            self._settled.notify_all()
+
+    async def flush(self):
+        """Записать принятые ставки пачкой"""
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            await self.db.save_roulette_bets(rows)
+        except Exception:
+            self._pending = rows + self._pending
+            raise
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи ставок рулетки: {e}")
@@ -0,0 +1,218 @@
+"""
+Хранилища игровых сессий в памяти
+
+SessionStore - словарь с временем жизни записей и жестким ограничением
+размера. Сроки истечения лежат в куче: очистка снимает с вершины только
+истекшие записи (O(истекших · log n)), а при переполнении вытесняются записи,
+которые истекли бы первыми. Ведутся счетчики попаданий, промахов, истечений
+и вытеснений.
+
+Хранилища с persistent=True можно сохранить в SQLite при остановке бота и
+восстановить при запуске (SESSION_SNAPSHOT=1), чтобы незавершенные игры и
+настройки ставок переживали перезапуск.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from collections.abc import MutableMapping
+from typing import Any, Dict, Hashable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Максимум записей в одном хранилище по умолчанию
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "100000"))
+# Сохранять хранилища в SQLite при остановке и восстанавливать при запуске
+SESSION_SNAPSHOT = os.getenv("SESSION_SNAPSHOT", "0") == "1"
+# Как часто (сек) фоновая задача очищает истекшие записи
+SESSION_SWEEP_INTERVAL = 30
+
+_stores: Dict[str, "SessionStore"] = {}
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "seq")
+
+    def __init__(self, value: Any, expires_at: float, seq: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.seq = seq
+
+
+class SessionStore(MutableMapping):
+    """Словарь с TTL записей (от последней записи ключа) и ограничением размера"""
+
+    def __init__(self, name: str, ttl: float, max_entries: int = SESSION_MAX_ENTRIES, persistent: bool = False):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self._data: Dict[Hashable, _Entry] = {}
+        # (истекает, seq, ключ); устаревшие элементы (ключ удален или перезаписан) пропускаются
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        _stores[name] = self
+
+    def _live(self, key: Hashable, now: float) -> Optional[_Entry]:
+        entry = self._data.get(key)
+        if entry is not None and entry.expires_at <= now:
+            del self._data[key]
+            self.expired += 1
+            return None
+        return entry
+
+    def __getitem__(self, key: Hashable) -> Any:
+        entry = self._live(key, time.monotonic())
+        if entry is None:
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        return entry.value
+
+    def __contains__(self, key: object) -> bool:
+        return self._live(key, time.monotonic()) is not None
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Записать значение; срок жизни отсчитывается заново"""
+        now = time.monotonic()
+        self.sweep(now)
+        seq = next(self._seq)
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        entry = self._data.get(key)
+        if entry is None:
+            self._data[key] = _Entry(value, expires_at, seq)
+        else:
+            entry.value, entry.expires_at, entry.seq = value, expires_at, seq
+        heapq.heappush(self._heap, (expires_at, seq, key))
+        while len(self._data) > self.max_entries:
+            self._pop_first(evicted=True)
+        if len(self._heap) > 2 * len(self._data) + 64:
+            self._compact()
+
+    def __delitem__(self, key: Hashable):
+        del self._data[key]
+
+    def __iter__(self) -> Iterator:
+        self.sweep()
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        self.sweep()
+        return len(self._data)
+
+    def _pop_first(self, evicted: bool = False) -> bool:
+        """Снять с кучи запись, истекающую первой. False - куча пуста"""
+        while self._heap:
+            _expires_at, seq, key = heapq.heappop(self._heap)
+            entry = self._data.get(key)
+            if entry is not None and entry.seq == seq:
+                del self._data[key]
+                if evicted:
+                    self.evicted += 1
+                else:
+                    self.expired += 1
+                return True
+        return False
+
+    def _compact(self):
+        """Перестроить кучу без устаревших элементов"""
+        self._heap = [(entry.expires_at, entry.seq, key) for key, entry in self._data.items()]
+        heapq.heapify(self._heap)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удалить истекшие записи. Возвращает количество удаленных"""
+        now = time.monotonic() if now is None else now
+        removed = 0
+        while self._heap and self._heap[0][0] <= now:
+            _expires_at, seq, key = heapq.heappop(self._heap)
+            entry = self._data.get(key)
+            if entry is not None and entry.seq == seq:
+                del self._data[key]
+                self.expired += 1
+                removed += 1
+        return removed
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def dump(self) -> List[tuple]:
+        """Записи для снимка: (ключ JSON, значение JSON, истекает по времени UNIX)"""
+        now, wall = time.monotonic(), time.time()
+        rows = []
+        for key, entry in self._data.items():
+            if entry.expires_at <= now:
+                continue
+            try:
+                rows.append((json.dumps(key), json.dumps(entry.value, ensure_ascii=False), wall + entry.expires_at - now))
+            except (TypeError, ValueError):
+                logger.warning(f"⚠️ Сессия {self.name}[{key}] не сериализуется, пропускаю в снимке")
+        return rows
+
+    def load(self, rows: List[tuple]) -> int:
+        """Восстановить записи из снимка (истекшие пропускаются)"""
+        wall = time.time()
+        restored = 0
+        for key, value, expires_at in rows:
+            if expires_at > wall:
+                self.set(json.loads(key), json.loads(value), ttl=expires_at - wall)
+                restored += 1
+        return restored
+
+
+def session_metrics() -> Dict[str, Dict[str, int]]:
+    """Метрики всех хранилищ сессий"""
+    return {name: store.metrics() for name, store in _stores.items()}
+
+
+async def run_session_sweeper(interval: float = SESSION_SWEEP_INTERVAL):
+    """Фоновая очистка истекших записей во всех хранилищах"""
+    while True:
+        await asyncio.sleep(interval)
+        for store in list(_stores.values()):
+            removed = store.sweep()
+            if removed:
+                logger.debug(f"🧹 Сессии {store.name}: удалено истекших {removed}, метрики {store.metrics()}")
+
+
+async def save_session_snapshot(db) -> int:
+    """Сохранить хранилища с persistent=True в SQLite (вызывается при остановке бота)"""
+    if not SESSION_SNAPSHOT:
+        return 0
+    rows = [(name, *row) for name, store in _stores.items() if store.persistent for row in store.dump()]
+    await db.save_session_snapshot(rows)
+    logger.info(f"💾 Снимок игровых сессий сохранен: {len(rows)} записей")
+    return len(rows)
+
+
+async def restore_session_snapshot(db) -> int:
+    """Восстановить хранилища из снимка (вызывается при запуске бота, снимок удаляется)"""
+    if not SESSION_SNAPSHOT:
+        return 0
+    by_store: Dict[str, List[tuple]] = {}
+    for store_name, key, value, expires_at in await db.pop_session_snapshot():
+        by_store.setdefault(store_name, []).append((key, value, expires_at))
+    restored = 0
+    for name, rows in by_store.items():
+        store = _stores.get(name)
+        if store is not None and store.persistent:
+            restored += store.load(rows)
+    if restored:
+        logger.info(f"♻️ Восстановлено игровых сессий из снимка: {restored}")
+    return restored
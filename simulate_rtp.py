@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Монте-Карло симулятор RTP и преимущества казино по config.GAME_CONFIGS
+
+Для каждой ставки каждой игры разыгрываются броски с равномерным
+распределением граней Telegram (кубик, дартс, боулинг - 1-6, футбол и
+баскетбол - 1-5, слоты - 1-64) пачками до SIM_BATCH_ROLLS бросков NumPy.
+Выигрыш определяется теми же правилами, что и в боте: таблица
+outcomes.outcome_table разворачивается в массив по всем комбинациям граней,
+длинные серии проверяются по outcomes.RULES.
+
+Отчет: вероятность выигрыша, RTP (точный - перебором комбинаций, и по
+симуляции), дисперсия выплаты, преимущество казино, риск разорения банка
+казино на серии ставок и оценка джекпотов из JACKPOT_CONFIG.
+
+Запуск: python simulate_rtp.py --jackpot-share ДОЛЯ [--games N] [--bankroll B] [--ruin-bets N] [--seed S]
+"""
+import argparse
+import itertools
+import time
+from typing import Optional
+
+import numpy as np
+
+from config import GAME_CONFIGS, JACKPOT_CONFIG
+from outcomes import FACES, MAX_TABLE_THROWS, RULES, outcome_table
+
+# Грани эмодзи Telegram
+GAME_FACES = {
+    "dice": 6,
+    "dice_7": 6,
+    "dart": 6,
+    "bowling": 6,
+    "football": 5,
+    "basketball": 5,
+}
+SLOT_VALUES = 64
+# Размер пачки (бросков) для одной векторной операции
+SIM_BATCH_ROLLS = 10_000_000
+# Перебирать комбинации для точного RTP, если их не больше
+EXACT_MAX_COMBINATIONS = 1_000_000
+# Траектории для оценки риска разорения
+RUIN_PATHS = 2000
+
+
+def build_lookup(game_type: str, bet_type: str, throws: int) -> Optional[np.ndarray]:
+    """Массив выигрышей по всем комбинациям граней FACES (индекс - число в системе счисления len(FACES))"""
+    if throws > MAX_TABLE_THROWS:
+        return None
+    lookup = np.zeros(len(FACES) ** throws, dtype=bool)
+    for index, combination in enumerate(itertools.product(FACES, repeat=throws)):
+        lookup[index] = outcome_table.evaluate(game_type, bet_type, list(combination))[0]
+    return lookup
+
+
+def evaluate_batch(rolls: np.ndarray, rule, lookup: Optional[np.ndarray]) -> np.ndarray:
+    """Выигрыши для пачки игр rolls (игры x броски)"""
+    if lookup is not None:
+        index = np.zeros(len(rolls), dtype=np.int64)
+        for column in range(rolls.shape[1]):
+            index = index * len(FACES) + (rolls[:, column] - FACES[0])
+        return lookup[index]
+    # Длинные серии - векторная версия outcomes.rule_wins
+    head = rolls[:, :rule.throws]
+    if rule.kind == "all_in":
+        return np.isin(head, list(rule.faces)).all(axis=1)
+    if rule.kind == "pair":
+        return head[:, 0] == head[:, 1]
+    total = head.sum(axis=1)
+    if rule.kind == "sum_eq":
+        return total == rule.target
+    if rule.kind == "sum_lt":
+        return total < rule.target
+    if rule.kind == "sum_gt":
+        return total > rule.target
+    raise ValueError(f"Неизвестный тип правила: {rule.kind}")
+
+
+def exact_win_probability(game_type: str, bet_type: str, throws: int, faces: int) -> Optional[float]:
+    """Точная вероятность выигрыша перебором всех равновероятных комбинаций"""
+    if faces ** throws > EXACT_MAX_COMBINATIONS:
+        return None
+    wins = sum(
+        outcome_table.evaluate(game_type, bet_type, list(combination))[0]
+        for combination in itertools.product(range(1, faces + 1), repeat=throws)
+    )
+    return wins / faces ** throws
+
+
+def risk_of_ruin(rng: np.random.Generator, payouts: np.ndarray, probabilities: np.ndarray,
+                 bankroll: float, bets: int) -> float:
+    """Доля траекторий, на которых банк казино (в ставках) уходит в ноль за bets ставок по 1"""
+    ruined = 0
+    cumulative = np.cumsum(probabilities)[:-1].astype(np.float32)
+    house_result = (1.0 - payouts).astype(np.float32)
+    chunk = max(1, SIM_BATCH_ROLLS // bets)
+    if len(payouts) == 2 and payouts[0] == 0:
+        # Выплата m или 0: банк уходит в ноль, когда выигрышей W(t) >= (t + bankroll) / m
+        multiplier, probability = float(payouts[1]), float(probabilities[1])
+        if multiplier <= 0 or probability <= 0:
+            return 0.0
+        threshold = (np.arange(1, bets + 1) + bankroll) / multiplier
+        for start in range(0, RUIN_PATHS, chunk):
+            paths = min(chunk, RUIN_PATHS - start)
+            wins = np.cumsum(rng.random((paths, bets), dtype=np.float32) < probability, axis=1, dtype=np.int32)
+            ruined += int((wins >= threshold).any(axis=1).sum())
+        return ruined / RUIN_PATHS
+    for start in range(0, RUIN_PATHS, chunk):
+        paths = min(chunk, RUIN_PATHS - start)
+        # Исход ставки по обратной функции распределения
+        outcomes = np.searchsorted(cumulative, rng.random((paths, bets), dtype=np.float32), side="right")
+        # Результат казино за ставку: ставка минус выплата
+        house = np.cumsum(house_result[outcomes], axis=1)
+        ruined += int((house.min(axis=1) <= -bankroll).sum())
+    return ruined / RUIN_PATHS
+
+
+def simulate_bet(rng, game_type: str, bet_type: str, rule, games: int, args) -> dict:
+    faces = GAME_FACES[game_type]
+    lookup = build_lookup(game_type, bet_type, rule.throws)
+    multiplier = outcome_table.evaluate(game_type, bet_type, [])[1]
+    wins = 0
+    batch_games = max(1, SIM_BATCH_ROLLS // rule.throws)
+    for start in range(0, games, batch_games):
+        size = min(batch_games, games - start)
+        rolls = rng.integers(1, faces + 1, size=(size, rule.throws), dtype=np.int8).astype(np.int64)
+        wins += int(evaluate_batch(rolls, rule, lookup).sum())
+    probability = wins / games
+    exact = exact_win_probability(game_type, bet_type, rule.throws, faces)
+    p = exact if exact is not None else probability
+    return {
+        "game": game_type,
+        "bet": bet_type,
+        "throws": rule.throws,
+        "multiplier": multiplier,
+        "p_sim": probability,
+        "p_exact": exact,
+        "rtp_sim": probability * multiplier,
+        "rtp_exact": exact * multiplier if exact is not None else None,
+        # Дисперсия выплаты на ставку 1 (выплата m с вероятностью p)
+        "variance": multiplier ** 2 * p * (1 - p),
+        "ruin": risk_of_ruin(rng, np.array([0.0, multiplier]), np.array([1 - p, p]), args.bankroll, args.ruin_bets),
+    }
+
+
+def simulate_slots(rng, games: int, args) -> dict:
+    multipliers = np.array([0.0] + [outcome_table.slot(value)[1] for value in range(1, SLOT_VALUES + 1)])
+    total = 0.0
+    for start in range(0, games, SIM_BATCH_ROLLS):
+        size = min(SIM_BATCH_ROLLS, games - start)
+        total += float(multipliers[rng.integers(1, SLOT_VALUES + 1, size=size)].sum())
+    payouts = multipliers[1:]
+    probabilities = np.full(SLOT_VALUES, 1 / SLOT_VALUES)
+    return {
+        "game": "slots",
+        "bet": "spin",
+        "throws": 1,
+        "multiplier": float(payouts.max()),
+        "p_sim": None,
+        "p_exact": float((payouts > 0).mean()),
+        "rtp_sim": total / games,
+        "rtp_exact": float(payouts.mean()),
+        "variance": float(payouts.var()),
+        "ruin": risk_of_ruin(rng, payouts, probabilities, args.bankroll, args.ruin_bets),
+    }
+
+
+def simulate_jackpots(rng, args):
+    """Джекпоты: ставка растет от initial_bet на bet_increment за игру до max_bet,
+    доля jackpot_share каждой ставки идет в банк, выигрыш - с шансом jackpot_odds за игру"""
+    print(f"\nДжекпоты (шанс выигрыша 1/{1 / args.jackpot_odds:.0f} за игру, в банк идет {args.jackpot_share:.0%} ставки)")
+    print(f"{'джекпот':<8} {'игр до выигрыша':>16} {'поставлено':>12} {'банк':>12} {'вклад RTP':>10}")
+    for name, config in JACKPOT_CONFIG.items():
+        plays = rng.geometric(args.jackpot_odds, size=args.jackpot_rounds)
+        # Сумма прогрессии ставок за plays игр с потолком max_bet
+        capped_after = int(np.ceil((config["max_bet"] - config["initial_bet"]) / config["bet_increment"]))
+        ramp = np.minimum(plays, capped_after)
+        staked = ramp * config["initial_bet"] + config["bet_increment"] * ramp * (ramp - 1) / 2
+        staked += np.maximum(plays - capped_after, 0) * config["max_bet"]
+        pool = config["initial"] + args.jackpot_share * staked
+        print(f"{name:<8} {plays.mean():>16.1f} {staked.mean():>12.2f} {pool.mean():>12.2f} "
+              f"{pool.sum() / staked.sum():>10.1%}")
+
+
+def format_probability(value: Optional[float]) -> str:
+    return f"{value:.5f}" if value is not None else "-"
+
+
+def format_percent(value: Optional[float]) -> str:
+    return f"{value:.2%}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Монте-Карло симулятор RTP игр из config.GAME_CONFIGS")
+    parser.add_argument("--games", type=int, default=1_000_000, help="игр на каждую ставку")
+    parser.add_argument("--bankroll", type=float, default=1000.0, help="банк казино в ставках для риска разорения")
+    parser.add_argument("--ruin-bets", type=int, default=10_000, help="ставок в серии для риска разорения")
+    parser.add_argument("--jackpot-odds", type=float, default=1 / 1000, help="шанс выигрыша джекпота за игру")
+    # Доля отчислений в банк в JACKPOT_CONFIG не задана, без нее колонка "вклад RTP" не имеет смысла
+    parser.add_argument("--jackpot-share", type=float, required=True,
+                        help="доля ставки, идущая в банк джекпота (0-1)")
+    parser.add_argument("--jackpot-rounds", type=int, default=100_000, help="розыгрышей джекпота в симуляции")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    if not 0 <= args.jackpot_share <= 1:
+        parser.error("--jackpot-share должна быть от 0 до 1")
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    results = [
+        simulate_bet(rng, game_type, bet_type, rule, args.games, args)
+        for game_type, bets in RULES.items()
+        for bet_type, rule in bets.items()
+    ]
+    if "slots" in GAME_CONFIGS:
+        results.append(simulate_slots(rng, args.games, args))
+
+    print(f"Игр на ставку: {args.games}, банк {args.bankroll:.0f} ставок, серия {args.ruin_bets} ставок\n")
+    print(f"{'игра':<11} {'ставка':<9} {'бр.':>3} {'x':>6} {'P сим':>8} {'P точн':>8} "
+          f"{'RTP сим':>8} {'RTP точн':>8} {'край':>7} {'дисп.':>9} {'разор.':>7}")
+    for row in results:
+        rtp = row["rtp_exact"] if row["rtp_exact"] is not None else row["rtp_sim"]
+        print(f"{row['game']:<11} {row['bet']:<9} {row['throws']:>3} {row['multiplier']:>6g} "
+              f"{format_probability(row['p_sim']):>8} {format_probability(row['p_exact']):>8} "
+              f"{row['rtp_sim']:>8.2%} {format_percent(row['rtp_exact']):>8} "
+              f"{1 - rtp:>7.2%} {row['variance']:>9.2f} {row['ruin']:>7.1%}")
+        if rtp > 1:
+            print(f"  ⚠️ RTP больше 100%: ставка {row['game']}/{row['bet']} убыточна для казино")
+
+    simulate_jackpots(rng, args)
+    print(f"\nГотово за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Табло билетов PvP #500
+
+Занятость 128 позиций дуэли хранится в памяти битовой маской (бит i-1 -
+позиция i), владельцы - массивом позиция -> user_id. Подсчет проданных
+билетов, владелец позиции и поиск свободных позиций не обращаются к базе:
+свободная позиция - младший нулевой бит маски.
+
+Позиции выбираются и занимаются синхронно, без await, поэтому две
+одновременные покупки не получат одну позицию. Покупка (списание, билеты
+через executemany и банк дуэли) пишется одной транзакцией; если она не
+прошла, позиции освобождаются. Дуэль заполнена, когда заняты все позиции и
+ни одна покупка не ждет записи: игру запускает ровно одна покупка - та,
+после записи которой это стало верно. Табло строится из pvp_tickets при
+первом обращении после запуска.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Билетов в дуэли PvP #500
+PVP_TICKETS_TOTAL = 128
+# Покупка дороже этой суммы раскладывается честно: до 5 билетов в начало (1-5), остальные в конец (124-128)
+PVP_TICKETS_SPREAD_AMOUNT = 0.5
+PVP_TICKETS_HEAD = (1, 5)
+PVP_TICKETS_TAIL = (124, 128)
+
+db = Database()
+
+
+def _range_mask(first: int, last: int) -> int:
+    """Маска позиций first..last включительно"""
+    return ((1 << (last - first + 1)) - 1) << (first - 1)
+
+
+class TicketBoard:
+    """Занятость и владельцы позиций билетов одной дуэли"""
+
+    __slots__ = ("duel_id", "size", "occupied", "owners", "in_flight", "filled")
+
+    def __init__(self, duel_id: int, size: int = PVP_TICKETS_TOTAL):
+        self.duel_id = duel_id
+        self.size = size
+        self.occupied = 0
+        self.owners: List[Optional[int]] = [None] * (size + 1)  # позиции с 1
+        self.in_flight = 0  # покупки, позиции которых заняты, но еще не записаны
+        self.filled = False  # заполнение уже объявлено (игру запускает одна покупка)
+
+    @property
+    def count(self) -> int:
+        return self.occupied.bit_count()
+
+    @property
+    def free(self) -> int:
+        return self.size - self.count
+
+    def owner(self, position: int) -> Optional[int]:
+        if 1 <= position <= self.size:
+            return self.owners[position]
+        return None
+
+    def free_positions(self, limit: int, first: int = 1, last: Optional[int] = None) -> List[int]:
+        """До limit свободных позиций из first..last по возрастанию"""
+        free = ~self.occupied & _range_mask(first, last or self.size)
+        positions = []
+        while free and len(positions) < limit:
+            lowest = free & -free
+            positions.append(lowest.bit_length())
+            free ^= lowest
+        return positions
+
+    def taken_positions(self, exclude: Iterable[int] = ()) -> List[int]:
+        """Занятые позиции по возрастанию (кроме exclude)"""
+        taken = self.occupied
+        for position in exclude:
+            taken &= ~(1 << (position - 1))
+        positions = []
+        while taken:
+            lowest = taken & -taken
+            positions.append(lowest.bit_length())
+            taken ^= lowest
+        return positions
+
+    def claim(self, positions: Iterable[int], user_id: int):
+        for position in positions:
+            self.occupied |= 1 << (position - 1)
+            self.owners[position] = user_id
+
+    def release(self, positions: Iterable[int]):
+        for position in positions:
+            self.occupied &= ~(1 << (position - 1))
+            self.owners[position] = None
+
+    def allocate(self, user_id: int, ticket_count: int, spread: bool) -> Optional[List[int]]:
+        """Выбрать и занять позиции для ticket_count билетов. None - свободных позиций не хватает
+
+        При spread сначала занимаются свободные позиции 1-5, затем 124-128, остальные - по порядку.
+        """
+        if ticket_count > self.free:
+            return None
+        positions: List[int] = []
+        if spread:
+            positions = self.free_positions(ticket_count, *PVP_TICKETS_HEAD)
+            self.claim(positions, user_id)
+            tail = self.free_positions(ticket_count - len(positions), *PVP_TICKETS_TAIL)
+            self.claim(tail, user_id)
+            positions += tail
+        rest = self.free_positions(ticket_count - len(positions))
+        self.claim(rest, user_id)
+        return positions + rest
+
+
+class TicketBoards:
+    """Табло билетов по дуэлям, строятся из pvp_tickets при первом обращении"""
+
+    def __init__(self):
+        self._boards: Dict[int, TicketBoard] = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, duel_id: int) -> TicketBoard:
+        board = self._boards.get(duel_id)
+        if board is not None:
+            return board
+        async with self._lock:
+            if duel_id not in self._boards:
+                board = TicketBoard(duel_id)
+                for position, user_id in await db.get_pvp_ticket_positions(duel_id):
+                    if 1 <= position <= board.size:
+                        if board.owner(position) is not None:
+                            logger.warning(f"⚠️ PvP #{duel_id}: позиция {position} продана повторно, владелец - первый покупатель")
+                            continue
+                        board.claim((position,), user_id)
+                self._boards[duel_id] = board
+                logger.info(f"🎫 Табло билетов PvP #{duel_id} построено: продано {board.count}/{board.size}")
+        return self._boards[duel_id]
+
+    async def buy(self, duel_id: int, user_id: int, amount: float,
+                  ticket_count: int) -> Optional[Tuple[List[int], bool]]:
+        """Купить билеты: позиции занимаются сразу, покупка пишется одной транзакцией
+
+        Returns:
+            (позиции билетов, эта покупка заполнила дуэль) или None, если не хватает
+            свободных позиций или средств
+        """
+        board = await self.get(duel_id)
+        positions = board.allocate(user_id, ticket_count, amount > PVP_TICKETS_SPREAD_AMOUNT)
+        if positions is None:
+            return None
+        board.in_flight += 1
+        try:
+            bought = await db.buy_pvp_tickets(duel_id, user_id, amount, positions) is not None
+        except Exception:
+            board.in_flight -= 1
+            board.release(positions)
+            raise
+        board.in_flight -= 1
+        if not bought:
+            board.release(positions)
+            return None
+        # Игру запускает только та записанная покупка, после которой заняты все позиции
+        # и ни одна другая покупка не ждет записи (она еще может не пройти и освободить позиции)
+        filled = board.free == 0 and board.in_flight == 0 and not board.filled
+        if filled:
+            board.filled = True
+        return positions, filled
+
+
+ticket_boards = TicketBoards()
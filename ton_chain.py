@@ -1,8 +1,8 @@
-import aiohttp
 import logging
 import base64
 from typing import Optional, Tuple, List, Dict
 from config import TONCENTER_API_KEY, TON_ADDRESS
+from http_client import http_request
 
 logger = logging.getLogger(__name__)
 
@@ -11,16 +11,7 @@ TONCENTER_API = "https://toncenter.com/api/v2"
 MIN_DEPOSIT_NANO = int(0.1 * 1e9)  # 100,000,000 наноTON = 0.1 TON
 
 
-async def find_incoming_tx_by_comment(
-    address: str,
-    comment: str,
-    min_amount_nano: int,
-    limit: int = 50,
-) -> Optional[Tuple[str, int]]:
-    """
-    Ищет входящую транзакцию на address с текстовым комментарием == comment
-    и суммой >= min_amount_nano. Возвращает (tx_hash, amount_nano) или None.
-    """
+def _toncenter_params(address: str, limit: int) -> Tuple[Dict, Dict]:
     params = {
         "address": address,
         "limit": limit,
@@ -33,10 +24,186 @@ async def find_incoming_tx_by_comment(
         params["api_key"] = TONCENTER_API_KEY
         # Также можно использовать заголовок X-API-Key (дополнительная опция)
         # headers["X-API-Key"] = TONCENTER_API_KEY
+    return params, headers
+
+
+async def find_incoming_tx_by_comment(
+    address: str,
+    comment: str,
+    min_amount_nano: int,
+    limit: int = 50,
+) -> Optional[Tuple[str, int]]:
+    """
+    Ищет входящую транзакцию на address с текстовым комментарием == comment
+    и суммой >= min_amount_nano. Возвращает (tx_hash, amount_nano) или None.
+    """
+    params, headers = _toncenter_params(address, limit)
+
+    url = f"{TONCENTER_API}/getTransactions"
+    async with http_request("GET", url, params=params, headers=headers) as resp:
+        try:
+            data = await resp.json()
+        except Exception:
+            logger.error("TONCENTER getTransactions: failed to decode JSON")
+            return None
+
+        if resp.status != 200 or not data.get("ok"):
+            logger.error(f"TONCENTER error: HTTP {resp.status}, body={data}")
+            return None
+
+        transactions = data.get("result", [])
+        # Перебираем транзакции, ищем входящие (in_msg) с нужным комментом
+        for tx in transactions:
+            in_msg = tx.get("in_msg") or {}
+            value_str = in_msg.get("value", "0")
+            msg_data = in_msg.get("msg_data") or {}
+            tx_comment = None
+            if isinstance(msg_data, dict):
+                tx_comment = msg_data.get("text") or msg_data.get("comment")
+
+            try:
+                amount_nano = int(value_str)
+            except Exception:
+                amount_nano = 0
+
+            # Проверяем сумму и ровное совпадение комментария
+            if amount_nano >= min_amount_nano and tx_comment is not None and str(tx_comment).strip() == str(comment).strip():
+                tx_hash = tx.get("transaction_id", {}).get("hash") or tx.get("utime_string") or ""
+                if tx_hash:
+                    return tx_hash, amount_nano
+    return None
+
+
+def parse_incoming_transaction(tx: Dict) -> Optional[Dict]:
+    """
+    Разбирает транзакцию toncenter. Возвращает словарь hash/amount_nano/comment/lt/utime
+    для входящей транзакции не меньше минимального депозита, иначе None.
+    """
+    in_msg = tx.get("in_msg")
+    if not in_msg:
+        return None
+
+    value_str = in_msg.get("value", "0")
+    msg_data = in_msg.get("msg_data") or {}
+
+    # Извлекаем комментарий из разных полей
+    tx_comment = None
+    if isinstance(msg_data, dict):
+        # В TON комментарии могут быть в разных форматах:
+        # 1. Прямой текст (text)
+        # 2. Base64 закодированный текст
+        # 3. Hex закодированный текст
+
+        # Сначала пробуем прямые поля
+        tx_comment = (
+            msg_data.get("text") 
+            or msg_data.get("comment")
+            or msg_data.get("msg_body")
+            or msg_data.get("body")
+            or (msg_data.get("msg") if isinstance(msg_data.get("msg"), str) else None)
+        )
+
+        # Если есть base64 или hex данные, пробуем декодировать
+        if not tx_comment:
+            # Пробуем base64 декодирование
+            base64_data = msg_data.get("base64") or msg_data.get("b64")
+            if base64_data:
+                try:
+                    decoded = base64.b64decode(base64_data)
+                    tx_comment = decoded.decode('utf-8', errors='ignore').strip()
+                    logger.debug(f"🔓 Декодирован base64 комментарий: {tx_comment}")
+                except Exception as e:
+                    logger.debug(f"⚠️ Ошибка декодирования base64: {e}")
+
+            # Пробуем hex декодирование
+            if not tx_comment:
+                hex_data = msg_data.get("hex") or msg_data.get("body_hex")
+                if hex_data and isinstance(hex_data, str):
+                    try:
+                        decoded = bytes.fromhex(hex_data)
+                        tx_comment = decoded.decode('utf-8', errors='ignore').strip()
+                        logger.debug(f"🔓 Декодирован hex комментарий: {tx_comment}")
+                    except Exception as e:
+                        logger.debug(f"⚠️ Ошибка декодирования hex: {e}")
+
+    # Если не нашли в msg_data, пробуем в корне in_msg
+    if not tx_comment and isinstance(in_msg, dict):
+        tx_comment = in_msg.get("message") or in_msg.get("comment") or in_msg.get("text")
+
+    # Если комментарий все еще base64 строка, пробуем декодировать
+    if tx_comment and isinstance(tx_comment, str) and len(tx_comment) > 0:
+        # Проверяем, является ли это base64
+        try:
+            # Пробуем декодировать как base64
+            decoded = base64.b64decode(tx_comment)
+            decoded_str = decoded.decode('utf-8', errors='ignore').strip()
+            # Если декодирование успешно и результат не пустой, используем его
+            if decoded_str and decoded_str.isprintable():
+                tx_comment = decoded_str
+                logger.debug(f"🔓 Декодирован base64 комментарий из строки: {tx_comment}")
+        except Exception:
+            # Не base64, оставляем как есть
+            pass
+
+    try:
+        amount_nano = int(value_str)
+    except Exception:
+        amount_nano = 0
+
+    # Получаем хеш транзакции
+    tx_hash_obj = tx.get("transaction_id") or {}
+    tx_hash = None
+    if isinstance(tx_hash_obj, dict):
+        tx_hash = tx_hash_obj.get("hash")
+    elif isinstance(tx_hash_obj, str):
+        tx_hash = tx_hash_obj
+
+    if not tx_hash:
+        # Попробуем получить из другого поля
+        tx_hash = tx.get("hash") or tx.get("transaction_id")
+
+    if tx_hash and amount_nano >= MIN_DEPOSIT_NANO:
+        return {
+            "hash": tx_hash,
+            "amount_nano": amount_nano,
+            "comment": tx_comment,
+            "lt": tx.get("transaction_id", {}).get("lt") or tx.get("lt"),
+            "utime": tx.get("utime") or tx.get("transaction_id", {}).get("utime"),
+        }
+    return None
+
+
+def _transaction_cursor(tx: Dict) -> Optional[Tuple[int, str]]:
+    """(lt, hash) транзакции для курсора сканирования"""
+    tx_id = tx.get("transaction_id") or {}
+    try:
+        return int(tx_id.get("lt")), tx_id.get("hash")
+    except (TypeError, ValueError):
+        return None
+
+
+async def get_transactions_page(
+    address: str,
+    limit: int = 100,
+    lt: Optional[int] = None,
+    tx_hash: Optional[str] = None,
+    to_lt: Optional[int] = None,
+) -> Optional[List[Dict]]:
+    """
+    Одна страница getTransactions (от новых к старым). lt/tx_hash - транзакция,
+    с которой начинать (включительно), to_lt - на какой остановиться.
+    Возвращает сырые транзакции или None при ошибке.
+    """
+    params, headers = _toncenter_params(address, limit)
+    if lt is not None and tx_hash:
+        params["lt"] = lt
+        params["hash"] = tx_hash
+    if to_lt is not None:
+        params["to_lt"] = to_lt
 
     url = f"{TONCENTER_API}/getTransactions"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, params=params, headers=headers) as resp:
+    try:
+        async with http_request("GET", url, params=params, headers=headers, timeout=15) as resp:
             try:
                 data = await resp.json()
             except Exception:
@@ -46,28 +213,63 @@ async def find_incoming_tx_by_comment(
             if resp.status != 200 or not data.get("ok"):
                 logger.error(f"TONCENTER error: HTTP {resp.status}, body={data}")
                 return None
+            return data.get("result", [])
+    except Exception as e:
+        logger.error(f"Ошибка при получении транзакций: {e}", exc_info=True)
+        return None
 
-            transactions = data.get("result", [])
-            # Перебираем транзакции, ищем входящие (in_msg) с нужным комментом
-            for tx in transactions:
-                in_msg = tx.get("in_msg") or {}
-                value_str = in_msg.get("value", "0")
-                msg_data = in_msg.get("msg_data") or {}
-                tx_comment = None
-                if isinstance(msg_data, dict):
-                    tx_comment = msg_data.get("text") or msg_data.get("comment")
 
-                try:
-                    amount_nano = int(value_str)
-                except Exception:
-                    amount_nano = 0
-
-                # Проверяем сумму и ровное совпадение комментария
-                if amount_nano >= min_amount_nano and tx_comment is not None and str(tx_comment).strip() == str(comment).strip():
-                    tx_hash = tx.get("transaction_id", {}).get("hash") or tx.get("utime_string") or ""
-                    if tx_hash:
-                        return tx_hash, amount_nano
-    return None
+async def get_incoming_transactions_since(
+    address: str,
+    since_lt: Optional[int],
+    page_size: int = 100,
+    max_pages: int = 20,
+    start: Optional[Tuple[int, str]] = None,
+) -> Optional[Tuple[List[Dict], Optional[Tuple[int, str]], Optional[Tuple[int, str]]]]:
+    """
+    Получает входящие транзакции новее since_lt, листая страницы от новых к старым
+    (с самой новой транзакции или с start). Без since_lt (первый запуск) берется
+    только последняя страница.
+
+    Возвращает (входящие транзакции, (lt, hash) самой новой из просмотренных
+    транзакций, (lt, hash) самой старой просмотренной, если сканирование оборвано
+    лимитом страниц, иначе None) или None, если какую-то страницу получить не
+    удалось. После обрыва между since_lt и самой старой просмотренной транзакцией
+    остается непросмотренный промежуток: продолжать нужно с нее (start), не
+    сдвигая курсор.
+    """
+    incoming: List[Dict] = []
+    newest: Optional[Tuple[int, str]] = None
+    seen = set()
+    lt, tx_hash = start if start else (None, None)
+    for _ in range(max_pages):
+        page = await get_transactions_page(address, page_size, lt=lt, tx_hash=tx_hash, to_lt=since_lt)
+        if page is None:
+            return None
+        oldest = None
+        for tx in page:
+            cursor = _transaction_cursor(tx)
+            # Страница начинается с транзакции, на которой закончилась предыдущая
+            if cursor is None or cursor in seen:
+                continue
+            if since_lt is not None and cursor[0] <= since_lt:
+                continue
+            seen.add(cursor)
+            if newest is None or cursor[0] > newest[0]:
+                newest = cursor
+            if oldest is None or cursor[0] < oldest[0]:
+                oldest = cursor
+            parsed = parse_incoming_transaction(tx)
+            if parsed:
+                incoming.append(parsed)
+        if since_lt is None or len(page) < page_size or oldest is None:
+            break
+        lt, tx_hash = oldest
+    else:
+        logger.warning(f"⚠️ TON: достигнут лимит страниц ({max_pages}) при сканировании {address}, "
+                       f"продолжу с lt={lt}")
+        return incoming, newest, (lt, tx_hash)
+    return incoming, newest, None
 
 
 async def get_all_incoming_transactions(address: str, limit: int = 100) -> List[Dict]:
@@ -75,129 +277,9 @@ async def get_all_incoming_transactions(address: str, limit: int = 100) -> List[
     Получает все входящие транзакции на адрес.
     Возвращает список транзакций с комментариями и суммами.
     """
-    params = {
-        "address": address,
-        "limit": limit,
-        "archival": "true",
-    }
-    # Поддержка обоих методов авторизации: query параметр или заголовок
-    headers = {}
-    if TONCENTER_API_KEY:
-        # Используем query параметр (поддерживается и работает)
-        params["api_key"] = TONCENTER_API_KEY
-        # Также можно использовать заголовок X-API-Key (дополнительная опция)
-        # headers["X-API-Key"] = TONCENTER_API_KEY
-
-    url = f"{TONCENTER_API}/getTransactions"
     transactions = []
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, headers=headers, timeout=15) as resp:
-                try:
-                    data = await resp.json()
-                except Exception:
-                    logger.error("TONCENTER getTransactions: failed to decode JSON")
-                    return []
-
-                if resp.status != 200 or not data.get("ok"):
-                    logger.error(f"TONCENTER error: HTTP {resp.status}, body={data}")
-                    return []
-
-                tx_list = data.get("result", [])
-                for tx in tx_list:
-                    in_msg = tx.get("in_msg")
-                    if not in_msg:
-                        continue
-                    
-                    value_str = in_msg.get("value", "0")
-                    msg_data = in_msg.get("msg_data") or {}
-                    
-                    # Извлекаем комментарий из разных полей
-                    tx_comment = None
-                    if isinstance(msg_data, dict):
-                        # В TON комментарии могут быть в разных форматах:
-                        # 1. Прямой текст (text)
-                        # 2. Base64 закодированный текст
-                        # 3. Hex закодированный текст
-                        
-                        # Сначала пробуем прямые поля
-                        tx_comment = (
-                            msg_data.get("text") 
-                            or msg_data.get("comment")
-                            or msg_data.get("msg_body")
-                            or msg_data.get("body")
-                            or (msg_data.get("msg") if isinstance(msg_data.get("msg"), str) else None)
-                        )
-                        
-                        # Если есть base64 или hex данные, пробуем декодировать
-                        if not tx_comment:
-                            # Пробуем base64 декодирование
-                            base64_data = msg_data.get("base64") or msg_data.get("b64")
-                            if base64_data:
-                                try:
-                                    decoded = base64.b64decode(base64_data)
-                                    tx_comment = decoded.decode('utf-8', errors='ignore').strip()
-                                    logger.debug(f"🔓 Декодирован base64 комментарий: {tx_comment}")
-                                except Exception as e:
-                                    logger.debug(f"⚠️ Ошибка декодирования base64: {e}")
-                            
-                            # Пробуем hex декодирование
-                            if not tx_comment:
-                                hex_data = msg_data.get("hex") or msg_data.get("body_hex")
-                                if hex_data and isinstance(hex_data, str):
-                                    try:
-                                        decoded = bytes.fromhex(hex_data)
-                                        tx_comment = decoded.decode('utf-8', errors='ignore').strip()
-                                        logger.debug(f"🔓 Декодирован hex комментарий: {tx_comment}")
-                                    except Exception as e:
-                                        logger.debug(f"⚠️ Ошибка декодирования hex: {e}")
-                    
-                    # Если не нашли в msg_data, пробуем в корне in_msg
-                    if not tx_comment and isinstance(in_msg, dict):
-                        tx_comment = in_msg.get("message") or in_msg.get("comment") or in_msg.get("text")
-                    
-                    # Если комментарий все еще base64 строка, пробуем декодировать
-                    if tx_comment and isinstance(tx_comment, str) and len(tx_comment) > 0:
-                        # Проверяем, является ли это base64
-                        try:
-                            # Пробуем декодировать как base64
-                            decoded = base64.b64decode(tx_comment)
-                            decoded_str = decoded.decode('utf-8', errors='ignore').strip()
-                            # Если декодирование успешно и результат не пустой, используем его
-                            if decoded_str and decoded_str.isprintable():
-                                tx_comment = decoded_str
-                                logger.debug(f"🔓 Декодирован base64 комментарий из строки: {tx_comment}")
-                        except Exception:
-                            # Не base64, оставляем как есть
-                            pass
-                    
-                    try:
-                        amount_nano = int(value_str)
-                    except Exception:
-                        amount_nano = 0
-                    
-                    # Получаем хеш транзакции
-                    tx_hash_obj = tx.get("transaction_id") or {}
-                    tx_hash = None
-                    if isinstance(tx_hash_obj, dict):
-                        tx_hash = tx_hash_obj.get("hash")
-                    elif isinstance(tx_hash_obj, str):
-                        tx_hash = tx_hash_obj
-                    
-                    if not tx_hash:
-                        # Попробуем получить из другого поля
-                        tx_hash = tx.get("hash") or tx.get("transaction_id")
-                    
-                    if tx_hash and amount_nano >= MIN_DEPOSIT_NANO:
-                        transactions.append({
-                            "hash": tx_hash,
-                            "amount_nano": amount_nano,
-                            "comment": tx_comment,
-                            "lt": tx.get("transaction_id", {}).get("lt") or tx.get("lt"),
-                            "utime": tx.get("utime") or tx.get("transaction_id", {}).get("utime"),
-                        })
-    except Exception as e:
-        logger.error(f"Ошибка при получении транзакций: {e}", exc_info=True)
-    
+    for tx in await get_transactions_page(address, limit) or []:
+        parsed = parse_incoming_transaction(tx)
+        if parsed:
+            transactions.append(parsed)
     return transactions
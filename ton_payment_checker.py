@@ -3,9 +3,9 @@
 """
 import asyncio
 import logging
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from database import Database
-from ton_chain import get_all_incoming_transactions, MIN_DEPOSIT_NANO
+from ton_chain import get_incoming_transactions_since
 from ton_price import get_ton_to_usd_rate, ton_to_usd, usd_to_ton
 from config import TON_ADDRESS, BOT_TOKEN
 from aiogram import Bot
@@ -19,6 +19,9 @@ db = Database()
 # Глобальный экземпляр бота для отправки сообщений
 bot_instance: Optional[Bot] = None
 
+# Незавершенные сканирования по адресам: (с какой транзакции продолжить, курсор после завершения)
+_resume_scans: Dict[str, Tuple[Tuple[int, str], Tuple[int, str]]] = {}
+
 def set_bot_instance(bot: Bot):
     """Установить экземпляр бота для отправки уведомлений"""
     global bot_instance
@@ -27,25 +30,49 @@ def set_bot_instance(bot: Bot):
 
 async def process_ton_payments():
     """
-    Проверяет все входящие TON транзакции и автоматически начисляет баланс
+    Проверяет новые входящие TON транзакции и автоматически начисляет баланс
     пользователям по memo (user_id).
+    
+    Сканирование идет от сохраненного курсора (lt последней обработанной транзакции):
+    запрашиваются только более новые транзакции, при всплеске - постранично.
+    Зачисления и сдвиг курсора выполняются одной транзакцией БД.
+    
+    Если за один проход не удалось долистать до курсора (лимит страниц), курсор
+    не сдвигается: следующий проход продолжает с самой старой просмотренной
+    транзакции, и только когда промежуток просмотрен полностью, курсор
+    переходит на самую новую транзакцию первого прохода.
     """
     try:
-        logger.info(f"🔍 Проверяю TON транзакции на адресе {TON_ADDRESS}...")
+        logger.debug(f"🔍 Проверяю TON транзакции на адресе {TON_ADDRESS}...")
+        
+        cursor = await db.get_chain_cursor(TON_ADDRESS)
+        resume, target = _resume_scans.get(TON_ADDRESS, (None, None))
+        result = await get_incoming_transactions_since(
+            TON_ADDRESS, cursor[0] if cursor else None, start=resume
+        )
+        if result is None:
+            # Не удалось получить транзакции - курсор не двигаем, повторим в следующий раз
+            return
+        transactions, newest, truncated_at = result
+        if target is not None:
+            newest = target
         
-        # Получаем все входящие транзакции
-        transactions = await get_all_incoming_transactions(TON_ADDRESS, limit=100)
+        if truncated_at is not None:
+            # Промежуток до курсора еще не просмотрен: зачисляем найденное, курсор не двигаем
+            _resume_scans[TON_ADDRESS] = (truncated_at, newest)
+        else:
+            _resume_scans.pop(TON_ADDRESS, None)
         
-        if not transactions:
-            logger.debug("Нет транзакций для проверки")
+        if newest is None:
+            logger.debug("Нет новых транзакций")
             return
         
-        # Получаем курс TON к USD
-        ton_rate = await get_ton_to_usd_rate()
+        # Уже обработанные транзакции - одним запросом
+        known = await db.get_known_chain_payments([tx["hash"] for tx in transactions])
         
-        processed = 0
-        credited = 0
+        ton_rate = await get_ton_to_usd_rate() if transactions else None
         
+        payments = []
         for tx in transactions:
             tx_hash = tx.get("hash")
             comment = tx.get("comment")
@@ -53,21 +80,10 @@ async def process_ton_payments():
             
             logger.debug(f"🔍 Проверяю транзакцию: hash={tx_hash}, comment={comment}, amount_nano={amount_nano}")
             
-            if not tx_hash:
-                logger.debug(f"⚠️ Транзакция без хеша: {tx}")
-                continue
-            
-            # Проверяем, что транзакция еще не обработана
-            is_new = await db.is_chain_payment_new(tx_hash)
-            if not is_new:
+            if tx_hash in known:
                 logger.debug(f"⏭️ Транзакция {tx_hash} уже обработана, пропускаю")
                 continue
             
-            # Проверяем минимальную сумму
-            if amount_nano < MIN_DEPOSIT_NANO:
-                logger.info(f"⚠️ Транзакция {tx_hash} меньше минимума: {amount_nano / 1e9:.4f} TON (минимум: {MIN_DEPOSIT_NANO / 1e9:.4f} TON)")
-                continue
-            
             # Комментарий должен быть числом (user_id)
             if not comment:
                 logger.info(f"⚠️ Транзакция {tx_hash} без комментария (memo). Сумма: {amount_nano / 1e9:.4f} TON. Пропускаю.")
@@ -76,41 +92,47 @@ async def process_ton_payments():
             
             # Пробуем извлечь user_id из комментария
             comment_str = str(comment).strip()
-            logger.debug(f"🔍 Комментарий транзакции {tx_hash}: '{comment_str}'")
-            
             try:
                 user_id = int(comment_str)
-                logger.debug(f"✅ Извлечен user_id из комментария: {user_id}")
             except (ValueError, TypeError) as e:
                 logger.debug(f"⚠️ Не удалось извлечь user_id из комментария '{comment_str}': {e}")
                 # Пропускаем транзакции с невалидным комментарием
                 continue
             
             # Конвертируем сумму в USD
-            amount_ton = amount_nano / 1e9
-            amount_usd = ton_to_usd(amount_ton, ton_rate)
+            amount_usd = ton_to_usd(amount_nano / 1e9, ton_rate)
+            payments.append((tx_hash, user_id, amount_usd))
+        
+        # Начисляем все подходящие платежи и сдвигаем курсор одной транзакцией
+        credited = await db.credit_chain_payments(
+            payments, "ton_auto", TON_ADDRESS, newest if truncated_at is None else None
+        )
+        
+        notified = 0
+        for payment in credited:
+            user_id = payment["user_id"]
+            amount_usd = payment["amount"]
+            amount_ton = usd_to_ton(amount_usd, ton_rate)
+            tx_hash = payment["tx_hash"]
+            user_balance = payment["balance"]
             
-            # Проверяем, существует ли пользователь
-            user = await db.get_user(user_id)
-            if not user:
+            if user_balance is None:
+                # Транзакция сохранена, чтобы не проверять ее повторно
                 logger.warning(f"Пользователь {user_id} не найден для транзакции {tx_hash}")
-                # Пропускаем, но сохраняем транзакцию, чтобы не проверять повторно
-                await db.save_chain_payment(tx_hash, user_id, amount_usd)
                 continue
             
-            # Начисляем баланс
-            try:
-                await db.update_balance(user_id, amount_usd)
-                await db.add_deposit(user_id, amount_usd, "ton_auto")
-                await db.save_chain_payment(tx_hash, user_id, amount_usd)
-                
-                # Отправляем уведомление пользователю
-                if bot_instance:
-                    try:
-                        user_balance = await db.get_balance(user_id)
-                        user_balance_ton = usd_to_ton(user_balance, ton_rate)
-                        
-                        notification_text = f"""✅ <b>Баланс пополнен автоматически!</b>
+            logger.info(
+                f"✅ Автоматически начислен баланс: "
+                f"user_id={user_id}, amount={amount_ton:.4f} TON (${amount_usd:.2f}), "
+                f"tx_hash={tx_hash}"
+            )
+            
+            # Отправляем уведомление пользователю
+            if bot_instance:
+                try:
+                    user_balance_ton = usd_to_ton(user_balance, ton_rate)
+                    
+                    notification_text = f"""✅ <b>Баланс пополнен автоматически!</b>
 
 💰 <b>Получено:</b> {amount_ton:.4f} TON (${amount_usd:.2f})
 💰 <b>Текущий баланс:</b> {user_balance_ton:.4f} TON (${user_balance:.2f})
@@ -118,31 +140,22 @@ async def process_ton_payments():
 🔗 <b>Транзакция:</b> <code>{tx_hash}</code>
 
 <i>Спасибо за использование бота!</i>"""
-                        
-                        await bot_instance.send_message(
-                            chat_id=user_id,
-                            text=notification_text,
-                            parse_mode=ParseMode.HTML
-                        )
-                        logger.info(f"📨 Уведомление отправлено пользователю {user_id}")
-                    except Exception as e:
-                        logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {user_id}: {e}")
-                
-                credited += 1
-                logger.info(
-                    f"✅ Автоматически начислен баланс: "
-                    f"user_id={user_id}, amount={amount_ton:.4f} TON (${amount_usd:.2f}), "
-                    f"tx_hash={tx_hash}"
-                )
-            except Exception as e:
-                logger.error(f"❌ Ошибка при начислении баланса для {user_id}: {e}", exc_info=True)
-            
-            processed += 1
+                    
+                    await bot_instance.send_message(
+                        chat_id=user_id,
+                        text=notification_text,
+                        parse_mode=ParseMode.HTML
+                    )
+                    notified += 1
+                except Exception as e:
+                    logger.warning(f"⚠️ Не удалось отправить уведомление пользователю {user_id}: {e}")
         
-        if credited > 0:
-            logger.info(f"✨ Обработано транзакций: {processed}, начислено балансов: {credited}")
-        elif processed == 0 and len(transactions) > 0:
-            logger.debug(f"ℹ️ Все {len(transactions)} транзакций уже обработаны или не подходят условиям")
+        if credited:
+            logger.info(
+                f"✨ Новых входящих транзакций: {len(transactions)}, зачислено: {len(credited)}, "
+                f"уведомлений: {notified}, "
+                + (f"курсор: lt={newest[0]}" if truncated_at is None else f"продолжу с lt={truncated_at[0]}")
+            )
         
     except Exception as e:
         logger.error(f"❌ Ошибка при проверке TON транзакций: {e}", exc_info=True)
@@ -2,11 +2,12 @@
 Модуль для получения актуального курса TON к USD
 Использует CoinGecko API (бесплатный, не требует API ключа)
 """
-import aiohttp
 import logging
 from typing import Optional
 import asyncio
 
+from http_client import http_request
+
 logger = logging.getLogger(__name__)
 
 # Кэш для курса (обновляется каждые 5 минут)
@@ -31,30 +32,30 @@ async def get_ton_to_usd_rate() -> float:
         return _ton_price_cache["price"]
     
     try:
-        async with aiohttp.ClientSession() as session:
-            # CoinGecko API для получения цены TON
-            url = "https://api.coingecko.com/api/v3/simple/price"
-            params = {
-                "ids": "the-open-network",
-                "vs_currencies": "usd"
-            }
-            
-            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=2)) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    price = data.get("the-open-network", {}).get("usd")
+        # CoinGecko API для получения цены TON
+        url = "https://api.coingecko.com/api/v3/simple/price"
+        params = {
+            "ids": "the-open-network",
+            "vs_currencies": "usd"
+        }
+        
+        # Курс нужен быстро: без повторов, при ошибке отдаем значение из кэша
+        async with http_request("GET", url, params=params, timeout=2, retries=0) as response:
+            if response.status == 200:
+                data = await response.json()
+                price = data.get("the-open-network", {}).get("usd")
                     
-                    if price:
-                        _ton_price_cache["price"] = float(price)
-                        _ton_price_cache["timestamp"] = current_time
-                        logger.info(f"Курс TON обновлен: ${price}")
-                        return float(price)
-                    else:
-                        logger.warning("Не удалось получить цену TON из ответа API")
-                        return _ton_price_cache["price"]
+                if price:
+                    _ton_price_cache["price"] = float(price)
+                    _ton_price_cache["timestamp"] = current_time
+                    logger.info(f"Курс TON обновлен: ${price}")
+                    return float(price)
                 else:
-                    logger.warning(f"Ошибка API CoinGecko: статус {response.status}")
+                    logger.warning("Не удалось получить цену TON из ответа API")
                     return _ton_price_cache["price"]
+            else:
+                logger.warning(f"Ошибка API CoinGecko: статус {response.status}")
+                return _ton_price_cache["price"]
                     
     except asyncio.TimeoutError:
         logger.warning("Таймаут при запросе курса TON")
@@ -1,16 +1,118 @@
 """
 Утилиты для проверки подписки на канал
 """
+import asyncio
 import logging
-from typing import Optional
+import os
+import time
+from typing import Dict, Optional, Tuple
 from aiogram import Bot
 from aiogram.enums import ChatMemberStatus
 from aiogram.exceptions import TelegramBadRequest
 
 logger = logging.getLogger(__name__)
 
+# Время жизни (сек) закэшированного результата: подписан / не подписан / ошибка проверки
+SUBSCRIPTION_POSITIVE_TTL = float(os.getenv("SUBSCRIPTION_POSITIVE_TTL", "1800"))
+SUBSCRIPTION_NEGATIVE_TTL = float(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", "60"))
+SUBSCRIPTION_ERROR_TTL = float(os.getenv("SUBSCRIPTION_ERROR_TTL", "30"))
+SUBSCRIBED_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR)
 
-async def check_subscription(bot: Bot, user_id: int, channel: str = None, channel_id: int = None) -> bool:
+
+class SubscriptionCache:
+    """
+    Кэш результатов проверки подписки по (канал, user_id)
+    
+    Одновременные проверки одного пользователя объединяются в один запрос
+    get_chat_member, а обновления chat_member канала сразу меняют результат.
+    """
+    
+    def __init__(self):
+        # (канал, user_id) -> (подписан, истекает в)
+        self._verdicts: Dict[Tuple[object, int], Tuple[bool, float]] = {}
+        self._inflight: Dict[Tuple[object, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, chat_id, user_id: int) -> Optional[bool]:
+        verdict = self._verdicts.get((chat_id, user_id))
+        if verdict is None:
+            return None
+        if verdict[1] < time.monotonic():
+            del self._verdicts[(chat_id, user_id)]
+            return None
+        return verdict[0]
+    
+    def set(self, chat_id, user_id: int, subscribed: bool, ttl: Optional[float] = None):
+        if ttl is None:
+            ttl = SUBSCRIPTION_POSITIVE_TTL if subscribed else SUBSCRIPTION_NEGATIVE_TTL
+        self._verdicts[(chat_id, user_id)] = (subscribed, time.monotonic() + ttl)
+        # Заодно выбрасываем истекшие записи, чтобы кэш не рос бесконечно
+        if len(self._verdicts) % 1024 == 0:
+            now = time.monotonic()
+            for key in [key for key, (_, expires) in self._verdicts.items() if expires < now]:
+                del self._verdicts[key]
+    
+    def invalidate(self, chat_id, user_id: int):
+        self._verdicts.pop((chat_id, user_id), None)
+    
+    async def resolve(self, chat_id, user_id: int, fetch) -> bool:
+        """Вернуть результат из кэша или выполнить fetch() (один на пользователя одновременно)"""
+        cached = self.get(chat_id, user_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        key = (chat_id, user_id)
+        future = self._inflight.get(key)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Отменили исходную проверку, а не нас - проверяем сами
+                return await self.resolve(chat_id, user_id, fetch)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            subscribed, ttl = await fetch()
+            self.set(chat_id, user_id, subscribed, ttl)
+            future.set_result(subscribed)
+            return subscribed
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Исключение уже получил вызывающий; ожидающих может не быть
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+
+subscription_cache = SubscriptionCache()
+
+
+def _resolve_chat_id(channel: str = None, channel_id: int = None):
+    # Используем ID канала если указан, иначе username
+    if channel_id:
+        return channel_id
+    if channel:
+        return f"@{channel.lstrip('@')}"
+    return None
+
+
+def update_subscription_from_member(chat_id, user_id: int, status) -> bool:
+    """Обновить кэш по событию chat_member канала. Возвращает новый статус подписки"""
+    subscribed = status in SUBSCRIBED_STATUSES
+    subscription_cache.set(chat_id, user_id, subscribed)
+    return subscribed
+
+
+async def check_subscription(bot: Bot, user_id: int, channel: str = None, channel_id: int = None,
+                             use_cache: bool = True) -> bool:
     """
     Проверяет, подписан ли пользователь на канал
     
@@ -19,42 +121,42 @@ async def check_subscription(bot: Bot, user_id: int, channel: str = None, channe
         user_id: ID пользователя
         channel: Username канала (например, "@arbuzikgame") - опционально
         channel_id: ID канала (например, -1003236997426) - приоритетнее чем username
+        use_cache: использовать закэшированный результат (False - принудительно спросить Telegram)
     
     Returns:
         True если пользователь подписан, False если нет
     """
+    chat_id = _resolve_chat_id(channel, channel_id)
+    if chat_id is None:
+        logger.error("Не указан ни channel, ни channel_id для проверки подписки")
+        return True  # В случае ошибки разрешаем доступ
+    if not use_cache:
+        subscription_cache.invalidate(chat_id, user_id)
+    return await subscription_cache.resolve(
+        chat_id, user_id, lambda: _fetch_subscription(bot, user_id, chat_id, channel_id or channel)
+    )
+
+
+async def _fetch_subscription(bot: Bot, user_id: int, chat_id, channel_label) -> Tuple[bool, Optional[float]]:
+    """Запросить статус в Telegram. Возвращает (подписан, TTL кэша или None - TTL по умолчанию)"""
     try:
-        # Используем ID канала если указан, иначе username
-        if channel_id:
-            chat_id = channel_id
-        elif channel:
-            # Убираем @ если есть
-            channel_username = channel.lstrip("@")
-            chat_id = f"@{channel_username}"
-        else:
-            logger.error("Не указан ни channel, ни channel_id для проверки подписки")
-            return True  # В случае ошибки разрешаем доступ
-        
         # Получаем информацию о статусе пользователя в канале
         member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
         
         # Проверяем статус подписки
         # member, administrator, creator - подписан
         # left, kicked, restricted - не подписан
-        if member.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR]:
-            return True
-        else:
-            return False
+        return member.status in SUBSCRIBED_STATUSES, None
             
     except TelegramBadRequest as e:
         # Если канал не найден или бот не может проверить подписку
-        logger.error(f"Ошибка при проверке подписки на канал {channel_id or channel}: {e}")
+        logger.error(f"Ошибка при проверке подписки на канал {channel_label}: {e}")
         # В случае ошибки разрешаем доступ (чтобы не блокировать пользователей)
-        return True
+        return True, SUBSCRIPTION_ERROR_TTL
     except Exception as e:
         logger.error(f"Неожиданная ошибка при проверке подписки: {e}", exc_info=True)
         # В случае ошибки разрешаем доступ
-        return True
+        return True, SUBSCRIPTION_ERROR_TTL
 
 
 def get_subscription_keyboard(channel: str) -> "InlineKeyboardMarkup":
@@ -0,0 +1,113 @@
+"""
+Проверка initData мини-приложения Telegram
+
+Секретный ключ WebAppData зависит только от токена бота и вычисляется один
+раз. Мини-приложение присылает один и тот же заголовок X-Telegram-Init-Data
+на все запросы сессии, поэтому проверенные initData кэшируются в LRU по
+sha256 строки: повторный запрос обходится поиском в словаре без разбора
+строки, HMAC и json.loads. Запись живет до auth_date + INIT_DATA_MAX_AGE,
+initData старше этого срока отклоняются.
+
+auth_middleware кладет проверенного пользователя Telegram (или None) в
+request["user"], обработчикам остается только прочитать его.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Сколько (сек) initData действителен после auth_date
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", "86400"))
+# Максимум проверенных initData в кэше
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", "10000"))
+
+INIT_DATA_HEADER = "X-Telegram-Init-Data"
+
+
+class InitDataVerifier:
+    """Проверка подписи initData с кэшем проверенных строк"""
+
+    def __init__(self, bot_token: str, max_age: int = INIT_DATA_MAX_AGE, max_entries: int = INIT_DATA_CACHE_SIZE):
+        self._secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        self.max_entries = max_entries
+        # sha256(initData) -> (данные пользователя, истекает по времени UNIX)
+        self._cache: "OrderedDict[bytes, Tuple[Optional[Dict], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, init_data: str) -> Optional[Dict]:
+        """Данные пользователя из initData или None, если подпись неверна или initData устарели"""
+        if not init_data:
+            return None
+        key = hashlib.sha256(init_data.encode()).digest()
+        now = time.time()
+        cached = self._cache.get(key)
+        if cached is not None:
+            user_data, expires_at = cached
+            if expires_at > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return user_data
+            del self._cache[key]
+        self.misses += 1
+        verified = self._verify(init_data, now)
+        if verified is None:
+            return None
+        self._cache[key] = verified
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return verified[0]
+
+    def _verify(self, init_data: str, now: float) -> Optional[Tuple[Optional[Dict], float]]:
+        """Полная проверка: (данные пользователя, истекает) или None"""
+        try:
+            data_dict = {}
+            for pair in init_data.split('&'):
+                if '=' in pair:
+                    key, value = pair.split('=', 1)
+                    data_dict[key] = unquote(value)
+
+            hash_value = data_dict.pop('hash', None)
+            if not hash_value:
+                return None
+            data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(data_dict.items()))
+            calculated_hash = hmac.new(self._secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+            if not hmac.compare_digest(calculated_hash, hash_value):
+                logger.warning("Неверная подпись initData")
+                return None
+
+            auth_date = int(data_dict.get('auth_date', now))
+            expires_at = auth_date + self.max_age
+            if expires_at <= now:
+                logger.warning(f"⚠️ initData устарели (auth_date {auth_date})")
+                return None
+
+            user_data = json.loads(data_dict['user']) if 'user' in data_dict else None
+            return user_data, expires_at
+        except Exception as e:
+            logger.error(f"Ошибка проверки initData: {e}")
+            return None
+
+    def metrics(self) -> Dict[str, int]:
+        return {"size": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+def auth_middleware(verifier: InitDataVerifier):
+    """aiohttp middleware: request["user"] - проверенный пользователь Telegram или None"""
+
+    @web.middleware
+    async def middleware_handler(request, handler):
+        request["user"] = verifier.verify(request.headers.get(INIT_DATA_HEADER, ''))
+        return await handler(request)
+
+    return middleware_handler
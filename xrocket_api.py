@@ -3,6 +3,7 @@ import logging
 import re
 from typing import Optional, Dict
 from config import XROCKET_API_KEY, TON_ADDRESS
+from http_client import http_request
 
 logger = logging.getLogger(__name__)
 
@@ -52,57 +53,56 @@ async def create_invoice(coin: str, amount_usd: float, memo: str) -> Optional[Di
     url = f"{XROCKET_API_BASE}/tg-invoices"
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers, timeout=15) as resp:
-                # Проверяем статус ответа
-                if resp.status == 200 or resp.status == 201:
-                    try:
-                        data = await resp.json()
-                        logger.info(f"xRocket createInvoice: HTTP {resp.status}, URL: {url}, data={data}")
+        async with http_request("POST", url, json=payload, headers=headers, timeout=15) as resp:
+            # Проверяем статус ответа
+            if resp.status == 200 or resp.status == 201:
+                try:
+                    data = await resp.json()
+                    logger.info(f"xRocket createInvoice: HTTP {resp.status}, URL: {url}, data={data}")
                         
-                        # Проверяем, есть ли данные
-                        if data:
-                            # API возвращает структуру: {'success': True, 'data': {...}}
-                            # Нужно извлечь данные из поля 'data'
-                            invoice_data = data.get("data") or data
+                    # Проверяем, есть ли данные
+                    if data:
+                        # API возвращает структуру: {'success': True, 'data': {...}}
+                        # Нужно извлечь данные из поля 'data'
+                        invoice_data = data.get("data") or data
                             
-                            # Согласно документации, ответ содержит поле "link" со ссылкой
-                            # Также может быть поле "id" для invoice_id
-                            pay_url = invoice_data.get("link") or invoice_data.get("payUrl") or invoice_data.get("url")
-                            invoice_id = invoice_data.get("id") or invoice_data.get("invoiceId")
+                        # Согласно документации, ответ содержит поле "link" со ссылкой
+                        # Также может быть поле "id" для invoice_id
+                        pay_url = invoice_data.get("link") or invoice_data.get("payUrl") or invoice_data.get("url")
+                        invoice_id = invoice_data.get("id") or invoice_data.get("invoiceId")
                             
-                            # Извлекаем токен из ссылки, если она есть
-                            inv_token = None
-                            if pay_url and "start=inv_" in pay_url:
-                                # Извлекаем токен из ссылки https://t.me/xrocket?start=inv_xxx
-                                match = re.search(r'start=inv_([^&]+)', pay_url)
-                                if match:
-                                    inv_token = f"inv_{match.group(1)}"
+                        # Извлекаем токен из ссылки, если она есть
+                        inv_token = None
+                        if pay_url and "start=inv_" in pay_url:
+                            # Извлекаем токен из ссылки https://t.me/xrocket?start=inv_xxx
+                            match = re.search(r'start=inv_([^&]+)', pay_url)
+                            if match:
+                                inv_token = f"inv_{match.group(1)}"
                             
-                            if pay_url:
-                                result = {
-                                    "invoice_id": invoice_id,
-                                    "inv_token": inv_token or "",
-                                    "pay_url": pay_url,
-                                }
-                                logger.info(f"✅ xRocket invoice created successfully: {result}")
-                                return result
-                            else:
-                                logger.warning(f"xRocket API returned data but no link found: {data}")
+                        if pay_url:
+                            result = {
+                                "invoice_id": invoice_id,
+                                "inv_token": inv_token or "",
+                                "pay_url": pay_url,
+                            }
+                            logger.info(f"✅ xRocket invoice created successfully: {result}")
+                            return result
                         else:
-                            logger.warning(f"xRocket API returned empty data, status: {resp.status}")
-                    except Exception as json_error:
-                        text = await resp.text()
-                        logger.warning(f"xRocket API response is not JSON (URL: {url}): {text[:200]}, error: {json_error}")
-                else:
+                            logger.warning(f"xRocket API returned data but no link found: {data}")
+                    else:
+                        logger.warning(f"xRocket API returned empty data, status: {resp.status}")
+                except Exception as json_error:
                     text = await resp.text()
-                    logger.warning(f"xRocket API returned status {resp.status} (URL: {url}): {text[:500]}")
-                    # Если получили JSON с ошибкой, логируем полностью
-                    try:
-                        error_data = await resp.json()
-                        logger.warning(f"xRocket API error details: {error_data}")
-                    except:
-                        pass
+                    logger.warning(f"xRocket API response is not JSON (URL: {url}): {text[:200]}, error: {json_error}")
+            else:
+                text = await resp.text()
+                logger.warning(f"xRocket API returned status {resp.status} (URL: {url}): {text[:500]}")
+                # Если получили JSON с ошибкой, логируем полностью
+                try:
+                    error_data = await resp.json()
+                    logger.warning(f"xRocket API error details: {error_data}")
+                except:
+                    pass
     except aiohttp.ClientError as e:
         logger.warning(f"xRocket createInvoice connection error via {url}: {e}")
     except Exception as e: